@@ -1,6 +1,9 @@
 from flask import Blueprint, request, jsonify
 from util.auth import token_required
-from service.instance_service import register_instance, start_monitoring, stop_monitoring, get_user_instances, delete_instance
+from service.instance_service import (
+    register_instance, start_monitoring, stop_monitoring, get_user_instances, delete_instance,
+    get_scaling_policy, set_scaling_policy, clear_scaling_policy
+)
 
 instance_bp = Blueprint('instances', __name__)
 
@@ -98,3 +101,52 @@ def delete_instance_route(current_user, instance_id):
             return jsonify({'error': message}), 403
         else:
             return jsonify({'error': message}), 400
+
+def _policy_error(message):
+    if "not found" in message.lower():
+        return jsonify({'error': message}), 404
+    elif "unauthorized" in message.lower():
+        return jsonify({'error': message}), 403
+    else:
+        return jsonify({'error': message}), 400
+
+@instance_bp.route('/policy', methods=['GET'])
+@instance_bp.route('/<instance_id>/policy', methods=['GET'])
+@token_required
+def get_policy(current_user, instance_id=None):
+    """Get the scaling policy in effect for an instance, or the user's default policy."""
+    success, result = get_scaling_policy(current_user['user_id'], instance_id)
+
+    if success:
+        return jsonify(result), 200
+    else:
+        return _policy_error(result)
+
+@instance_bp.route('/policy', methods=['PUT'])
+@instance_bp.route('/<instance_id>/policy', methods=['PUT'])
+@token_required
+def set_policy(current_user, instance_id=None):
+    """Set the scaling policy of an instance, or the user's default policy."""
+    data = request.get_json()
+
+    if not data:
+        return jsonify({'error': 'No data provided'}), 400
+
+    success, result = set_scaling_policy(current_user['user_id'], data, instance_id)
+
+    if success:
+        return jsonify({'message': 'Scaling policy updated', 'policy': result}), 200
+    else:
+        return _policy_error(result)
+
+@instance_bp.route('/policy', methods=['DELETE'])
+@instance_bp.route('/<instance_id>/policy', methods=['DELETE'])
+@token_required
+def clear_policy(current_user, instance_id=None):
+    """Remove the scaling policy of an instance, or the user's default policy."""
+    success, message = clear_scaling_policy(current_user['user_id'], instance_id)
+
+    if success:
+        return jsonify({'message': message}), 200
+    else:
+        return _policy_error(message)
@@ -1,6 +1,18 @@
+from datetime import datetime, timedelta, timezone
 from flask import Blueprint, request, jsonify
 from util.auth import token_required
-from repo.models import Metric, ScalingDecision, Instance
+from repo.db import db
+from repo.models import Metric, MetricOutlier, ScalingDecision, Instance
+from repo.metric_writer import upsert_metrics, metric_row
+from repo.retention import clear_instance_metrics
+from service.window_store import window_store
+from service.decision_queue import decision_queue
+from service.forecaster import forecast_store
+from service.decision_trace import decision_trace
+from service.rollups import rollup_tracker, get_metric_series
+from service.scaling_service import with_outlier_flags
+from constants.service_constants import EVENT_DRIVEN_DECISIONS, ROLLUP_DEFAULT_POINTS, ROLLUP_MAX_POINTS
+from util.logger import logger
 
 metrics_bp = Blueprint('metrics', __name__)
 
@@ -44,10 +56,11 @@ def get_instance_metrics(current_user, instance_id):
     offset = (page - 1) * page_size
     
     # Get total count
-    total_count = Metric.query.filter_by(instance_id=instance_id).count()
+    total_count = Metric.query.filter_by(instance_key=instance.instance_key).count()
     
-    # Get metrics with pagination
-    metrics = Metric.query.filter_by(instance_id=instance_id)\
+    # Get metrics with pagination, with their outlier flag if a decision set one
+    metrics = with_outlier_flags(db.session.query(Metric, MetricOutlier.outlier_type))\
+        .filter(Metric.instance_key == instance.instance_key)\
         .order_by(Metric.timestamp.desc())\
         .limit(page_size)\
         .offset(offset)\
@@ -67,9 +80,9 @@ def get_instance_metrics(current_user, instance_id):
             'memory_usage': m.memory_usage,
             'network_in': m.network_in,
             'network_out': m.network_out,
-            'is_outlier': m.is_outlier,
-            'outlier_type': m.outlier_type
-        } for m in metrics],
+            'is_outlier': outlier_type is not None,
+            'outlier_type': outlier_type
+        } for m, outlier_type in metrics],
         'pagination': {
             'page': page,
             'page_size': page_size,
@@ -80,6 +93,56 @@ def get_instance_metrics(current_user, instance_id):
         }
     }), 200
 
+def _parse_utc(value):
+    """An ISO 8601 timestamp as naive UTC, the way metrics are stored."""
+    timestamp = datetime.fromisoformat(value)
+    if timestamp.tzinfo:
+        timestamp = timestamp.astimezone(timezone.utc).replace(tzinfo=None)
+    return timestamp
+
+@metrics_bp.route('/<instance_id>/series', methods=['GET'])
+@token_required
+def get_instance_metric_series(current_user, instance_id):
+    """
+    Get the metrics of an instance over a time range, summarized to fit a point budget.
+    
+    Query Parameters:
+        - start (str, optional): ISO 8601 start of the range, UTC (default: 24 hours before end)
+        - end (str, optional): ISO 8601 end of the range, UTC, exclusive (default: now)
+        - max_points (int, optional): Most points to return (default: 500, max: 5000)
+    """
+    user_id = current_user['user_id']
+    
+    instance = Instance.query.filter_by(instance_id=instance_id).first()
+    if not instance:
+        return jsonify({'error': 'Instance not found'}), 404
+    
+    if str(instance.user_id) != str(user_id):
+        return jsonify({'error': 'Unauthorized: You don\'t own this instance'}), 403
+    
+    try:
+        end = _parse_utc(request.args['end']) if 'end' in request.args else datetime.utcnow()
+        start = _parse_utc(request.args['start']) if 'start' in request.args else end - timedelta(hours=24)
+    except ValueError:
+        return jsonify({'error': 'start and end must be ISO 8601 timestamps'}), 400
+    if start >= end:
+        return jsonify({'error': 'start must be before end'}), 400
+    
+    max_points = request.args.get('max_points', ROLLUP_DEFAULT_POINTS, type=int)
+    if max_points < 1 or max_points > ROLLUP_MAX_POINTS:
+        return jsonify({'error': f'max_points must be between 1 and {ROLLUP_MAX_POINTS}'}), 400
+    
+    success, result = get_metric_series(instance_id, start, end, max_points)
+    if not success:
+        return jsonify({'error': result}), 500
+    
+    return jsonify({
+        'instance_id': instance_id,
+        'start': start.isoformat(),
+        'end': end.isoformat(),
+        **result
+    }), 200
+
 @metrics_bp.route('/decisions/<instance_id>', methods=['GET'])
 @token_required
 def get_scaling_decisions(current_user, instance_id):
@@ -155,6 +218,30 @@ def get_scaling_decisions(current_user, instance_id):
         }
     }), 200
 
+@metrics_bp.route('/trace', methods=['GET'])
+@token_required
+def get_decision_trace(current_user):
+    """
+    Get per-phase timing histograms of the recent scaling decision cycles.
+    
+    Query Parameters:
+        - instance_id (str, optional): Only count the phases recorded for this instance
+    """
+    user_id = current_user['user_id']
+    instance_id = request.args.get('instance_id')
+    
+    instance_ids = None
+    if instance_id:
+        instance = Instance.query.filter_by(instance_id=instance_id).first()
+        if not instance:
+            return jsonify({'error': 'Instance not found'}), 404
+        
+        if str(instance.user_id) != str(user_id):
+            return jsonify({'error': 'Unauthorized: You don\'t own this instance'}), 403
+        instance_ids = {instance_id}
+    
+    return jsonify(decision_trace.summary(instance_ids)), 200
+
 @metrics_bp.route('/simulate', methods=['POST'])
 @token_required
 def simulate_metrics(current_user):
@@ -174,8 +261,6 @@ def simulate_metrics(current_user):
         - duration_minutes (optional): Duration in minutes for prolonged simulation
         - interval_seconds (optional): Interval between metrics in seconds (default: 30)
     """
-    from repo.db import db
-    from datetime import datetime, timedelta
     import time
     
     user_id = current_user['user_id']
@@ -206,65 +291,67 @@ def simulate_metrics(current_user):
     try:
         # Clear existing metrics if requested
         if clear_existing:
-            deleted_count = Metric.query.filter_by(instance_id=instance_id).delete()
-            db.session.commit()
+            # Batched, each batch committed on its own, so a long history does not hold locks for the request
+            deleted_count = clear_instance_metrics(instance.instance_key, instance_id)
+            window_store.discard(instance_id)
+            # The simulated series starts in the past, the old model would ignore it
+            forecast_store.discard(instance_id)
             logger.info(f"Cleared {deleted_count} existing metrics for {instance_id} before simulation")
         
         if duration_minutes:
             num_metrics = int((duration_minutes * 60) / interval_seconds)
             start_time = datetime.utcnow()
             
+            rows = []
             for i in range(num_metrics):
                 metric_timestamp = start_time - timedelta(seconds=(num_metrics - i - 1) * interval_seconds)
-                
-                metric = Metric(
-                    instance_id=instance_id,
-                    cpu_utilization=cpu_utilization,
-                    memory_usage=memory_usage,
-                    network_in=network_in,
-                    network_out=network_out,
-                    timestamp=metric_timestamp
-                )
-                db.session.add(metric)
-                created_metrics.append({
-                    'timestamp': metric_timestamp.isoformat(),
-                    'cpu_utilization': cpu_utilization,
-                    'memory_usage': memory_usage
-                })
+                rows.append(metric_row(instance_id, metric_timestamp, cpu_utilization, memory_usage, network_in, network_out))
+                if len(created_metrics) < 3:
+                    created_metrics.append({
+                        'timestamp': metric_timestamp.isoformat(),
+                        'cpu_utilization': cpu_utilization,
+                        'memory_usage': memory_usage
+                    })
             
+            upsert_metrics(rows)
             db.session.commit()
+            window_store.append_rows(rows)
+            rollup_tracker.note_rows(rows)
+            if EVENT_DRIVEN_DECISIONS:
+                decision_queue.enqueue([instance_id])
             
             return jsonify({
                 'message': f'Created {num_metrics} simulated metrics over {duration_minutes} minutes',
                 'metrics_created': num_metrics,
                 'duration_minutes': duration_minutes,
                 'interval_seconds': interval_seconds,
-                'sample_metrics': created_metrics[:3]
+                'sample_metrics': created_metrics
             }), 201
         else:
-            metric = Metric(
-                instance_id=instance_id,
-                cpu_utilization=cpu_utilization,
-                memory_usage=memory_usage,
-                network_in=network_in,
-                network_out=network_out
-            )
-            
-            db.session.add(metric)
+            metric_timestamp = datetime.utcnow()
+            rows = [metric_row(instance_id, metric_timestamp, cpu_utilization, memory_usage, network_in, network_out)]
+            upsert_metrics(rows)
             db.session.commit()
+            window_store.append_rows(rows)
+            rollup_tracker.note_rows(rows)
+            if EVENT_DRIVEN_DECISIONS:
+                decision_queue.enqueue([instance_id])
+            
+            metric = Metric.query.filter_by(instance_key=instance.instance_key, timestamp=metric_timestamp).first()
             
             return jsonify({
                 'message': 'Simulated metric created successfully',
                 'metric': {
                     'id': str(metric.id),
-                    'instance_id': metric.instance_id,
+                    'instance_id': instance_id,
                     'timestamp': metric.timestamp.isoformat(),
                     'cpu_utilization': metric.cpu_utilization,
                     'memory_usage': metric.memory_usage,
                     'network_in': metric.network_in,
                     'network_out': metric.network_out,
-                    'is_outlier': metric.is_outlier,
-                    'outlier_type': metric.outlier_type
+                    # Just written, no decision has looked at it yet
+                    'is_outlier': False,
+                    'outlier_type': None
                 }
             }), 201
     except Exception as e:
@@ -0,0 +1,74 @@
+"""
+Benchmark fleet evaluation sharded across worker processes (service/decision_pool.py)
+against in-process evaluation, for 1 up to N workers.
+
+Usage:
+    python benchmarks/bench_decision_pool.py --instances 50000 --samples 20 --max-workers 8
+
+Windows are generated like bench_fleet_evaluator.py. Workers are started and warmed up
+before timing, as the scheduler keeps its pool across cycles. Every timing includes
+packing the shards in the parent, sending them and collecting the outcomes. The script
+checks that every worker count returns the same outcomes as in-process evaluation.
+
+Packing reads every sample object and stays in the parent, so it bounds the speedup
+together with the cores available; on a single core the pool only adds transfer cost.
+"""
+import argparse
+import logging
+import os
+import sys
+import time
+from datetime import datetime
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from bench_fleet_evaluator import build_windows
+from service.policy_engine import DEFAULT_PLAN
+from service.decision_pool import evaluate_in_pool, pack_shard, shutdown_pool
+from util.logger import logger
+
+
+def best_time(repeat, function):
+    times = []
+    result = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = function()
+        times.append(time.perf_counter() - started)
+    return min(times), result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--instances', type=int, default=50000)
+    parser.add_argument('--samples', type=int, default=20, help='samples per instance window')
+    parser.add_argument('--max-workers', type=int, default=os.cpu_count() or 1)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    # Pool start and fallback messages only
+    logger.setLevel(logging.WARNING)
+
+    now = datetime(2026, 1, 1, 12, 0)
+    windows = build_windows(args.instances, args.samples, now)
+
+    print(f"{args.instances:,d} instances x {args.samples} samples, {os.cpu_count()} CPU(s), best of {args.repeat}")
+    in_process, expected = best_time(args.repeat, lambda: DEFAULT_PLAN.evaluate(windows, now))
+    print(f"{'in-process':24s} {in_process:8.3f}s")
+    packing, _ = best_time(args.repeat, lambda: pack_shard(DEFAULT_PLAN, windows, now))
+    print(f"{'packing (parent share)':24s} {packing:8.3f}s")
+
+    try:
+        for workers in range(1, args.max_workers + 1):
+            # Warm up: start the workers and import the evaluator in each of them
+            evaluate_in_pool(DEFAULT_PLAN, windows[:workers * 10], now, workers=workers)
+            elapsed, outcomes = best_time(
+                args.repeat, lambda: evaluate_in_pool(DEFAULT_PLAN, windows, now, workers=workers))
+            print(f"{f'{workers} worker(s)':24s} {elapsed:8.3f}s  "
+                  f"speedup {in_process / elapsed:5.2f}x  identical results: {outcomes == expected}")
+    finally:
+        shutdown_pool()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,85 @@
+"""
+Benchmark in-memory decision evaluation: evaluate_scaling_decision per instance vs the
+NumPy evaluation of the built-in policy (DEFAULT_PLAN in service/policy_engine.py).
+
+Usage:
+    python benchmarks/bench_fleet_evaluator.py --instances 10000 --samples 20
+
+No database is needed: windows are generated in the shape load_fleet_windows returns,
+with a mix of low, normal, high and noisy usage and a few missing values. The script
+checks that both evaluators return identical results.
+"""
+import argparse
+import logging
+import os
+import random
+import sys
+import time
+from collections import namedtuple
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from service.scaling_service import evaluate_scaling_decision
+from service.policy_engine import DEFAULT_PLAN
+from util.logger import logger
+
+Sample = namedtuple('Sample', 'id timestamp cpu_utilization memory_usage network_in network_out is_outlier')
+
+# (cpu mean, cpu spread, memory mean, memory spread) per usage profile
+PROFILES = [(5.0, 3.0, 15.0, 3.0), (45.0, 5.0, 55.0, 5.0), (95.0, 3.0, 50.0, 5.0), (50.0, 30.0, 50.0, 30.0)]
+
+
+def build_windows(instances, samples_per_instance, now, seed=1):
+    rnd = random.Random(seed)
+    step = timedelta(minutes=5) / samples_per_instance
+    windows = []
+    for n in range(instances):
+        cpu_mean, cpu_spread, memory_mean, memory_spread = PROFILES[n % len(PROFILES)]
+        samples = [
+            Sample(
+                id=f'{n}-{k}',
+                timestamp=now - step * (samples_per_instance - 1 - k),
+                cpu_utilization=None if rnd.random() < 0.01 else rnd.gauss(cpu_mean, cpu_spread),
+                memory_usage=rnd.gauss(memory_mean, memory_spread),
+                network_in=rnd.randint(10 ** 6, 5 * 10 ** 6),
+                network_out=rnd.randint(5 * 10 ** 5, 3 * 10 ** 6),
+                is_outlier=rnd.random() < 0.05
+            )
+            for k in range(samples_per_instance)
+        ]
+        windows.append((f'i-bench-{n:05d}', samples, samples[-1], now - timedelta(hours=1)))
+    return windows
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--instances', type=int, default=10000)
+    parser.add_argument('--samples', type=int, default=20, help='samples per instance window')
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    # Per-instance info logging would dominate the scalar timings
+    logger.setLevel(logging.WARNING)
+
+    now = datetime(2026, 1, 1, 12, 0)
+    windows = build_windows(args.instances, args.samples, now)
+
+    scalar_times, vectorized_times = [], []
+    for _ in range(args.repeat):
+        started = time.perf_counter()
+        scalar = [evaluate_scaling_decision(*window, now) for window in windows]
+        scalar_times.append(time.perf_counter() - started)
+
+        started = time.perf_counter()
+        vectorized = DEFAULT_PLAN.evaluate(windows, now)
+        vectorized_times.append(time.perf_counter() - started)
+
+    print(f"{args.instances:,d} instances x {args.samples} samples, best of {args.repeat}")
+    print(f"{'evaluate_scaling_decision per instance':40s} {min(scalar_times):8.3f}s")
+    print(f"{'DEFAULT_PLAN.evaluate':40s} {min(vectorized_times):8.3f}s")
+    print(f"Speedup: {min(scalar_times) / min(vectorized_times):.1f}x, identical results: {scalar == vectorized}")
+
+
+if __name__ == '__main__':
+    main()
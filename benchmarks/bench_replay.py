@@ -0,0 +1,92 @@
+"""
+Benchmark the replay engine (service/replay.py) on synthetic or recorded metrics.
+
+Usage:
+    python benchmarks/bench_replay.py --instances 1000 --hours 24
+    python benchmarks/bench_replay.py --input metrics.parquet --interval 15
+
+Without --input, every instance reports one sample per --sample-seconds (with up to
+5 seconds of jitter) following a daily-ish sine wave plus noise, so the timeline has
+scale ups, scale downs and the flapping in between. With --input, a CSV or Parquet
+file with instance_id, timestamp, cpu_utilization, memory_usage and optionally
+network_in and network_out columns is replayed instead.
+"""
+import argparse
+import logging
+import os
+import sys
+import time
+from datetime import datetime
+
+import numpy as np
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from service.replay import MetricSeries, replay, load_series
+from service.window_store import to_micros
+from util.logger import logger
+
+
+def build_series(instances, hours, sample_seconds, seed=1):
+    rnd = np.random.default_rng(seed)
+    per_instance = int(hours * 3600 // sample_seconds)
+    total = instances * per_instance
+    step = np.tile(np.arange(per_instance), instances)
+    timestamps = to_micros(datetime(2026, 1, 1)) + step * sample_seconds * 1000000 + \
+        rnd.integers(0, 5000000, total)
+    phase = np.repeat(rnd.uniform(0, 2 * np.pi, instances), per_instance)
+    minutes = step * sample_seconds / 60
+    cpu = np.clip(50 + 40 * np.sin(minutes / 240 + phase) + rnd.normal(0, 5, total), 0, 100)
+    memory = np.clip(50 + 30 * np.sin(minutes / 300 + phase) + rnd.normal(0, 5, total), 0, 100)
+    network_in = rnd.integers(10 ** 6, 5 * 10 ** 6, total).astype(float)
+    return MetricSeries(
+        [f'i-{i:05d}' for i in range(instances)], np.repeat(np.arange(instances), per_instance), timestamps,
+        cpu, memory, network_in, network_in / 2
+    )
+
+
+def print_delays(label, stats):
+    if not stats['count']:
+        print(f"{label:24s} none ({stats['missed']} missed)")
+        return
+    print(f"{label:24s} mean {stats['mean_seconds']:.0f}s, median {stats['median_seconds']:.0f}s, "
+          f"p95 {stats['p95_seconds']:.0f}s over {stats['count']:,d} ({stats['missed']:,d} missed)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--instances', type=int, default=1000)
+    parser.add_argument('--hours', type=float, default=24)
+    parser.add_argument('--sample-seconds', type=int, default=60, help='seconds between synthetic samples')
+    parser.add_argument('--interval', type=float, default=None, help='seconds between simulated decision cycles')
+    parser.add_argument('--input', help='CSV or Parquet file to replay instead of synthetic metrics')
+    parser.add_argument('--predictive', action='store_true', help='replay with predictive scaling')
+    args = parser.parse_args()
+
+    # Per-decision log lines would dominate the timing
+    logger.setLevel(logging.WARNING)
+
+    started = time.perf_counter()
+    if args.input:
+        series = load_series(args.input)
+    else:
+        series = build_series(args.instances, args.hours, args.sample_seconds)
+    loaded = time.perf_counter() - started
+    print(f"{len(series.instance_ids):,d} instances, {len(series):,d} samples, loaded in {loaded:.2f}s")
+
+    options = {'predictive': args.predictive}
+    if args.interval is not None:
+        options['interval_seconds'] = args.interval
+    stats = replay(series, **options).stats
+
+    print(f"{'simulated':24s} {stats['simulated_hours']:.1f}h in {stats['ticks']:,d} ticks")
+    print(f"{'evaluations':24s} {stats['evaluations']:,d}")
+    print(f"{'decisions':24s} {stats['decisions']:,d} ({stats['decisions_per_hour']:.1f}/h)")
+    print(f"{'flaps':24s} {stats['flaps']:,d}")
+    print_delays('time to scale up', stats['time_to_scale_up'])
+    print_delays('time to scale down', stats['time_to_scale_down'])
+    print(f"{'wall time':24s} {stats['wall_seconds']:.2f}s ({stats['speedup']:,.0f}x real time)")
+
+
+if __name__ == '__main__':
+    main()
@@ -23,3 +23,114 @@ SUSTAINED_DURATION_MINUTES = 5
 IQR_MULTIPLIER = 1.5
 IQR_MIN_DATA_POINTS = 4
 IQR_MIN_DATA_DURATION_MINUTES = 5
+IQR_WINDOW_MINUTES = 5
+IQR_BASELINE_MINUTES = 5  # 60 or 1440 for a 1h or 24h baseline kept in streaming quantile sketches
+BASELINE_SNAPSHOT_INTERVAL_SECONDS = 300  # how often sketch state is persisted
+
+# Sustained Usage
+SUSTAINED_MIN_DATA_POINTS = 3
+SUSTAINED_PERCENTAGE_THRESHOLD = 80
+SUSTAINED_TRACKER_ENABLED = True  # keep running per-instance counts instead of recounting the window for every check
+
+# Predictive Scaling
+PREDICTIVE_SCALING_ENABLED = False  # also scale when a Holt forecast of CPU or memory reaches a threshold within the horizon
+FORECAST_HORIZON_MINUTES = 5  # how far ahead forecasts are checked against the thresholds
+FORECAST_LEVEL_SMOOTHING = 0.3  # Holt alpha, weight of each new sample in the level
+FORECAST_TREND_SMOOTHING = 0.1  # Holt beta, weight of each new slope in the trend
+FORECAST_MIN_SAMPLES = 6  # samples a model needs before its forecast is used
+FORECAST_MAX_GAP_MINUTES = 10  # a longer gap between samples restarts the model
+
+# Window Statistics
+STATS_WINDOW_MINUTES = (1, 5, 15)  # trailing windows summarized together by service.window_stats, short ones catch spikes, long ones sustained load
+
+# Scaling Policies
+POLICY_CACHE_SIZE = 256  # compiled policies kept in memory, one per distinct definition
+
+# Fleet Evaluation
+SCALING_FLEET_EVALUATION = True  # False falls back to one make_scaling_decision call per instance
+SCALING_VECTORIZED_EVALUATION = True  # evaluate the fleet with NumPy instead of one evaluate_scaling_decision call per instance
+SKIP_UNCHANGED_INSTANCES = True  # skip instances with no metric newer than the one their last decision used
+
+# Decision Pool
+DECISION_POOL_WORKERS = 0  # worker processes to shard fleet evaluation across (always with the NumPy evaluator), 0 evaluates in the scheduler thread
+DECISION_POOL_MIN_INSTANCES = 5000  # smaller fleets are evaluated in-process, shipping them to workers costs more than it saves
+
+# Window Store
+WINDOW_STORE_ENABLED = True  # serve decision windows from memory, reading the database only on a miss
+WINDOW_STORE_CAPACITY = 64  # samples kept per instance, enough for 5 minutes at 5 second resolution
+
+# Decision Queue
+EVENT_DRIVEN_DECISIONS = True  # evaluate instances as soon as their metrics are committed
+SCALING_DECISION_INTERVAL_SECONDS = 15  # periodic decision job when EVENT_DRIVEN_DECISIONS is off
+SCALING_SAFETY_NET_INTERVAL_SECONDS = 60  # periodic full pass kept as a safety net when it is on
+DECISION_QUEUE_POLL_SECONDS = 1  # how long the worker waits for work before checking for shutdown
+
+# Decision Trace
+DECISION_TRACE_ENABLED = False  # record per-phase wall time, statements and rows of every decision cycle, see GET /api/metrics/trace
+DECISION_TRACE_CYCLES = 200  # most recent cycles kept for the histograms
+DECISION_TRACE_BUCKETS_MS = (1, 5, 10, 25, 50, 100, 250, 500, 1000, 5000)  # histogram bucket upper bounds
+
+# Replay
+REPLAY_FLAP_WINDOW_MINUTES = 15  # a scale up and scale down of one instance this close together count as a flap
+
+# Metrics Collector
+METRICS_COLLECTOR_MAX_WORKERS = 16
+METRICS_COLLECTION_DEADLINE_SECONDS = 25  # must stay below the 30 second fetch interval
+METRICS_INSTANCE_TIMEOUT_SECONDS = 10
+
+# CloudWatch
+CLOUDWATCH_MAX_QUERIES_PER_CALL = 500  # GetMetricData hard limit
+CLOUDWATCH_LOOKBACK_MINUTES = 10
+CLOUDWATCH_PERIOD_SECONDS = 60
+
+# AWS Clients
+AWS_MAX_POOL_CONNECTIONS = 50  # keep >= METRICS_COLLECTOR_MAX_WORKERS
+AWS_CONNECT_TIMEOUT_SECONDS = 5
+AWS_READ_TIMEOUT_SECONDS = 10
+AWS_RETRY_MODE = 'adaptive'
+AWS_MAX_ATTEMPTS = 5
+CLOUDWATCH_MAX_BACKFILL_MINUTES = 60  # cap on how far back a stale watermark is caught up per fetch
+CLOUDWATCH_SETTLE_PERIODS = 5  # stored periods up to the watermark that every fetch reads again, so late datapoints (CWAgent memory) fill in their rows
+
+# Metric Partitioning
+METRICS_PARTITIONING_ENABLED = True  # on PostgreSQL, partition metrics by day (a TimescaleDB hypertable when the extension is installed)
+METRICS_PARTITION_DAYS_AHEAD = 7  # daily partitions kept created ahead of today
+METRICS_RETENTION_DAYS = 30  # metrics older than this are dropped (whole partitions, else by the retention job), 0 keeps everything
+METRICS_PARTITION_INTERVAL_SECONDS = 3600  # how often partitions are created and expired
+
+# Metric Rollups
+ROLLUP_RESOLUTIONS_SECONDS = (60, 300, 3600)  # bucket lengths summarized by service.rollups, finest first
+ROLLUP_INTERVAL_SECONDS = 60  # how often buckets with new metrics are recomputed
+ROLLUP_RETENTION_DAYS = {60: 7, 300: 90, 3600: 730}  # buckets of each resolution kept this long, 0 keeps everything
+ROLLUP_DEFAULT_POINTS = 500  # point budget of a series query that does not give max_points
+ROLLUP_MAX_POINTS = 5000  # largest max_points a series query may ask for
+
+# Retention
+RETENTION_POLICIES = {  # per table: days rows are kept (0 keeps everything) and whether expired rows move to <table>_archive
+    'metrics': {'days': METRICS_RETENTION_DAYS, 'archive': False},  # only a plain table, partitions are dropped whole
+    'metric_outliers': {'days': METRICS_RETENTION_DAYS, 'archive': False},
+    'scaling_decisions': {'days': 365, 'archive': True},
+}
+RETENTION_BATCH_ROWS = 5000  # rows deleted per transaction
+RETENTION_BATCH_PAUSE_SECONDS = 0.5  # sleep between batches, capping the I/O of a run
+RETENTION_MAX_BATCHES_PER_RUN = 200  # per table; the next run carries on
+RETENTION_INTERVAL_SECONDS = 900  # how often the retention job runs
+
+# Cold Archive
+ARCHIVE_ENABLED = False  # export closed days of metrics and decisions to Parquet (needs pyarrow) and read old metric ranges from there
+ARCHIVE_ROOT = 'archive'  # directory holding the Parquet files, one per instance and day
+ARCHIVE_COMPRESSION = 'zstd'  # Parquet compression codec of the archive files
+ARCHIVE_CLOSE_AFTER_MINUTES = 120  # a day is exported this long after it ends, once late datapoints are in
+ARCHIVE_DAYS_PER_RUN = 1  # days of each kind exported per run of the archive job
+ARCHIVE_EXPORT_BATCH_ROWS = 10000  # rows fetched at a time while exporting a day
+ARCHIVE_INTERVAL_SECONDS = 3600  # how often the archive job runs
+
+# Metric Layout Migration
+METRICS_COMPACTION_RECENT_MINUTES = 60  # metrics this recent are copied to the compact table during the upgrade itself
+METRICS_COMPACTION_BATCH_ROWS = 20000  # older metrics moved per transaction by the compaction job
+METRICS_COMPACTION_BATCHES_PER_RUN = 50  # transactions per run of the compaction job
+METRICS_COMPACTION_INTERVAL_SECONDS = 30  # how often the compaction job runs while old metrics remain
+
+# Metric Ingestion
+BULK_INSERT_PAGE_SIZE = 1000  # rows per multi-row INSERT statement
+BULK_COPY_MIN_ROWS = 5000  # switch to COPY on PostgreSQL from this batch size
@@ -1,9 +1,26 @@
-from repo.models import Instance, Metric
+import threading
+from repo.models import Instance
 from repo.db import db
+from repo.metric_writer import METRIC_COLUMNS, upsert_metrics, metric_row, filled_instances
+from repo.partitions import maintain_partitions
+from repo.compaction import move_wide_metrics
+from repo.retention import apply_retention
+from repo.archive import export_pending
 from util.logger import logger
-from service.mock_monitor import generate_mock_metrics
-from service.aws_monitor import fetch_instance_metrics
+from service.metrics_collector import collect_metrics
+from service.aws_clients import client_registry
+from service.window_store import window_store
+from service.decision_queue import decision_queue
+from service.baseline_store import save_baselines
+from service.rollups import rollup_tracker, refresh_rollups, expire_rollups
 from service.scaling_service import process_all_monitored_instances
+from constants.service_constants import (
+    EVENT_DRIVEN_DECISIONS, DECISION_QUEUE_POLL_SECONDS, METRICS_COMPACTION_BATCHES_PER_RUN
+)
+
+# The periodic job and the decision worker run on different threads; evaluating the
+# same instance twice at once could record the same state change twice
+_decision_lock = threading.Lock()
 
 def fetch_metrics_job(app):
     """Job to fetch metrics for all instances that are being monitored."""
@@ -16,38 +33,76 @@ def fetch_metrics_job(app):
         logger.debug(f"Running fetch_metrics_job for {monitored_count} instance(s)...")
         instances = Instance.query.filter_by(is_monitoring=True).all()
         
-        for instance in instances:
-            logger.debug(f"Fetching metrics for {instance.instance_id}...")
+        # Fan the fetches out over the collector pool, then write everything in one transaction
+        targets = [
+            (instance.instance_id, instance.region, instance.is_mock, instance.last_ingested_at)
+            for instance in instances
+        ]
+        collected = collect_metrics(targets)
+        instances_by_id = {instance.instance_id: instance for instance in instances}
+        
+        rows = []
+        for instance_id, samples in collected.items():
+            if samples is None:
+                logger.error(f"Failed to fetch metrics for {instance_id}")
+                continue
             
-            # Use mock data for mock instances, real AWS data for regular instances
-            if instance.is_mock:
-                logger.debug(f"Using mock data for {instance.instance_id}")
-                metrics_data = generate_mock_metrics(instance.instance_id)
-            else:
-                metrics_data = fetch_instance_metrics(instance.instance_id, instance.region)
+            # Keep samples with at least one stored metric (disk I/O is fetched but not stored)
+            samples = [s for s in samples if any(s.get(column) is not None for column in METRIC_COLUMNS[2:])]
+            if not samples:
+                logger.debug(f"No new metrics for {instance_id}")
+                continue
             
-            if metrics_data:
-                # Check if we got at least one metric
-                if any(v is not None for v in metrics_data.values()):
-                   new_metric = Metric(
-                       instance_id=instance.instance_id,
-                       cpu_utilization=metrics_data.get('cpu_utilization'),
-                       memory_usage=metrics_data.get('memory_usage'),
-                       network_in=metrics_data.get('network_in'),
-                       network_out=metrics_data.get('network_out')
-                   )
-                   db.session.add(new_metric)
-                   logger.info(f"Saved metrics for {instance.instance_id}")
-                else:
-                    logger.warning(f"No metrics found for {instance.instance_id}")
-            else:
-                 logger.error(f"Failed to fetch metrics for {instance.instance_id}")
+            rows.extend(
+                metric_row(instance_id, s['timestamp'], s.get('cpu_utilization'), s.get('memory_usage'),
+                           s.get('network_in'), s.get('network_out'))
+                for s in samples
+            )
+            # Advance the watermark so the next fetch asks for newer datapoints (and its settle window)
+            instance = instances_by_id[instance_id]
+            if instance.last_ingested_at is None or samples[-1]['timestamp'] > instance.last_ingested_at:
+                instance.last_ingested_at = samples[-1]['timestamp']
+            logger.info(f"Saved {len(samples)} metric sample(s) for {instance_id}")
         
         try:
+            # A late value filled into a metric a decision already used makes that decision
+            # stale; without a reset the skip-unchanged check would keep it until a newer sample
+            evaluated = [
+                row for row in rows
+                if instances_by_id[row[0]].last_evaluated_at is not None and row[1] <= instances_by_id[row[0]].last_evaluated_at
+            ]
+            for instance_id in filled_instances(evaluated):
+                instances_by_id[instance_id].last_evaluated_at = None
+                logger.info(f"Late metrics filled in for {instance_id}, its last decision will be re-evaluated")
+            # Idempotent: datapoints fetched again only fill in values that arrived late
+            upsert_metrics(rows)
             db.session.commit()
         except Exception as e:
             logger.error(f"Error saving metrics: {e}")
             db.session.rollback()
+        else:
+            # Only committed rows go to the hot tier the scaling engine reads from
+            window_store.append_rows(rows)
+            rollup_tracker.note_rows(rows)
+            if EVENT_DRIVEN_DECISIONS:
+                decision_queue.enqueue(row[0] for row in rows)
+        
+        client_stats = client_registry.get_stats()
+        logger.debug(
+            f"AWS clients: {client_stats['clients_created']} created, {client_stats['clients_reused']} reused, "
+            f"{client_stats['saturated_calls']} call(s) over the {client_stats['max_pool_connections']} connection pool"
+        )
+
+def log_decision_results(results):
+    skipped = sum(1 for result in results if result['skipped'])
+    logger.info(f"Scaling cycle: {len(results) - skipped} instance(s) evaluated, {skipped} skipped with no new metrics")
+    for result in results:
+        if result['skipped']:
+            continue
+        if result['success']:
+            logger.debug(f"Decision for {result['instance_id']}: {result['result']}")
+        else:
+            logger.error(f"Failed to make decision for {result['instance_id']}: {result['result']}")
 
 def scaling_decision_job(app):
     """Job to make scaling decisions for all monitored instances."""
@@ -60,10 +115,102 @@ def scaling_decision_job(app):
             return
         
         logger.debug(f"Running scaling_decision_job for {monitored_count} instance(s)...")
-        results = process_all_monitored_instances()
-        
-        for result in results:
-            if result['success']:
-                logger.debug(f"Decision for {result['instance_id']}: {result['result']}")
-            else:
-                logger.error(f"Failed to make decision for {result['instance_id']}: {result['result']}")
+        with _decision_lock:
+            results = process_all_monitored_instances()
+        log_decision_results(results)
+
+def process_queued_decisions(app, instance_ids):
+    """Make scaling decisions for instances whose metrics just arrived."""
+    with app.app_context():
+        logger.debug(f"Evaluating {len(instance_ids)} instance(s) with new metrics...")
+        with _decision_lock:
+            results = process_all_monitored_instances(instance_ids)
+        log_decision_results(results)
+
+def decision_worker(app, stop_event):
+    """
+    Long-running loop that evaluates queued instances as soon as they arrive.
+    Runs on its own daemon thread until stop_event is set.
+    """
+    logger.info("Decision worker started")
+    while not stop_event.is_set():
+        instance_ids = decision_queue.take(timeout=DECISION_QUEUE_POLL_SECONDS)
+        if not instance_ids:
+            continue
+        try:
+            process_queued_decisions(app, instance_ids)
+        except Exception as e:
+            # The periodic safety net picks these instances up again
+            logger.error(f"Decision worker failed for {len(instance_ids)} instance(s): {e}")
+    logger.info("Decision worker stopped")
+
+def persist_baselines_job(app):
+    """Job to persist the long IQR baselines so a restart does not reset them."""
+    with app.app_context():
+        saved = save_baselines()
+        if saved:
+            logger.debug(f"Persisted {saved} IQR baseline(s)")
+
+def maintain_partitions_job(app):
+    """Job to create the metrics partitions of the coming days and drop expired ones."""
+    with app.app_context():
+        try:
+            created, dropped = maintain_partitions(db.engine)
+        except Exception as e:
+            logger.error(f"Error maintaining metrics partitions: {e}")
+            return
+        if created:
+            logger.info(f"Created metrics partition(s): {', '.join(created)}")
+        if dropped:
+            logger.info(f"Dropped expired metrics partition(s): {', '.join(dropped)}")
+
+def refresh_rollups_job(app):
+    """Job to recompute the rollup buckets of instances with new metrics and expire old buckets."""
+    with app.app_context():
+        try:
+            written = refresh_rollups()
+            expired = expire_rollups()
+        except Exception as e:
+            logger.error(f"Error refreshing metric rollups: {e}")
+            return
+        if written or expired:
+            logger.debug(f"Rollups: {written} bucket(s) written, {expired} expired")
+
+def compact_metrics_job(app):
+    """Job to move metrics left in the old wide layout into the compact metrics table, a batch per transaction."""
+    with app.app_context():
+        moved = 0
+        try:
+            for _ in range(METRICS_COMPACTION_BATCHES_PER_RUN):
+                copied = move_wide_metrics(db.engine)
+                if copied is None:
+                    break
+                moved += copied
+        except Exception as e:
+            logger.error(f"Error moving metrics to the compact layout: {e}")
+            return
+        if moved:
+            logger.info(f"Moved {moved} metric(s) to the compact layout")
+
+def apply_retention_job(app):
+    """Job to delete or archive expired metrics, outlier flags and scaling decisions in batches."""
+    with app.app_context():
+        try:
+            progress = apply_retention()
+        except Exception as e:
+            logger.error(f"Error applying retention: {e}")
+            return
+        for table, (removed, done) in progress.items():
+            if removed:
+                logger.info(f"Retention: removed {removed} expired row(s) from {table}{'' if done else ', more left for the next run'}")
+
+def archive_job(app):
+    """Job to export closed days of metrics and scaling decisions to the cold archive."""
+    with app.app_context():
+        try:
+            exported = export_pending()
+        except Exception as e:
+            logger.error(f"Error archiving metrics: {e}")
+            return
+        for kind, days in exported.items():
+            logger.debug(f"Archive: exported {len(days)} day(s) of {kind}")
@@ -6,17 +6,29 @@ from api.metrics_routes import metrics_bp
 from api.middleware import register_middleware
 from flask_cors import CORS
 from repo.db import db
+from repo.migrations import prepare_schema, upgrade_schema
 from dotenv import load_dotenv
 import os
+import threading
 from flask_apscheduler import APScheduler
 from flask_swagger_ui import get_swaggerui_blueprint
 from repo.models import Instance, Metric
 from util.logger import logger
-from jobs.tasks import fetch_metrics_job, scaling_decision_job
+from jobs.tasks import (
+    fetch_metrics_job, scaling_decision_job, decision_worker, persist_baselines_job, maintain_partitions_job,
+    refresh_rollups_job, compact_metrics_job, apply_retention_job, archive_job
+)
+from service.baseline_store import long_baseline_enabled
+from constants.service_constants import (
+    EVENT_DRIVEN_DECISIONS, SCALING_DECISION_INTERVAL_SECONDS, SCALING_SAFETY_NET_INTERVAL_SECONDS,
+    BASELINE_SNAPSHOT_INTERVAL_SECONDS, METRICS_PARTITION_INTERVAL_SECONDS, ROLLUP_INTERVAL_SECONDS,
+    METRICS_COMPACTION_INTERVAL_SECONDS, RETENTION_INTERVAL_SECONDS, ARCHIVE_ENABLED, ARCHIVE_INTERVAL_SECONDS
+)
 
 load_dotenv()
 
 scheduler = APScheduler()
+decision_worker_stop = threading.Event()
 
 
 def create_app():
@@ -50,14 +62,79 @@ def create_app():
             seconds=30
         )
         
-        # Add scaling decision job (every 15 seconds)
+        # Add scaling decision job. With event-driven decisions the worker evaluates
+        # instances as their metrics arrive and this full pass is only a safety net
         scheduler.add_job(
             id='scaling_decisions',
             func=scaling_decision_job,
             args=[app],
             trigger='interval',
-            seconds= 15
+            seconds=SCALING_SAFETY_NET_INTERVAL_SECONDS if EVENT_DRIVEN_DECISIONS else SCALING_DECISION_INTERVAL_SECONDS
         )
+        
+        # Persist the streaming IQR baselines (only kept for baselines longer than the IQR window)
+        if long_baseline_enabled():
+            scheduler.add_job(
+                id='persist_baselines',
+                func=persist_baselines_job,
+                args=[app],
+                trigger='interval',
+                seconds=BASELINE_SNAPSHOT_INTERVAL_SECONDS
+            )
+        
+        # Keep the daily metrics partitions created ahead and drop expired ones (PostgreSQL only)
+        scheduler.add_job(
+            id='maintain_partitions',
+            func=maintain_partitions_job,
+            args=[app],
+            trigger='interval',
+            seconds=METRICS_PARTITION_INTERVAL_SECONDS
+        )
+        
+        # Keep the 1 minute / 5 minute / 1 hour metric rollups up to date
+        scheduler.add_job(
+            id='refresh_rollups',
+            func=refresh_rollups_job,
+            args=[app],
+            trigger='interval',
+            seconds=ROLLUP_INTERVAL_SECONDS
+        )
+        
+        # Move metrics left in the old wide layout to the compact table; idle once they are all moved
+        scheduler.add_job(
+            id='compact_metrics',
+            func=compact_metrics_job,
+            args=[app],
+            trigger='interval',
+            seconds=METRICS_COMPACTION_INTERVAL_SECONDS
+        )
+        
+        # Delete or archive expired rows in small batches (see RETENTION_POLICIES)
+        scheduler.add_job(
+            id='apply_retention',
+            func=apply_retention_job,
+            args=[app],
+            trigger='interval',
+            seconds=RETENTION_INTERVAL_SECONDS
+        )
+        
+        # Export closed days to the Parquet cold archive (see repo/archive.py)
+        if ARCHIVE_ENABLED:
+            scheduler.add_job(
+                id='archive',
+                func=archive_job,
+                args=[app],
+                trigger='interval',
+                seconds=ARCHIVE_INTERVAL_SECONDS
+            )
+        
+        if EVENT_DRIVEN_DECISIONS:
+            threading.Thread(
+                target=decision_worker,
+                args=[app, decision_worker_stop],
+                name='decision-worker',
+                daemon=True
+            ).start()
     
     # Register Blueprints
     app.register_blueprint(api_bp, url_prefix='/api')
@@ -82,7 +159,11 @@ def create_app():
     with app.app_context():
         from repo import models
         try:
+            prepare_schema(db.engine)
             db.create_all()
+            upgrade_schema(db.engine)
+            # Partitions for today onwards before the first metrics arrive
+            maintain_partitions_job(app)
         except Exception as e:
             logger.error(f"Error connecting to database: {e}")
     
@@ -0,0 +1,234 @@
+import os
+from datetime import datetime, timedelta
+from urllib.parse import quote
+import numpy as np
+from sqlalchemy import func
+from repo.db import db
+from repo.models import Instance, Metric, ScalingDecision
+from repo.metric_writer import widen_real
+from util.logger import logger
+from constants.service_constants import (
+    ARCHIVE_ROOT, ARCHIVE_COMPRESSION, ARCHIVE_CLOSE_AFTER_MINUTES, ARCHIVE_DAYS_PER_RUN,
+    ARCHIVE_EXPORT_BATCH_ROWS
+)
+
+# Cold tier: metrics and scaling decisions of closed UTC days are exported to Parquet
+# files on local disk, one per instance and day (ARCHIVE_ROOT/metrics/2026-10-17/
+# i-0abc.parquet), sorted by timestamp and compressed with ARCHIVE_COMPRESSION. A day
+# is exported once ARCHIVE_CLOSE_AFTER_MINUTES have passed since it ended, so late
+# CloudWatch datapoints are in, and a _SUCCESS file marks it complete. Files are written
+# beside their final name and renamed, so a reader never sees half a file.
+#
+# Every day from the oldest row in the database on is exported, and retention keeps
+# every day that is not exported yet (see archive_horizon), so the archive has no gaps. Reads memory-map the files of the days in range instead of
+# reading them into buffers, decode their pages from the mapping, and cut the rows out
+# with a binary search on the timestamps as zero-copy slices of the decoded columns.
+#
+# The metric files have the columns service/replay.py reads, so load_series replays them.
+
+DONE_MARKER = '_SUCCESS'
+
+# The archive kind each archived table is exported as
+ARCHIVED_TABLES = {'metrics': 'metrics', 'scaling_decisions': 'decisions'}
+
+ARCHIVE_COLUMNS = {
+    'metrics': ('instance_id', 'timestamp', 'cpu_utilization', 'memory_usage', 'network_in', 'network_out'),
+    'decisions': ('instance_id', 'timestamp', 'cpu_utilization', 'memory_usage', 'network_in', 'network_out',
+                  'decision', 'reason'),
+}
+
+def _pyarrow():
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise ImportError("The metric archive needs pyarrow (pip install pyarrow)")
+    return pa, pq
+
+def _schema(pa, kind):
+    # Stored like the database columns: float4 utilisation for metrics, float8 for decisions
+    utilisation = pa.float32() if kind == 'metrics' else pa.float64()
+    types = {
+        'instance_id': pa.string(), 'timestamp': pa.timestamp('us'),
+        'cpu_utilization': utilisation, 'memory_usage': utilisation,
+        'network_in': pa.int64(), 'network_out': pa.int64(),
+        'decision': pa.string(), 'reason': pa.string(),
+    }
+    return pa.schema([(name, types[name]) for name in ARCHIVE_COLUMNS[kind]])
+
+def _rows(kind, start, end):
+    """Query of the rows of kind in [start, end) in ARCHIVE_COLUMNS order, grouped by instance and sorted by time."""
+    if kind == 'metrics':
+        return db.session.query(
+            Instance.instance_id, Metric.timestamp, Metric.cpu_utilization, Metric.memory_usage,
+            Metric.network_in, Metric.network_out
+        ).join(Instance, Instance.instance_key == Metric.instance_key)\
+            .filter(Metric.timestamp >= start, Metric.timestamp < end)\
+            .order_by(Metric.instance_key, Metric.timestamp)
+    return db.session.query(*(getattr(ScalingDecision, name) for name in ARCHIVE_COLUMNS[kind]))\
+        .filter(ScalingDecision.timestamp >= start, ScalingDecision.timestamp < end)\
+        .order_by(ScalingDecision.instance_id, ScalingDecision.timestamp)
+
+def day_start(timestamp):
+    return datetime(timestamp.year, timestamp.month, timestamp.day)
+
+def day_directory(kind, day, root=None):
+    return os.path.join(root or ARCHIVE_ROOT, kind, f'{day:%Y-%m-%d}')
+
+def archive_path(kind, instance_id, day, root=None):
+    return os.path.join(day_directory(kind, day, root), f"{quote(instance_id, safe='')}.parquet")
+
+def is_archived(kind, day, root=None):
+    return os.path.exists(os.path.join(day_directory(kind, day, root), DONE_MARKER))
+
+def _write(kind, instance_id, day, columns, root):
+    pa, pq = _pyarrow()
+    path = archive_path(kind, instance_id, day, root)
+    table = pa.Table.from_arrays(
+        [pa.array(values, type=field.type) for values, field in zip(columns, _schema(pa, kind))], schema=_schema(pa, kind)
+    )
+    pq.write_table(table, f'{path}.tmp', compression=ARCHIVE_COMPRESSION)
+    os.replace(f'{path}.tmp', path)
+
+def export_day(kind, day, root=None, batch_rows=ARCHIVE_EXPORT_BATCH_ROWS):
+    """
+    Write the rows of kind on day (a UTC midnight) to one file per instance and mark the
+    day complete. Rows are streamed, one instance held at a time. Returns the number of files.
+    """
+    _pyarrow()
+    directory = day_directory(kind, day, root)
+    os.makedirs(directory, exist_ok=True)
+    files = 0
+    instance_id, columns = None, None
+    for row in _rows(kind, day, day + timedelta(days=1)).execution_options(yield_per=batch_rows):
+        if row[0] != instance_id:
+            if instance_id is not None:
+                _write(kind, instance_id, day, columns, root)
+                files += 1
+            instance_id, columns = row[0], [[] for _ in row]
+        for column, value in zip(columns, row):
+            column.append(value)
+    if instance_id is not None:
+        _write(kind, instance_id, day, columns, root)
+        files += 1
+    open(os.path.join(directory, DONE_MARKER), 'w').close()
+    return files
+
+def oldest_timestamp(kind):
+    """Timestamp of the oldest row of kind in the database, None when it has none."""
+    if kind == 'metrics':
+        # The least of each instance's first entry in the (instance_key, timestamp) index
+        first = db.session.query(func.min(Metric.timestamp))\
+            .filter(Metric.instance_key == Instance.instance_key).correlate(Instance).scalar_subquery()
+        return db.session.query(func.min(first)).select_from(Instance).scalar()
+    return db.session.query(func.min(ScalingDecision.timestamp)).scalar()
+
+def pending_days(kind, now=None, root=None, first=None):
+    """
+    Closed UTC days that are not exported yet, oldest first, from first on: by default
+    the day of the oldest row of kind in the database.
+    """
+    now = now or datetime.utcnow()
+    last = day_start(now - timedelta(days=1, minutes=ARCHIVE_CLOSE_AFTER_MINUTES))
+    if first is None:
+        oldest = oldest_timestamp(kind)
+        first = day_start(oldest) if oldest is not None else last + timedelta(days=1)
+    days = []
+    day = first
+    while day <= last:
+        if not is_archived(kind, day, root):
+            days.append(day)
+        day += timedelta(days=1)
+    return days
+
+def archive_horizon(kind, now=None, root=None):
+    """Start of the oldest day not exported yet: rows from there on must stay in the database."""
+    now = now or datetime.utcnow()
+    pending = pending_days(kind, now, root)
+    if pending:
+        return pending[0]
+    # Days still open are exported later
+    return day_start(now - timedelta(days=1, minutes=ARCHIVE_CLOSE_AFTER_MINUTES)) + timedelta(days=1)
+
+def export_pending(now=None, root=None, max_days=ARCHIVE_DAYS_PER_RUN):
+    """Export the oldest max_days pending days of each kind; returns {kind: [days exported]}."""
+    exported = {}
+    for kind in ARCHIVE_COLUMNS:
+        for day in pending_days(kind, now, root)[:max_days]:
+            files = export_day(kind, day, root)
+            exported.setdefault(kind, []).append(day)
+            logger.info(f"Archived {kind} of {day:%Y-%m-%d} to {files} file(s)")
+    return exported
+
+def archived_until(kind, start, end, before, root=None):
+    """
+    End of the leading run of exported days of [start, end) that ended by before, cut to
+    end; start when the day holding start is not such a day.
+    """
+    day = day_start(start)
+    while day < end and day + timedelta(days=1) <= before and is_archived(kind, day, root):
+        day += timedelta(days=1)
+    return min(max(day, start), end)
+
+def _micros(timestamp):
+    return np.datetime64(timestamp, 'us').astype(np.int64)
+
+def _files(kind, instance_id, start, end, root):
+    """(path, whether the whole day is in range) of each archive file of one instance with days in [start, end)."""
+    day = day_start(start)
+    while day < end:
+        path = archive_path(kind, instance_id, day, root)
+        if os.path.exists(path):
+            yield path, start <= day and day + timedelta(days=1) <= end
+        day += timedelta(days=1)
+
+def _bounds(pa, table, start, end):
+    """Row range of [start, end) in a day's table, by binary search on its timestamps."""
+    timestamps = table.column('timestamp').combine_chunks().cast(pa.int64()).to_numpy()
+    return np.searchsorted(timestamps, [_micros(start), _micros(end)])
+
+def read_range(kind, instance_id, start, end, root=None):
+    """
+    Archived rows of one instance in [start, end) as a pyarrow Table sorted by timestamp.
+    Each day's file is memory-mapped and the range is a slice of its columns, not a copy.
+    """
+    pa, pq = _pyarrow()
+    tables = []
+    for path, _ in _files(kind, instance_id, start, end, root):
+        table = pq.read_table(path, memory_map=True)
+        low, high = _bounds(pa, table, start, end)
+        tables.append(table.slice(low, high - low))
+    if not tables:
+        return _schema(pa, kind).empty_table()
+    return pa.concat_tables(tables)
+
+def count_range(kind, instance_id, start, end, root=None):
+    """
+    Number of archived rows of one instance in [start, end), without decoding them: the
+    row count in the footer of the days wholly in range, and a binary search on the
+    timestamp column alone for the first and last day.
+    """
+    pa, pq = _pyarrow()
+    count = 0
+    for path, whole in _files(kind, instance_id, start, end, root):
+        if whole:
+            count += pq.read_metadata(path, memory_map=True).num_rows
+        else:
+            low, high = _bounds(pa, pq.read_table(path, columns=['timestamp'], memory_map=True), start, end)
+            count += int(high - low)
+    return count
+
+def to_rows(table):
+    """
+    Rows of an archive table as tuples. float4 columns are widened to the float with the
+    same shortest decimal (12.3, not 12.300000190734863), as PostgreSQL prints a real.
+    """
+    pa, _ = _pyarrow()
+    columns = []
+    for column in table.itercolumns():
+        if column.type == pa.float32():
+            widened = widen_real(column.to_numpy(zero_copy_only=False))
+            columns.append([None if value != value else value for value in widened.tolist()])
+        else:
+            columns.append(column.to_pylist())
+    return list(zip(*columns))
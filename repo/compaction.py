@@ -0,0 +1,161 @@
+from datetime import datetime, timedelta
+from sqlalchemy import DateTime, bindparam, inspect, text
+from repo.models import Metric, MetricOutlier, OUTLIER_TYPES
+from util.logger import logger
+from constants.service_constants import (
+    METRICS_COMPACTION_RECENT_MINUTES, METRICS_COMPACTION_BATCH_ROWS, METRICS_RETENTION_DAYS
+)
+
+# Older releases stored metrics wide: a UUID id, the instance_id string repeated on every
+# row, float8 utilisation and the outlier type as a string. The compact layout of the
+# current models refers to instances by their integer instance_key instead.
+#
+# A wide metrics table is converted online. upgrade_schema renames it, with its
+# partitions and their indexes, to metrics_wide, creates the compact table in its place
+# and copies the last METRICS_COMPACTION_RECENT_MINUTES over, so decision windows are
+# complete straight away and new metrics land in the compact table from the first write.
+# The compaction job then moves the remaining rows in keyset batches along the
+# (instance_id, timestamp) unique index, each batch its own short transaction, and drops
+# metrics_wide once it is empty. Until then the oldest history reads as missing. Rows past
+# METRICS_RETENTION_DAYS are dropped rather than copied.
+#
+# metric_outliers is small and is rebuilt within the upgrade.
+
+WIDE_SUFFIX = '_wide'
+WIDE_TABLE = f'metrics{WIDE_SUFFIX}'
+
+_STORED_COLUMNS = 'instance_key, timestamp, cpu_utilization, memory_usage, network_in, network_out'
+_KEYSET = '(w.instance_id, w.timestamp)'
+
+# (instance_id, timestamp) of the last row moved by this process, so each batch seeks past
+# the rows deleted before it instead of scanning their index entries again
+_cursor = None
+
+def outlier_code_sql(column):
+    """SQL mapping an outlier type name in column to its OUTLIER_TYPES code."""
+    cases = ' '.join(f"WHEN '{name}' THEN {code}" for name, code in OUTLIER_TYPES.items())
+    return f'CASE {column} {cases} END'
+
+def _columns(conn, table):
+    return {c['name'] for c in inspect(conn).get_columns(table)}
+
+def _is_wide(conn, table):
+    return inspect(conn).has_table(table) and 'instance_id' in _columns(conn, table)
+
+def add_instance_keys(conn):
+    """Schema step: give existing instances the instance_key the compact tables refer to."""
+    if not inspect(conn).has_table('instances') or 'instance_key' in _columns(conn, 'instances'):
+        return
+    conn.execute(text('ALTER TABLE instances ADD COLUMN instance_key INTEGER'))
+    if conn.dialect.name == 'postgresql':
+        conn.execute(text('CREATE SEQUENCE IF NOT EXISTS instances_instance_key_seq'))
+        conn.execute(text("UPDATE instances SET instance_key = nextval('instances_instance_key_seq')"))
+        conn.execute(text('ALTER TABLE instances ALTER COLUMN instance_key SET NOT NULL'))
+        conn.execute(text('ALTER TABLE instances ADD CONSTRAINT instances_instance_key_key UNIQUE (instance_key)'))
+    else:
+        # New keys continue from the largest, see Instance.instance_key
+        conn.execute(text('UPDATE instances SET instance_key = rowid'))
+        conn.execute(text('CREATE UNIQUE INDEX instances_instance_key_key ON instances (instance_key)'))
+    logger.info("Added instances.instance_key")
+
+def _retire(conn, table):
+    """Rename table, its partitions and all their indexes with WIDE_SUFFIX, freeing every name the compact table reuses."""
+    if conn.dialect.name == 'postgresql':
+        tables = [table] + conn.execute(text(
+            "SELECT inhrelid::regclass::text FROM pg_inherits WHERE inhparent = to_regclass(:table)"
+        ), {'table': table}).scalars().all()
+        # Renaming the index of a primary key or unique constraint renames the constraint too
+        for index in conn.execute(text(
+            "SELECT c.relname FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid "
+            "WHERE i.indrelid = ANY(CAST(:tables AS regclass[]))"
+        ), {'tables': tables}).scalars().all():
+            conn.execute(text(f'ALTER INDEX {index} RENAME TO {index}{WIDE_SUFFIX}'))
+        for partition in tables[1:]:
+            conn.execute(text(f'ALTER TABLE {partition} RENAME TO {partition}{WIDE_SUFFIX}'))
+    conn.execute(text(f'ALTER TABLE {table} RENAME TO {table}{WIDE_SUFFIX}'))
+
+def compact_outlier_table(conn):
+    """Schema step: rebuild a metric_outliers table keyed by instance_id in the compact layout."""
+    if not _is_wide(conn, 'metric_outliers'):
+        return
+    _retire(conn, 'metric_outliers')
+    MetricOutlier.__table__.create(conn)
+    moved = conn.execute(text(
+        'INSERT INTO metric_outliers (instance_key, timestamp, outlier_type, flagged_at) '
+        f"SELECT i.instance_key, o.timestamp, {outlier_code_sql('o.outlier_type')}, o.flagged_at "
+        'FROM metric_outliers_wide o JOIN instances i ON i.instance_id = o.instance_id'
+    )).rowcount
+    conn.execute(text('DROP TABLE metric_outliers_wide'))
+    logger.info(f"Rebuilt metric_outliers in the compact layout ({moved} flag(s))")
+
+def _copy_statement(conn, where):
+    """INSERT of the metrics_wide rows matching where into metrics, skipping any already there."""
+    select = (
+        f"SELECT i.instance_key, w.timestamp, w.cpu_utilization, w.memory_usage, w.network_in, w.network_out "
+        f"FROM {WIDE_TABLE} w JOIN instances i ON i.instance_id = w.instance_id WHERE {where}"
+    )
+    if conn.dialect.name == 'postgresql':
+        return text(f'INSERT INTO metrics ({_STORED_COLUMNS}) {select} ON CONFLICT (instance_key, timestamp) DO NOTHING')
+    return text(f'INSERT OR IGNORE INTO metrics ({_STORED_COLUMNS}) {select}')
+
+def compact_metrics_table(conn, now=None):
+    """
+    Schema step: put a compact metrics table in place of a wide one, which is kept as
+    metrics_wide for the compaction job, and copy its most recent rows over.
+    """
+    global _cursor
+    if not _is_wide(conn, 'metrics'):
+        return
+    now = now or datetime.utcnow()
+    _retire(conn, 'metrics')
+    _cursor = None
+    # Plain; partition_metrics_table, the next step, partitions it
+    Metric.__table__.create(conn)
+    copied = conn.execute(_copy_statement(conn, 'w.timestamp >= :cutoff').bindparams(
+        bindparam('cutoff', now - timedelta(minutes=METRICS_COMPACTION_RECENT_MINUTES), type_=DateTime)
+    )).rowcount
+    logger.info(f"Created the compact metrics table with the last {copied} metric(s); older ones follow from {WIDE_TABLE}")
+
+def compaction_pending(conn):
+    return inspect(conn).has_table(WIDE_TABLE)
+
+def move_wide_metrics(engine, batch_rows=METRICS_COMPACTION_BATCH_ROWS, now=None, retention_days=METRICS_RETENTION_DAYS):
+    """
+    Move the next batch_rows rows of metrics_wide into metrics in one transaction, dropping
+    metrics_wide with the last of them. Returns the number of rows copied, or None when
+    there is no metrics_wide (left).
+    """
+    global _cursor
+    now = now or datetime.utcnow()
+    with engine.begin() as conn:
+        if not compaction_pending(conn):
+            return None
+        batch, params = [], {}
+        if _cursor:
+            batch.append(f'{_KEYSET} > (:after_id, :after_ts)')
+            params.update(after_id=_cursor[0], after_ts=_cursor[1])
+        last = conn.execute(text(
+            f"SELECT w.instance_id, w.timestamp FROM {WIDE_TABLE} w WHERE {' AND '.join(batch) or 'TRUE'} "
+            "ORDER BY w.instance_id, w.timestamp LIMIT 1 OFFSET :offset"
+        ), {**params, 'offset': batch_rows - 1}).first()
+        if last is not None:
+            batch.append(f'{_KEYSET} <= (:last_id, :last_ts)')
+            params.update(last_id=last[0], last_ts=last[1])
+        where = ' AND '.join(batch) or 'TRUE'
+
+        if retention_days:
+            copy = _copy_statement(conn, f'{where} AND w.timestamp >= :cutoff').bindparams(
+                bindparam('cutoff', now - timedelta(days=retention_days), type_=DateTime)
+            )
+        else:
+            copy = _copy_statement(conn, where)
+        copied = conn.execute(copy, params).rowcount
+        if last is None:
+            conn.execute(text(f'DROP TABLE {WIDE_TABLE}'))
+            _cursor = None
+            logger.info(f"Moved the last {copied} metric(s) of {WIDE_TABLE} and dropped it")
+            return copied
+        # Deleted rather than only skipped, so a restart carries on where this left off
+        conn.execute(text(f'DELETE FROM {WIDE_TABLE} AS w WHERE {where}'), params)
+    _cursor = tuple(last)
+    return copied
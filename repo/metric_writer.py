@@ -0,0 +1,242 @@
+import io
+import numpy as np
+from psycopg2.extras import execute_values
+from sqlalchemy import DateTime, bindparam, func, or_, select, tuple_
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from repo.db import db
+from repo.models import Instance, Metric, MetricOutlier, MetricRollup, OutlierType
+from constants.service_constants import BULK_INSERT_PAGE_SIZE, BULK_COPY_MIN_ROWS
+
+METRIC_COLUMNS = ('instance_id', 'timestamp', 'cpu_utilization', 'memory_usage', 'network_in', 'network_out')
+OUTLIER_COLUMNS = ('instance_id', 'timestamp', 'outlier_type')
+ROLLUP_COLUMNS = (
+    'instance_id', 'resolution', 'bucket', 'samples',
+    'cpu_min', 'cpu_max', 'cpu_avg', 'cpu_p95', 'memory_min', 'memory_max', 'memory_avg', 'memory_p95',
+    'network_in', 'network_out'
+)
+
+# Metric values a later fetch of the same datapoint may fill in
+_VALUE_COLUMNS = METRIC_COLUMNS[2:]
+
+_COLUMN_LIST = ', '.join(METRIC_COLUMNS)
+_STORED_COLUMN_LIST = ', '.join(('instance_key',) + METRIC_COLUMNS[1:])
+_SELECT_STORED = f"SELECT i.instance_key, {', '.join(f'v.{column}' for column in METRIC_COLUMNS[1:])}"
+
+def widen_real(values):
+    """
+    float4 values widened to the float with the same shortest decimal (12.3, not
+    12.300000190734863), the value PostgreSQL returns for a real. Returns a float64 array.
+    """
+    return np.asarray(values, dtype=np.float32).astype(str).astype(np.float64)
+
+def _real(value):
+    return None if value is None else float(widen_real(value))
+
+def metric_row(instance_id, timestamp, cpu_utilization, memory_usage, network_in, network_out):
+    """
+    Build a row in METRIC_COLUMNS order, holding the values as stored so they are the
+    same in every store. CPU and memory are rounded to float4, the REAL columns' type on
+    PostgreSQL, and read back as PostgreSQL returns them (see widen_real), so a window
+    served from memory evaluates like one reloaded from the database. Network byte counts are rounded to whole bytes (CloudWatch averages can be
+    fractional): both network columns are BigInteger, and COPY rejects fractional input.
+    """
+    return (
+        instance_id, timestamp, _real(cpu_utilization), _real(memory_usage),
+        None if network_in is None else round(network_in),
+        None if network_out is None else round(network_out)
+    )
+
+# A stored datapoint keeps its values, except where the new row has one it lacks or
+# CloudWatch revised it; a row that changes nothing is not rewritten
+_PG_ON_CONFLICT = (
+    "ON CONFLICT (instance_key, timestamp) DO UPDATE SET "
+    + ', '.join(f"{column} = COALESCE(EXCLUDED.{column}, metrics.{column})" for column in _VALUE_COLUMNS)
+    + " WHERE "
+    + ' OR '.join(f"COALESCE(EXCLUDED.{column}, metrics.{column}) IS DISTINCT FROM metrics.{column}"
+                  for column in _VALUE_COLUMNS)
+)
+
+# Rows carry the instance_id; the stored instance_key is joined in by the statement itself.
+# Rows of unknown instances are dropped by that join. Ids come from the identity column
+_PG_INSERT = (
+    f"INSERT INTO metrics ({_STORED_COLUMN_LIST}) {_SELECT_STORED} "
+    f"FROM (VALUES %s) AS v ({_COLUMN_LIST}) JOIN instances i ON i.instance_id = v.instance_id "
+    f"{_PG_ON_CONFLICT}"
+)
+# Typed, as a column of NULLs in a VALUES list would otherwise be text
+_PG_VALUES_TEMPLATE = "(%s, %s::timestamp, %s::real, %s::real, %s::bigint, %s::bigint)"
+
+_PG_STAGING_TABLE = """
+    CREATE TEMP TABLE IF NOT EXISTS metrics_ingest (
+        instance_id varchar, timestamp timestamp, cpu_utilization real,
+        memory_usage real, network_in bigint, network_out bigint
+    ) ON COMMIT DELETE ROWS
+"""
+_PG_COPY = f"COPY metrics_ingest ({_COLUMN_LIST}) FROM STDIN"
+_PG_MERGE_STAGING = (
+    f"INSERT INTO metrics ({_STORED_COLUMN_LIST}) {_SELECT_STORED} "
+    "FROM metrics_ingest v JOIN instances i ON i.instance_id = v.instance_id "
+    f"{_PG_ON_CONFLICT}"
+)
+
+def _copy_field(value):
+    if value is None:
+        return '\\N'
+    if hasattr(value, 'isoformat'):
+        return value.isoformat()
+    return str(value)
+
+def _pg_upsert(rows):
+    cursor = db.session.connection().connection.cursor()
+    try:
+        if len(rows) < BULK_COPY_MIN_ROWS:
+            execute_values(cursor, _PG_INSERT, rows, template=_PG_VALUES_TEMPLATE, page_size=BULK_INSERT_PAGE_SIZE)
+            return
+
+        # COPY cannot merge conflicts, so stream into a temp table and merge from there
+        buffer = io.StringIO()
+        for row in rows:
+            buffer.write('\t'.join(_copy_field(value) for value in row))
+            buffer.write('\n')
+        buffer.seek(0)
+
+        cursor.execute(_PG_STAGING_TABLE)
+        cursor.copy_expert(_PG_COPY, buffer)
+        cursor.execute(_PG_MERGE_STAGING)
+        cursor.execute("TRUNCATE metrics_ingest")
+    finally:
+        cursor.close()
+
+def instance_keys(instance_ids):
+    """{instance_id: instance_key} of the known instances among instance_ids."""
+    return dict(
+        db.session.query(Instance.instance_id, Instance.instance_key)
+        .filter(Instance.instance_id.in_(set(instance_ids)))
+        .all()
+    )
+
+def _sqlite_upsert(rows):
+    statement = sqlite_insert(Metric.__table__)
+    table = Metric.__table__.c
+    filled = {column: func.coalesce(statement.excluded[column], table[column]) for column in _VALUE_COLUMNS}
+    statement = statement.on_conflict_do_update(
+        index_elements=['instance_key', 'timestamp'],
+        set_=filled,
+        where=or_(*(value.is_distinct_from(table[column]) for column, value in filled.items()))
+    )
+    keys = instance_keys(row[0] for row in rows)
+    stored = ('instance_key',) + METRIC_COLUMNS[1:]
+    keyed = [dict(zip(stored, (keys[row[0]], *row[1:]))) for row in rows if row[0] in keys]
+    if keyed:
+        db.session.execute(statement, keyed)
+
+def _merge_duplicates(rows):
+    """
+    One row per (instance_id, timestamp), first seen order, later values taking over
+    where they are not None, as one upsert statement cannot touch a row twice.
+    """
+    merged = {}
+    for row in rows:
+        earlier = merged.get(row[:2])
+        merged[row[:2]] = row if earlier is None else tuple(
+            old if new is None else new for new, old in zip(row, earlier)
+        )
+    return list(merged.values())
+
+def upsert_metrics(rows):
+    """
+    Bulk insert metric rows. A row whose (instance_id, timestamp) is already stored fills
+    in the values the stored one lacks and updates those CloudWatch revised; its None
+    values never erase a stored value.
+
+    rows is a sequence of plain tuples in METRIC_COLUMNS order; each is stored under the
+    instance_key of its instance, and rows of unknown instances are skipped. No ORM objects are
+    built: PostgreSQL gets multi-row INSERTs via execute_values, or COPY through a
+    staging table for large batches; SQLite gets a single executemany.
+    Re-ingesting the same datapoints is a no-op. Runs in the current session
+    transaction; the caller commits. Returns the number of rows submitted.
+    """
+    rows = list(rows)
+    if not rows:
+        return 0
+    submitted = len(rows)
+    rows = _merge_duplicates(rows)
+
+    if db.session.get_bind().dialect.name == 'postgresql':
+        _pg_upsert(rows)
+    else:
+        _sqlite_upsert(rows)
+    return submitted
+
+def filled_instances(rows):
+    """
+    instance_ids whose stored metrics upsert_metrics(rows) would change: a row already
+    stored that gains a value it lacks, or one CloudWatch revised. New datapoints are not
+    counted. Call it before the upsert, in the same transaction. Returns a set.
+    """
+    rows = list(rows)
+    if not rows:
+        return set()
+    keys = instance_keys(row[0] for row in rows)
+    rows = [row for row in _merge_duplicates(rows) if row[0] in keys]
+    if not rows:
+        return set()
+
+    instance_ids = {key: instance_id for instance_id, key in keys.items()}
+    stored = {
+        (instance_ids[row[0]], row[1]): row[2:]
+        for row in db.session.query(Metric.instance_key, Metric.timestamp, *(getattr(Metric, column) for column in _VALUE_COLUMNS))
+        .filter(tuple_(Metric.instance_key, Metric.timestamp).in_([(keys[row[0]], row[1]) for row in rows]))
+        .all()
+    }
+    return {
+        row[0] for row in rows
+        if row[:2] in stored and any(
+            new is not None and new != old for new, old in zip(row[2:], stored[row[:2]])
+        )
+    }
+
+def record_outliers(rows):
+    """
+    Append outlier annotations to metric_outliers.
+
+    rows is a sequence of (instance_id, timestamp, outlier_type) tuples, one per flagged
+    metric. A metric that already has an annotation keeps it, so flagging the same metric
+    again is a no-op. The metrics table itself is never updated. Runs in the current
+    session transaction; the caller commits. Returns the number of rows submitted.
+    """
+    rows = list(rows)
+    if not rows:
+        return 0
+
+    insert = pg_insert if db.session.get_bind().dialect.name == 'postgresql' else sqlite_insert
+    # The instance_key is looked up by the statement, flags of unknown instances insert nothing
+    keyed = select(
+        Instance.instance_key, bindparam('timestamp', type_=DateTime), bindparam('outlier_type', type_=OutlierType)
+    ).where(Instance.instance_id == bindparam('instance_id'))
+    statement = insert(MetricOutlier.__table__)\
+        .from_select(['instance_key', 'timestamp', 'outlier_type'], keyed)\
+        .on_conflict_do_nothing(index_elements=['instance_key', 'timestamp'])
+    db.session.execute(statement, [dict(zip(OUTLIER_COLUMNS, row)) for row in rows])
+    return len(rows)
+
+def upsert_rollups(rows):
+    """
+    Insert rollup buckets, replacing any already stored for the same (instance_id,
+    resolution, bucket). rows is a sequence of tuples in ROLLUP_COLUMNS order. Runs in the
+    current session transaction; the caller commits. Returns the number of rows submitted.
+    """
+    rows = list(rows)
+    if not rows:
+        return 0
+
+    insert = pg_insert if db.session.get_bind().dialect.name == 'postgresql' else sqlite_insert
+    statement = insert(MetricRollup.__table__)
+    statement = statement.on_conflict_do_update(
+        index_elements=['instance_id', 'resolution', 'bucket'],
+        set_={column: statement.excluded[column] for column in ROLLUP_COLUMNS[3:]}
+    )
+    for start in range(0, len(rows), BULK_INSERT_PAGE_SIZE):
+        db.session.execute(statement, [dict(zip(ROLLUP_COLUMNS, row)) for row in rows[start:start + BULK_INSERT_PAGE_SIZE]])
+    return len(rows)
@@ -0,0 +1,84 @@
+from sqlalchemy import inspect, text
+from util.logger import logger
+from repo.partitions import partition_metrics_table
+from repo.compaction import add_instance_keys, compact_outlier_table, compact_metrics_table, outlier_code_sql
+
+# db.create_all() only creates missing tables, it never alters existing ones.
+# These steps bring a database created by an older version up to the current models.
+# Every step checks the live schema first, so running them on each start is safe.
+
+def _add_column_if_missing(conn, table, column, ddl_type):
+    columns = {c['name'] for c in inspect(conn).get_columns(table)}
+    if column not in columns:
+        conn.execute(text(f'ALTER TABLE {table} ADD COLUMN {column} {ddl_type}'))
+        logger.info(f"Added column {table}.{column}")
+
+def _create_index_if_missing(conn, table, name, columns):
+    inspector = inspect(conn)
+    if not inspector.has_table(table):
+        return
+    if name not in {i['name'] for i in inspector.get_indexes(table)}:
+        conn.execute(text(f'CREATE INDEX {name} ON {table} ({", ".join(columns)})'))
+        logger.info(f"Created index {name} on {table}")
+
+def _create_unique_index_if_missing(conn, table, name, columns):
+    inspector = inspect(conn)
+    if not set(columns) <= {c['name'] for c in inspector.get_columns(table)}:
+        # A table in a newer layout, which is created with its constraints
+        return
+    existing = {i['name'] for i in inspector.get_indexes(table)}
+    existing |= {c['name'] for c in inspector.get_unique_constraints(table)}
+    if name not in existing:
+        conn.execute(text(f'CREATE UNIQUE INDEX {name} ON {table} ({", ".join(columns)})'))
+        logger.info(f"Created unique index {name} on {table}")
+
+def _move_outlier_flags(conn):
+    """Older releases flagged outliers on the metric rows; move those flags to metric_outliers."""
+    inspector = inspect(conn)
+    columns = {c['name'] for c in inspector.get_columns('metrics')}
+    if 'is_outlier' not in columns or not inspector.has_table('metric_outliers'):
+        return
+    outlier_type = outlier_code_sql('m.outlier_type') if 'outlier_type' in columns else 'NULL'
+    # Such a metrics table is still wide, metric_outliers is already compact
+    moved = conn.execute(text(
+        'INSERT INTO metric_outliers (instance_key, timestamp, outlier_type, flagged_at) '
+        f'SELECT i.instance_key, m.timestamp, {outlier_type}, CURRENT_TIMESTAMP '
+        'FROM metrics m JOIN instances i ON i.instance_id = m.instance_id WHERE m.is_outlier = true'
+    )).rowcount
+    # Dropping a column is a catalog change on PostgreSQL, the rows are not rewritten
+    conn.execute(text('ALTER TABLE metrics DROP COLUMN is_outlier'))
+    if 'outlier_type' in columns:
+        conn.execute(text('ALTER TABLE metrics DROP COLUMN outlier_type'))
+    logger.info(f"Moved {moved} outlier flag(s) from metrics to metric_outliers")
+
+def _run(engine, steps):
+    for step in steps:
+        try:
+            with engine.begin() as conn:
+                step(conn)
+        except Exception as e:
+            logger.error(f"Schema upgrade step failed: {e}")
+
+def prepare_schema(engine):
+    """Steps to run before db.create_all(), as tables it creates refer to what they add."""
+    _run(engine, [add_instance_keys])
+
+def upgrade_schema(engine):
+    steps = [
+        lambda conn: _add_column_if_missing(conn, 'instances', 'last_ingested_at', 'TIMESTAMP'),
+        lambda conn: _add_column_if_missing(conn, 'instances', 'last_evaluated_at', 'TIMESTAMP'),
+        lambda conn: _add_column_if_missing(conn, 'instances', 'scaling_policy', 'JSON'),
+        lambda conn: _add_column_if_missing(conn, 'users', 'scaling_policy', 'JSON'),
+        lambda conn: _create_unique_index_if_missing(
+            conn, 'metrics', 'uq_metrics_instance_timestamp', ['instance_id', 'timestamp']
+        ),
+        add_instance_keys,
+        compact_outlier_table,
+        _move_outlier_flags,
+        lambda conn: _create_index_if_missing(conn, 'scaling_decisions', 'ix_scaling_decisions_timestamp', ['timestamp']),
+        lambda conn: _create_index_if_missing(conn, 'metric_outliers', 'ix_metric_outliers_timestamp', ['timestamp']),
+        compact_metrics_table,
+        # Last: the partitioned table is created from the current model
+        partition_metrics_table,
+    ]
+    _run(engine, steps)
@@ -1,5 +1,7 @@
 from repo.db import db
+from sqlalchemy import text
 from sqlalchemy.dialects.postgresql import UUID
+from sqlalchemy.types import TypeDecorator
 import uuid
 from datetime import datetime
 
@@ -10,16 +12,38 @@ class User(db.Model):
     email = db.Column(db.String, unique=True, nullable=False)
     password = db.Column(db.String, nullable=False)  # to hash password
     created_at = db.Column(db.DateTime, default=datetime.utcnow)    
+    scaling_policy = db.Column(db.JSON(none_as_null=True), nullable=True, default=None)  # default for the user's instances, see service/policy_engine.py
     instances = db.relationship('Instance', backref='user', lazy=True)
 
     def __repr__(self):
         return f'<User {self.email}>'
 
+# Metric rows refer to their instance by a small integer surrogate instead of the
+# instance_id string. SQLite only generates values for an INTEGER PRIMARY KEY, so
+# the key is drawn by the model: from a sequence on PostgreSQL, and on SQLite by
+# inserting the next key into INSTANCE_KEY_TABLE. That insert takes SQLite's write
+# lock, so a concurrent session waits and then draws after it, never the same key
+INSTANCE_KEY_SEQUENCE = db.Sequence('instances_instance_key_seq', metadata=db.metadata)
+INSTANCE_KEY_TABLE = 'instance_key_draws'
+
+def _next_instance_key(context):
+    if context.dialect.name == 'postgresql':
+        return context.connection.scalar(text("SELECT nextval('instances_instance_key_seq')"))
+    conn = context.connection
+    conn.execute(text(f'CREATE TABLE IF NOT EXISTS {INSTANCE_KEY_TABLE} (instance_key INTEGER PRIMARY KEY)'))
+    # Past every stored key and every earlier draw, including those of this statement
+    return conn.execute(text(
+        f"INSERT INTO {INSTANCE_KEY_TABLE} (instance_key) SELECT MAX("
+        f"(SELECT COALESCE(MAX(instance_key), 0) FROM instances), "
+        f"(SELECT COALESCE(MAX(instance_key), 0) FROM {INSTANCE_KEY_TABLE})) + 1"
+    )).lastrowid
+
 class Instance(db.Model):
     __tablename__ = 'instances'
 
     id = db.Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
     instance_id = db.Column(db.String, unique=True, nullable=False)
+    instance_key = db.Column(db.Integer, unique=True, nullable=False, default=_next_instance_key)  # what metric rows refer to
     instance_type = db.Column(db.String)
     region = db.Column(db.String)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
@@ -28,30 +52,111 @@ class Instance(db.Model):
     is_mock = db.Column(db.Boolean, default=False)
     deleted_at = db.Column(db.DateTime, nullable=True, default=None)
     last_decision = db.Column(db.String, nullable=True, default=None)  # scale_up / scale_down / no_action
+    last_ingested_at = db.Column(db.DateTime, nullable=True, default=None)  # newest CloudWatch datapoint stored
+    last_evaluated_at = db.Column(db.DateTime, nullable=True, default=None)  # newest metric the last decision was based on
+    scaling_policy = db.Column(db.JSON(none_as_null=True), nullable=True, default=None)  # overrides the user's policy
     metrics = db.relationship('Metric', backref='instance', lazy=True)
     decisions = db.relationship('ScalingDecision', backref='instance', lazy=True)
 
     def __repr__(self):
         return f'<Instance {self.instance_id}>'
 
+def instance_key_of(instance_id):
+    """The instance_key of an instance_id as a scalar subquery, so rows keyed by it are filtered in one statement."""
+    return db.select(Instance.instance_key).where(Instance.instance_id == instance_id).scalar_subquery()
+
+def instance_keys_of(instance_ids):
+    """Subquery of the instance_keys of instance_ids, for an IN filter."""
+    return db.select(Instance.instance_key).where(Instance.instance_id.in_(instance_ids))
+
+# The decision that flagged an outlier, stored as a smallint code
+OUTLIER_TYPES = {'scale_up': 1, 'scale_down': 2}
+_OUTLIER_TYPE_NAMES = {code: name for name, code in OUTLIER_TYPES.items()}
+
+class OutlierType(TypeDecorator):
+    """An outlier type name ('scale_up' / 'scale_down') stored as its OUTLIER_TYPES code."""
+
+    impl = db.SmallInteger
+    cache_ok = True
+
+    def process_bind_param(self, value, dialect):
+        return None if value is None else OUTLIER_TYPES[value]
+
+    def process_result_value(self, value, dialect):
+        return None if value is None else _OUTLIER_TYPE_NAMES[value]
+
 class Metric(db.Model):
     __tablename__ = 'metrics'
+    __table_args__ = (
+        # One sample per instance and timestamp; ingestion upserts against this
+        db.UniqueConstraint('instance_key', 'timestamp', name='uq_metrics_instance_timestamp'),
+    )
 
-    id = db.Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
-    instance_id = db.Column(db.String, db.ForeignKey('instances.instance_id'), nullable=False)
-    timestamp = db.Column(db.DateTime, default=datetime.utcnow)
-    cpu_utilization = db.Column(db.Float)
-    memory_usage = db.Column(db.Float)
+    # Compact rows, the bulk of the database: a bigint identity key, the integer key of the
+    # instance rather than its id string, and float4 utilisation (percentages need no more
+    # than its 7 significant digits). On PostgreSQL the table is partitioned by day on
+    # timestamp (see repo/partitions.py), where the primary key becomes (id, timestamp)
+    id = db.Column(db.BigInteger().with_variant(db.Integer, 'sqlite'), db.Identity(), primary_key=True)
+    instance_key = db.Column(db.Integer, db.ForeignKey('instances.instance_key'), nullable=False)
+    timestamp = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    cpu_utilization = db.Column(db.REAL)
+    memory_usage = db.Column(db.REAL)
     network_in = db.Column(db.BigInteger)
     network_out = db.Column(db.BigInteger)
-    is_outlier = db.Column(db.Boolean, default=False)
-    outlier_type = db.Column(db.String)
 
     def __repr__(self):
         return f'<Metric {self.id}>'
 
+class MetricOutlier(db.Model):
+    __tablename__ = 'metric_outliers'
+    __table_args__ = (
+        # Retention walks expired flags oldest first (see repo/retention.py)
+        db.Index('ix_metric_outliers_timestamp', 'timestamp'),
+    )
+
+    # Append-only: one row per metric a scaling decision flagged, so metric rows are never
+    # updated. Keyed like the metric it annotates; IQR history leaves these out with an anti-join
+    instance_key = db.Column(db.Integer, db.ForeignKey('instances.instance_key'), primary_key=True)
+    timestamp = db.Column(db.DateTime, primary_key=True)
+    outlier_type = db.Column(OutlierType)  # the decision that flagged it: scale_up / scale_down
+    flagged_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    def __repr__(self):
+        return f'<MetricOutlier {self.instance_key} at {self.timestamp}>'
+
+class MetricRollup(db.Model):
+    __tablename__ = 'metric_rollups'
+    __table_args__ = (
+        # Expiry deletes old buckets of one resolution
+        db.Index('ix_metric_rollups_resolution_bucket', 'resolution', 'bucket'),
+    )
+
+    # Summary of the metrics of one instance in one time bucket, kept up to date by the
+    # rollup job (see service/rollups.py) so long ranges are not read from raw metrics
+    instance_id = db.Column(db.String, db.ForeignKey('instances.instance_id'), primary_key=True)
+    resolution = db.Column(db.Integer, primary_key=True)  # bucket length in seconds: 60, 300 or 3600
+    bucket = db.Column(db.DateTime, primary_key=True)  # start of the bucket
+    samples = db.Column(db.Integer, nullable=False)
+    cpu_min = db.Column(db.Float)
+    cpu_max = db.Column(db.Float)
+    cpu_avg = db.Column(db.Float)
+    cpu_p95 = db.Column(db.Float)
+    memory_min = db.Column(db.Float)
+    memory_max = db.Column(db.Float)
+    memory_avg = db.Column(db.Float)
+    memory_p95 = db.Column(db.Float)
+    network_in = db.Column(db.BigInteger)  # bytes summed over the bucket
+    network_out = db.Column(db.BigInteger)
+
+    def __repr__(self):
+        return f'<MetricRollup {self.instance_id} {self.resolution}s at {self.bucket}>'
+
 class ScalingDecision(db.Model):
     __tablename__ = 'scaling_decisions'
+    __table_args__ = (
+        # Retention walks expired decisions oldest first (see repo/retention.py)
+        db.Index('ix_scaling_decisions_timestamp', 'timestamp'),
+    )
 
     id = db.Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
     instance_id = db.Column(db.String, db.ForeignKey('instances.instance_id'), nullable=False)
@@ -65,3 +170,14 @@ class ScalingDecision(db.Model):
 
     def __repr__(self):
         return f'<ScalingDecision {self.decision} for {self.instance_id}>'
+
+class MetricBaseline(db.Model):
+    __tablename__ = 'metric_baselines'
+
+    instance_id = db.Column(db.String, db.ForeignKey('instances.instance_id'), primary_key=True)
+    window_minutes = db.Column(db.Integer, nullable=False)
+    state = db.Column(db.JSON, nullable=False)  # serialized quantile sketches, see service/baseline_store.py
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    def __repr__(self):
+        return f'<MetricBaseline {self.instance_id} ({self.window_minutes} min)>'
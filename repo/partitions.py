@@ -0,0 +1,213 @@
+import re
+from datetime import datetime, timedelta
+from sqlalchemy import text
+from sqlalchemy.schema import CreateTable
+from repo.models import Metric
+from repo.archive import archive_horizon
+from util.logger import logger
+from constants.service_constants import (
+    METRICS_PARTITIONING_ENABLED, METRICS_PARTITION_DAYS_AHEAD, METRICS_RETENTION_DAYS, ARCHIVE_ENABLED
+)
+
+# On PostgreSQL the metrics table is range partitioned by timestamp, one partition per
+# UTC day (metrics_p20261017 holds [2026-10-17, 2026-10-18)), or is a TimescaleDB
+# hypertable with daily chunks when that extension is installed. Partitions are created
+# METRICS_PARTITION_DAYS_AHEAD days ahead by a background job, and retention drops whole
+# partitions (or chunks) instead of deleting rows. SQLite keeps one plain table.
+#
+# A plain metrics table from an older release is converted once by upgrade_schema. Its
+# rows stay where they are: the table is attached as metrics_legacy, the partition of
+# everything before the first daily one, and is dropped in one piece once all of it has
+# expired. metrics_default catches rows outside every partition (a backfill older than
+# the oldest day, or days the job did not get to), so an insert never fails for want of
+# a partition; rows found there are moved into the daily partition when it is created.
+# Only the partitioned table has an identity on id: the legacy table's is dropped before it
+# is attached, and the new one starts past the legacy ids.
+
+PARTITION_PREFIX = 'metrics_p'
+LEGACY_PARTITION = 'metrics_legacy'
+DEFAULT_PARTITION = 'metrics_default'
+
+_BOUNDS = re.compile(r"FROM \((.+?)\) TO \((.+?)\)")
+
+def partition_name(day):
+    return f"{PARTITION_PREFIX}{day:%Y%m%d}"
+
+def _parse_bound(value):
+    """A range bound as printed by pg_get_expr: a quoted timestamp, or MINVALUE / MAXVALUE (None)."""
+    value = value.strip()
+    if not value.startswith("'"):
+        return None
+    return datetime.fromisoformat(value.strip("'"))
+
+def plan_partitions(existing, today, days_ahead=METRICS_PARTITION_DAYS_AHEAD):
+    """
+    Daily ranges [(name, start, end), ...] from today through days_ahead days later that
+    no existing (name, start, end) partition overlaps; a None start or end is unbounded.
+    """
+    first = datetime(today.year, today.month, today.day)
+    planned = []
+    for offset in range(days_ahead + 1):
+        start = first + timedelta(days=offset)
+        end = start + timedelta(days=1)
+        if any((lower is None or lower < end) and (upper is None or start < upper) for _, lower, upper in existing):
+            continue
+        planned.append((partition_name(start), start, end))
+    return planned
+
+def expired_partitions(existing, cutoff):
+    """Names of the (name, start, end) partitions holding nothing newer than cutoff."""
+    return [name for name, _, upper in existing if upper is not None and upper <= cutoff]
+
+def _timescale_installed(conn):
+    return conn.execute(text("SELECT EXISTS (SELECT 1 FROM pg_extension WHERE extname = 'timescaledb')")).scalar()
+
+def metrics_layout(conn):
+    """How the metrics table is stored: 'hypertable', 'partitioned' or 'plain'."""
+    if conn.dialect.name != 'postgresql':
+        return 'plain'
+    if _timescale_installed(conn) and conn.execute(text(
+        "SELECT EXISTS (SELECT 1 FROM timescaledb_information.hypertables "
+        "WHERE hypertable_name = 'metrics' AND hypertable_schema = current_schema())"
+    )).scalar():
+        return 'hypertable'
+    if conn.execute(text(
+        "SELECT EXISTS (SELECT 1 FROM pg_partitioned_table WHERE partrelid = to_regclass('metrics'))"
+    )).scalar():
+        return 'partitioned'
+    return 'plain'
+
+def list_partitions(conn):
+    """[(name, start, end), ...] of the range partitions of metrics, without the default partition."""
+    rows = conn.execute(text(
+        "SELECT c.relname, pg_get_expr(c.relpartbound, c.oid) FROM pg_inherits i "
+        "JOIN pg_class c ON c.oid = i.inhrelid WHERE i.inhparent = to_regclass('metrics')"
+    )).all()
+    partitions = []
+    for name, bound in rows:
+        match = _BOUNDS.search(bound)
+        if match:
+            partitions.append((name, _parse_bound(match.group(1)), _parse_bound(match.group(2))))
+    return sorted(partitions, key=lambda p: (p[1] is not None, p[1] or datetime.min))
+
+def _create_partition(conn, name, start, end):
+    # Built beside the table and attached, which locks metrics less than CREATE ... PARTITION OF.
+    # LIKE copies the columns, NOT NULLs and defaults but not the parent's identity, which a
+    # table attached as a partition must not have; inserts through metrics draw their ids
+    # from the parent's identity
+    conn.execute(text(f"CREATE TABLE {name} (LIKE metrics INCLUDING DEFAULTS)"))
+    moved = conn.execute(text(
+        f"WITH moved AS (DELETE FROM {DEFAULT_PARTITION} WHERE timestamp >= :start AND timestamp < :end RETURNING *) "
+        f"INSERT INTO {name} SELECT * FROM moved"
+    ), {'start': start, 'end': end}).rowcount
+    conn.execute(text(
+        f"ALTER TABLE metrics ATTACH PARTITION {name} "
+        f"FOR VALUES FROM ('{start.isoformat(' ')}') TO ('{end.isoformat(' ')}')"
+    ))
+    if moved:
+        logger.info(f"Moved {moved} metric(s) from {DEFAULT_PARTITION} to {name}")
+
+def _timestamp_in_primary_key(conn, table):
+    # Every unique index of a partitioned table or hypertable must include the partition column
+    primary_key = conn.execute(text(
+        "SELECT conname FROM pg_constraint WHERE conrelid = to_regclass(:table) AND contype = 'p'"
+    ), {'table': table}).scalar()
+    conn.execute(text(f'ALTER TABLE {table} DROP CONSTRAINT {primary_key}, ADD PRIMARY KEY (id, timestamp)'))
+
+def partition_metrics_table(conn):
+    """Schema upgrade step: turn a plain metrics table into a partitioned table or a hypertable."""
+    if conn.dialect.name != 'postgresql' or not METRICS_PARTITIONING_ENABLED:
+        return
+    if metrics_layout(conn) != 'plain':
+        return
+
+    if _timescale_installed(conn):
+        _timestamp_in_primary_key(conn, 'metrics')
+        conn.execute(text(
+            "SELECT create_hypertable('metrics', 'timestamp', "
+            "chunk_time_interval => INTERVAL '1 day', migrate_data => true)"
+        ))
+        logger.info("Converted metrics to a TimescaleDB hypertable")
+        return
+
+    tomorrow = datetime.combine(datetime.utcnow().date(), datetime.min.time()) + timedelta(days=1)
+    empty = conn.execute(text('SELECT NOT EXISTS (SELECT 1 FROM metrics)')).scalar()
+    if empty:
+        conn.execute(text('DROP TABLE metrics'))
+    else:
+        # Free the names of the constraint and index the partitioned table is created with
+        conn.execute(text(f'ALTER TABLE metrics RENAME TO {LEGACY_PARTITION}'))
+        for constraint in conn.execute(text(
+            "SELECT conname FROM pg_constraint WHERE conrelid = to_regclass(:table) AND contype IN ('p', 'u')"
+        ), {'table': LEGACY_PARTITION}).scalars().all():
+            conn.execute(text(f'ALTER TABLE {LEGACY_PARTITION} RENAME CONSTRAINT {constraint} TO {LEGACY_PARTITION}_{constraint}'))
+        for index in conn.execute(text(
+            "SELECT indexname FROM pg_indexes WHERE tablename = :table AND schemaname = current_schema() "
+            "AND indexname NOT LIKE :prefix"
+        ), {'table': LEGACY_PARTITION, 'prefix': f'{LEGACY_PARTITION}_%'}).scalars().all():
+            conn.execute(text(f'ALTER INDEX {index} RENAME TO {LEGACY_PARTITION}_{index}'))
+        _timestamp_in_primary_key(conn, LEGACY_PARTITION)
+        # A partition cannot have an identity of its own (PostgreSQL 17 refuses to attach it),
+        # and the partitioned table's identity must carry on past the ids already handed out
+        conn.execute(text(f'ALTER TABLE {LEGACY_PARTITION} ALTER COLUMN id DROP IDENTITY IF EXISTS'))
+        next_id = conn.execute(text(f'SELECT COALESCE(MAX(id), 0) + 1 FROM {LEGACY_PARTITION}')).scalar()
+
+    ddl = str(CreateTable(Metric.__table__).compile(dialect=conn.dialect)).rstrip()
+    # The model's key is id alone, which SQLite needs to generate it
+    ddl = ddl.replace('PRIMARY KEY (id)', 'PRIMARY KEY (id, timestamp)')
+    conn.execute(text(f'{ddl} PARTITION BY RANGE (timestamp)'))
+    if not empty:
+        conn.execute(text(f'ALTER TABLE metrics ALTER COLUMN id RESTART WITH {int(next_id)}'))
+        conn.execute(text(
+            f"ALTER TABLE metrics ATTACH PARTITION {LEGACY_PARTITION} "
+            f"FOR VALUES FROM (MINVALUE) TO ('{tomorrow.isoformat(' ')}')"
+        ))
+    conn.execute(text(f'CREATE TABLE {DEFAULT_PARTITION} PARTITION OF metrics DEFAULT'))
+    logger.info(f"Partitioned metrics by day{'' if empty else f', existing rows kept in {LEGACY_PARTITION}'}")
+
+def create_partitions(conn, today, days_ahead=METRICS_PARTITION_DAYS_AHEAD):
+    """Create the missing daily partitions from today through days_ahead days later; returns their names."""
+    if metrics_layout(conn) != 'partitioned':
+        # TimescaleDB creates chunks as rows arrive
+        return []
+    planned = plan_partitions(list_partitions(conn), today, days_ahead)
+    for name, start, end in planned:
+        _create_partition(conn, name, start, end)
+    return [name for name, _, _ in planned]
+
+def drop_expired(conn, cutoff):
+    """Drop the partitions (or chunks) holding nothing newer than cutoff; returns their names."""
+    layout = metrics_layout(conn)
+    if layout == 'hypertable':
+        dropped = conn.execute(text("SELECT drop_chunks('metrics', older_than => :cutoff)"), {'cutoff': cutoff}).scalars().all()
+    elif layout == 'partitioned':
+        dropped = expired_partitions(list_partitions(conn), cutoff)
+        for name in dropped:
+            conn.execute(text(f'DROP TABLE {name}'))
+        # Stragglers outside every range; the default partition stays small
+        conn.execute(text(f'DELETE FROM {DEFAULT_PARTITION} WHERE timestamp < :cutoff'), {'cutoff': cutoff})
+    else:
+        return []
+    # The flags of the dropped metrics are expired by the retention job, see repo/retention.py
+    return dropped
+
+def maintain_partitions(engine, now=None, days_ahead=METRICS_PARTITION_DAYS_AHEAD, retention_days=METRICS_RETENTION_DAYS):
+    """
+    Create the partitions of the coming days and, with retention_days set, drop those
+    entirely older than that. Returns (created, dropped) partition names; both empty
+    unless metrics is partitioned.
+    """
+    if engine.dialect.name != 'postgresql' or not METRICS_PARTITIONING_ENABLED:
+        return [], []
+    now = now or datetime.utcnow()
+    with engine.begin() as conn:
+        created = create_partitions(conn, now, days_ahead)
+    dropped = []
+    if retention_days:
+        cutoff = now - timedelta(days=retention_days)
+        if ARCHIVE_ENABLED:
+            # A partition is only dropped once its days are in the cold archive
+            cutoff = min(cutoff, archive_horizon('metrics', now))
+        with engine.begin() as conn:
+            dropped = drop_expired(conn, cutoff)
+    return created, dropped
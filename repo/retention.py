@@ -0,0 +1,218 @@
+import time
+from datetime import datetime, timedelta
+from sqlalchemy import DateTime, bindparam, inspect, text
+from repo.db import db
+from repo.partitions import metrics_layout
+from repo.archive import ARCHIVED_TABLES, archive_horizon
+from util.logger import logger
+from constants.service_constants import (
+    RETENTION_POLICIES, RETENTION_BATCH_ROWS, RETENTION_BATCH_PAUSE_SECONDS, RETENTION_MAX_BATCHES_PER_RUN,
+    ARCHIVE_ENABLED
+)
+
+# Expired rows are deleted, or moved to <table>_archive, in batches of keyset ranges: a
+# batch is the next batch_rows keys after the last one handled, found with one LIMIT
+# query on the key's index, and is deleted in its own transaction. No statement touches
+# more than a batch of rows, so locks are short and the WAL of a batch is bounded, and a
+# pause between batches caps the I/O of a run. A run stops after a number of batches and
+# the next one carries on, since deleted rows are not found again.
+#
+# Each table is walked along a key that keeps its expired rows together: the timestamp
+# index of metric_outliers and scaling_decisions, and, for metrics, which only has its
+# (instance_key, timestamp) index, instance by instance (see delete_expired_metrics).
+# On PostgreSQL a partitioned metrics table (or hypertable) is left to
+# repo/partitions.py, which drops expired days whole. With the cold archive enabled,
+# rows of days not exported yet are kept (see repo/archive.py).
+
+ARCHIVE_SUFFIX = '_archive'
+
+# Keyset of each table with a policy, unique and backed by an index
+RETENTION_KEYS = {
+    'metrics': ('instance_key', 'timestamp'),
+    'metric_outliers': ('timestamp', 'instance_key'),
+    'scaling_decisions': ('timestamp', 'id'),
+}
+
+def _statement(sql, params, types):
+    """
+    text(sql) with its parameters bound as the types given by name, datetimes as DateTime,
+    so they are stored like the columns they compare with.
+    """
+    return text(sql).bindparams(*(
+        bindparam(name, type_=types.get(name, DateTime)) for name, value in params.items()
+        if (name in types or isinstance(value, datetime)) and f':{name}' in sql
+    ))
+
+def _ensure_archive(table):
+    """Create <table>_archive with the columns of table if it does not exist; returns its name."""
+    archive = f'{table}{ARCHIVE_SUFFIX}'
+    if not inspect(db.session.connection()).has_table(archive):
+        if db.session.get_bind().dialect.name == 'postgresql':
+            db.session.execute(text(f'CREATE TABLE {archive} (LIKE {table} INCLUDING DEFAULTS)'))
+        else:
+            db.session.execute(text(f'CREATE TABLE {archive} AS SELECT * FROM {table} WHERE 0'))
+        db.session.commit()
+        logger.info(f"Created {archive}")
+    return archive
+
+def _remove(table, where, params, types, archive):
+    """Delete the rows of table matching where, copying them to archive first if given; returns the count."""
+    delete = f'DELETE FROM {table} WHERE {where}'
+    if archive is None:
+        return db.session.execute(_statement(delete, params, types), params).rowcount
+    if db.session.get_bind().dialect.name == 'postgresql':
+        move = f'WITH moved AS ({delete} RETURNING *) INSERT INTO {archive} SELECT * FROM moved'
+        return db.session.execute(_statement(move, params, types), params).rowcount
+    copy = f'INSERT INTO {archive} SELECT * FROM {table} WHERE {where}'
+    db.session.execute(_statement(copy, params, types), params)
+    return db.session.execute(_statement(delete, params, types), params).rowcount
+
+def delete_in_batches(table, key, where, params=None, batch_rows=RETENTION_BATCH_ROWS, archive=False,
+                      pause_seconds=0, max_batches=None):
+    """
+    Delete the rows of table matching the SQL condition where, batch_rows keys of key
+    (a tuple of columns in the order of a unique index) per committed transaction, and
+    copy them to <table>_archive first when archive is set.
+
+    Each batch selects the next keys matching where, so the index must find them without
+    reading other rows.
+
+    Returns (rows deleted, whether no batch is left).
+    """
+    params = dict(params or {})
+    archive_table = _ensure_archive(table) if archive else None
+    columns = ', '.join(key)
+    key_columns = [db.metadata.tables[table].c[column] for column in key]
+    types = {f'{side}_{i}': column.type for side in ('after', 'last') for i, column in enumerate(key_columns)}
+    keyset = f'({columns})'
+    after = None
+    deleted = batches = 0
+    while max_batches is None or batches < max_batches:
+        batch = [f'({where})']
+        if after is not None:
+            batch.append(f"{keyset} > ({', '.join(f':after_{i}' for i in range(len(key)))})")
+            params.update({f'after_{i}': value for i, value in enumerate(after)})
+        try:
+            bound = (
+                f"SELECT {columns} FROM {table} WHERE {' AND '.join(batch) or '1 = 1'} "
+                f"ORDER BY {columns} LIMIT 1 OFFSET :offset"
+            )
+            # Read and bound back typed like the key columns
+            last = db.session.execute(
+                _statement(bound, params, types).columns(*key_columns),
+                {**params, 'offset': batch_rows - 1}
+            ).first()
+            if last is not None:
+                batch.append(f"{keyset} <= ({', '.join(f':last_{i}' for i in range(len(key)))})")
+                params.update({f'last_{i}': value for i, value in enumerate(last)})
+            removed = _remove(table, ' AND '.join(batch), params, types, archive_table)
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+        deleted += removed
+        batches += 1
+        logger.debug(f"{table}: batch {batches} removed {removed} row(s), {deleted} so far")
+        if last is None:
+            return deleted, True
+        after = tuple(last)
+        if pause_seconds:
+            time.sleep(pause_seconds)
+    return deleted, False
+
+def delete_expired_metrics(cutoff, batch_rows=RETENTION_BATCH_ROWS, archive=False, pause_seconds=0, max_batches=None):
+    """
+    Delete the metrics older than cutoff like delete_in_batches, along the
+    (instance_key, timestamp) index one instance at a time: a batch joins the instances,
+    in key order, to the index range of each one's rows before cutoff, so only expired
+    entries are read, however many live rows lie between them, and deletes the same ranges.
+
+    Returns (rows deleted, whether no batch is left).
+    """
+    archive_table = _ensure_archive('metrics') if archive else None
+    key_columns = [db.metadata.tables['metrics'].c[column] for column in RETENTION_KEYS['metrics']]
+    types = {f'{side}_{i}': column.type for side in ('after', 'last') for i, column in enumerate(key_columns)}
+    params = {'cutoff': cutoff}
+    after = None
+    deleted = batches = 0
+    while max_batches is None or batches < max_batches:
+        # Conditions on the instance key, then on the row key, with {m} before metrics columns
+        instances, rows = [], ['{m}timestamp < :cutoff']
+        if after is not None:
+            instances.append('{m}instance_key >= :after_0')
+            rows.append('({m}instance_key, {m}timestamp) > (:after_0, :after_1)')
+            params.update({'after_0': after[0], 'after_1': after[1]})
+        try:
+            bound = (
+                "SELECT m.instance_key, m.timestamp FROM instances i JOIN metrics m ON m.instance_key = i.instance_key "
+                f"WHERE {' AND '.join([c.format(m='i.') for c in instances] + [c.format(m='m.') for c in rows])} "
+                "ORDER BY m.instance_key, m.timestamp LIMIT 1 OFFSET :offset"
+            )
+            last = db.session.execute(
+                _statement(bound, params, types).columns(*key_columns), {**params, 'offset': batch_rows - 1}
+            ).first()
+            if last is not None:
+                instances.append('{m}instance_key <= :last_0')
+                rows.append('({m}instance_key, {m}timestamp) <= (:last_0, :last_1)')
+                params.update({'last_0': last[0], 'last_1': last[1]})
+            where = (
+                f"instance_key IN (SELECT instance_key FROM instances WHERE {' AND '.join(instances).format(m='') or '1 = 1'}) "
+                f"AND {' AND '.join(rows).format(m='')}"
+            )
+            removed = _remove('metrics', where, params, types, archive_table)
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+        deleted += removed
+        batches += 1
+        logger.debug(f"metrics: batch {batches} removed {removed} row(s), {deleted} so far")
+        if last is None:
+            return deleted, True
+        after = tuple(last)
+        if pause_seconds:
+            time.sleep(pause_seconds)
+    return deleted, False
+
+def apply_retention(now=None, policies=RETENTION_POLICIES, batch_rows=RETENTION_BATCH_ROWS,
+                    pause_seconds=RETENTION_BATCH_PAUSE_SECONDS, max_batches=RETENTION_MAX_BATCHES_PER_RUN):
+    """
+    Remove the rows older than their table's policy, at most max_batches batches per
+    table. Returns {table: (rows removed, whether the table is done)} for the tables
+    handled; tables kept forever (days 0) or left to partition drops are skipped.
+    """
+    now = now or datetime.utcnow()
+    progress = {}
+    for table, policy in policies.items():
+        if not policy['days']:
+            continue
+        if table == 'metrics' and metrics_layout(db.session.connection()) != 'plain':
+            continue
+        cutoff = now - timedelta(days=policy['days'])
+        if ARCHIVE_ENABLED and table in ARCHIVED_TABLES:
+            # Days not in the cold archive yet are kept
+            cutoff = min(cutoff, archive_horizon(ARCHIVED_TABLES[table], now))
+        if table == 'metrics':
+            progress[table] = delete_expired_metrics(
+                cutoff, batch_rows=batch_rows, archive=policy['archive'], pause_seconds=pause_seconds,
+                max_batches=max_batches
+            )
+            continue
+        progress[table] = delete_in_batches(
+            table, RETENTION_KEYS[table], 'timestamp < :cutoff', {'cutoff': cutoff}, batch_rows=batch_rows,
+            archive=policy['archive'], pause_seconds=pause_seconds, max_batches=max_batches
+        )
+    return progress
+
+def clear_instance_metrics(instance_key, instance_id, batch_rows=RETENTION_BATCH_ROWS):
+    """
+    Delete all metrics of one instance with their outlier flags and rollups, in batches
+    along the per-instance indexes. Returns the number of metrics deleted.
+    """
+    delete_in_batches('metric_outliers', ('instance_key', 'timestamp'), 'instance_key = :instance_key',
+                      {'instance_key': instance_key}, batch_rows=batch_rows)
+    delete_in_batches('metric_rollups', ('instance_id', 'resolution', 'bucket'), 'instance_id = :instance_id',
+                      {'instance_id': instance_id}, batch_rows=batch_rows)
+    deleted, _ = delete_in_batches('metrics', ('instance_key', 'timestamp'), 'instance_key = :instance_key',
+                                   {'instance_key': instance_key}, batch_rows=batch_rows)
+    return deleted
@@ -0,0 +1,114 @@
+import threading
+import boto3
+from botocore.config import Config
+from util.logger import logger
+from constants.service_constants import (
+    AWS_MAX_POOL_CONNECTIONS, AWS_CONNECT_TIMEOUT_SECONDS, AWS_READ_TIMEOUT_SECONDS,
+    AWS_RETRY_MODE, AWS_MAX_ATTEMPTS
+)
+
+def build_client_config(max_pool_connections=AWS_MAX_POOL_CONNECTIONS,
+                        connect_timeout=AWS_CONNECT_TIMEOUT_SECONDS,
+                        read_timeout=AWS_READ_TIMEOUT_SECONDS,
+                        retry_mode=AWS_RETRY_MODE,
+                        max_attempts=AWS_MAX_ATTEMPTS):
+    return Config(
+        max_pool_connections=max_pool_connections,
+        connect_timeout=connect_timeout,
+        read_timeout=read_timeout,
+        retries={'mode': retry_mode, 'max_attempts': max_attempts}
+    )
+
+class AwsClientRegistry:
+    """
+    Thread-safe cache of boto3 clients keyed by (service, region).
+
+    Building a client loads the service model and opens fresh connections, so
+    every (service, region) pair is built once and shared. boto3 clients are
+    safe to use from several threads; only client creation is serialised.
+
+    Every client counts its in-flight calls. A call that starts while the
+    client already has max_pool_connections calls in flight is counted as
+    saturated: urllib3 has no pooled connection for it and opens a new one.
+    """
+
+    def __init__(self, config=None):
+        self._config = config or build_client_config()
+        self._session = boto3.session.Session()
+        self._lock = threading.Lock()
+        self._clients = {}
+        self._stats = {}
+
+    def get_client(self, service, region):
+        key = (service, region)
+        # Fast path without the lock; dict reads are atomic
+        client = self._clients.get(key)
+        if client is not None:
+            with self._lock:
+                if key in self._stats:
+                    self._stats[key]['reused'] += 1
+            return client
+
+        with self._lock:
+            client = self._clients.get(key)
+            if client is not None:
+                self._stats[key]['reused'] += 1
+                return client
+
+            client = self._session.client(service, region_name=region, config=self._config)
+            self._stats[key] = {
+                'created': 1,
+                'reused': 0,
+                'calls': 0,
+                'in_flight': 0,
+                'peak_in_flight': 0,
+                'saturated_calls': 0
+            }
+            self._track_calls(client, key)
+            self._clients[key] = client
+            logger.info(f"Created {service} client for {region}")
+            return client
+
+    def _track_calls(self, client, key):
+        max_pool = self._config.max_pool_connections
+
+        def on_start(**kwargs):
+            with self._lock:
+                stats = self._stats[key]
+                if stats['in_flight'] >= max_pool:
+                    stats['saturated_calls'] += 1
+                stats['calls'] += 1
+                stats['in_flight'] += 1
+                stats['peak_in_flight'] = max(stats['peak_in_flight'], stats['in_flight'])
+
+        def on_finish(**kwargs):
+            with self._lock:
+                stats = self._stats[key]
+                stats['in_flight'] = max(0, stats['in_flight'] - 1)
+
+        # register_first so the counters run before any handler that short-circuits the call
+        client.meta.events.register_first('before-call.*.*', on_start)
+        client.meta.events.register_first('after-call.*.*', on_finish)
+        client.meta.events.register_first('after-call-error.*.*', on_finish)
+
+    def get_stats(self):
+        """Return per-client reuse and pool usage counters plus fleet totals."""
+        with self._lock:
+            clients = {
+                f"{service}/{region}": dict(stats)
+                for (service, region), stats in self._stats.items()
+            }
+        return {
+            'max_pool_connections': self._config.max_pool_connections,
+            'clients_created': sum(s['created'] for s in clients.values()),
+            'clients_reused': sum(s['reused'] for s in clients.values()),
+            'saturated_calls': sum(s['saturated_calls'] for s in clients.values()),
+            'clients': clients
+        }
+
+    def clear(self):
+        with self._lock:
+            self._clients.clear()
+            self._stats.clear()
+
+client_registry = AwsClientRegistry()
@@ -1,52 +1,167 @@
-import boto3
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
 from util.logger import logger
+from service.aws_clients import client_registry
+from constants.service_constants import (
+    CLOUDWATCH_MAX_QUERIES_PER_CALL, CLOUDWATCH_LOOKBACK_MINUTES, CLOUDWATCH_PERIOD_SECONDS,
+    CLOUDWATCH_MAX_BACKFILL_MINUTES, CLOUDWATCH_SETTLE_PERIODS
+)
 
 def get_cloudwatch_client(region):
-    return boto3.client('cloudwatch', region_name=region)
+    return client_registry.get_client('cloudwatch', region)
 
 def get_ec2_client(region):
-    return boto3.client('ec2', region_name=region)
+    return client_registry.get_client('ec2', region)
 
-def get_metric(cw_client, instance_id, metric_name, namespace, stat='Average'):
-    try:
-        response = cw_client.get_metric_statistics(
-            Namespace=namespace,
-            MetricName=metric_name,
-            Dimensions=[{'Name': 'InstanceId', 'Value': instance_id}],
-            # this is because the aws cloudwatch metircs are not always available so i am checking last 10 min
-            StartTime=datetime.utcnow() - timedelta(minutes=10),
-            EndTime=datetime.utcnow(),
-            # first 60 seconds which is there I am considering as the metrics
-            Period=60,
-            Statistics=[stat]
-        )
-        if response['Datapoints']:
-            # Sort by timestamp to get the absolute latest value
-            return sorted(response['Datapoints'], key=lambda x: x['Timestamp'])[-1][stat]
-    except Exception as e:
-        logger.error(f"Error fetching metric {metric_name} for {instance_id}: {e}")
-    return None
+# (result key, CloudWatch metric name, namespace) collected for every instance.
+# Memory metrics usually come from the CloudWatch Agent (custom namespace 'CWAgent')
+# If the agent is not installed/configured, memory_usage will be -> None
+INSTANCE_METRICS = [
+    ('cpu_utilization', 'CPUUtilization', 'AWS/EC2'),
+    ('memory_usage', 'mem_used_percent', 'CWAgent'),
+    ('network_in', 'NetworkIn', 'AWS/EC2'),
+    ('network_out', 'NetworkOut', 'AWS/EC2'),
+    ('disk_read', 'DiskReadBytes', 'AWS/EC2'),
+]
+
+# Number of instances whose metrics fit in one GetMetricData call
+INSTANCES_PER_BATCH = CLOUDWATCH_MAX_QUERIES_PER_CALL // len(INSTANCE_METRICS)
+
+def build_metric_queries(instance_ids, stat='Average'):
+    """
+    Build GetMetricData queries for every metric of every instance.
+    Returns (queries, query_index) where query_index maps a query Id back to (instance_id, result key).
+    """
+    queries = []
+    query_index = {}
+    for i, instance_id in enumerate(instance_ids):
+        for key, metric_name, namespace in INSTANCE_METRICS:
+            # Query Ids must start with a lowercase letter and be unique within the call
+            query_id = f"i{i}_{key}"
+            queries.append({
+                'Id': query_id,
+                'MetricStat': {
+                    'Metric': {
+                        'Namespace': namespace,
+                        'MetricName': metric_name,
+                        'Dimensions': [{'Name': 'InstanceId', 'Value': instance_id}]
+                    },
+                    'Period': CLOUDWATCH_PERIOD_SECONDS,
+                    'Stat': stat
+                },
+                'ReturnData': True
+            })
+            query_index[query_id] = (instance_id, key)
+    return queries, query_index
+
+def _to_naive_utc(timestamp):
+    # CloudWatch returns timezone-aware timestamps, the database stores naive UTC
+    if timestamp.tzinfo is not None:
+        timestamp = timestamp.astimezone(timezone.utc).replace(tzinfo=None)
+    return timestamp
+
+def settle_start(watermark):
+    """
+    Oldest timestamp a fetch reads again for an instance with this watermark: the last
+    CLOUDWATCH_SETTLE_PERIODS periods up to the watermark, whose datapoints may still be
+    incomplete because some metrics (CWAgent memory) are published late.
+    """
+    return watermark - timedelta(seconds=CLOUDWATCH_PERIOD_SECONDS * (CLOUDWATCH_SETTLE_PERIODS - 1))
+
+def get_fetch_range(instance_ids, watermarks, now=None):
+    """
+    Work out the [start, end) range for one GetMetricData call.
+    end is floored to the period so only closed periods are read. When a period closed
+    after some watermark of the batch, start is the oldest settle_start in the batch, or
+    CLOUDWATCH_LOOKBACK_MINUTES for instances never fetched, but never further back than
+    CLOUDWATCH_MAX_BACKFILL_MINUTES. Otherwise nothing is new and start is not before end.
+    """
+    now = now or datetime.utcnow()
+    period = CLOUDWATCH_PERIOD_SECONDS
+    epoch = datetime(1970, 1, 1)
+    end_time = epoch + timedelta(seconds=int((now - epoch).total_seconds()) // period * period)
+    earliest = end_time - timedelta(minutes=CLOUDWATCH_MAX_BACKFILL_MINUTES)
+    default_start = end_time - timedelta(minutes=CLOUDWATCH_LOOKBACK_MINUTES)
+
+    new_starts, starts = [], []
+    for instance_id in instance_ids:
+        watermark = watermarks.get(instance_id)
+        # The watermark datapoint itself is already stored, new ones start a period later
+        new_starts.append(watermark + timedelta(seconds=period) if watermark else default_start)
+        starts.append(settle_start(watermark) if watermark else default_start)
+    if min(new_starts) >= end_time:
+        return min(new_starts), end_time
+    return max(min(starts), earliest), end_time
+
+def get_metric_data(cw_client, instance_ids, watermarks=None, stat='Average', now=None):
+    """
+    Fetch every new datapoint of every metric for up to INSTANCES_PER_BATCH instances
+    with a single GetMetricData call (plus pagination, if CloudWatch asks for it).
+
+    Datapoints newer than the instance's watermark are returned, plus the ones of its
+    settle window (settle_start onwards) to fill in metrics that arrived late. Returns
+    {instance_id: [sample dict, ...]} with one sample per CloudWatch timestamp,
+    oldest first; metrics missing at a timestamp are None.
+    """
+    watermarks = watermarks or {}
+    queries, query_index = build_metric_queries(instance_ids, stat)
+    samples = {instance_id: {} for instance_id in instance_ids}
+
+    start_time, end_time = get_fetch_range(instance_ids, watermarks, now)
+    if start_time >= end_time:
+        return {instance_id: [] for instance_id in instance_ids}
+
+    request = {
+        'MetricDataQueries': queries,
+        'StartTime': start_time,
+        'EndTime': end_time,
+        'ScanBy': 'TimestampAscending'
+    }
+    while True:
+        response = cw_client.get_metric_data(**request)
+        for result in response.get('MetricDataResults', []):
+            instance_id, key = query_index[result['Id']]
+            watermark = watermarks.get(instance_id)
+            since = settle_start(watermark) if watermark else None
+            for timestamp, value in zip(result.get('Timestamps', []), result.get('Values', [])):
+                timestamp = _to_naive_utc(timestamp)
+                if since and timestamp < since:
+                    continue
+                sample = samples[instance_id].setdefault(
+                    timestamp, dict({k: None for k, _, _ in INSTANCE_METRICS}, timestamp=timestamp)
+                )
+                sample[key] = value
+
+        next_token = response.get('NextToken')
+        if not next_token:
+            break
+        request['NextToken'] = next_token
 
-def fetch_instance_metrics(instance_id, region):
-    cw = get_cloudwatch_client(region)
-    
-    cpu = get_metric(cw, instance_id, 'CPUUtilization', 'AWS/EC2')
-    # Memory metrics usually come from the CloudWatch Agent (custom namespace 'CWAgent')
-    # If the agent is not installed/configured, this will return -> None
-    memory = get_metric(cw, instance_id, 'mem_used_percent', 'CWAgent')
-    net_in = get_metric(cw, instance_id, 'NetworkIn', 'AWS/EC2')
-    net_out = get_metric(cw, instance_id, 'NetworkOut', 'AWS/EC2')
-    disk_read = get_metric(cw, instance_id, 'DiskReadBytes', 'AWS/EC2')
-    
     return {
-        'cpu_utilization': cpu,
-        'memory_usage': memory,
-        'network_in': net_in,
-        'network_out': net_out,
-        'disk_read': disk_read
+        instance_id: [by_time[timestamp] for timestamp in sorted(by_time)]
+        for instance_id, by_time in samples.items()
     }
 
+def fetch_instance_metrics_batch(instance_ids, region, watermarks=None):
+    """
+    Fetch new datapoints for many instances of one region, INSTANCES_PER_BATCH instances per API call.
+    watermarks maps instance_id -> timestamp of the newest datapoint already stored; the
+    datapoints of its settle window are returned again.
+    Instances whose batch failed are returned as None.
+    """
+    cw = get_cloudwatch_client(region)
+    results = {}
+    for i in range(0, len(instance_ids), INSTANCES_PER_BATCH):
+        chunk = instance_ids[i:i + INSTANCES_PER_BATCH]
+        try:
+            results.update(get_metric_data(cw, chunk, watermarks))
+        except Exception as e:
+            logger.error(f"Error fetching metrics for {len(chunk)} instance(s) in {region}: {e}")
+            results.update({instance_id: None for instance_id in chunk})
+    return results
+
+def fetch_instance_metrics(instance_id, region, watermark=None):
+    return fetch_instance_metrics_batch([instance_id], region, {instance_id: watermark}).get(instance_id)
+
 def verify_connection(instance_id, region):
     """
     Verifies if we can connect to AWS and find the instance.
@@ -0,0 +1,212 @@
+import threading
+from collections import namedtuple
+from datetime import datetime, timedelta
+from repo.db import db
+from repo.models import MetricBaseline
+from util.logger import logger
+from service.quantile_sketch import P2Quartiles
+from constants.service_constants import IQR_BASELINE_MINUTES, IQR_WINDOW_MINUTES, IQR_MIN_DATA_POINTS, IQR_MULTIPLIER
+
+BASELINE_COLUMNS = ('cpu_utilization', 'memory_usage', 'network_in', 'network_out')
+
+# count is the number of non-outlier samples behind the baseline, bounds maps every
+# BASELINE_COLUMNS entry to (lower, upper), or None with too few values for that metric.
+# The same meaning as the historical metrics and iqr_bounds of the 5 minute analysis.
+Baseline = namedtuple('Baseline', 'count bounds')
+
+EMPTY_BASELINE = Baseline(0, {column: None for column in BASELINE_COLUMNS})
+
+class BaselineGeneration:
+    """One P2Quartiles per metric over every sample observed since started."""
+
+    __slots__ = ('started', 'count', 'sketches')
+
+    def __init__(self, started):
+        self.started = started
+        self.count = 0
+        self.sketches = {column: P2Quartiles() for column in BASELINE_COLUMNS}
+
+    def add(self, sample):
+        self.count += 1
+        for column, sketch in self.sketches.items():
+            value = getattr(sample, column)
+            if value is not None:
+                sketch.add(value)
+
+    def baseline(self):
+        bounds = {}
+        for column, sketch in self.sketches.items():
+            if sketch.count < IQR_MIN_DATA_POINTS:
+                bounds[column] = None
+                continue
+            q1, q3 = sketch.quartiles()
+            iqr = q3 - q1
+            bounds[column] = (q1 - IQR_MULTIPLIER * iqr, q3 + IQR_MULTIPLIER * iqr)
+        return Baseline(self.count, bounds)
+
+    def to_state(self):
+        return [self.started.isoformat(), self.count, {c: s.to_state() for c, s in self.sketches.items()}]
+
+    @classmethod
+    def from_state(cls, state):
+        generation = cls(datetime.fromisoformat(state[0]))
+        generation.count = state[1]
+        generation.sketches = {c: P2Quartiles.from_state(s) for c, s in state[2].items()}
+        return generation
+
+class InstanceBaseline:
+    """
+    Sliding quartile baseline of one instance over roughly the last window_minutes.
+
+    P² cannot forget old values, so two generations overlap: a new one starts every
+    half window and the oldest is dropped, which leaves the oldest live generation
+    covering between half and all of the window. Baselines are read from it.
+    Rotation follows sample timestamps, not the wall clock.
+    """
+
+    __slots__ = ('window', 'generations', 'last_timestamp')
+
+    def __init__(self, window_minutes):
+        self.window = timedelta(minutes=window_minutes)
+        self.generations = []
+        self.last_timestamp = None
+
+    def add(self, sample):
+        timestamp = sample.timestamp
+        # A gap longer than the window leaves nothing worth keeping
+        self.generations = [g for g in self.generations if g.started > timestamp - self.window]
+        if not self.generations or self.generations[-1].started <= timestamp - self.window / 2:
+            self.generations.append(BaselineGeneration(timestamp))
+            del self.generations[:-2]
+        for generation in self.generations:
+            generation.add(sample)
+        self.last_timestamp = timestamp
+
+    def baseline(self):
+        return self.generations[0].baseline() if self.generations else EMPTY_BASELINE
+
+    def to_state(self):
+        return {
+            'last_timestamp': self.last_timestamp.isoformat() if self.last_timestamp else None,
+            'generations': [g.to_state() for g in self.generations]
+        }
+
+    @classmethod
+    def from_state(cls, window_minutes, state):
+        baseline = cls(window_minutes)
+        last = state.get('last_timestamp')
+        baseline.last_timestamp = datetime.fromisoformat(last) if last else None
+        baseline.generations = [BaselineGeneration.from_state(g) for g in state['generations']]
+        return baseline
+
+class BaselineStore:
+    """
+    Long IQR baselines (IQR_BASELINE_MINUTES) of every instance, kept in memory.
+
+    The scaling engine observes each instance's window after deciding on it, so
+    the baseline used for a decision never includes the metrics being judged and
+    a metric flagged as an outlier never enters it. Each sample is observed once,
+    in timestamp order. State is written to metric_baselines by save_baselines
+    and read back by load_baselines, so a restart keeps the baselines.
+    """
+
+    def __init__(self, window_minutes=IQR_BASELINE_MINUTES):
+        self.window_minutes = window_minutes
+        self._lock = threading.Lock()
+        self._baselines = {}
+        self._checked = set()  # instances looked up in the database, found or not
+        self._dirty = set()
+
+    def observe(self, instance_id, samples, flagged_timestamp=None):
+        """
+        Add an instance's samples (oldest first) that are newer than the last one observed.
+        Outliers, and the sample at flagged_timestamp flagged by this decision, are left out.
+        """
+        with self._lock:
+            baseline = self._baselines.get(instance_id)
+            if baseline is None:
+                baseline = self._baselines[instance_id] = InstanceBaseline(self.window_minutes)
+            last = baseline.last_timestamp
+            for sample in samples:
+                if last is not None and sample.timestamp <= last:
+                    continue
+                if sample.is_outlier == False and sample.timestamp != flagged_timestamp:
+                    baseline.add(sample)
+                baseline.last_timestamp = last = sample.timestamp
+                self._dirty.add(instance_id)
+
+    def get_baseline(self, instance_id):
+        with self._lock:
+            baseline = self._baselines.get(instance_id)
+            return baseline.baseline() if baseline else EMPTY_BASELINE
+
+    def restore(self, instance_id, window_minutes, state):
+        with self._lock:
+            self._checked.add(instance_id)
+            if instance_id in self._baselines or window_minutes != self.window_minutes:
+                return
+            self._baselines[instance_id] = InstanceBaseline.from_state(window_minutes, state)
+
+    def unchecked(self, instance_ids):
+        with self._lock:
+            missing = [i for i in instance_ids if i not in self._checked and i not in self._baselines]
+            self._checked.update(missing)
+            return missing
+
+    def take_dirty(self):
+        """Return {instance_id: state} for every instance changed since the last call."""
+        with self._lock:
+            states = {i: self._baselines[i].to_state() for i in self._dirty if i in self._baselines}
+            self._dirty.clear()
+            return states
+
+    def mark_dirty(self, instance_ids):
+        with self._lock:
+            self._dirty.update(instance_ids)
+
+    def clear(self):
+        with self._lock:
+            self._baselines.clear()
+            self._checked.clear()
+            self._dirty.clear()
+
+    def get_stats(self):
+        with self._lock:
+            return {'instances': len(self._baselines), 'dirty': len(self._dirty)}
+
+baseline_store = BaselineStore()
+
+def long_baseline_enabled():
+    return baseline_store.window_minutes > IQR_WINDOW_MINUTES
+
+def load_baselines(instance_ids):
+    """Restore persisted baselines of instances not seen yet by this process, in one query."""
+    missing = baseline_store.unchecked(instance_ids)
+    if not missing:
+        return
+    rows = MetricBaseline.query.filter(MetricBaseline.instance_id.in_(missing)).all()
+    for row in rows:
+        baseline_store.restore(row.instance_id, row.window_minutes, row.state)
+    if rows:
+        logger.debug(f"Restored {len(rows)} IQR baseline(s)")
+
+def save_baselines():
+    """Persist every baseline changed since the last save. Returns the number written."""
+    states = baseline_store.take_dirty()
+    if not states:
+        return 0
+    try:
+        MetricBaseline.query.filter(MetricBaseline.instance_id.in_(list(states))).delete(synchronize_session=False)
+        now = datetime.utcnow()
+        db.session.add_all(
+            MetricBaseline(instance_id=i, window_minutes=baseline_store.window_minutes, state=state, updated_at=now)
+            for i, state in states.items()
+        )
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        # Try again on the next save
+        baseline_store.mark_dirty(states)
+        logger.error(f"Failed to save {len(states)} IQR baseline(s): {e}")
+        return 0
+    return len(states)
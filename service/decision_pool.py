@@ -0,0 +1,143 @@
+import multiprocessing
+import threading
+import numpy as np
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from util.logger import logger
+from service.fleet_evaluator import WINDOW_FIELDS
+from service.policy_engine import compile_policy
+from constants.service_constants import DECISION_POOL_WORKERS
+
+# Fleet evaluation sharded across worker processes, so large fleets are not bound
+# by the GIL of the scheduler thread. Workers never see ORM objects, sessions or
+# datetimes: the parent extracts each shard's columns into flat NumPy arrays
+# (policy_engine.PolicyPlan.pack, the only step that has to touch every sample
+# object) and the workers compile the shard's policy, compute every statistic and
+# build the reasons (PolicyPlan.evaluate_packed). Outcomes come back as plain tuples
+# and the parent commits them, so workers never write to the database.
+
+# The metric values of an instance's latest sample, all the reasons need
+LatestValues = namedtuple('LatestValues', WINDOW_FIELDS)
+
+_pool_lock = threading.Lock()
+_pool = None
+_pool_workers = 0
+
+def pack_shard(plan, windows, now, baselines=None, sustained=None, forecasts=None):
+    """
+    Pack [(instance_id, samples, latest, oldest_timestamp), ...] for a PolicyPlan into a
+    picklable payload: the plan's definition, the output of its pack with the latest value
+    of every WINDOW_FIELDS column, and the already plain baselines, sustained tracker
+    results and forecasts.
+    """
+    packed = plan.pack(windows, now)
+    flat = packed['flat']
+    for field in WINDOW_FIELDS:
+        if f'latest_{field}' not in flat:
+            # The reasons may read columns the plan's rules do not
+            flat[f'latest_{field}'] = np.array([getattr(latest, field) for _, _, latest, _ in windows], dtype=float)
+    return {
+        'policy': plan.definition,
+        'packed': packed,
+        'baselines': baselines,
+        'sustained': sustained,
+        'forecasts': forecasts
+    }
+
+def column_values(values, integral=False):
+    """
+    Plain values of a float column: None for NaN and, with integral, int for whole
+    numbers, like window_store.from_double and network_from_double one value at a time.
+    """
+    result = values.astype(object)
+    if integral:
+        whole = np.isfinite(values) & (values == np.floor(values))
+        result[whole] = values[whole].astype(np.int64).astype(object)
+    result[np.isnan(values)] = None
+    return result.tolist()
+
+def latest_values(flat):
+    """Rebuild each instance's latest values from a flattened shard, with the types they were read with."""
+    return list(map(LatestValues._make, zip(
+        column_values(flat['latest_cpu_utilization']),
+        column_values(flat['latest_memory_usage']),
+        column_values(flat['latest_network_in'], integral=True),
+        column_values(flat['latest_network_out'], integral=True)
+    )))
+
+def evaluate_shard(payload):
+    """Worker entry point: evaluate one packed shard and return its outcomes in order."""
+    # Compiled once per worker and definition, see policy_engine.compile_policy
+    plan = compile_policy(payload['policy'])
+    packed = payload['packed']
+    return plan.evaluate_packed(
+        packed, latest_values(packed['flat']),
+        baselines=payload['baselines'], sustained=payload['sustained'], forecasts=payload['forecasts']
+    )
+
+def shard_bounds(count, shards):
+    """Split range(count) into at most shards contiguous (start, stop) ranges of near equal size."""
+    shards = max(1, min(shards, count))
+    size, extra = divmod(count, shards)
+    bounds = []
+    start = 0
+    for i in range(shards):
+        stop = start + size + (1 if i < extra else 0)
+        bounds.append((start, stop))
+        start = stop
+    return bounds
+
+def get_pool(workers):
+    """The shared worker pool, started on first use and kept across decision cycles."""
+    global _pool, _pool_workers
+    with _pool_lock:
+        if _pool is not None and _pool_workers != workers:
+            _pool.shutdown(wait=False, cancel_futures=True)
+            _pool = None
+        if _pool is None:
+            # spawn, not fork: the scheduler process runs threads and holds database connections
+            _pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'))
+            _pool_workers = workers
+            logger.info(f"Started decision pool with {workers} worker process(es)")
+        return _pool
+
+def shutdown_pool(wait=True):
+    global _pool, _pool_workers
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown(wait=wait, cancel_futures=True)
+        _pool = None
+        _pool_workers = 0
+
+def evaluate_in_pool(plan, windows, now, baselines=None, sustained=None, forecasts=None, workers=None):
+    """
+    Evaluate windows like plan.evaluate (a policy_engine.PolicyPlan), one shard per worker.
+
+    workers defaults to DECISION_POOL_WORKERS. Outcomes come back in the order of windows.
+    If the pool fails (a worker died, or a payload could not be sent) the pool is
+    restarted on the next call and this one is evaluated in-process instead, so a
+    cycle never goes without decisions.
+    """
+    if not windows:
+        return []
+    workers = workers or DECISION_POOL_WORKERS
+
+    try:
+        pool = get_pool(workers)
+        futures = [
+            pool.submit(evaluate_shard, pack_shard(
+                plan, windows[start:stop], now,
+                baselines[start:stop] if baselines is not None else None,
+                sustained[start:stop] if sustained is not None else None,
+                forecasts[start:stop] if forecasts is not None else None
+            ))
+            for start, stop in shard_bounds(len(windows), workers)
+        ]
+        outcomes = []
+        for future in futures:
+            outcomes.extend(future.result())
+        return outcomes
+    except Exception as e:
+        logger.error(f"Decision pool failed, evaluating {len(windows)} instance(s) in-process: {e}")
+        shutdown_pool(wait=False)
+        return plan.evaluate(windows, now, baselines=baselines, sustained=sustained, forecasts=forecasts)
@@ -0,0 +1,57 @@
+import threading
+
+class DecisionQueue:
+    """
+    Instance IDs waiting for a scaling decision, fed by the ingestion paths.
+
+    Pending IDs are kept in a set, so an instance enqueued again before the
+    decision worker picked it up is evaluated once. take hands the worker
+    everything pending in one batch, which it evaluates as a small fleet.
+    Thread-safe: producers are the collector job and request handlers, the
+    consumer is the decision worker thread.
+    """
+
+    def __init__(self):
+        self._condition = threading.Condition()
+        self._pending = set()
+        self._enqueued = 0
+        self._batches = 0
+
+    def enqueue(self, instance_ids):
+        with self._condition:
+            before = len(self._pending)
+            self._pending.update(instance_ids)
+            if len(self._pending) > before:
+                self._enqueued += len(self._pending) - before
+                self._condition.notify()
+
+    def take(self, timeout=None):
+        """
+        Wait up to timeout seconds for pending instances and return all of them, sorted.
+        Returns an empty list when nothing arrived in time.
+        """
+        with self._condition:
+            if not self._pending:
+                self._condition.wait(timeout)
+            if not self._pending:
+                return []
+            instance_ids = sorted(self._pending)
+            self._pending.clear()
+            self._batches += 1
+            return instance_ids
+
+    def clear(self):
+        with self._condition:
+            self._pending.clear()
+            self._enqueued = 0
+            self._batches = 0
+
+    def get_stats(self):
+        with self._condition:
+            return {
+                'pending': len(self._pending),
+                'enqueued': self._enqueued,
+                'batches': self._batches
+            }
+
+decision_queue = DecisionQueue()
@@ -0,0 +1,222 @@
+import threading
+import time
+from bisect import bisect_left
+from collections import deque, namedtuple
+from datetime import datetime
+from functools import wraps
+import numpy as np
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from constants.service_constants import DECISION_TRACE_ENABLED, DECISION_TRACE_CYCLES, DECISION_TRACE_BUCKETS_MS
+
+# Per-phase timing of scaling decision cycles. A cycle is one call of a function
+# decorated with decision_trace.traced (a fleet pass, or one make_scaling_decision);
+# inside it a PhaseTimer closes a phase at every lap, recording the wall time,
+# SQL statements and rows loaded since the previous lap. Statements are counted by
+# one engine listener into a per-thread counter, so a lap costs two perf_counter
+# reads and a tuple. Fleet phases also record the instances they covered, with the
+# rows of each, so a fleet pass can be broken down per instance too. Finished cycles
+# are kept in a bounded ring and only aggregated into histograms when summary is
+# asked for.
+#
+# While tracing is off no listener is installed, traced calls straight through
+# and timer hands out a shared no-op timer: the cost is one attribute check.
+
+# members maps each instance a fleet phase covered to the rows it loaded or wrote for it, or is None
+Span = namedtuple('Span', 'phase instance_id seconds queries rows instances members')
+Cycle = namedtuple('Cycle', 'kind started_at seconds queries spans')
+
+class _NullTimer:
+    """Stand-in handed out while tracing is off."""
+
+    __slots__ = ()
+
+    recording = False
+
+    def lap(self, phase, rows=0, instances=None, members=None):
+        pass
+
+NULL_TIMER = _NullTimer()
+
+class PhaseTimer:
+    """
+    Records the phases of one instance (instance_id set) or of a whole fleet pass.
+    recording tells callers whether building the members of a lap is worth it.
+    """
+
+    __slots__ = ('trace', 'instance_id', 'spans', 'started', 'queries')
+
+    recording = True
+
+    def __init__(self, trace, instance_id, spans):
+        self.trace = trace
+        self.instance_id = instance_id
+        self.spans = spans
+        self.started = time.perf_counter()
+        self.queries = trace.query_count()
+
+    def lap(self, phase, rows=0, instances=None, members=None):
+        """
+        Close phase, which ran since the previous lap (or since the timer was made).
+        members maps each instance the phase covered to its rows, for fleet phases.
+        """
+        now = time.perf_counter()
+        queries = self.trace.query_count()
+        if instances is None:
+            instances = len(members) if members is not None else (1 if self.instance_id is not None else 0)
+        self.spans.append(Span(
+            phase, self.instance_id, now - self.started, queries - self.queries, rows, instances, members
+        ))
+        # Restart after recording, so the bookkeeping is not charged to the next phase
+        self.started = time.perf_counter()
+        self.queries = queries
+
+def histogram(values, buckets_ms=DECISION_TRACE_BUCKETS_MS):
+    """Distribution of durations in seconds: mean, percentiles and counts per bucket, all in milliseconds."""
+    milliseconds = np.asarray(values, dtype=float) * 1000
+    counts = [0] * (len(buckets_ms) + 1)
+    for value in milliseconds.tolist():
+        counts[bisect_left(buckets_ms, value)] += 1
+    if not len(milliseconds):
+        return {'count': 0, 'buckets': []}
+    p50, p95, p99 = np.percentile(milliseconds, [50, 95, 99]).tolist()
+    return {
+        'count': len(milliseconds),
+        'total_ms': float(milliseconds.sum()),
+        'mean_ms': float(milliseconds.mean()),
+        'p50_ms': p50,
+        'p95_ms': p95,
+        'p99_ms': p99,
+        'max_ms': float(milliseconds.max()),
+        # Upper bound of each bucket, None for the overflow bucket
+        'buckets': [{'le_ms': bound, 'count': count} for bound, count in zip(list(buckets_ms) + [None], counts)],
+    }
+
+def member_share(span, instance_ids):
+    """The part of a fleet span that falls to instance_ids, or None if it covered none of them."""
+    if not span.members:
+        return None
+    selected = [instance_id for instance_id in instance_ids if instance_id in span.members]
+    if not selected:
+        return None
+    share = len(selected) / len(span.members)
+    return span._replace(
+        seconds=span.seconds * share, queries=span.queries * share,
+        rows=sum(span.members[instance_id] for instance_id in selected), instances=len(selected)
+    )
+
+class DecisionTrace:
+    """
+    Span recorder for scaling decision cycles, keeping the last `capacity` cycles.
+    Thread-safe: the decision worker and the periodic job trace their own cycles.
+    """
+
+    def __init__(self, enabled=DECISION_TRACE_ENABLED, capacity=DECISION_TRACE_CYCLES):
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._cycles = deque(maxlen=capacity)
+        self.enabled = False
+        if enabled:
+            self.enable()
+
+    def enable(self):
+        with self._lock:
+            if not self.enabled:
+                event.listen(Engine, 'before_cursor_execute', self._count_query)
+                self.enabled = True
+
+    def disable(self):
+        with self._lock:
+            if self.enabled:
+                event.remove(Engine, 'before_cursor_execute', self._count_query)
+                self.enabled = False
+
+    def clear(self):
+        with self._lock:
+            self._cycles.clear()
+
+    def _count_query(self, conn, cursor, statement, parameters, context, executemany):
+        self._local.queries = getattr(self._local, 'queries', 0) + 1
+
+    def query_count(self):
+        """SQL statements executed by this thread while tracing was on."""
+        return getattr(self._local, 'queries', 0)
+
+    def traced(self, kind):
+        """Decorator making every call of the function a traced cycle; nested calls join the outer cycle."""
+        def decorator(func):
+            @wraps(func)
+            def wrapper(*args, **kwargs):
+                if not self.enabled or getattr(self._local, 'spans', None) is not None:
+                    return func(*args, **kwargs)
+                started_at = datetime.utcnow()
+                started = time.perf_counter()
+                queries = self.query_count()
+                self._local.spans = spans = []
+                try:
+                    return func(*args, **kwargs)
+                finally:
+                    self._local.spans = None
+                    cycle = Cycle(kind, started_at, time.perf_counter() - started, self.query_count() - queries, spans)
+                    with self._lock:
+                        self._cycles.append(cycle)
+            return wrapper
+        return decorator
+
+    def timer(self, instance_id=None):
+        """A PhaseTimer for the current cycle, or a no-op one when tracing is off or no cycle is running."""
+        if not self.enabled:
+            return NULL_TIMER
+        spans = getattr(self._local, 'spans', None)
+        if spans is None:
+            return NULL_TIMER
+        return PhaseTimer(self, instance_id, spans)
+
+    def cycles(self):
+        with self._lock:
+            return list(self._cycles)
+
+    def summary(self, instance_ids=None):
+        """
+        Histograms over the kept cycles: one for whole cycles per kind and one per phase,
+        with the statements and rows each phase accounted for. With instance_ids, phases
+        only count the spans recorded for those instances and their share of fleet
+        phases: an even share of the time and statements, and their own rows.
+        """
+        cycles = self.cycles()
+        by_kind = {}
+        phases = {}
+        for cycle in cycles:
+            by_kind.setdefault(cycle.kind, []).append(cycle)
+            for span in cycle.spans:
+                if instance_ids is not None and span.instance_id not in instance_ids:
+                    span = member_share(span, instance_ids)
+                    if span is None:
+                        continue
+                phases.setdefault(span.phase, []).append(span)
+
+        summary = {
+            'enabled': self.enabled,
+            'cycles': len(cycles),
+            'since': cycles[0].started_at.isoformat() if cycles else None,
+            'cycle_kinds': {},
+            'phases': {},
+        }
+        for kind, entries in by_kind.items():
+            summary['cycle_kinds'][kind] = {
+                **histogram([cycle.seconds for cycle in entries]),
+                'queries': sum(cycle.queries for cycle in entries),
+            }
+        for phase, spans in phases.items():
+            instances = sum(span.instances for span in spans)
+            seconds = sum(span.seconds for span in spans)
+            summary['phases'][phase] = {
+                **histogram([span.seconds for span in spans]),
+                'queries': sum(span.queries for span in spans),
+                'rows': sum(span.rows for span in spans),
+                'instances': instances,
+                'us_per_instance': seconds * 1e6 / instances if instances else None,
+            }
+        return summary
+
+decision_trace = DecisionTrace()
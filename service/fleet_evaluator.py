@@ -0,0 +1,80 @@
+import numpy as np
+from bisect import bisect_left
+from operator import attrgetter
+from service.scaling_service import FORECAST_HORIZON_SECONDS
+from constants.service_constants import FORECAST_MIN_SAMPLES
+
+# Array building blocks of the vectorized fleet evaluation. The windows of many
+# instances are extracted column by column into flat NumPy arrays (one entry per
+# sample, NaN for missing values) and the trackers, baselines and forecasts the
+# scaling service keeps into per-instance arrays. service.policy_engine runs every
+# plan, DEFAULT_PLAN included, on top of them; service.window_stats computes the
+# window statistics from the flat columns.
+
+WINDOW_FIELDS = ('cpu_utilization', 'memory_usage', 'network_in', 'network_out')
+
+_timestamp = attrgetter('timestamp')
+
+def window_starts(windows, cutoff):
+    """Position of the first sample at or after cutoff in each window; samples are oldest first."""
+    # Comparing positions avoids converting every datetime to datetime64, which dominates otherwise
+    return np.fromiter(
+        (bisect_left(samples, cutoff, key=_timestamp) for _, samples, _, _ in windows),
+        dtype=np.int64, count=len(windows)
+    )
+
+def flatten_samples(windows, fields=WINDOW_FIELDS, outliers=True):
+    """
+    Extract the given columns of [(instance_id, samples, latest, oldest_timestamp), ...] into flat arrays.
+
+    Returns a dict of per-instance 'counts' and 'latest_<field>' arrays, and per-sample
+    columns (NaN for None) and, unless outliers is False, 'included' (not an outlier).
+    """
+    n = len(windows)
+    flat = {'counts': np.fromiter((len(samples) for _, samples, _, _ in windows), dtype=np.int64, count=n)}
+    rows = [row for _, samples, _, _ in windows for row in samples]
+    # One column at a time: building a tuple per row would be slower than the whole evaluation
+    for field in fields:
+        # dtype=float turns None into NaN
+        flat[field] = np.array(list(map(attrgetter(field), rows)), dtype=float)
+        flat[f'latest_{field}'] = np.array([getattr(latest, field) for _, _, latest, _ in windows], dtype=float)
+    if outliers:
+        # Matches the `is_outlier == False` filter of the scalar path: NULL counts as an outlier
+        flat['included'] = np.array([row.is_outlier == False for row in rows], dtype=bool)
+    return flat
+
+def padded_layout(counts):
+    """
+    (width, rows, cols) to scatter flat per-sample values into padded (n_instances, width) arrays:
+    width is the longest window (at least 1), rows and cols the target of every flat value.
+    """
+    n = len(counts)
+    width = max(int(counts.max()) if n else 0, 1)
+    offsets = np.cumsum(counts) - counts
+    rows = np.repeat(np.arange(n), counts)
+    cols = np.arange(int(counts.sum())) - np.repeat(offsets, counts)
+    return width, rows, cols
+
+def tracked_usage(sustained, check):
+    """(is_sustained, percentage) arrays for one sustained check from per-instance tracker results."""
+    is_sustained = np.array([usage[check][0] for usage in sustained], dtype=bool)
+    percentage = np.array([usage[check][1] for usage in sustained], dtype=float)
+    return is_sustained, percentage
+
+def baseline_bounds(baselines, column):
+    """(lower, upper, has_bounds) arrays for one column of service.baseline_store.Baseline entries."""
+    bounds = [baseline.bounds[column] or (np.nan, np.nan) for baseline in baselines]
+    lower = np.array([b[0] for b in bounds], dtype=float)
+    upper = np.array([b[1] for b in bounds], dtype=float)
+    return lower, upper, ~np.isnan(lower)
+
+def forecast_peaks(forecasts, metric, min_samples=FORECAST_MIN_SAMPLES, horizon_seconds=FORECAST_HORIZON_SECONDS):
+    """
+    (ready, peak, slope) arrays for one metric of service.forecaster.Forecast entries,
+    peak as computed by scaling_service.forecast_peak.
+    """
+    trends = [getattr(forecast, metric) for forecast in forecasts]
+    ready = np.array([trend.count >= min_samples for trend in trends], dtype=bool)
+    level = np.array([trend.level for trend in trends], dtype=float)
+    slope = np.array([trend.slope for trend in trends], dtype=float)
+    return ready, level + np.maximum(slope, 0.0) * horizon_seconds, slope
@@ -0,0 +1,155 @@
+import threading
+from bisect import bisect_right
+from collections import namedtuple
+from datetime import timedelta
+from operator import attrgetter
+from constants.service_constants import (
+    FORECAST_LEVEL_SMOOTHING, FORECAST_TREND_SMOOTHING, FORECAST_MAX_GAP_MINUTES,
+    CLOUDWATCH_SETTLE_PERIODS
+)
+
+_timestamp = attrgetter('timestamp')
+
+# State of one metric's model: samples seen, smoothed level, and trend in units per second
+Trend = namedtuple('Trend', 'count level slope')
+
+# What the scaling engine reads for an instance, a Trend for CPU and one for memory
+Forecast = namedtuple('Forecast', 'cpu memory')
+
+class HoltTrend:
+    """
+    Holt's linear trend (double exponential smoothing) over one metric of one instance.
+
+    Samples arrive at the collector's pace, not on a fixed grid, so the slope is kept
+    per second and the level is projected over the actual gap before blending in a
+    new value. Each add is O(1) and the state is three numbers and a timestamp.
+    """
+
+    __slots__ = ('count', 'level', 'slope', 'timestamp')
+
+    def __init__(self):
+        self.count = 0
+        self.level = 0.0
+        self.slope = 0.0
+        self.timestamp = None
+
+    def add(self, timestamp, value):
+        if self.count == 0:
+            self.level = value
+        else:
+            seconds = (timestamp - self.timestamp).total_seconds()
+            if seconds <= 0:
+                return
+            if self.count == 1:
+                # Start from the first observed slope
+                self.slope = (value - self.level) / seconds
+                self.level = value
+            else:
+                previous = self.level
+                self.level = FORECAST_LEVEL_SMOOTHING * value + \
+                    (1 - FORECAST_LEVEL_SMOOTHING) * (previous + self.slope * seconds)
+                self.slope = FORECAST_TREND_SMOOTHING * (self.level - previous) / seconds + \
+                    (1 - FORECAST_TREND_SMOOTHING) * self.slope
+        self.count += 1
+        self.timestamp = timestamp
+
+    def trend(self):
+        return Trend(self.count, self.level, self.slope)
+
+    def copy(self):
+        model = HoltTrend()
+        model.count, model.level, model.slope, model.timestamp = self.count, self.level, self.slope, self.timestamp
+        return model
+
+class InstanceForecast:
+    """
+    The CPU and memory models of one instance.
+
+    The models hold the settled samples, up to last_timestamp. The newest ones a
+    settle window may still fill in are kept in pending and only added to a copy
+    of the models when forecasting.
+    """
+
+    __slots__ = ('cpu', 'memory', 'last_timestamp', 'pending')
+
+    def __init__(self):
+        self.cpu = HoltTrend()
+        self.memory = HoltTrend()
+        self.last_timestamp = None
+        self.pending = []
+
+    def add(self, sample):
+        if sample.cpu_utilization is not None:
+            self.cpu.add(sample.timestamp, sample.cpu_utilization)
+        if sample.memory_usage is not None:
+            self.memory.add(sample.timestamp, sample.memory_usage)
+        self.last_timestamp = sample.timestamp
+
+    def forecast(self):
+        if not self.pending:
+            return Forecast(self.cpu.trend(), self.memory.trend())
+        current = InstanceForecast()
+        current.cpu, current.memory = self.cpu.copy(), self.memory.copy()
+        for sample in self.pending:
+            current.add(sample)
+        return Forecast(current.cpu.trend(), current.memory.trend())
+
+class ForecastStore:
+    """
+    One InstanceForecast per instance, fed from the windows the scaling engine loads.
+
+    update only settles samples newer than the last settled one, so a cycle costs one
+    model update per new sample whatever the window size. The newest
+    CLOUDWATCH_SETTLE_PERIODS samples stay pending and are taken again from every
+    window, so values a settle window fills in late still reach the models. After a
+    gap longer than FORECAST_MAX_GAP_MINUTES the instance's models start over.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._forecasts = {}
+        self._restarts = 0
+
+    def update(self, instance_id, samples):
+        """Add the instance's samples (oldest first) not seen yet and return its Forecast."""
+        max_gap = timedelta(minutes=FORECAST_MAX_GAP_MINUTES)
+        with self._lock:
+            forecast = self._forecasts.get(instance_id)
+            if forecast is None:
+                forecast = self._forecasts[instance_id] = InstanceForecast()
+            last = forecast.last_timestamp
+            start = 0 if last is None else bisect_right(samples, last, key=_timestamp)
+            if start < len(samples):
+                # The window's copy of a pending sample replaces it, late values included
+                first = samples[start].timestamp
+                pending = [sample for sample in forecast.pending if sample.timestamp < first]
+                newest = pending[-1].timestamp if pending else last
+                for position in range(start, len(samples)):
+                    sample = samples[position]
+                    if newest is not None and sample.timestamp - newest > max_gap:
+                        self._restarts += 1
+                        forecast = self._forecasts[instance_id] = InstanceForecast()
+                        pending = []
+                    pending.append(sample)
+                    newest = sample.timestamp
+                # A stored period holds one datapoint, so only the newest samples can still change
+                settled = max(len(pending) - CLOUDWATCH_SETTLE_PERIODS, 0)
+                for sample in pending[:settled]:
+                    forecast.add(sample)
+                forecast.pending = pending[settled:]
+            return forecast.forecast()
+
+    def discard(self, instance_id):
+        with self._lock:
+            self._forecasts.pop(instance_id, None)
+
+    def clear(self):
+        with self._lock:
+            self._forecasts.clear()
+            self._restarts = 0
+
+    def get_stats(self):
+        with self._lock:
+            return {'instances': len(self._forecasts), 'restarts': self._restarts}
+
+forecast_store = ForecastStore()
@@ -1,8 +1,10 @@
 from repo.db import db
-from repo.models import Instance
+from repo.models import Instance, User
 from service.aws_monitor import verify_connection
+from service.policy_engine import DEFAULT_POLICY, compile_policy
 from util.logger import logger
 from datetime import datetime
+import uuid
 
 def register_instance(user_id, instance_id, instance_type, region, is_mock=False):
     existing_instance = Instance.query.filter_by(instance_id=instance_id).filter(Instance.deleted_at.is_(None)).first()
@@ -110,3 +112,98 @@ def delete_instance(user_id, instance_id):
         logger.error(f"Failed to delete instance {instance_id}: {str(e)}")
         return False, str(e)
 
+def _owned_instance(user_id, instance_id):
+    """(instance, None) for one of the user's non-deleted instances, or (None, error message)."""
+    instance = Instance.query.filter_by(instance_id=instance_id).filter(Instance.deleted_at.is_(None)).first()
+    if not instance:
+        return None, "Instance not found"
+    if str(instance.user_id) != str(user_id):
+        return None, "Unauthorized: You don't own this instance"
+    return instance, None
+
+def _get_user(user_id):
+    # Tokens carry the id as a string, which only PostgreSQL compares to a UUID column by itself
+    return User.query.filter_by(id=uuid.UUID(str(user_id))).first()
+
+def _reset_last_evaluated(user_id, instance_id):
+    # Without this the skip-unchanged check would keep the old decision until new metrics arrive
+    query = Instance.query.filter_by(user_id=uuid.UUID(str(user_id)))
+    if instance_id is not None:
+        query = query.filter_by(instance_id=instance_id)
+    query.update({'last_evaluated_at': None})
+
+def get_scaling_policy(user_id, instance_id=None):
+    """
+    Get the scaling policy in effect for one of the user's instances, or the user's own
+    default policy when instance_id is None.
+    Returns (success, result) where result is {'source': 'instance', 'user' or 'default',
+    'policy': the definition with every default filled in} or an error message.
+    """
+    user = _get_user(user_id)
+    if not user:
+        return False, "User not found"
+    if instance_id is not None:
+        instance, error = _owned_instance(user_id, instance_id)
+        if error:
+            return False, error
+        if instance.scaling_policy is not None:
+            return True, {'source': 'instance', 'policy': compile_policy(instance.scaling_policy).definition}
+    if user.scaling_policy is not None:
+        return True, {'source': 'user', 'policy': compile_policy(user.scaling_policy).definition}
+    return True, {'source': 'default', 'policy': compile_policy(DEFAULT_POLICY).definition}
+
+def set_scaling_policy(user_id, definition, instance_id=None):
+    """
+    Set the scaling policy of one of the user's instances, or the user's default policy
+    for all instances without one of their own when instance_id is None.
+    Returns (success, result) where result is the stored definition or an error message.
+    """
+    try:
+        plan = compile_policy(definition)
+    except ValueError as e:
+        return False, f"Invalid scaling policy: {e}"
+
+    if instance_id is not None:
+        target, error = _owned_instance(user_id, instance_id)
+        if error:
+            return False, error
+    else:
+        target = _get_user(user_id)
+        if not target:
+            return False, "User not found"
+
+    target.scaling_policy = plan.definition
+    _reset_last_evaluated(user_id, instance_id)
+    try:
+        db.session.commit()
+        logger.info(f"Set scaling policy '{plan.definition['name']}' for {instance_id or f'user {user_id}'}")
+        return True, plan.definition
+    except Exception as e:
+        db.session.rollback()
+        return False, str(e)
+
+def clear_scaling_policy(user_id, instance_id=None):
+    """
+    Remove the scaling policy of one of the user's instances (it falls back to the user's)
+    or the user's default policy (instances fall back to the built-in default).
+    Returns (success, message).
+    """
+    if instance_id is not None:
+        target, error = _owned_instance(user_id, instance_id)
+        if error:
+            return False, error
+    else:
+        target = _get_user(user_id)
+        if not target:
+            return False, "User not found"
+
+    if target.scaling_policy is None:
+        return False, "No scaling policy set"
+    target.scaling_policy = None
+    _reset_last_evaluated(user_id, instance_id)
+    try:
+        db.session.commit()
+        return True, "Scaling policy removed"
+    except Exception as e:
+        db.session.rollback()
+        return False, str(e)
@@ -0,0 +1,162 @@
+import time
+from datetime import datetime
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from util.logger import logger
+from service.mock_monitor import generate_mock_metrics
+from service.aws_monitor import fetch_instance_metrics_batch, INSTANCES_PER_BATCH
+from constants.service_constants import (
+    METRICS_COLLECTOR_MAX_WORKERS, METRICS_COLLECTION_DEADLINE_SECONDS,
+    METRICS_INSTANCE_TIMEOUT_SECONDS
+)
+
+# How often the collector wakes up to check timeouts while waiting on workers
+POLL_INTERVAL_SECONDS = 0.25
+
+# One thread pool serves every collection cycle. Its threads are started on demand up
+# to max_workers and then reused, so a fetch abandoned at a timeout keeps one of them
+# busy until it returns instead of a new pool being built around it every cycle.
+_executor_lock = threading.Lock()
+_executor = None
+_executor_workers = 0
+
+def build_fetch_tasks(targets, batch_size=INSTANCES_PER_BATCH):
+    """
+    Group real instances by region into batches of at most batch_size instances.
+    Returns a list of (region, instance_ids) tasks, one GetMetricData call each.
+    """
+    by_region = {}
+    for instance_id, region, is_mock, _ in targets:
+        if not is_mock:
+            by_region.setdefault(region, []).append(instance_id)
+
+    tasks = []
+    for region, instance_ids in by_region.items():
+        for i in range(0, len(instance_ids), batch_size):
+            tasks.append((region, instance_ids[i:i + batch_size]))
+    return tasks
+
+def get_executor(workers):
+    """The shared collector pool, started on first use and kept across cycles."""
+    global _executor, _executor_workers
+    with _executor_lock:
+        if _executor is not None and _executor_workers != workers:
+            _executor.shutdown(wait=False, cancel_futures=True)
+            _executor = None
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='metrics-collector')
+            _executor_workers = workers
+        return _executor
+
+def shutdown_executor(wait=True):
+    global _executor, _executor_workers
+    with _executor_lock:
+        if _executor is not None:
+            _executor.shutdown(wait=wait, cancel_futures=True)
+        _executor = None
+        _executor_workers = 0
+
+def collect_metrics(targets, max_workers=METRICS_COLLECTOR_MAX_WORKERS,
+                    cycle_deadline=METRICS_COLLECTION_DEADLINE_SECONDS,
+                    instance_timeout=METRICS_INSTANCE_TIMEOUT_SECONDS):
+    """
+    Fetch metrics for many instances concurrently on the shared, bounded thread pool.
+
+    targets is a list of (instance_id, region, is_mock, last_ingested_at) tuples.
+    Plain values are passed to the workers so no ORM object crosses a thread
+    boundary. Mock instances are generated inline; real instances are grouped
+    per region into batched CloudWatch calls, and each batch runs as one pool
+    task that only asks for datapoints newer than last_ingested_at.
+
+    A batch whose fetch runs longer than instance_timeout, or that has not
+    finished when cycle_deadline expires, is abandoned and its instances are
+    reported as None. Workers that are still running keep going in the
+    background, their result is simply discarded, and batches not started
+    yet are cancelled.
+
+    Returns a dict of instance_id -> list of timestamped sample dicts, oldest
+    first (or None on failure/timeout).
+    """
+    results = {instance_id: None for instance_id, _, _, _ in targets}
+    watermarks = {instance_id: watermark for instance_id, _, _, watermark in targets}
+
+    # Use mock data for mock instances, real AWS data for regular instances
+    for instance_id, _, is_mock, _ in targets:
+        if is_mock:
+            logger.debug(f"Using mock data for {instance_id}")
+            results[instance_id] = [dict(generate_mock_metrics(instance_id), timestamp=datetime.utcnow())]
+
+    tasks = build_fetch_tasks(targets)
+    if not tasks:
+        return results
+
+    started = {}
+    started_lock = threading.Lock()
+
+    def run(task_index, region, instance_ids):
+        with started_lock:
+            started[task_index] = time.monotonic()
+        return fetch_instance_metrics_batch(
+            instance_ids, region, {instance_id: watermarks[instance_id] for instance_id in instance_ids}
+        )
+
+    cycle_start = time.monotonic()
+    deadline = cycle_start + cycle_deadline
+    executor = get_executor(max(1, max_workers))
+
+    pending = {}
+    try:
+        for task_index, (region, instance_ids) in enumerate(tasks):
+            future = executor.submit(run, task_index, region, instance_ids)
+            pending[future] = task_index
+
+        while pending:
+            now = time.monotonic()
+            if now >= deadline:
+                break
+
+            done, _ = wait(
+                pending,
+                timeout=min(POLL_INTERVAL_SECONDS, deadline - now),
+                return_when=FIRST_COMPLETED
+            )
+
+            for future in done:
+                region, instance_ids = tasks[pending.pop(future)]
+                try:
+                    batch = future.result()
+                    for instance_id in instance_ids:
+                        results[instance_id] = batch.get(instance_id)
+                except Exception as e:
+                    logger.error(f"Error collecting metrics for {len(instance_ids)} instance(s) in {region}: {e}")
+
+            now = time.monotonic()
+            with started_lock:
+                expired = [
+                    future for future, task_index in pending.items()
+                    if task_index in started and now - started[task_index] > instance_timeout
+                ]
+            for future in expired:
+                region, instance_ids = tasks[pending.pop(future)]
+                logger.warning(
+                    f"Metrics fetch for {len(instance_ids)} instance(s) in {region} "
+                    f"exceeded {instance_timeout}s, skipping this cycle"
+                )
+
+        if pending:
+            skipped = sum(len(tasks[task_index][1]) for task_index in pending.values())
+            logger.warning(
+                f"Metrics collection deadline of {cycle_deadline}s reached, "
+                f"{skipped} instance(s) not collected this cycle"
+            )
+    finally:
+        # Never block the scheduler thread on stragglers, and leave the pool to the next cycle
+        for future in pending:
+            future.cancel()
+
+    collected = sum(1 for v in results.values() if v is not None)
+    logger.debug(
+        f"Collected metrics for {collected}/{len(targets)} instance(s) "
+        f"in {len(tasks)} batch(es), {time.monotonic() - cycle_start:.2f}s"
+    )
+    return results
@@ -0,0 +1,580 @@
+import json
+import math
+import numpy as np
+from collections import namedtuple
+from datetime import timedelta
+from functools import lru_cache
+from repo.db import db
+from repo.models import Instance, User
+from util.logger import logger
+from service.scaling_service import (
+    IQR_METRICS, DECISION_WINDOW_MINUTES, describe_current, describe_bound, iqr_decision,
+    insufficient_duration_reason, insufficient_iqr_data_reason,
+    predicted_scale_up_reason, predicted_scale_down_reason
+)
+from service.fleet_evaluator import (
+    WINDOW_FIELDS, flatten_samples, window_starts, forecast_peaks, tracked_usage, baseline_bounds
+)
+from service.window_stats import WindowStats
+from constants.service_constants import (
+    SCALE_DOWN_CPU_THRESHOLD, SCALE_DOWN_MEMORY_THRESHOLD, SCALE_UP_THRESHOLD, SUSTAINED_DURATION_MINUTES,
+    SUSTAINED_MIN_DATA_POINTS, SUSTAINED_PERCENTAGE_THRESHOLD,
+    IQR_MULTIPLIER, IQR_MIN_DATA_POINTS, IQR_MIN_DATA_DURATION_MINUTES, IQR_WINDOW_MINUTES,
+    FORECAST_HORIZON_MINUTES, FORECAST_MIN_SAMPLES, PREDICTIVE_SCALING_ENABLED, POLICY_CACHE_SIZE,
+    STATS_WINDOW_MINUTES
+)
+
+# Declarative scaling policies. A policy is a JSON document with an ordered list of
+# rules; the first rule that fires decides. Rule types:
+#
+#   sustained  decision (scale_up / scale_down) when the samples of the last `minutes`
+#              meeting `conditions` (all or any of them) reach `percentage`
+#   average    decision when the means over the last `minutes` meet `conditions`,
+#              e.g. a 1 minute average for spikes next to a 15 minute sustained rule
+#   forecast   scale ahead of time on the Holt forecasts of service.forecaster
+#   iqr        vote on the latest metric against IQR bounds of the last `minutes`;
+#              always decides, so it can only be the last rule
+#
+# compile_policy turns a definition into a PolicyPlan once per distinct definition.
+# The plan knows which columns and windows its rules read, so one window load (the
+# longest any rule needs) serves every rule, and evaluate runs the rules over many
+# instances at once with NumPy, each rule only on the instances no earlier rule decided.
+# Counts, means and quartiles of every window come from service.window_stats: counts
+# and means from one scan of the loaded samples whatever the number of distinct windows,
+# quartiles from padded rows built once per column.
+# DEFAULT_POLICY is the logic of scaling_service.evaluate_scaling_decision, and instances
+# without a policy are evaluated by DEFAULT_PLAN: the sustained trackers, long baselines
+# and forecasts the scaling service keeps for them are handed to evaluate as inputs.
+# evaluate is pack, the only step that reads sample objects, then evaluate_packed on
+# plain arrays, which service.decision_pool workers and service.replay run directly.
+
+MATCH_MODES = ('all', 'any')
+DECISIONS = ('scale_up', 'scale_down')
+
+# column -> (label, is_bytes), as used in reasons
+METRIC_LABELS = {column: (label, is_bytes) for column, label, _, is_bytes in IQR_METRICS}
+
+DEFAULT_IQR_WEIGHTS = {column: weight for column, _, weight, _ in IQR_METRICS}
+
+DEFAULT_POLICY = {
+    'name': 'default',
+    'rules': [
+        {
+            'type': 'sustained', 'decision': 'scale_down', 'match': 'all',
+            'conditions': [
+                {'metric': 'cpu_utilization', 'below': SCALE_DOWN_CPU_THRESHOLD},
+                {'metric': 'memory_usage', 'below': SCALE_DOWN_MEMORY_THRESHOLD},
+            ],
+        },
+        {
+            'type': 'sustained', 'decision': 'scale_up', 'require_current': True,
+            'conditions': [{'metric': 'cpu_utilization', 'above': SCALE_UP_THRESHOLD}],
+        },
+        {
+            'type': 'sustained', 'decision': 'scale_up', 'require_current': True,
+            'conditions': [{'metric': 'memory_usage', 'above': SCALE_UP_THRESHOLD}],
+        },
+        *([{'type': 'forecast'}] if PREDICTIVE_SCALING_ENABLED else []),
+        {'type': 'iqr'},
+    ],
+}
+
+Condition = namedtuple('Condition', 'metric above threshold')
+SustainedRule = namedtuple(
+    'SustainedRule', 'decision conditions match minutes percentage min_samples require_current flag_outlier'
+)
+AverageRule = namedtuple('AverageRule', 'decision conditions match minutes min_samples flag_outlier')
+ForecastRule = namedtuple(
+    'ForecastRule', 'horizon_minutes min_samples scale_up_above scale_down_cpu_below scale_down_memory_below'
+)
+# weights holds (column, label, weight, is_bytes) in IQR_METRICS order, zero weights left out
+IqrRule = namedtuple('IqrRule', 'minutes multiplier min_samples min_history_minutes votes weights')
+
+def _number(rule, key, default, where, minimum=None, maximum=None, integer=False, positive=False):
+    value = rule.get(key, default)
+    if isinstance(value, bool) or not isinstance(value, (int, float)) or not math.isfinite(value):
+        raise ValueError(f"{where}.{key} must be a number")
+    if integer and value != int(value):
+        raise ValueError(f"{where}.{key} must be a whole number")
+    if positive and value <= 0:
+        raise ValueError(f"{where}.{key} must be greater than 0")
+    if minimum is not None and value < minimum:
+        raise ValueError(f"{where}.{key} must be at least {minimum}")
+    if maximum is not None and value > maximum:
+        raise ValueError(f"{where}.{key} must be at most {maximum}")
+    return int(value) if integer else value
+
+def _flag(rule, key, default, where):
+    value = rule.get(key, default)
+    if not isinstance(value, bool):
+        raise ValueError(f"{where}.{key} must be true or false")
+    return value
+
+def _check_keys(entry, allowed, where):
+    unknown = sorted(set(entry) - set(allowed))
+    if unknown:
+        raise ValueError(f"{where} has unknown key(s): {', '.join(unknown)}")
+
+def _normalize_condition(condition, where):
+    if not isinstance(condition, dict):
+        raise ValueError(f"{where} must be an object")
+    _check_keys(condition, ('metric', 'above', 'below'), where)
+    if condition.get('metric') not in WINDOW_FIELDS:
+        raise ValueError(f"{where}.metric must be one of {', '.join(WINDOW_FIELDS)}")
+    comparisons = [key for key in ('above', 'below') if key in condition]
+    if len(comparisons) != 1:
+        raise ValueError(f"{where} needs exactly one of above or below")
+    return {'metric': condition['metric'], comparisons[0]: _number(condition, comparisons[0], None, where)}
+
+def _normalize_sustained(rule, where):
+    _check_keys(rule, ('type', 'decision', 'conditions', 'match', 'minutes', 'percentage', 'min_samples',
+                       'require_current', 'flag_outlier'), where)
+    if rule.get('decision') not in DECISIONS:
+        raise ValueError(f"{where}.decision must be one of {', '.join(DECISIONS)}")
+    conditions = rule.get('conditions')
+    if not isinstance(conditions, list) or not conditions:
+        raise ValueError(f"{where}.conditions must be a non-empty list")
+    match = rule.get('match', 'all')
+    if match not in MATCH_MODES:
+        raise ValueError(f"{where}.match must be one of {', '.join(MATCH_MODES)}")
+    return {
+        'type': 'sustained',
+        'decision': rule['decision'],
+        'conditions': [_normalize_condition(c, f"{where}.conditions[{k}]") for k, c in enumerate(conditions)],
+        'match': match,
+        'minutes': _number(rule, 'minutes', SUSTAINED_DURATION_MINUTES, where, positive=True),
+        'percentage': _number(rule, 'percentage', SUSTAINED_PERCENTAGE_THRESHOLD, where, maximum=100, positive=True),
+        'min_samples': _number(rule, 'min_samples', SUSTAINED_MIN_DATA_POINTS, where, minimum=1, integer=True),
+        'require_current': _flag(rule, 'require_current', False, where),
+        'flag_outlier': _flag(rule, 'flag_outlier', True, where),
+    }
+
+def _normalize_average(rule, where):
+    _check_keys(rule, ('type', 'decision', 'conditions', 'match', 'minutes', 'min_samples', 'flag_outlier'), where)
+    if rule.get('decision') not in DECISIONS:
+        raise ValueError(f"{where}.decision must be one of {', '.join(DECISIONS)}")
+    conditions = rule.get('conditions')
+    if not isinstance(conditions, list) or not conditions:
+        raise ValueError(f"{where}.conditions must be a non-empty list")
+    match = rule.get('match', 'all')
+    if match not in MATCH_MODES:
+        raise ValueError(f"{where}.match must be one of {', '.join(MATCH_MODES)}")
+    return {
+        'type': 'average',
+        'decision': rule['decision'],
+        'conditions': [_normalize_condition(c, f"{where}.conditions[{k}]") for k, c in enumerate(conditions)],
+        'match': match,
+        'minutes': _number(rule, 'minutes', min(STATS_WINDOW_MINUTES), where, positive=True),
+        'min_samples': _number(rule, 'min_samples', 1, where, minimum=1, integer=True),
+        'flag_outlier': _flag(rule, 'flag_outlier', True, where),
+    }
+
+def _normalize_forecast(rule, where):
+    _check_keys(rule, ('type', 'horizon_minutes', 'min_samples', 'scale_up_above', 'scale_down_cpu_below',
+                       'scale_down_memory_below'), where)
+    return {
+        'type': 'forecast',
+        'horizon_minutes': _number(rule, 'horizon_minutes', FORECAST_HORIZON_MINUTES, where, positive=True),
+        'min_samples': _number(rule, 'min_samples', FORECAST_MIN_SAMPLES, where, minimum=1, integer=True),
+        'scale_up_above': _number(rule, 'scale_up_above', SCALE_UP_THRESHOLD, where),
+        'scale_down_cpu_below': _number(rule, 'scale_down_cpu_below', SCALE_DOWN_CPU_THRESHOLD, where),
+        'scale_down_memory_below': _number(rule, 'scale_down_memory_below', SCALE_DOWN_MEMORY_THRESHOLD, where),
+    }
+
+def _normalize_iqr(rule, where):
+    _check_keys(rule, ('type', 'minutes', 'multiplier', 'min_samples', 'min_history_minutes', 'votes', 'weights'), where)
+    weights = rule.get('weights', DEFAULT_IQR_WEIGHTS)
+    if not isinstance(weights, dict):
+        raise ValueError(f"{where}.weights must be an object")
+    _check_keys(weights, WINDOW_FIELDS, f"{where}.weights")
+    return {
+        'type': 'iqr',
+        'minutes': _number(rule, 'minutes', IQR_WINDOW_MINUTES, where, positive=True),
+        'multiplier': _number(rule, 'multiplier', IQR_MULTIPLIER, where, minimum=0),
+        'min_samples': _number(rule, 'min_samples', IQR_MIN_DATA_POINTS, where, minimum=1, integer=True),
+        'min_history_minutes': _number(rule, 'min_history_minutes', IQR_MIN_DATA_DURATION_MINUTES, where, minimum=0),
+        'votes': _number(rule, 'votes', 2, where, positive=True),
+        'weights': {
+            field: _number(weights, field, 0, f"{where}.weights", minimum=0)
+            for field in WINDOW_FIELDS if field in weights
+        },
+    }
+
+RULE_TYPES = {
+    'sustained': _normalize_sustained, 'average': _normalize_average,
+    'forecast': _normalize_forecast, 'iqr': _normalize_iqr,
+}
+
+def normalize_policy(definition):
+    """
+    Validate a policy definition and fill in every omitted setting with its default from
+    constants/service_constants.py. Raises ValueError describing the first problem found.
+    """
+    if not isinstance(definition, dict):
+        raise ValueError("policy must be an object")
+    _check_keys(definition, ('name', 'rules'), 'policy')
+    name = definition.get('name', 'custom')
+    if not isinstance(name, str):
+        raise ValueError("policy.name must be a string")
+    rules = definition.get('rules')
+    if not isinstance(rules, list) or not rules:
+        raise ValueError("policy.rules must be a non-empty list")
+    normalized = []
+    for k, rule in enumerate(rules):
+        where = f"rules[{k}]"
+        if not isinstance(rule, dict) or rule.get('type') not in RULE_TYPES:
+            raise ValueError(f"{where}.type must be one of {', '.join(RULE_TYPES)}")
+        if normalized and normalized[-1]['type'] == 'iqr':
+            raise ValueError(f"{where} can never run, an iqr rule always decides and must be the last rule")
+        normalized.append(RULE_TYPES[rule['type']](rule, where))
+    return {'name': name, 'rules': normalized}
+
+def _compile_conditions(rule):
+    return tuple(
+        Condition(c['metric'], 'above' in c, c['above'] if 'above' in c else c['below'])
+        for c in rule['conditions']
+    )
+
+def _compile_rule(rule):
+    if rule['type'] == 'sustained':
+        return SustainedRule(rule['decision'], _compile_conditions(rule), rule['match'], rule['minutes'],
+                             rule['percentage'], rule['min_samples'], rule['require_current'], rule['flag_outlier'])
+    if rule['type'] == 'average':
+        return AverageRule(rule['decision'], _compile_conditions(rule), rule['match'], rule['minutes'],
+                           rule['min_samples'], rule['flag_outlier'])
+    if rule['type'] == 'forecast':
+        return ForecastRule(rule['horizon_minutes'], rule['min_samples'], rule['scale_up_above'],
+                            rule['scale_down_cpu_below'], rule['scale_down_memory_below'])
+    weights = tuple(
+        (column, label, rule['weights'][column], is_bytes)
+        for column, label, _, is_bytes in IQR_METRICS if rule['weights'].get(column)
+    )
+    return IqrRule(rule['minutes'], rule['multiplier'], rule['min_samples'], rule['min_history_minutes'],
+                   rule['votes'], weights)
+
+def _format_value(value, is_bytes):
+    if value is None:
+        text = "N/A"
+    else:
+        text = f"{value:,}" if is_bytes else f"{value:.2f}"
+    return text + (" bytes" if is_bytes else "%")
+
+def _describe_conditions(rule):
+    parts = []
+    for metric, above, threshold in rule.conditions:
+        label, is_bytes = METRIC_LABELS[metric]
+        parts.append(f"{label} {'>' if above else '<'} {threshold}{' bytes' if is_bytes else '%'}")
+    return (' AND ' if rule.match == 'all' else ' OR ').join(parts)
+
+def _describe_values(conditions, values):
+    """One formatted value per condition, labelled when there are several."""
+    formatted = [_format_value(value, METRIC_LABELS[c.metric][1]) for c, value in zip(conditions, values)]
+    if len(conditions) == 1:
+        return formatted[0]
+    return ', '.join(f"{METRIC_LABELS[c.metric][0]}={text}" for c, text in zip(conditions, formatted))
+
+def sustained_reason(rule, percentage, sample):
+    """Reason of a fired SustainedRule; for the default policy the same text as scaling_service."""
+    current = _describe_values(rule.conditions, [getattr(sample, c.metric) for c in rule.conditions])
+    direction = rule.decision.replace('_', ' ')
+    return f"Sustained {direction}: {_describe_conditions(rule)} for {percentage:.1f}% of last {rule.minutes} minutes (Current: {current})"
+
+def average_reason(rule, means):
+    """Reason of a fired AverageRule, means holding the window mean of each condition's metric."""
+    values = [
+        None if math.isnan(mean) else (round(mean) if METRIC_LABELS[c.metric][1] else mean)
+        for c, mean in zip(rule.conditions, means)
+    ]
+    direction = rule.decision.replace('_', ' ')
+    return f"Average {direction}: {_describe_conditions(rule)} over last {rule.minutes} minutes (Average: {_describe_values(rule.conditions, values)})"
+
+def no_rule_reason(sample):
+    return f"No policy rule matched. Current: {describe_current(sample.cpu_utilization, sample.memory_usage)}"
+
+class PolicyPlan:
+    """
+    A compiled policy. fields are the metric columns its rules read, minutes the
+    windows they count over, history the minimum histories of its iqr rules,
+    window_minutes the window to load for it and needs_forecast whether evaluate
+    wants forecasts.
+    """
+
+    def __init__(self, definition):
+        self.definition = definition
+        self.rules = tuple(_compile_rule(rule) for rule in definition['rules'])
+        used = set()
+        minutes = set()
+        history = []
+        for rule in self.rules:
+            if isinstance(rule, (SustainedRule, AverageRule)):
+                used.update(c.metric for c in rule.conditions)
+                minutes.add(rule.minutes)
+            elif isinstance(rule, IqrRule):
+                used.update(column for column, _, _, _ in rule.weights)
+                minutes.add(rule.minutes)
+                history.append(rule.min_history_minutes)
+        self.fields = tuple(field for field in WINDOW_FIELDS if field in used)
+        self.minutes = tuple(sorted(minutes))
+        self.history = tuple(sorted(set(history)))
+        # Also spans the minimum IQR history, like scaling_service.DECISION_WINDOW_MINUTES
+        self.window_minutes = max(self.minutes + tuple(history)) if minutes else DECISION_WINDOW_MINUTES
+        self.needs_forecast = any(isinstance(rule, ForecastRule) for rule in self.rules)
+        self.needs_outliers = any(isinstance(rule, IqrRule) for rule in self.rules)
+
+    def evaluate(self, windows, now, forecasts=None, baselines=None, sustained=None):
+        """
+        Run the policy over [(instance_id, samples, latest, oldest_timestamp), ...] with
+        latest set, loaded for at least window_minutes. The optional inputs are lists in
+        the same order: forecasts (service.forecaster.Forecast entries) enable forecast
+        rules, baselines (service.baseline_store.Baseline entries) replace the quartiles of
+        iqr rules' windows, and sustained holds the (is_sustained, percentage) of each
+        sustained rule in rule order, as scaling_service.sustained_trackers keeps them for
+        DEFAULT_PLAN, instead of counting those windows. Returns (decision, reason,
+        outlier_type) per window, like scaling_service.evaluate_scaling_decision.
+        """
+        return self.evaluate_packed(
+            self.pack(windows, now), [window[2] for window in windows],
+            forecasts=forecasts, baselines=baselines, sustained=sustained
+        )
+
+    def pack(self, windows, now):
+        """
+        The columns evaluate_packed reads from [(instance_id, samples, latest,
+        oldest_timestamp), ...]: 'flat' (flatten_samples of fields), 'starts' (for each
+        of minutes, the position of every window's first sample in it) and
+        'short_history' (for each of history, whether every window's oldest sample is
+        younger than that). Every value is a NumPy array or a list of booleans.
+        """
+        return {
+            'flat': flatten_samples(windows, self.fields, outliers=self.needs_outliers),
+            'starts': {m: window_starts(windows, now - timedelta(minutes=m)) for m in self.minutes},
+            'short_history': {
+                m: [oldest is None or oldest > now - timedelta(minutes=m) for _, _, _, oldest in windows]
+                for m in self.history
+            },
+        }
+
+    def evaluate_packed(self, packed, latest, forecasts=None, baselines=None, sustained=None):
+        """
+        evaluate on the output of pack. latest holds each window's newest sample; only
+        its metric values are read, for the reasons. The optional inputs are those of evaluate.
+        """
+        n = len(latest)
+        if not n:
+            return []
+        flat = packed['flat']
+        stats = WindowStats(None, None, self.minutes, self.fields, flat=flat, starts=packed['starts'])
+        state = {
+            'short_history': packed['short_history'],
+            'forecasts': forecasts,
+            'baselines': baselines,
+            'tracked': None,
+            'flat': flat,
+            'stats': stats,
+            'latest': {field: flat[f'latest_{field}'] for field in self.fields},
+        }
+        if sustained is not None:
+            rules = [rule for rule in self.rules if isinstance(rule, SustainedRule)]
+            state['tracked'] = {rule: tracked_usage(sustained, k) for k, rule in enumerate(rules)}
+
+        results = [None] * n
+        pending = np.arange(n)
+        for rule in self.rules:
+            if not len(pending):
+                break
+            fired, outcome = RULE_EVALUATORS[type(rule)](rule, pending, state)
+            for k in np.flatnonzero(fired).tolist():
+                i = int(pending[k])
+                results[i] = outcome(k, latest[i])
+            pending = pending[~fired]
+        for i in pending.tolist():
+            results[i] = ("no_action", no_rule_reason(latest[i]), None)
+        return results
+
+def _conditions_met(rule, values):
+    """Whether each entry of the arrays in values (one per condition) meets the rule's conditions."""
+    met = known_any = None
+    for (metric, above, threshold), column in zip(rule.conditions, values):
+        # NaN compares False
+        hit = column > threshold if above else column < threshold
+        if rule.match == 'any':
+            met = hit if met is None else met | hit
+        else:
+            # Unknown values neither meet nor fail an 'all' rule, as in scaling_service.sample_meets_condition
+            known = ~np.isnan(column)
+            hit |= ~known
+            met = hit if met is None else met & hit
+            known_any = known if known_any is None else known_any | known
+    if known_any is not None:
+        met &= known_any
+    return met
+
+def _evaluate_sustained(rule, pending, state):
+    if state['tracked'] is not None:
+        # Already counted by the trackers
+        is_sustained, percentage = state['tracked'][rule]
+        fired, percentage = is_sustained[pending], percentage[pending]
+    else:
+        stats = state['stats']
+        # Tested on every loaded sample at once, the window is applied by the prefix sums
+        met = _conditions_met(rule, [state['flat'][c.metric] for c in rule.conditions])
+        total = stats.count(rule.minutes)[pending]
+        matching = stats.count_where(met, rule.minutes)[pending]
+        with np.errstate(invalid='ignore', divide='ignore'):
+            percentage = np.where(total >= rule.min_samples, (matching / total) * 100, 0.0)
+        fired = (total >= rule.min_samples) & (percentage >= rule.percentage)
+    if rule.require_current:
+        for condition in rule.conditions:
+            fired &= ~np.isnan(state['latest'][condition.metric][pending])
+    percentage = percentage.tolist()
+    outlier_type = rule.decision if rule.flag_outlier else None
+    return fired, lambda k, sample: (rule.decision, sustained_reason(rule, percentage[k], sample), outlier_type)
+
+def _evaluate_average(rule, pending, state):
+    stats = state['stats']
+    means = [stats.mean(c.metric, rule.minutes)[pending] for c in rule.conditions]
+    fired = (stats.count(rule.minutes)[pending] >= rule.min_samples) & _conditions_met(rule, means)
+    means = [mean.tolist() for mean in means]
+    outlier_type = rule.decision if rule.flag_outlier else None
+    return fired, lambda k, sample: (rule.decision, average_reason(rule, [mean[k] for mean in means]), outlier_type)
+
+def _evaluate_forecast(rule, pending, state):
+    if state['forecasts'] is None:
+        return np.zeros(len(pending), dtype=bool), None
+    forecasts = [state['forecasts'][i] for i in pending.tolist()]
+    horizon_seconds = rule.horizon_minutes * 60
+    cpu_ready, cpu_peak, cpu_slope = forecast_peaks(forecasts, 'cpu', rule.min_samples, horizon_seconds)
+    memory_ready, memory_peak, memory_slope = forecast_peaks(forecasts, 'memory', rule.min_samples, horizon_seconds)
+    cpu_up = cpu_ready & (cpu_peak > rule.scale_up_above)
+    memory_up = memory_ready & (memory_peak > rule.scale_up_above)
+    down = cpu_ready & memory_ready & (cpu_peak < rule.scale_down_cpu_below) & (memory_peak < rule.scale_down_memory_below)
+    fired = cpu_up | memory_up | down
+    cpu_up, memory_up = cpu_up.tolist(), memory_up.tolist()
+    cpu_peak, cpu_slope = cpu_peak.tolist(), cpu_slope.tolist()
+    memory_peak, memory_slope = memory_peak.tolist(), memory_slope.tolist()
+
+    def outcome(k, sample):
+        # Nothing to flag, the latest metric has not crossed anything yet
+        if cpu_up[k]:
+            return "scale_up", predicted_scale_up_reason(
+                'CPU', cpu_peak[k], cpu_slope[k], rule.scale_up_above, rule.horizon_minutes), None
+        if memory_up[k]:
+            return "scale_up", predicted_scale_up_reason(
+                'Memory', memory_peak[k], memory_slope[k], rule.scale_up_above, rule.horizon_minutes), None
+        return "scale_down", predicted_scale_down_reason(
+            cpu_peak[k], memory_peak[k], rule.scale_down_cpu_below, rule.scale_down_memory_below,
+            rule.horizon_minutes), None
+    return fired, outcome
+
+def _evaluate_iqr(rule, pending, state):
+    stats = state['stats']
+    included = state['flat']['included']
+    short_history = state['short_history'][rule.min_history_minutes]
+    short_history = [short_history[i] for i in pending.tolist()]
+    baselines = state['baselines']
+    if baselines is not None:
+        baselines = [baselines[i] for i in pending.tolist()]
+        enough_points = [baseline.count >= rule.min_samples for baseline in baselines]
+    else:
+        enough_points = (stats.count_where(included, rule.minutes)[pending] >= rule.min_samples).tolist()
+
+    up_votes = np.zeros(len(pending))
+    down_votes = np.zeros(len(pending))
+    bounds = []
+    for column, label, weight, is_bytes in rule.weights:
+        if baselines is not None:
+            lower, upper, has_bounds = baseline_bounds(baselines, column)
+        else:
+            # Quartiles of the rule's window from the padded rows all windows share
+            q1, q3, known = stats.quartiles(column, rule.minutes, outliers=False, rows=pending)
+            lower, upper = q1 - rule.multiplier * (q3 - q1), q3 + rule.multiplier * (q3 - q1)
+            has_bounds = known >= rule.min_samples
+        current = state['latest'][column][pending]
+        usable = has_bounds & ~np.isnan(current)
+        above = usable & (current > upper)
+        below = usable & ~above & (current < lower)
+        up_votes += weight * above
+        down_votes += weight * below
+        bounds.append((column, label, is_bytes, lower.tolist(), upper.tolist(), above.tolist(), below.tolist()))
+    up_votes, down_votes = up_votes.tolist(), down_votes.tolist()
+
+    def outcome(k, sample):
+        if short_history[k]:
+            return "no_action", insufficient_duration_reason(rule.min_history_minutes), None
+        if not enough_points[k]:
+            return "no_action", insufficient_iqr_data_reason(sample.cpu_utilization, sample.memory_usage), None
+        reasons_list = []
+        for column, label, is_bytes, lower, upper, above, below in bounds:
+            if above[k]:
+                reasons_list.append(describe_bound(label, getattr(sample, column), upper[k], True, is_bytes))
+            elif below[k]:
+                reasons_list.append(describe_bound(label, getattr(sample, column), lower[k], False, is_bytes))
+        decision, reason = iqr_decision(up_votes[k], down_votes[k], reasons_list,
+                                        sample.cpu_utilization, sample.memory_usage, rule.votes)
+        return decision, reason, None
+    return np.ones(len(pending), dtype=bool), outcome
+
+RULE_EVALUATORS = {
+    SustainedRule: _evaluate_sustained, AverageRule: _evaluate_average,
+    ForecastRule: _evaluate_forecast, IqrRule: _evaluate_iqr,
+}
+
+@lru_cache(maxsize=POLICY_CACHE_SIZE)
+def _compile(text):
+    return PolicyPlan(normalize_policy(json.loads(text)))
+
+def compile_policy(definition):
+    """
+    The PolicyPlan of a policy definition. Equal definitions share one plan, compiled
+    the first time it is asked for. Raises ValueError for an invalid definition.
+    """
+    try:
+        text = json.dumps(definition, sort_keys=True)
+    except (TypeError, ValueError):
+        raise ValueError("policy must be plain JSON")
+    return _compile(text)
+
+# Always with the forecast rule: it only runs when forecasts are handed in, which the
+# scaling service does with PREDICTIVE_SCALING_ENABLED, as evaluate_scaling_decision
+DEFAULT_PLAN = compile_policy(dict(DEFAULT_POLICY, rules=[
+    *(rule for rule in DEFAULT_POLICY['rules'] if rule['type'] == 'sustained'), {'type': 'forecast'}, {'type': 'iqr'}
+]))
+
+def _plan_or_default(instance_id, definition):
+    if definition is None:
+        return None
+    try:
+        return compile_policy(definition)
+    except ValueError as e:
+        # Policies are validated when they are set, this only guards against hand edits
+        logger.warning(f"Ignoring invalid scaling policy for {instance_id}: {e}")
+        return None
+
+def resolve_policies(instances):
+    """
+    Plans for those of the given Instance rows (with their user loaded, as
+    scaling_service.load_fleet_instances does) that have a policy of their own or
+    through their user, keyed by instance_id. Instances on the built-in default are
+    left out: the caller evaluates them with DEFAULT_PLAN and their trackers, baselines
+    and forecasts.
+    """
+    plans = {}
+    for instance in instances:
+        definition = instance.scaling_policy
+        if definition is None:
+            definition = instance.user.scaling_policy
+        plan = _plan_or_default(instance.instance_id, definition)
+        if plan is not None:
+            plans[instance.instance_id] = plan
+    return plans
+
+def instance_plan(instance_id):
+    """The plan of one instance's own or its user's policy, or None for the built-in default."""
+    row = db.session.query(Instance.scaling_policy, User.scaling_policy)\
+        .join(User, User.id == Instance.user_id)\
+        .filter(Instance.instance_id == instance_id, Instance.deleted_at.is_(None))\
+        .first()
+    if row is None:
+        return None
+    instance_policy, user_policy = row
+    return _plan_or_default(instance_id, instance_policy if instance_policy is not None else user_policy)
@@ -0,0 +1,81 @@
+from bisect import bisect_right, insort
+
+# P² (Jain & Chlamtac, 1985) with five markers at the minimum, Q1, median, Q3 and
+# maximum of everything added so far. Each add moves at most three markers by one
+# position, so updates and reads are O(1) and the state is a fixed ten numbers.
+QUARTILE_MARKERS = (0.0, 0.25, 0.5, 0.75, 1.0)
+
+class P2Quartiles:
+    """
+    Streaming estimate of the first and third quartile of a series of values.
+
+    Up to five values are kept exactly, and quartiles picks the same elements as
+    scaling_service.iqr_bounds on them. From then on the P² markers estimate them.
+    """
+
+    __slots__ = ('count', 'heights', 'positions')
+
+    def __init__(self):
+        self.count = 0
+        self.heights = []
+        self.positions = [1, 2, 3, 4, 5]
+
+    def add(self, value):
+        self.count += 1
+        heights = self.heights
+        if self.count <= 5:
+            insort(heights, value)
+            return
+
+        if value < heights[0]:
+            heights[0] = value
+            cell = 0
+        elif value >= heights[4]:
+            heights[4] = value
+            cell = 3
+        else:
+            cell = bisect_right(heights, value) - 1
+
+        positions = self.positions
+        for i in range(cell + 1, 5):
+            positions[i] += 1
+
+        # Move the inner markers towards their desired positions, one step at most
+        for i in (1, 2, 3):
+            offset = 1 + (self.count - 1) * QUARTILE_MARKERS[i] - positions[i]
+            if (offset >= 1 and positions[i + 1] - positions[i] > 1) or \
+                    (offset <= -1 and positions[i - 1] - positions[i] < -1):
+                step = 1 if offset > 0 else -1
+                height = self._parabolic(i, step)
+                if not heights[i - 1] < height < heights[i + 1]:
+                    height = self._linear(i, step)
+                heights[i] = height
+                positions[i] += step
+
+    def _parabolic(self, i, step):
+        h, n = self.heights, self.positions
+        return h[i] + step / (n[i + 1] - n[i - 1]) * (
+            (n[i] - n[i - 1] + step) * (h[i + 1] - h[i]) / (n[i + 1] - n[i])
+            + (n[i + 1] - n[i] - step) * (h[i] - h[i - 1]) / (n[i] - n[i - 1])
+        )
+
+    def _linear(self, i, step):
+        h, n = self.heights, self.positions
+        return h[i] + step * (h[i + step] - h[i]) / (n[i + step] - n[i])
+
+    def quartiles(self):
+        """(q1, q3), or None before the first value."""
+        if not self.count:
+            return None
+        if self.count < 5:
+            return self.heights[self.count // 4], self.heights[(3 * self.count) // 4]
+        return self.heights[1], self.heights[3]
+
+    def to_state(self):
+        return [self.count, list(self.heights), list(self.positions)]
+
+    @classmethod
+    def from_state(cls, state):
+        sketch = cls()
+        sketch.count, sketch.heights, sketch.positions = state[0], list(state[1]), list(state[2])
+        return sketch
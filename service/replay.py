@@ -0,0 +1,373 @@
+import csv
+import time
+from array import array
+from collections import namedtuple
+from datetime import datetime
+import numpy as np
+from sqlalchemy.orm import joinedload
+from repo.db import db
+from repo.models import Instance, Metric
+from util.logger import logger
+from service.window_store import WindowSample, to_micros, from_micros, from_double, network_from_double
+from service.fleet_evaluator import WINDOW_FIELDS
+from service.policy_engine import DEFAULT_PLAN, resolve_policies
+from service.decision_pool import latest_values
+from service.baseline_store import BaselineStore, baseline_store, long_baseline_enabled
+from service.forecaster import ForecastStore
+from constants.service_constants import (
+    SCALE_UP_THRESHOLD, SCALE_DOWN_CPU_THRESHOLD, SCALE_DOWN_MEMORY_THRESHOLD,
+    SCALING_DECISION_INTERVAL_SECONDS, PREDICTIVE_SCALING_ENABLED, REPLAY_FLAP_WINDOW_MINUTES
+)
+
+# Replays stored metrics through the decision logic on a simulated clock. The
+# clock ticks every interval_seconds; at each tick every instance with metrics
+# newer than its last evaluation is evaluated, as the event-driven worker and the
+# skip-unchanged check do live. Metrics are held as sorted NumPy columns and each
+# tick cuts its windows out of them with searchsorted, so the only per-instance
+# Python work left is building reasons, in the same PolicyPlan.evaluate_packed
+# the scaling engine runs, one group per policy. Outlier flags, long baselines and forecasts evolve
+# as they would have; nothing is written to the database.
+
+MICROS_PER_SECOND = 1000000
+MICROS_PER_MINUTE = 60 * MICROS_PER_SECOND
+
+REPLAY_COLUMNS = ('instance_id', 'timestamp') + WINDOW_FIELDS
+
+# One state change in the decision timeline, like a ScalingDecision row
+ReplayDecision = namedtuple(
+    'ReplayDecision', 'timestamp instance_id decision reason cpu_utilization memory_usage'
+)
+
+ReplayResult = namedtuple('ReplayResult', 'decisions stats')
+
+class MetricSeries:
+    """
+    Metrics of many instances as columns sorted by instance, then timestamp.
+
+    instance holds an index into instance_ids per row, timestamps are int64
+    microseconds since the epoch and every WINDOW_FIELDS column is float64
+    with NaN for missing values.
+    """
+
+    __slots__ = ('instance_ids', 'instance', 'timestamps') + WINDOW_FIELDS
+
+    def __init__(self, instance_ids, instance, timestamps, cpu_utilization, memory_usage, network_in, network_out):
+        order = np.lexsort((timestamps, instance))
+        self.instance_ids = list(instance_ids)
+        self.instance = np.asarray(instance, dtype=np.int64)[order]
+        self.timestamps = np.asarray(timestamps, dtype=np.int64)[order]
+        self.cpu_utilization = np.asarray(cpu_utilization, dtype=float)[order]
+        self.memory_usage = np.asarray(memory_usage, dtype=float)[order]
+        self.network_in = np.asarray(network_in, dtype=float)[order]
+        self.network_out = np.asarray(network_out, dtype=float)[order]
+
+    def __len__(self):
+        return len(self.timestamps)
+
+    @classmethod
+    def from_rows(cls, rows):
+        """Build a series from (instance_id, timestamp, cpu, memory, network_in, network_out) tuples."""
+        index = {}
+        instance = array('q')
+        timestamps = array('q')
+        columns = [array('d') for _ in WINDOW_FIELDS]
+        for instance_id, timestamp, *values in rows:
+            instance.append(index.setdefault(instance_id, len(index)))
+            timestamps.append(to_micros(timestamp))
+            for column, value in zip(columns, values):
+                column.append(np.nan if value is None or value == '' else float(value))
+        return cls(list(index), np.frombuffer(instance, dtype=np.int64), np.frombuffer(timestamps, dtype=np.int64),
+                   *(np.frombuffer(column, dtype=float) for column in columns))
+
+def series_from_database(instance_ids=None, start=None, end=None, batch_size=10000):
+    """Stream Metric rows (optionally of some instances and between start and end) into a MetricSeries."""
+    query = db.session.query(Instance.instance_id, Metric.timestamp, *(getattr(Metric, f) for f in WINDOW_FIELDS))\
+        .join(Instance, Instance.instance_key == Metric.instance_key)
+    if instance_ids is not None:
+        query = query.filter(Instance.instance_id.in_(instance_ids))
+    if start is not None:
+        query = query.filter(Metric.timestamp >= start)
+    if end is not None:
+        query = query.filter(Metric.timestamp < end)
+    return MetricSeries.from_rows(query.execution_options(yield_per=batch_size))
+
+def series_from_csv(path):
+    """Read a CSV file with a header of REPLAY_COLUMNS; the network columns may be left out."""
+    with open(path, newline='') as f:
+        rows = (
+            (row['instance_id'], datetime.fromisoformat(row['timestamp']),
+             *(row.get(field) for field in WINDOW_FIELDS))
+            for row in csv.DictReader(f)
+        )
+        return MetricSeries.from_rows(rows)
+
+def series_from_parquet(path):
+    """Read a Parquet file with REPLAY_COLUMNS. Needs pyarrow."""
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise ImportError("Replaying Parquet files needs pyarrow (pip install pyarrow)")
+    table = pq.read_table(path)
+    instance_ids, instance = np.unique(np.array(table.column('instance_id').to_pylist(), dtype=object),
+                                       return_inverse=True)
+    timestamps = table.column('timestamp').cast(pa.timestamp('us')).cast(pa.int64()).to_numpy()
+    columns = [
+        table.column(field).cast(pa.float64()).to_numpy(zero_copy_only=False) if field in table.column_names
+        else np.full(len(table), np.nan)
+        for field in WINDOW_FIELDS
+    ]
+    return MetricSeries(instance_ids.tolist(), instance, timestamps, *columns)
+
+def load_series(path):
+    """A MetricSeries from a .csv or .parquet file."""
+    if str(path).endswith('.parquet'):
+        return series_from_parquet(path)
+    return series_from_csv(path)
+
+def window_sample(series, row, outliers):
+    return WindowSample(
+        None, from_micros(int(series.timestamps[row])),
+        from_double(float(series.cpu_utilization[row])), from_double(float(series.memory_usage[row])),
+        network_from_double(float(series.network_in[row])), network_from_double(float(series.network_out[row])),
+        bool(outliers[row])
+    )
+
+def stored_plans(instance_ids):
+    """Plans of the stored instances among instance_ids that have a scaling policy, see policy_engine.resolve_policies."""
+    instances = Instance.query.options(joinedload(Instance.user))\
+        .filter(Instance.instance_id.in_(list(instance_ids)), Instance.deleted_at.is_(None))\
+        .all()
+    return resolve_policies(instances)
+
+def replay(series, interval_seconds=SCALING_DECISION_INTERVAL_SECONDS, predictive=None,
+           flap_window_minutes=REPLAY_FLAP_WINDOW_MINUTES, plans=None):
+    """
+    Replay a MetricSeries through the decision logic.
+
+    plans maps instance_id to the policy_engine.PolicyPlan to decide it by, e.g.
+    stored_plans(series.instance_ids) for the policies set live; other instances are
+    decided by DEFAULT_PLAN. predictive defaults to PREDICTIVE_SCALING_ENABLED; long
+    baselines are used when the live engine uses them, in a store of their own. Returns
+    a ReplayResult with the timeline of state changes (ReplayDecision, in clock order)
+    and the stats of replay_stats.
+    """
+    started = time.perf_counter()
+    if predictive is None:
+        predictive = PREDICTIVE_SCALING_ENABLED
+    plans = plans or {}
+    needs_forecasts = predictive or any(plan.needs_forecast for plan in plans.values())
+    forecasts = ForecastStore() if needs_forecasts else None
+    baselines = BaselineStore(baseline_store.window_minutes) if long_baseline_enabled() else None
+
+    n = len(series.instance_ids)
+    timestamps = series.timestamps
+    decisions = []
+    decision_times = []  # the same clock in microseconds, for the stats
+    evaluations = 0
+    if not len(series):
+        return ReplayResult(decisions, replay_stats(series, decisions, decision_times, 0, 0, flap_window_minutes, started))
+
+    # One sorted key per row, instance first, so every window is a searchsorted range
+    first = int(timestamps.min())
+    span = int(timestamps.max()) - first + 1
+    keys = series.instance * span + (timestamps - first)
+    base = np.arange(n, dtype=np.int64) * span
+
+    def offset(moment):
+        # Clamped to the series' span so a search never lands in a neighbour's rows
+        return min(max(moment - first, 0), span - 1)
+    segment_start = np.searchsorted(series.instance, np.arange(n), 'left')
+    oldest = timestamps[np.minimum(segment_start, len(series) - 1)]
+
+    interval = int(interval_seconds * MICROS_PER_SECOND)
+    # A tick only matters if some metric arrived since the previous one
+    ticks = np.unique(-(-timestamps // interval)) * interval
+
+    def pack(plan, instances, end, tick):
+        # The columns PolicyPlan.pack would extract, cut out of the series
+        start = np.searchsorted(keys, base[instances] + offset(tick - int(plan.window_minutes * MICROS_PER_MINUTE)), 'left')
+        counts = end - start
+        rows = np.repeat(start - (np.cumsum(counts) - counts), counts) + np.arange(int(counts.sum()))
+        flat = {'counts': counts}
+        if plan.needs_outliers:
+            flat['included'] = ~outliers[rows]
+        for field in WINDOW_FIELDS:
+            column = getattr(series, field)
+            if field in plan.fields:
+                flat[field] = column[rows]
+            flat[f'latest_{field}'] = column[end - 1]
+        return {
+            'flat': flat,
+            'starts': {
+                m: np.searchsorted(keys, base[instances] + offset(tick - int(m * MICROS_PER_MINUTE)), 'left') - start
+                for m in plan.minutes
+            },
+            'short_history': {
+                m: (oldest[instances] > tick - int(m * MICROS_PER_MINUTE)).tolist() for m in plan.history
+            },
+        }
+
+    # Instances are evaluated in one group per plan, as the fleet pass does
+    group_plans = list(dict.fromkeys([DEFAULT_PLAN, *plans.values()]))
+    group_index = {plan: k for k, plan in enumerate(group_plans)}
+    group_of = np.array([group_index[plans.get(i, DEFAULT_PLAN)] for i in series.instance_ids], dtype=np.int64)
+
+    evaluated_until = segment_start.copy()
+    outliers = np.zeros(len(series), dtype=bool)
+    last_decision = [None] * n
+    for tick in ticks.tolist():
+        newest = np.searchsorted(keys, base + offset(tick), 'right')
+        changed = np.flatnonzero(newest > evaluated_until)
+        if not len(changed):
+            continue
+        previous = evaluated_until[changed]
+        end = newest[changed]
+        evaluated_until[changed] = end
+        latest = end - 1
+
+        new_samples = None
+        if forecasts is not None or baselines is not None:
+            # Sample objects only for metrics new at this tick, each is built once
+            new_samples = [
+                [window_sample(series, row, outliers) for row in range(lo, hi)]
+                for lo, hi in zip(previous.tolist(), end.tolist())
+            ]
+        instance_ids = [series.instance_ids[i] for i in changed.tolist()]
+        outcomes = [None] * len(changed)
+        for k, plan in enumerate(group_plans):
+            members = np.flatnonzero(group_of[changed] == k) if len(group_plans) > 1 else np.arange(len(changed))
+            if not len(members):
+                continue
+            members_list = members.tolist()
+            group_ids = [instance_ids[j] for j in members_list]
+            packed = pack(plan, changed[members], end[members], tick)
+            # Forecasts only advance for the instances whose plan reads them, as live
+            use_forecasts = forecasts is not None and (predictive if plan is DEFAULT_PLAN else plan.needs_forecast)
+            results = plan.evaluate_packed(
+                packed, latest_values(packed['flat']),
+                baselines=[baselines.get_baseline(i) for i in group_ids]
+                if baselines is not None and plan is DEFAULT_PLAN else None,
+                forecasts=[forecasts.update(group_ids[m], new_samples[j]) for m, j in enumerate(members_list)]
+                if use_forecasts else None
+            )
+            for j, outcome in zip(members_list, results):
+                outcomes[j] = outcome
+        evaluations += len(outcomes)
+
+        clock = from_micros(tick)
+        latest = latest.tolist()
+        for j, (i, (decision, reason, outlier_type)) in enumerate(zip(changed.tolist(), outcomes)):
+            if outlier_type is not None:
+                outliers[latest[j]] = True
+            if baselines is not None:
+                flagged = from_micros(int(timestamps[latest[j]])) if outlier_type is not None else None
+                baselines.observe(instance_ids[j], new_samples[j], flagged)
+            if decision != last_decision[i]:
+                last_decision[i] = decision
+                decisions.append(ReplayDecision(
+                    clock, instance_ids[j], decision, reason,
+                    from_double(float(series.cpu_utilization[latest[j]])),
+                    from_double(float(series.memory_usage[latest[j]]))
+                ))
+                decision_times.append(tick)
+
+    stats = replay_stats(series, decisions, decision_times, evaluations, len(ticks), flap_window_minutes, started)
+    logger.info(
+        f"Replayed {stats['simulated_hours']:.1f}h of {n} instance(s) in {stats['wall_seconds']:.2f}s: "
+        f"{len(decisions)} decision(s), {stats['flaps']} flap(s)"
+    )
+    return ReplayResult(decisions, stats)
+
+def delay_stats(delays, missed):
+    delays = np.asarray(delays, dtype=float)
+    if not len(delays):
+        return {'count': 0, 'missed': missed, 'mean_seconds': None, 'median_seconds': None, 'p95_seconds': None}
+    return {
+        'count': len(delays),
+        'missed': missed,
+        'mean_seconds': float(delays.mean()),
+        'median_seconds': float(np.median(delays)),
+        'p95_seconds': float(np.percentile(delays, 95))
+    }
+
+def time_to_scale(series, decisions, decision_times, condition, decision):
+    """
+    Seconds from each onset of condition (a per-row bool array) to the instance's next
+    state change to decision. Onsets while the instance is already in that state are
+    not counted; onsets followed by a different state change or by the next onset
+    first count as missed.
+    """
+    onset = condition.copy()
+    onset[1:] &= ~(condition[:-1] & (series.instance[1:] == series.instance[:-1]))
+    by_instance = {}
+    for d, timestamp in zip(decisions, decision_times):
+        by_instance.setdefault(d.instance_id, []).append((timestamp, d.decision))
+
+    delays, missed = [], 0
+    for instance, rows in _group_rows(series.instance, np.flatnonzero(onset)):
+        changes = by_instance.get(series.instance_ids[instance], [])
+        onset_times = series.timestamps[rows].tolist()
+        position = 0
+        for k, onset_time in enumerate(onset_times):
+            while position < len(changes) and changes[position][0] < onset_time:
+                position += 1
+            if position and changes[position - 1][1] == decision:
+                continue
+            next_onset = onset_times[k + 1] if k + 1 < len(onset_times) else None
+            if position < len(changes) and changes[position][1] == decision and \
+                    (next_onset is None or changes[position][0] < next_onset):
+                delays.append((changes[position][0] - onset_time) / MICROS_PER_SECOND)
+            else:
+                missed += 1
+    return delay_stats(delays, missed)
+
+def _group_rows(instance, rows):
+    """(instance, rows) pairs for sorted row positions, grouped by instance."""
+    if not len(rows):
+        return []
+    owners = instance[rows]
+    bounds = np.flatnonzero(np.diff(owners)) + 1
+    return [(int(group_owners[0]), group) for group_owners, group in
+            zip(np.split(owners, bounds), np.split(rows, bounds))]
+
+def count_flaps(decisions, decision_times, flap_window_minutes):
+    """Scale ups and scale downs that reverse the instance's previous one within flap_window_minutes."""
+    window = flap_window_minutes * MICROS_PER_MINUTE
+    last_direction = {}
+    flaps = 0
+    for d, timestamp in zip(decisions, decision_times):
+        if d.decision == 'no_action':
+            continue
+        previous = last_direction.get(d.instance_id)
+        if previous and previous[0] != d.decision and timestamp - previous[1] <= window:
+            flaps += 1
+        last_direction[d.instance_id] = (d.decision, timestamp)
+    return flaps
+
+def replay_stats(series, decisions, decision_times, evaluations, ticks, flap_window_minutes, started):
+    """Summary of a replay: volume, decisions per hour, flapping and time-to-scale."""
+    simulated_seconds = (int(series.timestamps.max()) - int(series.timestamps.min())) / MICROS_PER_SECOND \
+        if len(series) else 0.0
+    simulated_hours = simulated_seconds / 3600
+    cpu, memory = series.cpu_utilization, series.memory_usage
+    cpu_known, memory_known = ~np.isnan(cpu), ~np.isnan(memory)
+    # Same per-sample rules as the sustained checks; NaN compares False
+    high = (cpu > SCALE_UP_THRESHOLD) | (memory > SCALE_UP_THRESHOLD)
+    cpu_low, memory_low = cpu < SCALE_DOWN_CPU_THRESHOLD, memory < SCALE_DOWN_MEMORY_THRESHOLD
+    low = np.where(cpu_known & memory_known, cpu_low & memory_low, np.where(cpu_known, cpu_low, memory_low))
+    wall_seconds = time.perf_counter() - started
+    return {
+        'instances': len(series.instance_ids),
+        'samples': len(series),
+        'ticks': ticks,
+        'evaluations': evaluations,
+        'decisions': len(decisions),
+        'simulated_hours': simulated_hours,
+        'decisions_per_hour': len(decisions) / simulated_hours if simulated_hours else None,
+        'flaps': count_flaps(decisions, decision_times, flap_window_minutes),
+        'time_to_scale_up': time_to_scale(series, decisions, decision_times, high, 'scale_up'),
+        'time_to_scale_down': time_to_scale(series, decisions, decision_times, low, 'scale_down'),
+        'wall_seconds': wall_seconds,
+        'speedup': simulated_seconds / wall_seconds if wall_seconds else None
+    }
@@ -0,0 +1,287 @@
+import threading
+import numpy as np
+from datetime import datetime, timedelta
+from sqlalchemy import func
+from repo.db import db
+from repo.models import Instance, Metric, MetricRollup, instance_key_of, instance_keys_of
+from repo.metric_writer import upsert_rollups
+from repo.archive import archived_until, count_range, read_range, to_rows
+from util.logger import logger
+from constants.service_constants import (
+    ROLLUP_RESOLUTIONS_SECONDS, ROLLUP_RETENTION_DAYS, METRICS_RETENTION_DAYS, ARCHIVE_ENABLED
+)
+
+# Rollups summarize the metrics of each instance per 1 minute, 5 minute and 1 hour
+# bucket (min, max, mean and 95th percentile of CPU and memory, summed network
+# bytes) in metric_rollups, so a chart of a week reads a few hundred rows instead of
+# tens of thousands.
+#
+# They are maintained incrementally. The ingestion paths note the oldest timestamp
+# they committed per instance in rollup_tracker, and the rollup job rewrites every
+# bucket from the one holding that timestamp on, computed from the raw metrics since
+# the start of its hour in one NumPy pass per resolution. A percentile cannot be merged
+# from smaller buckets, so buckets are always recomputed whole rather than updated. After a restart the first refresh picks up from
+# the newest hourly bucket each instance has, or from its oldest metric if it has none.
+#
+# get_metric_series answers a range query from the finest source that still covers
+# the range and fits the point budget: raw metrics, then each resolution in turn. With
+# the cold archive enabled, raw metrics of exported days older than the hot window are
+# read from the archive files (see repo/archive.py), so old ranges can be read raw too.
+
+EPOCH = datetime(1970, 1, 1)
+PERCENTILE = 0.95
+REFRESH_SLICE = timedelta(days=1)  # rows read per query when catching up, a multiple of every resolution
+REFRESH_BATCH_INSTANCES = 500  # instances read per query
+
+def bucket_start(timestamp, resolution):
+    """Start of the resolution-second bucket holding timestamp, buckets being aligned to the epoch."""
+    delta = timestamp - EPOCH
+    offset = (delta.days * 86400 + delta.seconds) % resolution
+    return timestamp.replace(microsecond=0) - timedelta(seconds=offset)
+
+class RollupTracker:
+    """
+    Oldest metric timestamp committed per instance since its rollups were last refreshed.
+    Thread-safe: the producers are the collector job and request handlers, the consumer
+    is the rollup job.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stale = {}
+        self.primed = False  # the first refresh also catches up on what the database holds
+
+    def note_rows(self, rows):
+        """Record committed metric rows, tuples starting with instance_id and timestamp."""
+        with self._lock:
+            for row in rows:
+                instance_id, timestamp = row[0], row[1]
+                since = self._stale.get(instance_id)
+                if since is None or timestamp < since:
+                    self._stale[instance_id] = timestamp
+
+    def take(self):
+        """All instances with new metrics and the oldest of them, clearing the tracker."""
+        with self._lock:
+            stale, self._stale = self._stale, {}
+            return stale
+
+    def clear(self):
+        with self._lock:
+            self._stale = {}
+            self.primed = False
+
+rollup_tracker = RollupTracker()
+
+def _nullable(values):
+    return [None if value != value else value for value in values.tolist()]
+
+def _summarize(values, group, starts):
+    """Per-group min, max, mean and 95th percentile (as np.percentile) of a column, NaN where no value is known."""
+    known = ~np.isnan(values)
+    counts = np.add.reduceat(known.astype(np.int64), starts)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean = np.add.reduceat(np.where(known, values, 0.0), starts) / counts
+        lowest = np.fmin.reduceat(values, starts)
+        highest = np.fmax.reduceat(values, starts)
+    # Sorting by group, then value, leaves every group's known values first, in order
+    ordered = values[np.lexsort((values, group))]
+    position = PERCENTILE * np.maximum(counts - 1, 0)
+    lower = np.floor(position).astype(np.int64)
+    upper = np.minimum(lower + 1, np.maximum(counts - 1, 0))
+    low, high = ordered[starts + lower], ordered[starts + upper]
+    p95 = np.where(counts > 0, low + (high - low) * (position - lower), np.nan)
+    return lowest, highest, mean, p95
+
+def _total(values, starts):
+    known = ~np.isnan(values)
+    totals = np.add.reduceat(np.where(known, values, 0.0), starts)
+    return [int(total) if any_known else None
+            for total, any_known in zip(totals.tolist(), np.add.reduceat(known.astype(np.int64), starts).tolist())]
+
+def compute_rollups(rows, resolutions=ROLLUP_RESOLUTIONS_SECONDS):
+    """
+    Rollup tuples in ROLLUP_COLUMNS order, one per instance, resolution and bucket, for
+    metric rows (instance_id, timestamp, cpu_utilization, memory_usage, network_in,
+    network_out) sorted by instance and timestamp. Buckets are summarized from the rows
+    given only, so the rows must cover each bucket whole.
+    """
+    if not rows:
+        return []
+    instance_ids, timestamps, cpu, memory, network_in, network_out = zip(*rows)
+    instance_ids = np.array(instance_ids)
+    seconds = np.array(timestamps, dtype='datetime64[s]').astype(np.int64)
+    instance = np.r_[0, np.cumsum(instance_ids[1:] != instance_ids[:-1])]
+    columns = [np.array(column, dtype=float) for column in (cpu, memory, network_in, network_out)]
+
+    rollups = []
+    for resolution in resolutions:
+        buckets = seconds // resolution * resolution
+        change = np.r_[True, (instance[1:] != instance[:-1]) | (buckets[1:] != buckets[:-1])]
+        starts = np.flatnonzero(change)
+        group = np.cumsum(change) - 1
+        samples = np.diff(np.r_[starts, len(seconds)])
+        cpu_stats = [_nullable(stat) for stat in _summarize(columns[0], group, starts)]
+        memory_stats = [_nullable(stat) for stat in _summarize(columns[1], group, starts)]
+        rollups.extend(zip(
+            instance_ids[starts].tolist(), [resolution] * len(starts),
+            buckets[starts].astype('datetime64[s]').tolist(), samples.tolist(),
+            *cpu_stats, *memory_stats, _total(columns[2], starts), _total(columns[3], starts)
+        ))
+    return rollups
+
+def _stale_from_database():
+    """Where each instance's rollups fall behind its metrics: its newest hourly bucket, or its oldest metric."""
+    coarsest = ROLLUP_RESOLUTIONS_SECONDS[-1]
+    stale = dict(
+        db.session.query(MetricRollup.instance_id, func.max(MetricRollup.bucket))
+        .filter(MetricRollup.resolution == coarsest)
+        .group_by(MetricRollup.instance_id)
+        .all()
+    )
+    never_rolled = db.session.query(Instance.instance_id, func.min(Metric.timestamp))\
+        .join(Instance, Instance.instance_key == Metric.instance_key)\
+        .group_by(Instance.instance_id)
+    if stale:
+        never_rolled = never_rolled.filter(Instance.instance_id.notin_(list(stale)))
+    stale.update(never_rolled.all())
+    return stale
+
+def _load_rows(instance_ids, start, end):
+    return db.session.query(
+        Instance.instance_id, Metric.timestamp, Metric.cpu_utilization, Metric.memory_usage,
+        Metric.network_in, Metric.network_out
+    ).join(Instance, Instance.instance_key == Metric.instance_key).filter(
+        Metric.instance_key.in_(instance_keys_of(instance_ids)), Metric.timestamp >= start, Metric.timestamp < end
+    ).order_by(Metric.instance_key, Metric.timestamp).all()
+
+def refresh_rollups(now=None):
+    """
+    Recompute the buckets of the instances with new metrics, from the bucket of their
+    oldest new metric up to now. Commits per batch. Returns the number of buckets written.
+    """
+    stale = rollup_tracker.take()
+    if not rollup_tracker.primed:
+        for instance_id, since in _stale_from_database().items():
+            if instance_id not in stale or since < stale[instance_id]:
+                stale[instance_id] = since
+        rollup_tracker.primed = True
+    if not stale:
+        return 0
+
+    now = now or datetime.utcnow()
+    coarsest = ROLLUP_RESOLUTIONS_SECONDS[-1]
+    # Instances stale since the same hour share their queries
+    by_hour = {}
+    for instance_id, since in stale.items():
+        by_hour.setdefault(bucket_start(since, coarsest), []).append(instance_id)
+
+    written = 0
+    try:
+        for hour, instance_ids in sorted(by_hour.items()):
+            instance_ids.sort()
+            for batch_start in range(0, len(instance_ids), REFRESH_BATCH_INSTANCES):
+                batch = instance_ids[batch_start:batch_start + REFRESH_BATCH_INSTANCES]
+                start = hour
+                while start <= now:
+                    rollups = compute_rollups(_load_rows(batch, start, start + REFRESH_SLICE))
+                    # The hour is read whole for its hourly bucket; finer buckets before the new metrics are unchanged
+                    written += upsert_rollups(
+                        rollup for rollup in rollups if rollup[2] >= bucket_start(stale[rollup[0]], rollup[1])
+                    )
+                    db.session.commit()
+                    start += REFRESH_SLICE
+    except Exception:
+        db.session.rollback()
+        # Recomputing a bucket twice is harmless, so everything is retried next time
+        rollup_tracker.note_rows(stale.items())
+        raise
+    return written
+
+def expire_rollups(now=None):
+    """Delete buckets older than the retention of their resolution; returns the number deleted."""
+    now = now or datetime.utcnow()
+    deleted = 0
+    for resolution, days in ROLLUP_RETENTION_DAYS.items():
+        if days:
+            deleted += MetricRollup.query.filter(
+                MetricRollup.resolution == resolution, MetricRollup.bucket < now - timedelta(days=days)
+            ).delete(synchronize_session=False)
+    db.session.commit()
+    return deleted
+
+def choose_resolution(start, end, raw_count, max_points, now=None, archived=False):
+    """
+    Where to read [start, end) from: 0 for raw metrics if they fit in max_points, else the
+    finest resolution whose buckets fit and that is still kept for start, else the coarsest.
+    archived says the raw metrics past retention are read from the cold archive.
+    """
+    now = now or datetime.utcnow()
+
+    def kept(days):
+        return not days or start >= now - timedelta(days=days)
+
+    if raw_count <= max_points and (archived or kept(METRICS_RETENTION_DAYS)):
+        return 0
+    span = (end - start).total_seconds()
+    for resolution in ROLLUP_RESOLUTIONS_SECONDS:
+        # A range not aligned to buckets touches one more
+        if span // resolution + 1 <= max_points and kept(ROLLUP_RETENTION_DAYS.get(resolution)):
+            return resolution
+    return ROLLUP_RESOLUTIONS_SECONDS[-1]
+
+def _raw_point(timestamp, cpu_utilization, memory_usage, network_in, network_out):
+    return {
+        'timestamp': timestamp.isoformat(),
+        'cpu_utilization': cpu_utilization,
+        'memory_usage': memory_usage,
+        'network_in': network_in,
+        'network_out': network_out
+    }
+
+def _stats(low, high, mean, p95):
+    return {'min': low, 'max': high, 'avg': mean, 'p95': p95}
+
+def get_metric_series(instance_id, start, end, max_points):
+    """
+    Metrics of one instance in [start, end), oldest first, from the source picked by
+    choose_resolution. Returns (success, result); result holds resolution_seconds (0 for
+    raw metrics) and the points.
+    """
+    try:
+        # Whole exported days before the hot window come from the cold archive, the rest from metrics
+        split = start
+        if ARCHIVE_ENABLED and METRICS_RETENTION_DAYS:
+            split = archived_until('metrics', start, end, datetime.utcnow() - timedelta(days=METRICS_RETENTION_DAYS))
+        archived = split > start
+        hot = (Metric.instance_key == instance_key_of(instance_id), Metric.timestamp >= split, Metric.timestamp < end)
+        # Archived rows are counted from the files' footers and only read for a raw answer
+        raw_count = Metric.query.filter(*hot).count() + (count_range('metrics', instance_id, start, split) if archived else 0)
+        resolution = choose_resolution(start, end, raw_count, max_points, archived=archived)
+
+        if resolution == 0:
+            points = [_raw_point(*row[1:]) for row in to_rows(read_range('metrics', instance_id, start, split))] if archived else []
+            points += [
+                _raw_point(m.timestamp, m.cpu_utilization, m.memory_usage, m.network_in, m.network_out)
+                for m in Metric.query.filter(*hot).order_by(Metric.timestamp).all()
+            ]
+        else:
+            rollups = MetricRollup.query.filter(
+                MetricRollup.instance_id == instance_id,
+                MetricRollup.resolution == resolution,
+                MetricRollup.bucket >= bucket_start(start, resolution),
+                MetricRollup.bucket < end
+            ).order_by(MetricRollup.bucket).all()
+            points = [{
+                'timestamp': r.bucket.isoformat(),
+                'samples': r.samples,
+                'cpu_utilization': _stats(r.cpu_min, r.cpu_max, r.cpu_avg, r.cpu_p95),
+                'memory_usage': _stats(r.memory_min, r.memory_max, r.memory_avg, r.memory_p95),
+                'network_in': r.network_in,
+                'network_out': r.network_out
+            } for r in rollups]
+
+        return True, {'resolution_seconds': resolution, 'points': points}
+    except Exception as e:
+        logger.error(f"Error reading metric series for {instance_id}: {e}")
+        return False, str(e)
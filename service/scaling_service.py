@@ -1,65 +1,181 @@
 from repo.db import db
-from repo.models import Metric, ScalingDecision, Instance
-from sqlalchemy import func
+from repo.models import Metric, MetricOutlier, ScalingDecision, Instance, User, instance_key_of
+from repo.metric_writer import record_outliers
+from sqlalchemy import func, tuple_, and_, exists
+from sqlalchemy.orm import contains_eager
 from datetime import datetime, timedelta
+from functools import partial
 from util.logger import logger
+from service.window_store import window_store
+from service.baseline_store import baseline_store, long_baseline_enabled, load_baselines
+from service.sustained_tracker import SustainedTrackerStore
+from service.forecaster import forecast_store
+from service.decision_trace import decision_trace
 from constants.service_constants import (
     SCALE_DOWN_CPU_THRESHOLD, SCALE_DOWN_MEMORY_THRESHOLD,
     SCALE_UP_THRESHOLD, SUSTAINED_DURATION_MINUTES,
-    IQR_MULTIPLIER, IQR_MIN_DATA_DURATION_MINUTES
+    IQR_MULTIPLIER, IQR_MIN_DATA_POINTS, IQR_MIN_DATA_DURATION_MINUTES, IQR_WINDOW_MINUTES,
+    SUSTAINED_MIN_DATA_POINTS, SUSTAINED_PERCENTAGE_THRESHOLD, SCALING_FLEET_EVALUATION,
+    SCALING_VECTORIZED_EVALUATION, SKIP_UNCHANGED_INSTANCES, WINDOW_STORE_ENABLED, SUSTAINED_TRACKER_ENABLED,
+    DECISION_POOL_WORKERS, DECISION_POOL_MIN_INSTANCES, PREDICTIVE_SCALING_ENABLED,
+    FORECAST_HORIZON_MINUTES, FORECAST_MIN_SAMPLES
 )
 
-def check_sustained_usage(instance_id, cpu_threshold=None, memory_threshold=None, duration_minutes=5, above=True):
+# Outlier flags live in their own append-only table, so the metrics table is insert-only.
+# They are keyed by (instance_key, timestamp), which is unique and also known for samples
+# served from the window store, where the row id is not. Window rows get their flag
+# through an outer join on that key; queries leaving outliers out use an anti-join.
+_OUTLIER_OF_METRIC = and_(MetricOutlier.instance_key == Metric.instance_key, MetricOutlier.timestamp == Metric.timestamp)
+
+# Columns loaded for decision making; rows are plain tuples, not ORM objects.
+# Queries selecting them must go through with_outlier_flags
+WINDOW_COLUMNS = (
+    Metric.id, Metric.timestamp, Metric.cpu_utilization, Metric.memory_usage,
+    Metric.network_in, Metric.network_out, (MetricOutlier.timestamp != None).label('is_outlier')
+)
+
+def with_outlier_flags(query):
+    """Join the outlier annotations into a query of Metric rows, for the is_outlier column of WINDOW_COLUMNS."""
+    return query.outerjoin(MetricOutlier, _OUTLIER_OF_METRIC)
+
+def not_outlier():
+    """Filter keeping the Metric rows without an outlier annotation."""
+    return ~exists().where(_OUTLIER_OF_METRIC)
+
+# One window covers every check made by make_scaling_decision. It also spans the minimum
+# IQR history, so a window store that covers it can vouch for the oldest-metric check.
+DECISION_WINDOW_MINUTES = max(SUSTAINED_DURATION_MINUTES, IQR_WINDOW_MINUTES, IQR_MIN_DATA_DURATION_MINUTES)
+
+# Up to this many window-store misses are loaded with an IN list, more with a join on the monitored fleet
+FLEET_WINDOW_IN_LIMIT = 1000
+
+def load_metric_window(instance_id, window_minutes=DECISION_WINDOW_MINUTES, now=None):
+    """
+    Load an instance's recent metrics in a single query.
+    Returns (samples, latest, oldest_timestamp): the window rows oldest first, the newest
+    metric of the instance and the timestamp of its oldest metric. The newest metric
+    is normally the last window row; it is only looked up separately when the window is empty.
+    """
+    now = now or datetime.utcnow()
+    cutoff_time = now - timedelta(minutes=window_minutes)
+
+    # Rides along on every row so the oldest-metric check needs no extra round trip
+    instance_key = instance_key_of(instance_id)
+    oldest_timestamp = db.session.query(func.min(Metric.timestamp))\
+        .filter(Metric.instance_key == instance_key)\
+        .scalar_subquery()
+
+    rows = with_outlier_flags(db.session.query(*WINDOW_COLUMNS, oldest_timestamp.label('oldest_timestamp'))).filter(
+        Metric.instance_key == instance_key,
+        Metric.timestamp >= cutoff_time
+    ).order_by(Metric.timestamp.asc()).all()
+
+    if rows:
+        return rows, rows[-1], rows[0].oldest_timestamp
+
+    latest = with_outlier_flags(db.session.query(*WINDOW_COLUMNS, oldest_timestamp.label('oldest_timestamp')))\
+        .filter(Metric.instance_key == instance_key)\
+        .order_by(Metric.timestamp.desc())\
+        .first()
+    if not latest:
+        return [], None, None
+    return [], latest, latest.oldest_timestamp
+
+def sample_meets_condition(sample, cpu_threshold=None, memory_threshold=None, above=True):
+    """Whether one sample meets the CPU/memory threshold condition of a sustained check."""
+    condition_met = False
+    
+    if cpu_threshold is not None and sample.cpu_utilization is not None:
+        if above:
+            condition_met = sample.cpu_utilization > cpu_threshold
+        else:
+            condition_met = sample.cpu_utilization < cpu_threshold
+    
+    if memory_threshold is not None and sample.memory_usage is not None:
+        if above:
+            if cpu_threshold is not None:
+                condition_met = condition_met or sample.memory_usage > memory_threshold
+            else:
+                condition_met = sample.memory_usage > memory_threshold
+        else:
+            if cpu_threshold is not None and sample.cpu_utilization is not None:
+                condition_met = sample.cpu_utilization < cpu_threshold and sample.memory_usage < memory_threshold
+            else:
+                condition_met = sample.memory_usage < memory_threshold
+    
+    return condition_met
+
+# (cpu_threshold, memory_threshold, above) of the sustained checks in priority order:
+# scale down on low CPU and memory, scale up on high CPU, scale up on high memory
+SUSTAINED_CHECKS = (
+    (SCALE_DOWN_CPU_THRESHOLD, SCALE_DOWN_MEMORY_THRESHOLD, False),
+    (SCALE_UP_THRESHOLD, None, True),
+    (None, SCALE_UP_THRESHOLD, True),
+)
+
+# Incremental counterpart of sustained_usage for the checks above, see service/sustained_tracker.py
+sustained_trackers = SustainedTrackerStore([
+    partial(sample_meets_condition, cpu_threshold=cpu, memory_threshold=memory, above=above)
+    for cpu, memory, above in SUSTAINED_CHECKS
+])
+
+def sustained_usage(samples, cpu_threshold=None, memory_threshold=None, above=True):
+    """
+    Check in memory whether a threshold condition held for enough of the given samples.
+    Returns (is_sustained, percentage).
+    """
+    if len(samples) < SUSTAINED_MIN_DATA_POINTS:  # Need at least 3 data points for sustained check
+        return False, 0.0
+    
+    matching_count = sum(
+        1 for sample in samples
+        if sample_meets_condition(sample, cpu_threshold, memory_threshold, above)
+    )
+    total_count = len(samples)
+    
+    percentage = (matching_count / total_count) * 100 if total_count > 0 else 0
+    is_sustained = percentage >= SUSTAINED_PERCENTAGE_THRESHOLD
+    
+    logger.info(f"Sustained check result: {matching_count}/{total_count} metrics matched ({percentage:.1f}%), threshold={SUSTAINED_PERCENTAGE_THRESHOLD}%, is_sustained={is_sustained}")
+    
+    return is_sustained, percentage
+
+def check_sustained_usage(instance_id, cpu_threshold=None, memory_threshold=None, duration_minutes=SUSTAINED_DURATION_MINUTES, above=True):
     """
     Check if CPU/memory usage has been sustained above or below thresholds for a given duration
     """
     cutoff_time = datetime.utcnow() - timedelta(minutes=duration_minutes)
     
     metrics = Metric.query.filter(
-        Metric.instance_id == instance_id,
+        Metric.instance_key == instance_key_of(instance_id),
         Metric.timestamp >= cutoff_time
     ).order_by(Metric.timestamp.asc()).all()
     
     logger.info(f"Sustained usage check for {instance_id}: found {len(metrics)} metrics in last {duration_minutes} minutes")
     
-    if len(metrics) < 3:  # Need at least 3 data points for sustained check
-        return False, 0.0
-    
-    matching_count = 0
-    total_count = len(metrics)
-    
-    for metric in metrics:
-        condition_met = False
-        
-        if cpu_threshold is not None and metric.cpu_utilization is not None:
-            if above:
-                condition_met = metric.cpu_utilization > cpu_threshold
-            else:
-                condition_met = metric.cpu_utilization < cpu_threshold
-        
-        if memory_threshold is not None and metric.memory_usage is not None:
-            if above:
-                if cpu_threshold is not None:
-                    condition_met = condition_met or metric.memory_usage > memory_threshold
-                else:
-                    condition_met = metric.memory_usage > memory_threshold
-            else:
-                if cpu_threshold is not None and metric.cpu_utilization is not None:
-                    condition_met = metric.cpu_utilization < cpu_threshold and metric.memory_usage < memory_threshold
-                else:
-                    condition_met = metric.memory_usage < memory_threshold
-        
-        if condition_met:
-            matching_count += 1
+    return sustained_usage(metrics, cpu_threshold, memory_threshold, above)
+
+def metrics_mean(samples):
+    """
+    Mean of CPU, memory, network in and network out over the given samples.
+    Returns (cpu_mean, memory_mean, network_in_mean, network_out_mean) or None if there are no samples.
+    """
+    if not samples:
+        return None
     
-    percentage = (matching_count / total_count) * 100 if total_count > 0 else 0
-    is_sustained = percentage >= 80
+    cpu_values = [m.cpu_utilization for m in samples if m.cpu_utilization is not None]
+    memory_values = [m.memory_usage for m in samples if m.memory_usage is not None]
+    network_in_values = [m.network_in for m in samples if m.network_in is not None]
+    network_out_values = [m.network_out for m in samples if m.network_out is not None]
     
-    logger.info(f"Sustained check result: {matching_count}/{total_count} metrics matched ({percentage:.1f}%), threshold=80%, is_sustained={is_sustained}")
+    cpu_mean = sum(cpu_values) / len(cpu_values) if cpu_values else None
+    memory_mean = sum(memory_values) / len(memory_values) if memory_values else None
+    network_in_mean = sum(network_in_values) / len(network_in_values) if network_in_values else None
+    network_out_mean = sum(network_out_values) / len(network_out_values) if network_out_values else None
     
-    return is_sustained, percentage
+    return cpu_mean, memory_mean, network_in_mean, network_out_mean
 
-def calculate_metrics_mean(instance_id, time_window_minutes=5):
+def calculate_metrics_mean(instance_id, time_window_minutes=IQR_WINDOW_MINUTES):
     """
     Calculate mean of CPU utilization and memory usage for an instance.
     Uses metrics from the last N minutes, excluding outlier metrics.
@@ -68,38 +184,239 @@ def calculate_metrics_mean(instance_id, time_window_minutes=5):
     cutoff_time = datetime.utcnow() - timedelta(minutes=time_window_minutes)
     
     metrics = Metric.query.filter(
-        Metric.instance_id == instance_id,
+        Metric.instance_key == instance_key_of(instance_id),
         Metric.timestamp >= cutoff_time,
-        Metric.is_outlier == False
+        not_outlier()
     ).all()
     
-    if not metrics:
+    return metrics_mean(metrics)
+
+def iqr_bounds(values):
+    """
+    IQR outlier bounds for a list of values, or None with fewer than IQR_MIN_DATA_POINTS values.
+    Returns (lower, upper).
+    """
+    if len(values) < IQR_MIN_DATA_POINTS:
         return None
+    values = sorted(values)
+    n = len(values)
+    q1 = values[n // 4]
+    q3 = values[(3 * n) // 4]
+    iqr = q3 - q1
+    return q1 - IQR_MULTIPLIER * iqr, q3 + IQR_MULTIPLIER * iqr
+
+# (column, label, vote weight, is_bytes) for the IQR analysis, in reason order.
+# CPU and memory get a higher weight than network.
+IQR_METRICS = (
+    ('cpu_utilization', 'CPU', 2, False),
+    ('memory_usage', 'Memory', 2, False),
+    ('network_in', 'Network In', 1, True),
+    ('network_out', 'Network Out', 1, True),
+)
+
+def insufficient_duration_reason(minutes=IQR_MIN_DATA_DURATION_MINUTES):
+    return f"Insufficient historical data duration. Need at least {minutes} minutes of data for IQR analysis."
+
+INSUFFICIENT_DURATION_REASON = insufficient_duration_reason()
+
+def describe_current(current_cpu, current_memory):
+    metric_info = []
+    if current_cpu is not None:
+        metric_info.append(f"CPU: {current_cpu:.2f}%")
+    if current_memory is not None:
+        metric_info.append(f"Memory: {current_memory:.2f}%")
+    return ', '.join(metric_info)
+
+def sustained_scale_down_reason(percentage, current_cpu, current_memory):
+    curr_cpu_str = f"{current_cpu:.2f}" if current_cpu is not None else "N/A"
+    curr_mem_str = f"{current_memory:.2f}" if current_memory is not None else "N/A"
+    return f"Sustained scale down: CPU < {SCALE_DOWN_CPU_THRESHOLD}% AND Memory < {SCALE_DOWN_MEMORY_THRESHOLD}% for {percentage:.1f}% of last {SUSTAINED_DURATION_MINUTES} minutes (Current: CPU={curr_cpu_str}%, Memory={curr_mem_str}%)"
+
+def sustained_scale_up_reason(label, percentage, current):
+    return f"Sustained scale up: {label} > {SCALE_UP_THRESHOLD}% for {percentage:.1f}% of last {SUSTAINED_DURATION_MINUTES} minutes (Current: {current:.2f}%)"
+
+def insufficient_iqr_data_reason(current_cpu, current_memory):
+    return f"Insufficient data for IQR analysis. Current metrics - {describe_current(current_cpu, current_memory)}"
+
+def describe_bound(label, current, bound, above, is_bytes):
+    comparison = "> upper bound" if above else "< lower bound"
+    if is_bytes:
+        return f"{label} ({current:,} bytes) {comparison} ({bound:,.0f} bytes)"
+    return f"{label} ({current:.2f}%) {comparison} ({bound:.2f}%)"
+
+def iqr_decision(scale_up_votes, scale_down_votes, reasons_list, current_cpu, current_memory, votes_needed=2):
+    """Turn IQR votes into (decision, reason)."""
+    if scale_up_votes >= votes_needed:
+        return "scale_up", f"Scale up recommended. Reasons: {'; '.join(reasons_list)}"
+    if scale_down_votes >= votes_needed:
+        return "scale_down", f"Scale down recommended. Reasons: {'; '.join(reasons_list)}"
+    return "no_action", f"All metrics within acceptable range. Current: {describe_current(current_cpu, current_memory)}"
+
+FORECAST_HORIZON_SECONDS = FORECAST_HORIZON_MINUTES * 60
+
+def forecast_peak(trend):
+    """Highest value of a service.forecaster.Trend within the horizon; linear, so now or at its end."""
+    return trend.level + max(trend.slope, 0.0) * FORECAST_HORIZON_SECONDS
+
+def predicted_scale_up_reason(label, peak, slope, threshold=SCALE_UP_THRESHOLD, horizon_minutes=FORECAST_HORIZON_MINUTES):
+    return f"Predicted scale up: {label} forecast to reach {peak:.2f}% (> {threshold}%) within {horizon_minutes} minutes, trend {slope * 60:+.2f}%/min"
+
+def predicted_scale_down_reason(cpu_peak, memory_peak, cpu_threshold=SCALE_DOWN_CPU_THRESHOLD,
+                                memory_threshold=SCALE_DOWN_MEMORY_THRESHOLD, horizon_minutes=FORECAST_HORIZON_MINUTES):
+    return f"Predicted scale down: CPU forecast at most {cpu_peak:.2f}% (< {cpu_threshold}%) AND Memory at most {memory_peak:.2f}% (< {memory_threshold}%) for the next {horizon_minutes} minutes"
+
+def predicted_decision(forecast):
+    """
+    (decision, reason) from an instance's service.forecaster.Forecast, or None.
+
+    Scale up when the CPU or memory forecast exceeds SCALE_UP_THRESHOLD within
+    FORECAST_HORIZON_MINUTES, scale down when both stay under the scale down
+    thresholds for all of it. Models with fewer than FORECAST_MIN_SAMPLES samples
+    are not trusted yet.
+    """
+    cpu_ready = forecast.cpu.count >= FORECAST_MIN_SAMPLES
+    memory_ready = forecast.memory.count >= FORECAST_MIN_SAMPLES
+    cpu_peak = forecast_peak(forecast.cpu)
+    memory_peak = forecast_peak(forecast.memory)
+    if cpu_ready and cpu_peak > SCALE_UP_THRESHOLD:
+        return "scale_up", predicted_scale_up_reason('CPU', cpu_peak, forecast.cpu.slope)
+    if memory_ready and memory_peak > SCALE_UP_THRESHOLD:
+        return "scale_up", predicted_scale_up_reason('Memory', memory_peak, forecast.memory.slope)
+    if cpu_ready and memory_ready and cpu_peak < SCALE_DOWN_CPU_THRESHOLD and memory_peak < SCALE_DOWN_MEMORY_THRESHOLD:
+        return "scale_down", predicted_scale_down_reason(cpu_peak, memory_peak)
+    return None
+
+def evaluate_scaling_decision(instance_id, samples, latest, oldest_timestamp, now=None, baseline=None, sustained=None,
+                              forecast=None):
+    """
+    Decide on scaling for one instance from already loaded data, without touching the database.
+
+    samples are the instance's metrics of the last DECISION_WINDOW_MINUTES, oldest first,
+    latest is its newest metric and oldest_timestamp the timestamp of its oldest metric.
+    baseline, a service.baseline_store.Baseline, replaces the quartiles of the last
+    IQR_WINDOW_MINUTES with a longer streaming baseline when given. sustained, the
+    (is_sustained, percentage) of every SUSTAINED_CHECKS entry as kept by
+    sustained_trackers, saves counting the sustained window again. forecast, the instance's
+    service.forecaster.Forecast, enables the predictive check.
+    Returns (decision, reason, outlier_type); outlier_type is None unless the latest metric
+    should be flagged as an outlier.
+
+    Decision logic (priority order):
+    1. Immediate scale down if CPU < 10% AND memory < 20%
+    2. Immediate scale up if CPU > 90% OR memory > 90%
+    3. With a forecast, scale early when it reaches those thresholds (see predicted_decision)
+    4. Use IQR (Interquartile Range) method for outlier detection considering all metrics
+    """
+    now = now or datetime.utcnow()
     
-    cpu_values = [m.cpu_utilization for m in metrics if m.cpu_utilization is not None]
-    memory_values = [m.memory_usage for m in metrics if m.memory_usage is not None]
-    network_in_values = [m.network_in for m in metrics if m.network_in is not None]
-    network_out_values = [m.network_out for m in metrics if m.network_out is not None]
+    current_cpu = latest.cpu_utilization
+    current_memory = latest.memory_usage
     
-    cpu_mean = sum(cpu_values) / len(cpu_values) if cpu_values else None
-    memory_mean = sum(memory_values) / len(memory_values) if memory_values else None
-    network_in_mean = sum(network_in_values) / len(network_in_values) if network_in_values else None
-    network_out_mean = sum(network_out_values) / len(network_out_values) if network_out_values else None
+    sustained_cutoff = now - timedelta(minutes=SUSTAINED_DURATION_MINUTES)
+    iqr_cutoff = now - timedelta(minutes=IQR_WINDOW_MINUTES)
+    # Recent metrics excluding outliers, the baseline for the mean and the IQR analysis
+    historical_metrics = [s for s in samples if s.timestamp >= iqr_cutoff and s.is_outlier == False]  # NULL is excluded, as in SQL
     
-    return cpu_mean, memory_mean, network_in_mean, network_out_mean
+    result = metrics_mean(historical_metrics)
+    if result is not None:
+        logger.debug(f"Recent means for {instance_id}: CPU={result[0]}, Memory={result[1]}")
+    
+    # Priority 1: Scale down if BOTH CPU < SCALE_DOWN_CPU_THRESHOLD AND memory < SCALE_DOWN_MEMORY_THRESHOLD sustained for SUSTAINED_DURATION_MINUTES minutes
+    # We proceed even if current metrics are None, as long as we have enough historical data
+    if sustained is None:
+        sustained_samples = [s for s in samples if s.timestamp >= sustained_cutoff]
+        sustained = [sustained_usage(sustained_samples, *check) for check in SUSTAINED_CHECKS]
+    is_sustained, percentage = sustained[0]
+    logger.info(f"Scale down check for {instance_id}: is_sustained={is_sustained}, percentage={percentage:.1f}%")
+    if is_sustained:
+        return "scale_down", sustained_scale_down_reason(percentage, current_cpu, current_memory), "scale_down"
+    
+    # Priority 2: Scale up if CPU > SCALE_UP_THRESHOLD% OR memory > SCALE_UP_THRESHOLD% sustained for SUSTAINED_DURATION_MINUTES minutes
+    if current_cpu is not None:
+        is_sustained, percentage = sustained[1]
+        if is_sustained:
+            return "scale_up", sustained_scale_up_reason('CPU', percentage, current_cpu), "scale_up"
+    
+    if current_memory is not None:
+        is_sustained, percentage = sustained[2]
+        if is_sustained:
+            return "scale_up", sustained_scale_up_reason('Memory', percentage, current_memory), "scale_up"
+    
+    # Priority 3: Act before the thresholds have been exceeded for SUSTAINED_DURATION_MINUTES
+    if forecast is not None:
+        predicted = predicted_decision(forecast)
+        if predicted is not None:
+            # Nothing to flag, the latest metric has not crossed anything yet
+            return (*predicted, None)
+    
+    # Priority 4: Use IQR method for normal conditions considering all metrics
+    # Check if we have enough historical data (at least 5 minutes)
+    earliest_needed_time = now - timedelta(minutes=IQR_MIN_DATA_DURATION_MINUTES)
+    
+    # Check if the oldest metric is older than the required duration
+    if oldest_timestamp is None or oldest_timestamp > earliest_needed_time:
+        return "no_action", INSUFFICIENT_DURATION_REASON, None
+    
+    if baseline is not None:
+        logger.info(f"IQR analysis for {instance_id}: baseline of {baseline.count} non-outlier metrics")
+        baseline_count = baseline.count
+    else:
+        logger.info(f"IQR analysis for {instance_id}: found {len(historical_metrics)} non-outlier metrics in last {IQR_WINDOW_MINUTES} minutes")
+        baseline_count = len(historical_metrics)
+    
+    if baseline_count < IQR_MIN_DATA_POINTS:
+        return "no_action", insufficient_iqr_data_reason(current_cpu, current_memory), None
+    
+    scale_up_votes = 0
+    scale_down_votes = 0
+    reasons_list = []
+    
+    for column, label, weight, is_bytes in IQR_METRICS:
+        current = getattr(latest, column)
+        if current is None:
+            continue
+        if baseline is not None:
+            bounds = baseline.bounds[column]
+        else:
+            bounds = iqr_bounds([getattr(m, column) for m in historical_metrics if getattr(m, column) is not None])
+        if not bounds:
+            continue
+        lower, upper = bounds
+        
+        if current > upper:
+            scale_up_votes += weight
+            reasons_list.append(describe_bound(label, current, upper, True, is_bytes))
+        elif current < lower:
+            scale_down_votes += weight
+            reasons_list.append(describe_bound(label, current, lower, False, is_bytes))
+    
+    decision, reason = iqr_decision(scale_up_votes, scale_down_votes, reasons_list, current_cpu, current_memory)
+    return decision, reason, None
 
+@decision_trace.traced('instance')
 def make_scaling_decision(instance_id):
     """
     Make a scaling decision for an instance based on multiple metrics.
     
-    Decision logic (priority order):
-    1. Immediate scale down if CPU < 10% AND memory < 20%
-    2. Immediate scale up if CPU > 90% OR memory > 90%
-    3. Use IQR (Interquartile Range) method for outlier detection considering all metrics
+    The instance's recent metrics are loaded once and every check runs in memory
+    over that result set, see evaluate_scaling_decision for the decision logic.
+    An instance with a scaling policy of its own or through its user is decided
+    by that policy instead (see service.policy_engine). With SCALING_VECTORIZED_EVALUATION
+    the others are decided by its DEFAULT_PLAN, with the same inputs.
     """
-    latest_metric = Metric.query.filter_by(instance_id=instance_id)\
-        .order_by(Metric.timestamp.desc())\
-        .first()
+    # Imported here, service.policy_engine builds on this module
+    from service.policy_engine import DEFAULT_PLAN, instance_plan
+    now = datetime.utcnow()
+    timer = decision_trace.timer(instance_id)
+    plan = instance_plan(instance_id)
+    window_minutes = plan.window_minutes if plan is not None else DECISION_WINDOW_MINUTES
+    window = window_store.get_window(instance_id, window_minutes, now) if WINDOW_STORE_ENABLED else None
+    if window is None:
+        window = load_metric_window(instance_id, window_minutes, now=now)
+        if WINDOW_STORE_ENABLED:
+            window_store.seed(instance_id, window, now - timedelta(minutes=window_minutes))
+    samples, latest_metric, oldest_timestamp = window
+    timer.lap('load', rows=len(samples))
     
     if not latest_metric:
         return False, "No recent metrics available for decision making"
@@ -109,197 +426,58 @@ def make_scaling_decision(instance_id):
     current_network_in = latest_metric.network_in
     current_network_out = latest_metric.network_out
     
-    # Get recent metrics mean (excluding outliers)
-    result = calculate_metrics_mean(instance_id)
-    
-    if result is None:
-        cpu_mean, memory_mean, network_in_mean, network_out_mean = None, None, None, None
+    baseline = None
+    if plan is not None:
+        # Policies evaluate their own windows, the trackers and long baselines serve the default logic
+        forecasts = [forecast_store.update(instance_id, samples)] if plan.needs_forecast else None
+        [(decision, reason, outlier_type)] = plan.evaluate(
+            [(instance_id, samples, latest_metric, oldest_timestamp)], now, forecasts=forecasts
+        )
+        timer.lap('policy')
     else:
-        cpu_mean, memory_mean, network_in_mean, network_out_mean = result
-    
-    decision = None
-    reason = None
-    is_outlier = False
-    outlier_type = None
-    reasons_list = []
-    
-    # Priority 1: Scale down if BOTH CPU < SCALE_DOWN_CPU_THRESHOLD AND memory < SCALE_DOWN_MEMORY_THRESHOLD sustained for SUSTAINED_DURATION_MINUTES minutes
-    # We proceed even if current metrics are None, as long as we have enough historical data
-    is_sustained, percentage = check_sustained_usage(
-        instance_id, 
-        cpu_threshold=SCALE_DOWN_CPU_THRESHOLD, 
-        memory_threshold=SCALE_DOWN_MEMORY_THRESHOLD, 
-        duration_minutes=SUSTAINED_DURATION_MINUTES, 
-        above=False
-    )
-    logger.info(f"Scale down check for {instance_id}: is_sustained={is_sustained}, percentage={percentage:.1f}%")
-    if is_sustained:
-        decision = "scale_down"
-        curr_cpu_str = f"{current_cpu:.2f}" if current_cpu is not None else "N/A"
-        curr_mem_str = f"{current_memory:.2f}" if current_memory is not None else "N/A"
-        reason = f"Sustained scale down: CPU < {SCALE_DOWN_CPU_THRESHOLD}% AND Memory < {SCALE_DOWN_MEMORY_THRESHOLD}% for {percentage:.1f}% of last {SUSTAINED_DURATION_MINUTES} minutes (Current: CPU={curr_cpu_str}%, Memory={curr_mem_str}%)"
-        is_outlier = True
-        outlier_type = "scale_down"
-    
-    # Priority 2: Scale up if CPU > SCALE_UP_THRESHOLD% OR memory > SCALE_UP_THRESHOLD% sustained for SUSTAINED_DURATION_MINUTES minutes
-    if decision is None:
-        if current_cpu is not None:
-            is_sustained, percentage = check_sustained_usage(
-                instance_id, 
-                cpu_threshold=SCALE_UP_THRESHOLD, 
-                duration_minutes=SUSTAINED_DURATION_MINUTES, 
-                above=True
-            )
-            if is_sustained:
-                decision = "scale_up"
-                reason = f"Sustained scale up: CPU > {SCALE_UP_THRESHOLD}% for {percentage:.1f}% of last {SUSTAINED_DURATION_MINUTES} minutes (Current: {current_cpu:.2f}%)"
-                is_outlier = True
-                outlier_type = "scale_up"
+        if long_baseline_enabled():
+            load_baselines([instance_id])
+            baseline = baseline_store.get_baseline(instance_id)
+            timer.lap('baselines')
         
-        if decision is None and current_memory is not None:
-            is_sustained, percentage = check_sustained_usage(
-                instance_id, 
-                memory_threshold=SCALE_UP_THRESHOLD, 
-                duration_minutes=SUSTAINED_DURATION_MINUTES, 
-                above=True
-            )
-            if is_sustained:
-                decision = "scale_up"
-                reason = f"Sustained scale up: Memory > {SCALE_UP_THRESHOLD}% for {percentage:.1f}% of last {SUSTAINED_DURATION_MINUTES} minutes (Current: {current_memory:.2f}%)"
-                is_outlier = True
-                outlier_type = "scale_up"
-    
-    # Priority 3: Use IQR method for normal conditions considering all metrics
-    if decision is None:
-        # Check if we have enough historical data (at least 5 minutes)
-        earliest_needed_time = datetime.utcnow() - timedelta(minutes=IQR_MIN_DATA_DURATION_MINUTES)
+        sustained = None
+        if SUSTAINED_TRACKER_ENABLED:
+            sustained = sustained_trackers.track(instance_id, samples, now - timedelta(minutes=SUSTAINED_DURATION_MINUTES))
+            timer.lap('sustained')
         
-        # Check if the oldest metric is older than the required duration
-        oldest_metric = Metric.query.filter(
-            Metric.instance_id == instance_id
-        ).order_by(Metric.timestamp.asc()).first()
+        forecast = None
+        if PREDICTIVE_SCALING_ENABLED:
+            forecast = forecast_store.update(instance_id, samples)
+            timer.lap('forecast')
         
-        if not oldest_metric or oldest_metric.timestamp > earliest_needed_time:
-            decision = "no_action"
-            reason = f"Insufficient historical data duration. Need at least {IQR_MIN_DATA_DURATION_MINUTES} minutes of data for IQR analysis."
+        if SCALING_VECTORIZED_EVALUATION:
+            [(decision, reason, outlier_type)] = DEFAULT_PLAN.evaluate(
+                [(instance_id, samples, latest_metric, oldest_timestamp)], now,
+                forecasts=[forecast] if forecast is not None else None,
+                baselines=[baseline] if baseline is not None else None,
+                sustained=[sustained] if sustained is not None else None
+            )
         else:
-            cutoff_time = datetime.utcnow() - timedelta(minutes=5)
-            historical_metrics = Metric.query.filter(
-                Metric.instance_id == instance_id,
-                Metric.timestamp >= cutoff_time,
-                Metric.is_outlier == False
-            ).all()
-            
-            logger.info(f"IQR analysis for {instance_id}: found {len(historical_metrics)} non-outlier metrics in last 5 minutes")
-            
-            if len(historical_metrics) < 4:
-                decision = "no_action"
-                metric_info = []
-                if current_cpu is not None:
-                    metric_info.append(f"CPU: {current_cpu:.2f}%")
-                if current_memory is not None:
-                    metric_info.append(f"Memory: {current_memory:.2f}%")
-                reason = f"Insufficient data for IQR analysis. Current metrics - {', '.join(metric_info)}"
-            else:
-                scale_up_votes = 0
-                scale_down_votes = 0
-                
-                if current_cpu is not None:
-                    cpu_values = sorted([m.cpu_utilization for m in historical_metrics if m.cpu_utilization is not None])
-                    if len(cpu_values) >= 4:
-                        n = len(cpu_values)
-                        q1 = cpu_values[n // 4]
-                        q3 = cpu_values[(3 * n) // 4]
-                        iqr = q3 - q1
-                        cpu_lower = q1 - IQR_MULTIPLIER * iqr
-                        cpu_upper = q3 + IQR_MULTIPLIER * iqr
-                        
-                        if current_cpu > cpu_upper:
-                            scale_up_votes += 2  # CPU gets higher weight
-                            reasons_list.append(f"CPU ({current_cpu:.2f}%) > upper bound ({cpu_upper:.2f}%)")
-                        elif current_cpu < cpu_lower:
-                            scale_down_votes += 2
-                            reasons_list.append(f"CPU ({current_cpu:.2f}%) < lower bound ({cpu_lower:.2f}%)")
-                
-                # Memory Analysis
-                if current_memory is not None:
-                    memory_values = sorted([m.memory_usage for m in historical_metrics if m.memory_usage is not None])
-                    if len(memory_values) >= 4:
-                        n = len(memory_values)
-                        q1 = memory_values[n // 4]
-                        q3 = memory_values[(3 * n) // 4]
-                        iqr = q3 - q1
-                        mem_lower = q1 - IQR_MULTIPLIER * iqr
-                        mem_upper = q3 + IQR_MULTIPLIER * iqr
-                        
-                        if current_memory > mem_upper:
-                            scale_up_votes += 2  # Memory gets higher weight
-                            reasons_list.append(f"Memory ({current_memory:.2f}%) > upper bound ({mem_upper:.2f}%)")
-                        elif current_memory < mem_lower:
-                            scale_down_votes += 2
-                            reasons_list.append(f"Memory ({current_memory:.2f}%) < lower bound ({mem_lower:.2f}%)")
-                
-                # Network In Analysis
-                if current_network_in is not None:
-                    network_in_values = sorted([m.network_in for m in historical_metrics if m.network_in is not None])
-                    if len(network_in_values) >= 4:
-                        n = len(network_in_values)
-                        q1 = network_in_values[n // 4]
-                        q3 = network_in_values[(3 * n) // 4]
-                        iqr = q3 - q1
-                        net_in_lower = q1 - IQR_MULTIPLIER * iqr
-                        net_in_upper = q3 + IQR_MULTIPLIER * iqr
-                        
-                        if current_network_in > net_in_upper:
-                            scale_up_votes += 1  # Network gets lower weight
-                            reasons_list.append(f"Network In ({current_network_in:,} bytes) > upper bound ({net_in_upper:,.0f} bytes)")
-                        elif current_network_in < net_in_lower:
-                            scale_down_votes += 1
-                            reasons_list.append(f"Network In ({current_network_in:,} bytes) < lower bound ({net_in_lower:,.0f} bytes)")
-                
-                # Network Out Analysis
-                if current_network_out is not None:
-                    network_out_values = sorted([m.network_out for m in historical_metrics if m.network_out is not None])
-                    if len(network_out_values) >= 4:
-                        n = len(network_out_values)
-                        q1 = network_out_values[n // 4]
-                        q3 = network_out_values[(3 * n) // 4]
-                        iqr = q3 - q1
-                        net_out_lower = q1 - IQR_MULTIPLIER * iqr
-                        net_out_upper = q3 + IQR_MULTIPLIER * iqr
-                        
-                        if current_network_out > net_out_upper:
-                            scale_up_votes += 1  # Network gets lower weight
-                            reasons_list.append(f"Network Out ({current_network_out:,} bytes) > upper bound ({net_out_upper:,.0f} bytes)")
-                        elif current_network_out < net_out_lower:
-                            scale_down_votes += 1
-                            reasons_list.append(f"Network Out ({current_network_out:,} bytes) < lower bound ({net_out_lower:,.0f} bytes)")
-                
-                if scale_up_votes >= 2:
-                    decision = "scale_up"
-                    reason = f"Scale up recommended. Reasons: {'; '.join(reasons_list)}"
-                elif scale_down_votes >= 2:
-                    decision = "scale_down"
-                    reason = f"Scale down recommended. Reasons: {'; '.join(reasons_list)}"
-                else:
-                    decision = "no_action"
-                    metric_info = []
-                    if current_cpu is not None:
-                        metric_info.append(f"CPU: {current_cpu:.2f}%")
-                    if current_memory is not None:
-                        metric_info.append(f"Memory: {current_memory:.2f}%")
-                    reason = f"All metrics within acceptable range. Current: {', '.join(metric_info)}"
+            decision, reason, outlier_type = evaluate_scaling_decision(
+                instance_id, samples, latest_metric, oldest_timestamp, now,
+                baseline=baseline, sustained=sustained, forecast=forecast
+            )
+        timer.lap('evaluate')
+    is_outlier = outlier_type is not None
+    if baseline is not None:
+        # After deciding, so the judged metrics are not part of their own baseline
+        baseline_store.observe(instance_id, samples, latest_metric.timestamp if is_outlier else None)
 
-    
     # Flag the latest metric if it's an outlier
     if is_outlier:
         try:
-            latest_metric.is_outlier = True
-            latest_metric.outlier_type = outlier_type
+            record_outliers([(instance_id, latest_metric.timestamp, outlier_type)])
             db.session.commit()
+            window_store.mark_outlier(instance_id, latest_metric.timestamp)
         except Exception as e:
             db.session.rollback()
             logger.warning(f"Could not flag metric as outlier: {e}")
+        timer.lap('flag_outlier')
     
     instance = Instance.query.filter_by(instance_id=instance_id).filter(Instance.deleted_at.is_(None)).first()
     
@@ -309,6 +487,8 @@ def make_scaling_decision(instance_id):
     
     previous_decision = instance.last_decision
     is_state_change = (previous_decision != decision)
+    # Lets the periodic pass skip this instance until newer metrics arrive
+    instance.last_evaluated_at = latest_metric.timestamp
     
     # Logic for updating instance capacity and scale level has been removed as per requirements.
     # The system now only logs the decision to scale up or down without maintaining a scale level.
@@ -332,6 +512,7 @@ def make_scaling_decision(instance_id):
             instance.last_decision = decision
             
             db.session.commit()
+            timer.lap('commit')
 
             if previous_decision is None:
                 logger.info(f"Initial scaling state for {instance_id}: {decision}")
@@ -343,23 +524,350 @@ def make_scaling_decision(instance_id):
             return True, scaling_decision
         except Exception as e:
             db.session.rollback()
+            timer.lap('commit')
             logger.error(f"Failed to save scaling decision: {e}")
             return False, str(e)
     else:
+        try:
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            logger.warning(f"Could not record evaluated metric for {instance_id}: {e}")
+        timer.lap('commit')
         logger.debug(f"No state change for {instance_id}, still in '{decision}' state")
         return True, f"No state change (still {decision})"
 
 
-def process_all_monitored_instances():
-    monitored_instances = Instance.query.filter_by(is_monitoring=True).filter(Instance.deleted_at.is_(None)).all()
-    
+def load_fleet_instances(instance_ids=None):
+    """
+    Load every monitored, non-deleted instance (or the monitored ones among instance_ids)
+    with its oldest and newest metric timestamps, in one query.
+    Returns a list of (instance, oldest_timestamp, newest_timestamp) ordered by instance_id.
+    Each instance's user is loaded along, for its scaling policy.
+    """
+    # Correlated per-instance min/max are index lookups on (instance_key, timestamp)
+    oldest_timestamp = db.session.query(func.min(Metric.timestamp))\
+        .filter(Metric.instance_key == Instance.instance_key)\
+        .correlate(Instance)\
+        .scalar_subquery()
+    newest_timestamp = db.session.query(func.max(Metric.timestamp))\
+        .filter(Metric.instance_key == Instance.instance_key)\
+        .correlate(Instance)\
+        .scalar_subquery()
+
+    instances = db.session.query(Instance, oldest_timestamp, newest_timestamp)\
+        .join(User, User.id == Instance.user_id)\
+        .options(contains_eager(Instance.user))\
+        .filter(Instance.is_monitoring == True, Instance.deleted_at.is_(None))
+    if instance_ids is not None:
+        instances = instances.filter(Instance.instance_id.in_(instance_ids))
+    return instances.order_by(Instance.instance_id).all()
+
+def is_unchanged(instance, newest_timestamp):
+    """
+    True when the instance has a decision and no metric newer than the one it was based on.
+    fetch_metrics_job clears last_evaluated_at when late values fill in a metric it used.
+    """
+    return (
+        instance.last_decision is not None
+        and instance.last_evaluated_at is not None
+        and newest_timestamp is not None
+        and newest_timestamp <= instance.last_evaluated_at
+    )
+
+def load_fleet_windows(window_minutes=DECISION_WINDOW_MINUTES, now=None, instance_ids=None, instances=None):
+    """
+    Load the decision window of every monitored, non-deleted instance with a fixed number of queries.
+    When instance_ids is given, only those of them that are monitored are loaded. instances
+    can hand in rows already returned by load_fleet_instances to skip that query.
+    Windows the window store can answer are served from memory; only the misses are read
+    from the database, and those reads seed the store for the next cycle.
+    Returns a list of (instance, samples, latest, oldest_timestamp), one entry per instance,
+    with the same meaning as load_metric_window.
+    """
+    now = now or datetime.utcnow()
+    cutoff_time = now - timedelta(minutes=window_minutes)
+
+    if instances is None:
+        instances = load_fleet_instances(instance_ids)
+    if not instances:
+        return []
+
+    # Serve what the window store holds; the newest timestamp from the database guards
+    # against metrics written by another process that this store never saw
+    cached = {}
+    if WINDOW_STORE_ENABLED:
+        for instance, _, newest in instances:
+            if newest is None:
+                continue
+            window = window_store.get_window(instance.instance_id, window_minutes, now, newest_timestamp=newest)
+            if window is not None:
+                cached[instance.instance_id] = window
+
+    # Metric rows carry the instance_key; the instances are at hand to map it back
+    misses = {instance.instance_key: instance.instance_id for instance, _, _ in instances if instance.instance_id not in cached}
+    windows = {}
+    if misses:
+        query = with_outlier_flags(db.session.query(Metric.instance_key, *WINDOW_COLUMNS))\
+            .filter(Metric.timestamp >= cutoff_time)
+        if len(misses) <= FLEET_WINDOW_IN_LIMIT:
+            query = query.filter(Metric.instance_key.in_(list(misses)))
+        else:
+            query = query.join(Instance, Instance.instance_key == Metric.instance_key)\
+                .filter(Instance.is_monitoring == True, Instance.deleted_at.is_(None))
+            if instance_ids is not None:
+                query = query.filter(Instance.instance_id.in_(instance_ids))
+        for row in query.order_by(Metric.instance_key, Metric.timestamp.asc()).all():
+            if row.instance_key in misses:
+                windows.setdefault(misses[row.instance_key], []).append(row)
+
+    # Instances that went quiet still get evaluated on their newest metric
+    stale_keys = {
+        (instance.instance_key, newest): instance.instance_id
+        for instance, _, newest in instances
+        if newest is not None and instance.instance_id not in windows and instance.instance_id not in cached
+    }
+    stale_latest = {}
+    if stale_keys:
+        stale_rows = with_outlier_flags(db.session.query(Metric.instance_key, *WINDOW_COLUMNS))\
+            .filter(tuple_(Metric.instance_key, Metric.timestamp).in_(list(stale_keys)))\
+            .all()
+        stale_latest = {stale_keys[(row.instance_key, row.timestamp)]: row for row in stale_rows}
+
+    fleet = []
+    for instance, oldest, _ in instances:
+        if instance.instance_id in cached:
+            # The database knows the exact oldest timestamp, the store may only have an upper bound
+            samples, latest, _ = cached[instance.instance_id]
+            fleet.append((instance, samples, latest, oldest))
+            continue
+        samples = windows.get(instance.instance_id, [])
+        latest = samples[-1] if samples else stale_latest.get(instance.instance_id)
+        fleet.append((instance, samples, latest, oldest))
+        if WINDOW_STORE_ENABLED:
+            window_store.seed(instance.instance_id, (samples, latest, oldest), cutoff_time)
+    return fleet
+
+@decision_trace.traced('fleet')
+def evaluate_fleet(now=None, instance_ids=None):
+    """
+    Make scaling decisions for all monitored instances in one pass,
+    or only for the monitored ones among instance_ids.
+
+    Every window is loaded up front (see load_fleet_windows), each instance is
+    evaluated in memory, and all outlier flags, new ScalingDecision rows and
+    last_decision updates are written in a single commit. Decisions and results
+    match calling make_scaling_decision for each instance.
+
+    With SKIP_UNCHANGED_INSTANCES, instances without a metric newer than the one
+    their last decision was based on are not evaluated again; their result has
+    skipped set and repeats the current state.
+
+    Instances with a scaling policy (see service.policy_engine) get the window their
+    policy needs and are evaluated by it, all instances sharing a policy at once. With
+    SCALING_VECTORIZED_EVALUATION the others are evaluated by its DEFAULT_PLAN, which
+    takes their trackers, baselines and forecasts as inputs.
+
+    With DECISION_POOL_WORKERS set, every plan's group of at least
+    DECISION_POOL_MIN_INSTANCES instances is sharded across worker processes (see
+    service.decision_pool); loading, the trackers, baselines and the commit still happen here.
+
+    With tracing on (see service.decision_trace), every phase of the pass is timed.
+    """
+    # Imported here, service.policy_engine builds on this module
+    from service.policy_engine import DEFAULT_PLAN, resolve_policies
+    now = now or datetime.utcnow()
+
+    def evaluate_plan(plan, group, **inputs):
+        if DECISION_POOL_WORKERS and len(group) >= DECISION_POOL_MIN_INSTANCES:
+            # Imported here, service.decision_pool builds on this module
+            from service.decision_pool import evaluate_in_pool
+            return evaluate_in_pool(plan, group, now, **inputs)
+        return plan.evaluate(group, now, **inputs)
+
+    timer = decision_trace.timer()
+    instances = load_fleet_instances(instance_ids)
+    timer.lap('load_instances', rows=len(instances), instances=len(instances), members=dict.fromkeys(
+        (instance.instance_id for instance, _, _ in instances), 1
+    ) if timer.recording else None)
+
+    skipped = []
+    if SKIP_UNCHANGED_INSTANCES:
+        skipped = [instance for instance, _, newest in instances if is_unchanged(instance, newest)]
+        instances = [entry for entry in instances if not is_unchanged(entry[0], entry[2])]
+    plans = resolve_policies([instance for instance, _, _ in instances])
+    fleet = load_fleet_windows(now=now, instances=[entry for entry in instances if entry[0].instance_id not in plans])
+    # One load per distinct window length the policies in use need
+    for window_minutes in sorted({plan.window_minutes for plan in plans.values()}):
+        fleet += load_fleet_windows(window_minutes, now, instances=[
+            entry for entry in instances
+            if entry[0].instance_id in plans and plans[entry[0].instance_id].window_minutes == window_minutes
+        ])
+    timer.lap('load_windows', rows=sum(len(entry[1]) for entry in fleet), instances=len(fleet), members={
+        instance.instance_id: len(samples) for instance, samples, _, _ in fleet
+    } if timer.recording else None)
+
+    windows = []
+    policy_windows = {}
+    for instance, samples, latest, oldest in fleet:
+        if latest is None:
+            continue
+        window = (instance.instance_id, samples, latest, oldest)
+        if instance.instance_id in plans:
+            policy_windows.setdefault(plans[instance.instance_id], []).append(window)
+        else:
+            windows.append(window)
+    # The instances each later phase covers, for a per-instance breakdown of the trace
+    window_members = dict.fromkeys((window[0] for window in windows), 0) if timer.recording else None
+    baselines = None
+    if long_baseline_enabled():
+        load_baselines([window[0] for window in windows])
+        baselines = [baseline_store.get_baseline(window[0]) for window in windows]
+        timer.lap('baselines', instances=len(windows), members=window_members)
+    sustained = None
+    if SUSTAINED_TRACKER_ENABLED:
+        sustained_cutoff = now - timedelta(minutes=SUSTAINED_DURATION_MINUTES)
+        sustained = [sustained_trackers.track(window[0], window[1], sustained_cutoff) for window in windows]
+        timer.lap('sustained', instances=len(windows), members=window_members)
+    forecasts = None
+    if PREDICTIVE_SCALING_ENABLED:
+        forecasts = [forecast_store.update(window[0], window[1]) for window in windows]
+        timer.lap('forecast', instances=len(windows), members=window_members)
+    if SCALING_VECTORIZED_EVALUATION or (DECISION_POOL_WORKERS and len(windows) >= DECISION_POOL_MIN_INSTANCES):
+        outcomes = evaluate_plan(DEFAULT_PLAN, windows, forecasts=forecasts, baselines=baselines, sustained=sustained)
+    else:
+        outcomes = [
+            evaluate_scaling_decision(
+                *window, now,
+                baseline=baselines[i] if baselines else None,
+                sustained=sustained[i] if sustained else None,
+                forecast=forecasts[i] if forecasts else None
+            )
+            for i, window in enumerate(windows)
+        ]
+    outcomes = dict(zip((window[0] for window in windows), outcomes))
+    timer.lap('evaluate', instances=len(windows), members=window_members)
+    for plan, group in policy_windows.items():
+        forecasts = [forecast_store.update(window[0], window[1]) for window in group] if plan.needs_forecast else None
+        outcomes.update(zip((window[0] for window in group), evaluate_plan(plan, group, forecasts=forecasts)))
+    if policy_windows:
+        timer.lap('policies', instances=sum(len(group) for group in policy_windows.values()), members=dict.fromkeys(
+            (window[0] for group in policy_windows.values() for window in group), 0
+        ) if timer.recording else None)
+
+    results = [
+        {
+            'instance_id': instance.instance_id,
+            'success': True,
+            'result': f"No new metrics (still {instance.last_decision})",
+            'skipped': True
+        }
+        for instance in skipped
+    ]
+    outlier_flags = []
+    new_decisions = []
+    for instance, samples, latest, oldest_timestamp in fleet:
+        if not latest:
+            results.append({
+                'instance_id': instance.instance_id,
+                'success': False,
+                'result': "No recent metrics available for decision making",
+                'skipped': False
+            })
+            continue
+
+        decision, reason, outlier_type = outcomes[instance.instance_id]
+        if outlier_type is not None:
+            outlier_flags.append((instance.instance_id, latest.timestamp, outlier_type))
+
+        previous_decision = instance.last_decision
+        instance.last_evaluated_at = latest.timestamp
+        if previous_decision != decision:
+            new_decisions.append(ScalingDecision(
+                instance_id=instance.instance_id,
+                cpu_utilization=latest.cpu_utilization,
+                memory_usage=latest.memory_usage,
+                network_in=latest.network_in,
+                network_out=latest.network_out,
+                decision=decision,
+                reason=reason
+            ))
+            instance.last_decision = decision
+
+            if previous_decision is None:
+                logger.info(f"Initial scaling state for {instance.instance_id}: {decision}")
+            elif decision == 'no_action':
+                logger.info(f"State change for {instance.instance_id}: {previous_decision} → {decision} (returned to normal)")
+            else:
+                logger.info(f"State change for {instance.instance_id}: {previous_decision} → {decision}")
+            result = decision
+        else:
+            logger.debug(f"No state change for {instance.instance_id}, still in '{decision}' state")
+            result = f"No state change (still {decision})"
+
+        results.append({'instance_id': instance.instance_id, 'success': True, 'result': result, 'skipped': False})
+    results.sort(key=lambda r: r['instance_id'])
+
+    if not fleet:
+        return results
+    fleet_members = commit_members = None
+    if timer.recording:
+        fleet_members = dict.fromkeys((instance.instance_id for instance, _, _, _ in fleet), 0)
+        commit_members = dict(fleet_members)
+        for instance_id, _, _ in outlier_flags:
+            commit_members[instance_id] += 1
+        for decision in new_decisions:
+            commit_members[decision.instance_id] += 1
+    timer.lap('prepare', instances=len(fleet), members=fleet_members)
+
+    try:
+        # One executemany for all flags
+        record_outliers(outlier_flags)
+        db.session.add_all(new_decisions)
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        timer.lap('commit', rows=len(outlier_flags) + len(new_decisions), instances=len(fleet), members=commit_members)
+        logger.error(f"Failed to save scaling decisions for {len(fleet)} instance(s): {e}")
+        return [
+            {**r, 'success': False, 'result': str(e)} if r['success'] and not r['skipped'] else r
+            for r in results
+        ]
+
+    timer.lap('commit', rows=len(outlier_flags) + len(new_decisions), instances=len(fleet), members=commit_members)
+
+    for instance_id, timestamp, _ in outlier_flags:
+        window_store.mark_outlier(instance_id, timestamp)
+    if baselines is not None:
+        # After deciding, so the judged metrics are not part of their own baseline
+        for instance_id, samples, latest, _ in windows:
+            flagged = latest.timestamp if outcomes[instance_id][2] is not None else None
+            baseline_store.observe(instance_id, samples, flagged)
+        timer.lap('observe', instances=len(windows), members=window_members)
+    logger.debug(f"Saved {len(new_decisions)} scaling decision(s) and {len(outlier_flags)} outlier flag(s)")
+    return results
+
+@decision_trace.traced('fleet')
+def process_all_monitored_instances(instance_ids=None):
+    if SCALING_FLEET_EVALUATION:
+        return evaluate_fleet(instance_ids=instance_ids)
+
     results = []
-    for instance in monitored_instances:
+    for instance, _, newest in load_fleet_instances(instance_ids):
+        if SKIP_UNCHANGED_INSTANCES and is_unchanged(instance, newest):
+            results.append({
+                'instance_id': instance.instance_id,
+                'success': True,
+                'result': f"No new metrics (still {instance.last_decision})",
+                'skipped': True
+            })
+            continue
         success, result = make_scaling_decision(instance.instance_id)
         results.append({
             'instance_id': instance.instance_id,
             'success': success,
-            'result': result.decision if success and hasattr(result, 'decision') else result
+            'result': result.decision if success and hasattr(result, 'decision') else result,
+            'skipped': False
         })
     
     return results
@@ -0,0 +1,127 @@
+import threading
+from bisect import bisect_left, bisect_right
+from collections import deque
+from operator import attrgetter
+from constants.service_constants import SUSTAINED_MIN_DATA_POINTS, SUSTAINED_PERCENTAGE_THRESHOLD, CLOUDWATCH_SETTLE_PERIODS
+
+_timestamp = attrgetter('timestamp')
+
+class SustainedTracker:
+    """
+    Running counts over one instance's samples in the sustained window.
+
+    Every sample is tested against each condition once, when it is added, and
+    stored as (timestamp, bit mask of the conditions it met). Evicting expired
+    samples subtracts their bits again, so adding, evicting and reading a
+    sustained percentage are all O(1) amortized, whatever the window size.
+    """
+
+    __slots__ = ('conditions', 'entries', 'counts')
+
+    def __init__(self, conditions):
+        self.conditions = conditions
+        self.entries = deque()
+        self.counts = [0] * len(conditions)
+
+    def _mask(self, sample):
+        mask = 0
+        for i, condition in enumerate(self.conditions):
+            if condition(sample):
+                mask |= 1 << i
+        return mask
+
+    def _count(self, mask, step):
+        for i in range(len(self.counts)):
+            if mask & (1 << i):
+                self.counts[i] += step
+
+    def add(self, sample):
+        mask = self._mask(sample)
+        self._count(mask, 1)
+        self.entries.append((sample.timestamp, mask))
+
+    def retest(self, index, sample):
+        """Test entry index again against sample, the same sample with values filled in since."""
+        timestamp, mask = self.entries[index]
+        retested = self._mask(sample)
+        if retested != mask:
+            self._count(mask, -1)
+            self._count(retested, 1)
+            self.entries[index] = (timestamp, retested)
+
+    def evict(self, cutoff):
+        """Drop samples older than cutoff."""
+        entries = self.entries
+        while entries and entries[0][0] < cutoff:
+            _, mask = entries.popleft()
+            self._count(mask, -1)
+
+    def usage(self, index):
+        """
+        (is_sustained, percentage) for condition index, the same result as
+        scaling_service.sustained_usage over the tracked samples.
+        """
+        total = len(self.entries)
+        if total < SUSTAINED_MIN_DATA_POINTS:
+            return False, 0.0
+        percentage = (self.counts[index] / total) * 100
+        return percentage >= SUSTAINED_PERCENTAGE_THRESHOLD, percentage
+
+class SustainedTrackerStore:
+    """
+    One SustainedTracker per instance, fed from the windows the scaling engine loads.
+
+    track only adds samples newer than the ones already tracked and evicts the ones
+    that left the window. If the result does not match the window (after a back-fill
+    or deleted metrics), the tracker is rebuilt from the window. The newest
+    CLOUDWATCH_SETTLE_PERIODS samples already tracked are tested again, since the
+    settle window of the next fetch may fill in their late values (CWAgent memory).
+    """
+
+    def __init__(self, conditions):
+        self._conditions = conditions
+        self._lock = threading.Lock()
+        self._trackers = {}
+        self._rebuilds = 0
+
+    def track(self, instance_id, samples, cutoff):
+        """
+        Bring the instance's tracker up to date with samples (oldest first, at least every
+        metric at or after cutoff) and return [(is_sustained, percentage), ...], one per condition.
+        """
+        first = bisect_left(samples, cutoff, key=_timestamp)
+        with self._lock:
+            tracker = self._trackers.get(instance_id)
+            if tracker is None:
+                tracker = self._trackers[instance_id] = SustainedTracker(self._conditions)
+            entries = tracker.entries
+            start = first if not entries else max(first, bisect_right(samples, entries[-1][0], key=_timestamp))
+            for position in range(start, len(samples)):
+                tracker.add(samples[position])
+            tracker.evict(cutoff)
+            # Same count and same first and last sample as the window, or rebuild it
+            if len(entries) != len(samples) - first or (entries and (
+                entries[0][0] != samples[first].timestamp or entries[-1][0] != samples[-1].timestamp
+            )):
+                self._rebuilds += 1
+                tracker = self._trackers[instance_id] = SustainedTracker(self._conditions)
+                for position in range(first, len(samples)):
+                    tracker.add(samples[position])
+            else:
+                # A stored period holds one datapoint, so a settle window spans at most this many samples
+                for position in range(max(first, len(samples) - CLOUDWATCH_SETTLE_PERIODS), start):
+                    tracker.retest(position - first, samples[position])
+            return [tracker.usage(i) for i in range(len(self._conditions))]
+
+    def discard(self, instance_id):
+        with self._lock:
+            self._trackers.pop(instance_id, None)
+
+    def clear(self):
+        with self._lock:
+            self._trackers.clear()
+            self._rebuilds = 0
+
+    def get_stats(self):
+        with self._lock:
+            return {'instances': len(self._trackers), 'rebuilds': self._rebuilds}
@@ -0,0 +1,121 @@
+import numpy as np
+from datetime import timedelta
+from service.fleet_evaluator import WINDOW_FIELDS, flatten_samples, padded_layout, window_starts
+from constants.service_constants import STATS_WINDOW_MINUTES
+
+# Statistics of several trailing windows from one scan. The samples of every
+# instance sit back to back, oldest first, in one flat buffer (see
+# fleet_evaluator.flatten_samples), so a window is a slice [start, end) of it.
+# One cumulative sum per column then gives the count, sum or number of matching
+# samples of any window as the difference of two entries: a 1, 5 and 15 minute
+# view cost the same single pass as one window, plus a binary search per
+# instance and window for its start.
+#
+# Quartiles need the values of a window in order. Each column is laid out once in
+# padded rows, one per instance, shared by every window; a window masks the samples
+# before its start and sorts what is left, row by row. Sorting the rows once and
+# counting each window's samples in that order measured slower for the short rows
+# of a trailing window than one sort per window, so windows do not share the sort.
+
+def prefix_sums(values):
+    """Cumulative sums of a flat column with a leading zero, so prefix[end] - prefix[start] sums a slice."""
+    prefix = np.zeros(len(values) + 1)
+    np.cumsum(values, out=prefix[1:])
+    return prefix
+
+class WindowStats:
+    """
+    Per-instance statistics over the trailing windows of [(instance_id, samples, latest,
+    oldest_timestamp), ...], loaded for at least the longest of minutes.
+
+    flat is the output of flatten_samples for these windows if the caller already has
+    it, with at least the given fields. starts, if given, maps each of minutes to the
+    position of every window's first sample in it, in place of searching the windows
+    (which may then be None). Every statistic is a NumPy array with one entry per
+    instance; prefix sums and the padded rows quartiles sort are built once per column
+    and shared by all windows.
+    """
+
+    def __init__(self, windows, now, minutes=STATS_WINDOW_MINUTES, fields=WINDOW_FIELDS, flat=None, starts=None):
+        self.flat = flat if flat is not None else flatten_samples(windows, fields, outliers=False)
+        self.fields = tuple(fields)
+        self.minutes = tuple(sorted(set(minutes)))
+        counts = self.flat['counts']
+        self.ends = np.cumsum(counts)
+        self.offsets = self.ends - counts
+        self.starts = {
+            m: self.offsets + (starts[m] if starts is not None else window_starts(windows, now - timedelta(minutes=m)))
+            for m in self.minutes
+        }
+        self._prefix = {}
+        self._padded = {}
+        self._layout = None
+
+    def _column(self, field):
+        if field not in self._prefix:
+            values = self.flat[field]
+            known = ~np.isnan(values)
+            self._prefix[field] = (prefix_sums(np.where(known, values, 0.0)), prefix_sums(known))
+        return self._prefix[field]
+
+    def count(self, minutes):
+        """Samples in each instance's window."""
+        return self.ends - self.starts[minutes]
+
+    def known(self, field, minutes):
+        """Samples with a value for field in each instance's window."""
+        _, known = self._column(field)
+        start = self.starts[minutes]
+        return (known[self.ends] - known[start]).astype(np.int64)
+
+    def total(self, field, minutes):
+        """Sum of the known values of field in each instance's window."""
+        sums, _ = self._column(field)
+        return sums[self.ends] - sums[self.starts[minutes]]
+
+    def mean(self, field, minutes):
+        """Mean of the known values of field in each instance's window, NaN where there are none."""
+        known = self.known(field, minutes)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return np.where(known > 0, self.total(field, minutes) / known, np.nan)
+
+    def count_where(self, condition, minutes):
+        """Samples meeting condition (a flat boolean array, one entry per sample) in each instance's window."""
+        prefix = prefix_sums(condition)
+        return (prefix[self.ends] - prefix[self.starts[minutes]]).astype(np.int64)
+
+    def _rows(self, field, outliers):
+        """
+        The samples of field in padded rows, one per instance, NaN after the last
+        sample; without outliers, samples flat['included'] is False for are NaN too.
+        """
+        key = (field, outliers)
+        if key not in self._padded:
+            if self._layout is None:
+                self._layout = padded_layout(self.flat['counts'])
+            width, rows, cols = self._layout
+            padded = np.full((len(self.offsets), width), np.nan)
+            padded[rows, cols] = self.flat[field] if outliers else np.where(self.flat['included'], self.flat[field], np.nan)
+            self._padded[key] = padded
+        return self._padded[key]
+
+    def quartiles(self, field, minutes, outliers=True, rows=None):
+        """
+        (q1, q3, known) of the known values of field in the window of each instance, or of
+        the instances at rows, with the quartile picks of scaling_service.iqr_bounds;
+        outliers False leaves out the samples flat['included'] is False for. q1 and q3
+        are NaN where known is 0.
+        """
+        padded = self._rows(field, outliers)
+        if rows is not None:
+            padded = padded[rows]
+        start = self.starts[minutes] - self.offsets
+        before = np.arange(padded.shape[1]) < (start if rows is None else start[rows])[:, None]
+        values = np.where(before, np.nan, padded)
+        known = (~np.isnan(values)).sum(axis=1)
+        # NaN sorts last, so the first known entries of each row are its sorted values
+        ordered = np.sort(values, axis=1)
+        picked = np.arange(len(ordered))
+        q1 = ordered[picked, known // 4]
+        q3 = ordered[picked, (3 * known) // 4]
+        return q1, q3, known
@@ -0,0 +1,277 @@
+import math
+import threading
+from array import array
+from collections import namedtuple
+from datetime import datetime, timedelta
+from util.logger import logger
+from constants.service_constants import WINDOW_STORE_CAPACITY
+
+# A window sample in the shape of the rows load_metric_window returns.
+# id is None for samples that reached the store through the collector.
+WindowSample = namedtuple(
+    'WindowSample', 'id timestamp cpu_utilization memory_usage network_in network_out is_outlier'
+)
+
+EPOCH = datetime(1970, 1, 1)
+ONE_MICROSECOND = timedelta(microseconds=1)
+
+# is_outlier is kept as a signed byte so NULL survives a round trip
+OUTLIER_CODES = {False: 0, True: 1, None: -1}
+OUTLIER_VALUES = {0: False, 1: True, -1: None}
+
+def to_micros(timestamp):
+    return (timestamp - EPOCH) // ONE_MICROSECOND
+
+def from_micros(micros):
+    return EPOCH + timedelta(microseconds=micros)
+
+def to_double(value):
+    return math.nan if value is None else float(value)
+
+def from_double(value):
+    return None if math.isnan(value) else value
+
+def network_from_double(value):
+    # network columns are BigInteger; integral values come back as int like they do from the database
+    if math.isnan(value):
+        return None
+    return int(value) if value.is_integer() else value
+
+class InstanceWindow:
+    """
+    Fixed-capacity ring buffer of one instance's most recent metrics.
+
+    Every column is a flat typed array (int64 microseconds since the epoch for
+    timestamps, doubles for metrics with NaN for missing values, a signed byte
+    for is_outlier), so an instance costs capacity * 41 bytes plus a small
+    constant, about 2.6 KB at the default capacity of 64 samples.
+
+    covered_since is the oldest time from which every stored metric of the
+    instance is known to be in the buffer. It starts at the first appended or
+    seeded sample and moves forward whenever the ring overwrites a sample.
+    """
+
+    __slots__ = (
+        'capacity', 'timestamps', 'cpu', 'memory', 'network_in', 'network_out', 'outlier',
+        'start', 'size', 'covered_since', 'oldest_timestamp'
+    )
+
+    def __init__(self, capacity=WINDOW_STORE_CAPACITY):
+        self.capacity = capacity
+        self.timestamps = array('q', bytes(8 * capacity))
+        self.cpu = array('d', bytes(8 * capacity))
+        self.memory = array('d', bytes(8 * capacity))
+        self.network_in = array('d', bytes(8 * capacity))
+        self.network_out = array('d', bytes(8 * capacity))
+        self.outlier = array('b', bytes(capacity))
+        self.start = 0
+        self.size = 0
+        self.covered_since = None
+        self.oldest_timestamp = None
+
+    def last_micros(self):
+        if not self.size:
+            return None
+        return self.timestamps[(self.start + self.size - 1) % self.capacity]
+
+    def append(self, micros, cpu, memory, network_in, network_out, outlier=0):
+        if self.size == self.capacity:
+            # Overwrite the oldest sample; the window is only complete after it
+            self.covered_since = self.timestamps[self.start] + 1
+            position = self.start
+            self.start = (self.start + 1) % self.capacity
+        else:
+            position = (self.start + self.size) % self.capacity
+            self.size += 1
+        self.timestamps[position] = micros
+        self.cpu[position] = cpu
+        self.memory[position] = memory
+        self.network_in[position] = network_in
+        self.network_out[position] = network_out
+        self.outlier[position] = outlier
+        if self.covered_since is None:
+            self.covered_since = micros
+
+    def fill(self, micros, cpu, memory, network_in, network_out):
+        """Take the values that are not NaN into the sample at micros; False if it is not buffered."""
+        for position in self.positions(micros):
+            if self.timestamps[position] == micros:
+                for column, value in zip((self.cpu, self.memory, self.network_in, self.network_out),
+                                         (cpu, memory, network_in, network_out)):
+                    if not math.isnan(value):
+                        column[position] = value
+                return True
+        return False
+
+    def positions(self, since_micros=None):
+        """Buffer positions oldest first, optionally only samples at or after since_micros."""
+        positions = [(self.start + i) % self.capacity for i in range(self.size)]
+        if since_micros is None:
+            return positions
+        return [p for p in positions if self.timestamps[p] >= since_micros]
+
+    def sample(self, position):
+        return WindowSample(
+            id=None,
+            timestamp=from_micros(self.timestamps[position]),
+            cpu_utilization=from_double(self.cpu[position]),
+            memory_usage=from_double(self.memory[position]),
+            network_in=network_from_double(self.network_in[position]),
+            network_out=network_from_double(self.network_out[position]),
+            is_outlier=OUTLIER_VALUES[self.outlier[position]]
+        )
+
+class MetricWindowStore:
+    """
+    Process-local hot tier of recent metrics, one InstanceWindow per instance.
+
+    The ingestion paths append every row they commit (append_rows), so the
+    scaling engine can read an instance's decision window without a database
+    round trip. get_window returns None whenever the buffer cannot prove it
+    holds every metric of the window (after a restart, for an instance that
+    was never seen, or once the ring overwrote samples the window still
+    needs); the caller then reads the database and hands the result back via
+    seed. Thread-safe: the collector and the decision job run on different
+    scheduler threads.
+    """
+
+    def __init__(self, capacity=WINDOW_STORE_CAPACITY):
+        self._capacity = capacity
+        self._lock = threading.Lock()
+        self._windows = {}
+        self._hits = 0
+        self._misses = 0
+
+    def append_rows(self, rows):
+        """
+        Append committed metric rows, plain tuples in repo.metric_writer.METRIC_COLUMNS order.
+        Rows must be oldest first per instance. A row whose timestamp is already buffered
+        was fetched again and fills in that sample's values like upsert_metrics does; any
+        other row older than the newest buffered one means history was back-filled, so the
+        instance is dropped and reseeded on next read.
+        """
+        with self._lock:
+            for instance_id, timestamp, cpu, memory, network_in, network_out in rows:
+                window = self._windows.get(instance_id)
+                micros = to_micros(timestamp)
+                if window is None:
+                    window = self._windows[instance_id] = InstanceWindow(self._capacity)
+                    window.oldest_timestamp = timestamp
+                last = window.last_micros()
+                if last is not None and micros <= last:
+                    if not window.fill(micros, to_double(cpu), to_double(memory),
+                                       to_double(network_in), to_double(network_out)):
+                        logger.debug(f"Out of order metric for {instance_id}, dropping its cached window")
+                        del self._windows[instance_id]
+                    continue
+                window.append(
+                    micros, to_double(cpu), to_double(memory),
+                    to_double(network_in), to_double(network_out)
+                )
+
+    def seed(self, instance_id, window, covered_since):
+        """
+        Replace an instance's buffer with a window read from the database.
+
+        window is (samples, latest, oldest_timestamp) as returned by load_metric_window;
+        samples hold every metric at or after covered_since. When no sample is that
+        recent, latest alone is kept so the instance can still be answered from memory.
+        Rows appended meanwhile that are newer than the seeded ones are kept.
+        """
+        samples, latest, oldest_timestamp = window
+        if not samples:
+            if latest is None:
+                return
+            samples = [latest]
+        buffer = InstanceWindow(self._capacity)
+        for sample in samples[-self._capacity:]:
+            buffer.append(
+                to_micros(sample.timestamp), to_double(sample.cpu_utilization),
+                to_double(sample.memory_usage), to_double(sample.network_in),
+                to_double(sample.network_out), OUTLIER_CODES[sample.is_outlier]
+            )
+        if len(samples) > self._capacity:
+            # Only the newest samples fit, the window starts after the last one left out
+            buffer.covered_since = to_micros(samples[-self._capacity - 1].timestamp) + 1
+        else:
+            buffer.covered_since = to_micros(covered_since)
+        buffer.oldest_timestamp = oldest_timestamp
+
+        with self._lock:
+            previous = self._windows.get(instance_id)
+            if previous is not None:
+                for position in previous.positions(buffer.last_micros() + 1):
+                    buffer.append(
+                        previous.timestamps[position], previous.cpu[position], previous.memory[position],
+                        previous.network_in[position], previous.network_out[position], previous.outlier[position]
+                    )
+            self._windows[instance_id] = buffer
+
+    def get_window(self, instance_id, window_minutes, now, newest_timestamp=None):
+        """
+        Return (samples, latest, oldest_timestamp) like load_metric_window,
+        or None when the buffer does not cover the whole window.
+
+        Until the store has seen a full window, oldest_timestamp is the first sample
+        it was given, which may be later than the oldest one in the database. Once
+        the window is covered, both are at least window_minutes old.
+
+        When newest_timestamp (the newest metric in the database) is given and differs
+        from the newest buffered sample, the buffer missed writes and this is a miss too.
+        """
+        cutoff = to_micros(now - timedelta(minutes=window_minutes))
+        with self._lock:
+            window = self._windows.get(instance_id)
+            if window is None or not window.size or window.covered_since > cutoff or (
+                newest_timestamp is not None and window.last_micros() != to_micros(newest_timestamp)
+            ):
+                self._misses += 1
+                return None
+            self._hits += 1
+            positions = window.positions(cutoff)
+            samples = [window.sample(p) for p in positions]
+            latest = samples[-1] if samples else window.sample(window.positions()[-1])
+            return samples, latest, window.oldest_timestamp
+
+    def last_timestamp(self, instance_id):
+        with self._lock:
+            window = self._windows.get(instance_id)
+            last = window.last_micros() if window else None
+            return from_micros(last) if last is not None else None
+
+    def mark_outlier(self, instance_id, timestamp):
+        with self._lock:
+            window = self._windows.get(instance_id)
+            if window is None:
+                return
+            micros = to_micros(timestamp)
+            for position in window.positions(micros):
+                if window.timestamps[position] == micros:
+                    window.outlier[position] = 1
+                    break
+
+    def discard(self, instance_id):
+        with self._lock:
+            self._windows.pop(instance_id, None)
+
+    def clear(self):
+        with self._lock:
+            self._windows.clear()
+            self._hits = 0
+            self._misses = 0
+
+    def get_stats(self):
+        with self._lock:
+            buffers = self._windows.values()
+            return {
+                'instances': len(self._windows),
+                'samples': sum(window.size for window in buffers),
+                'bytes': sum(
+                    window.timestamps.itemsize * window.capacity * 5 + window.outlier.itemsize * window.capacity
+                    for window in buffers
+                ),
+                'hits': self._hits,
+                'misses': self._misses
+            }
+
+window_store = MetricWindowStore()
@@ -45,6 +45,22 @@ def app():
     test_app.register_blueprint(instance_bp, url_prefix='/api/instances')
     test_app.register_blueprint(metrics_bp, url_prefix='/api/metrics')
     
+    # The window store, decision queue, baselines, sustained trackers, forecasts, decision trace and rollup tracker are process-wide, start every test from empty ones
+    from service.window_store import window_store
+    from service.decision_queue import decision_queue
+    from service.baseline_store import baseline_store
+    from service.scaling_service import sustained_trackers
+    from service.forecaster import forecast_store
+    from service.decision_trace import decision_trace
+    from service.rollups import rollup_tracker
+    window_store.clear()
+    decision_queue.clear()
+    baseline_store.clear()
+    sustained_trackers.clear()
+    forecast_store.clear()
+    decision_trace.clear()
+    rollup_tracker.clear()
+    
     # Create application context and tables
     with test_app.app_context():
         db.create_all()
@@ -106,6 +122,7 @@ def sample_instance(app, sample_user):
         
         instance_data = {
             'instance_id': instance.instance_id,
+            'instance_key': instance.instance_key,
             'instance_type': instance.instance_type,
             'region': instance.region,
             'user_id': instance.user_id  # Return UUID object
@@ -125,13 +142,12 @@ def sample_metrics(app, sample_instance):
         # Create 10 metrics over 5 minutes
         for i in range(10):
             metric = Metric(
-                instance_id=sample_instance['instance_id'],
+                instance_key=sample_instance['instance_key'],
                 cpu_utilization=45.0 + i * 2,  # Gradually increasing
                 memory_usage=50.0 + i * 1.5,
                 network_in=1000000 + i * 10000,
                 network_out=500000 + i * 5000,
-                timestamp=base_time - timedelta(minutes=9-i),
-                is_outlier=False
+                timestamp=base_time - timedelta(minutes=9-i)
             )
             metrics.append(metric)
             db.session.add(metric)
@@ -0,0 +1,217 @@
+"""Unit tests for repo/archive.py"""
+import os
+import pytest
+from datetime import datetime, timedelta
+from repo.db import db
+from repo.models import Metric, ScalingDecision
+from repo.metric_writer import upsert_metrics, metric_row
+from repo.archive import (
+    DONE_MARKER, archive_path, archived_until, count_range, day_directory, day_start, export_day,
+    export_pending, pending_days, read_range, to_rows
+)
+from repo.retention import apply_retention
+from service.rollups import get_metric_series
+from service.replay import load_series
+
+pa = pytest.importorskip('pyarrow')
+
+NOW = datetime(2026, 10, 17, 12, 0)
+DAY = datetime(2026, 10, 10)
+
+
+@pytest.fixture
+def archive_root(tmp_path, monkeypatch):
+    """Archive files go to a temporary directory."""
+    monkeypatch.setattr('repo.archive.ARCHIVE_ROOT', str(tmp_path))
+    return str(tmp_path)
+
+
+def store_day(instance_id, day, every_minutes=60, cpu=12.3):
+    """Store one metric every every_minutes on day, newest first so the export has to sort."""
+    stamps = [day + timedelta(minutes=m) for m in range(0, 24 * 60, every_minutes)]
+    upsert_metrics(metric_row(instance_id, stamp, cpu, 50.0, 100, None) for stamp in reversed(stamps))
+    db.session.commit()
+
+
+class TestExport:
+    """Test cases for exporting closed days to Parquet files."""
+
+    def test_day_is_written_per_instance_sorted_and_marked(self, app, sample_instance, archive_root):
+        """Test that a day becomes one sorted file per instance plus a completion marker."""
+        store_day(sample_instance['instance_id'], DAY)
+        store_day(sample_instance['instance_id'], DAY + timedelta(days=1))
+
+        files = export_day('metrics', DAY)
+
+        assert files == 1
+        assert os.path.exists(os.path.join(day_directory('metrics', DAY), DONE_MARKER))
+        table = read_range('metrics', sample_instance['instance_id'], DAY, DAY + timedelta(days=2))
+        timestamps = table.column('timestamp').to_pylist()
+        assert timestamps == sorted(timestamps) and len(timestamps) == 24
+        assert timestamps[0] == DAY
+
+    def test_decisions_are_exported(self, app, sample_instance, archive_root):
+        """Test that scaling decisions of a day are archived with their reasons."""
+        db.session.add(ScalingDecision(instance_id=sample_instance['instance_id'], timestamp=DAY + timedelta(hours=3),
+                                       cpu_utilization=91.5, decision='scale_up', reason='CPU high'))
+        db.session.commit()
+
+        export_day('decisions', DAY)
+
+        rows = to_rows(read_range('decisions', sample_instance['instance_id'], DAY, DAY + timedelta(days=1)))
+        assert rows == [(sample_instance['instance_id'], DAY + timedelta(hours=3), 91.5, None, None, None, 'scale_up', 'CPU high')]
+
+    def test_only_closed_days_are_pending(self, archive_root):
+        """Test that days are exported once they have ended and late datapoints are in, oldest first."""
+        os.makedirs(day_directory('metrics', datetime(2026, 10, 14)))
+        open(os.path.join(day_directory('metrics', datetime(2026, 10, 14)), DONE_MARKER), 'w').close()
+
+        days = pending_days('metrics', now=datetime(2026, 10, 17, 1, 0), first=datetime(2026, 10, 13))
+
+        # The 16th ended an hour ago, within ARCHIVE_CLOSE_AFTER_MINUTES
+        assert days == [datetime(2026, 10, 13), datetime(2026, 10, 15)]
+
+    def test_export_pending_marks_each_kind(self, app, sample_instance, archive_root):
+        """Test that the job exports the oldest pending day of metrics and decisions."""
+        store_day(sample_instance['instance_id'], DAY)
+        db.session.add(ScalingDecision(instance_id=sample_instance['instance_id'], timestamp=DAY, decision='scale_up'))
+        db.session.commit()
+
+        exported = export_pending(now=NOW, max_days=1)
+
+        assert exported == {'metrics': [DAY], 'decisions': [DAY]}
+        assert pending_days('metrics', now=NOW)[0] == DAY + timedelta(days=1)
+
+    def test_pending_days_start_at_the_oldest_row(self, app, sample_instance, archive_root):
+        """Test that every day from the oldest stored row on is pending, however long ago it is."""
+        old = datetime(2026, 1, 5)
+        store_day(sample_instance['instance_id'], old)
+        db.session.add(ScalingDecision(instance_id=sample_instance['instance_id'], timestamp=DAY, decision='scale_up'))
+        db.session.commit()
+
+        assert pending_days('metrics', now=NOW)[0] == old
+        assert len(pending_days('metrics', now=NOW)) == (day_start(NOW) - old).days
+        assert pending_days('decisions', now=NOW)[0] == DAY
+
+    def test_nothing_is_pending_without_rows(self, app, archive_root):
+        """Test that an empty database has no days to export."""
+        assert pending_days('metrics', now=NOW) == [] and pending_days('decisions', now=NOW) == []
+
+    def test_archived_metrics_replay(self, app, sample_instance, archive_root):
+        """Test that an archive file loads as a replay series."""
+        store_day(sample_instance['instance_id'], DAY)
+        export_day('metrics', DAY)
+
+        series = load_series(archive_path('metrics', sample_instance['instance_id'], DAY))
+
+        assert series.instance_ids == [sample_instance['instance_id']] and len(series) == 24
+
+
+class TestReadRange:
+    """Test cases for reading ranges back from the archive."""
+
+    def test_range_is_cut_across_days(self, app, sample_instance, archive_root):
+        """Test that a range spanning two day files returns exactly the rows inside it."""
+        for day in (DAY, DAY + timedelta(days=1)):
+            store_day(sample_instance['instance_id'], day)
+            export_day('metrics', day)
+
+        table = read_range('metrics', sample_instance['instance_id'], DAY + timedelta(hours=22, minutes=30),
+                           DAY + timedelta(days=1, hours=2))
+
+        assert table.column('timestamp').to_pylist() == [DAY + timedelta(hours=h) for h in (23, 24, 25)]
+
+    def test_count_matches_the_rows_read(self, app, sample_instance, archive_root):
+        """Test that counting a range gives the number of rows reading it returns, for partial and whole days."""
+        for day in (DAY, DAY + timedelta(days=1), DAY + timedelta(days=2)):
+            store_day(sample_instance['instance_id'], day)
+            export_day('metrics', day)
+
+        for start, end in ((DAY + timedelta(hours=22, minutes=30), DAY + timedelta(days=2, hours=2)),
+                           (DAY, DAY + timedelta(days=3)), (DAY + timedelta(hours=1), DAY + timedelta(hours=3))):
+            expected = read_range('metrics', sample_instance['instance_id'], start, end).num_rows
+            assert count_range('metrics', sample_instance['instance_id'], start, end) == expected
+        assert count_range('metrics', sample_instance['instance_id'], DAY + timedelta(hours=22, minutes=30),
+                           DAY + timedelta(days=2, hours=2)) == 27
+
+    def test_float4_values_read_back_as_stored(self, app, sample_instance, archive_root):
+        """Test that float4 utilisation reads back with its shortest decimal and missing values as None."""
+        store_day(sample_instance['instance_id'], DAY)
+        export_day('metrics', DAY)
+
+        row = to_rows(read_range('metrics', sample_instance['instance_id'], DAY, DAY + timedelta(hours=1)))[0]
+
+        assert row[2:] == (12.3, 50.0, 100, None)
+
+    def test_missing_files_read_as_empty(self, archive_root):
+        """Test that a range with no archive files is an empty table."""
+        assert read_range('metrics', 'i-none', DAY, DAY + timedelta(days=3)).num_rows == 0
+
+    def test_archived_until_stops_at_the_first_day_not_exported(self, app, sample_instance, archive_root):
+        """Test that only the leading exported days older than the hot window are read from the archive."""
+        for day in (DAY, DAY + timedelta(days=1), DAY + timedelta(days=3)):
+            export_day('metrics', day)
+
+        assert archived_until('metrics', DAY + timedelta(hours=5), DAY + timedelta(days=5), NOW) == DAY + timedelta(days=2)
+        assert archived_until('metrics', DAY, DAY + timedelta(days=5), DAY + timedelta(days=1)) == DAY + timedelta(days=1)
+        assert archived_until('metrics', DAY + timedelta(days=2), NOW, NOW) == DAY + timedelta(days=2)
+
+
+class TestArchiveTiering:
+    """Test cases for the metrics API and retention with the cold archive enabled."""
+
+    @pytest.fixture(autouse=True)
+    def enable_archive(self, monkeypatch, archive_root):
+        monkeypatch.setattr('service.rollups.ARCHIVE_ENABLED', True)
+        monkeypatch.setattr('repo.retention.ARCHIVE_ENABLED', True)
+
+    def test_series_reads_old_days_from_the_archive(self, app, client, auth_headers, sample_instance):
+        """Test that a range older than the hot window is served raw from the archive and joined with hot rows."""
+        old = datetime.utcnow().replace(hour=0, minute=0, second=0, microsecond=0) - timedelta(days=40)
+        store_day(sample_instance['instance_id'], old)
+        export_day('metrics', old)
+        # Expired from the hot store
+        Metric.query.delete()
+        recent = datetime.utcnow() - timedelta(days=1)
+        upsert_metrics([metric_row(sample_instance['instance_id'], recent, 70.0, 20.0, 1, 2)])
+        db.session.commit()
+
+        success, result = get_metric_series(sample_instance['instance_id'], old, datetime.utcnow(), 500)
+
+        assert success
+        assert result['resolution_seconds'] == 0
+        points = result['points']
+        assert len(points) == 25
+        assert points[0] == {'timestamp': old.isoformat(), 'cpu_utilization': 12.3, 'memory_usage': 50.0,
+                             'network_in': 100, 'network_out': None}
+        assert points[-1]['timestamp'] == recent.isoformat()
+
+        response = client.get(
+            f"/api/metrics/{sample_instance['instance_id']}/series?start={old.isoformat()}&end={(old + timedelta(days=1)).isoformat()}",
+            headers=auth_headers
+        )
+        assert response.status_code == 200
+        assert len(response.get_json()['points']) == 24
+
+    def test_series_of_rollups_does_not_read_archived_rows(self, app, sample_instance, monkeypatch):
+        """Test that a range too long for raw points counts its archived rows without reading them."""
+        old = datetime.utcnow().replace(hour=0, minute=0, second=0, microsecond=0) - timedelta(days=40)
+        store_day(sample_instance['instance_id'], old, every_minutes=1)
+        export_day('metrics', old)
+        monkeypatch.setattr('service.rollups.read_range', lambda *args: pytest.fail('archived rows were read'))
+
+        success, result = get_metric_series(sample_instance['instance_id'], old, old + timedelta(days=1), 500)
+
+        assert success
+        assert result['resolution_seconds'] == 300
+
+    def test_retention_keeps_days_not_archived(self, app, sample_instance):
+        """Test that expired metrics are only deleted once their day is in the archive."""
+        exported, waiting = DAY, DAY + timedelta(days=1)
+        for day in (exported, waiting):
+            store_day(sample_instance['instance_id'], day)
+        export_day('metrics', exported)
+
+        apply_retention(now=NOW, policies={'metrics': {'days': 1, 'archive': False}}, pause_seconds=0)
+
+        assert {m.timestamp.date() for m in Metric.query.all()} == {waiting.date()}
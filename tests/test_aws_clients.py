@@ -0,0 +1,83 @@
+"""Unit tests for service/aws_clients.py"""
+import threading
+import pytest
+from botocore.stub import Stubber
+from service.aws_clients import AwsClientRegistry, build_client_config
+
+
+@pytest.fixture
+def registry():
+    return AwsClientRegistry(build_client_config(max_pool_connections=1))
+
+
+class TestClientConfig:
+    """Test cases for the shared botocore config."""
+
+    def test_config_values(self):
+        """Test that pool size, timeouts and retry mode are applied."""
+        config = build_client_config(max_pool_connections=20, connect_timeout=2, read_timeout=3)
+
+        assert config.max_pool_connections == 20
+        assert config.connect_timeout == 2
+        assert config.read_timeout == 3
+        assert config.retries['mode'] == 'adaptive'
+
+
+class TestAwsClientRegistry:
+    """Test cases for the per-region client cache."""
+
+    def test_client_is_reused(self, registry):
+        """Test that the same (service, region) returns the same client."""
+        first = registry.get_client('cloudwatch', 'us-east-1')
+        second = registry.get_client('cloudwatch', 'us-east-1')
+
+        stats = registry.get_stats()
+        assert first is second
+        assert stats['clients_created'] == 1
+        assert stats['clients_reused'] == 1
+
+    def test_clients_keyed_by_service_and_region(self, registry):
+        """Test that different services and regions get their own clients."""
+        cw_east = registry.get_client('cloudwatch', 'us-east-1')
+        cw_west = registry.get_client('cloudwatch', 'us-west-2')
+        ec2_east = registry.get_client('ec2', 'us-east-1')
+
+        assert len({id(cw_east), id(cw_west), id(ec2_east)}) == 3
+        assert cw_west.meta.region_name == 'us-west-2'
+        assert registry.get_stats()['clients_created'] == 3
+
+    def test_concurrent_get_builds_one_client(self, registry):
+        """Test that concurrent callers share a single client."""
+        clients = []
+
+        def worker():
+            clients.append(registry.get_client('cloudwatch', 'eu-west-1'))
+
+        threads = [threading.Thread(target=worker) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        assert len({id(client) for client in clients}) == 1
+        assert registry.get_stats()['clients_created'] == 1
+
+    def test_calls_are_counted(self, registry):
+        """Test that API calls update the in-flight counters."""
+        client = registry.get_client('ec2', 'us-east-1')
+        with Stubber(client) as stubber:
+            stubber.add_response('describe_instances', {'Reservations': []})
+            client.describe_instances(InstanceIds=['i-123'])
+
+        stats = registry.get_stats()['clients']['ec2/us-east-1']
+        assert stats['calls'] == 1
+        assert stats['in_flight'] == 0
+        assert stats['peak_in_flight'] == 1
+        assert stats['saturated_calls'] == 0
+
+    def test_clear(self, registry):
+        """Test that clear drops cached clients."""
+        first = registry.get_client('ec2', 'us-east-1')
+        registry.clear()
+
+        assert registry.get_client('ec2', 'us-east-1') is not first
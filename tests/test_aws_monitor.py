@@ -0,0 +1,192 @@
+"""Unit tests for service/aws_monitor.py"""
+import pytest
+from datetime import datetime, timedelta, timezone
+from unittest.mock import MagicMock, patch
+from service.aws_monitor import (
+    build_metric_queries,
+    get_fetch_range,
+    get_metric_data,
+    fetch_instance_metrics_batch,
+    INSTANCE_METRICS,
+    INSTANCES_PER_BATCH
+)
+
+NOW = datetime(2026, 1, 1, 12, 0, 40)
+T1 = datetime(2026, 1, 1, 11, 58, tzinfo=timezone.utc)
+T2 = datetime(2026, 1, 1, 11, 59, tzinfo=timezone.utc)
+
+
+def metric_data_response(query_ids, value=42.0, next_token=None, timestamps=(T1, T2)):
+    """Build a fake GetMetricData response with one datapoint per timestamp per query, the last one value."""
+    response = {
+        'MetricDataResults': [
+            {'Id': query_id, 'Timestamps': list(timestamps),
+             'Values': [value - len(timestamps) + 1 + i for i in range(len(timestamps))]}
+            for query_id in query_ids
+        ]
+    }
+    if next_token:
+        response['NextToken'] = next_token
+    return response
+
+
+class TestBuildMetricQueries:
+    """Test cases for GetMetricData query construction."""
+
+    def test_one_query_per_metric_per_instance(self):
+        """Test that every instance gets a query for every metric."""
+        queries, query_index = build_metric_queries(['i-a', 'i-b'])
+
+        assert len(queries) == 2 * len(INSTANCE_METRICS)
+        assert len(query_index) == len(queries)
+        assert query_index['i1_cpu_utilization'] == ('i-b', 'cpu_utilization')
+
+    def test_query_ids_are_valid(self):
+        """Test that query Ids start with a lowercase letter."""
+        queries, _ = build_metric_queries(['i-a'])
+
+        assert all(query['Id'][0].islower() for query in queries)
+
+    def test_batch_fits_api_limit(self):
+        """Test that a full batch stays within the per-call query limit."""
+        queries, _ = build_metric_queries([f'i-{n}' for n in range(INSTANCES_PER_BATCH)])
+
+        assert len(queries) <= 500
+
+
+class TestGetFetchRange:
+    """Test cases for watermark-based fetch ranges."""
+
+    def test_end_is_floored_to_period(self):
+        """Test that only closed periods are requested."""
+        _, end_time = get_fetch_range(['i-a'], {}, now=NOW)
+
+        assert end_time == datetime(2026, 1, 1, 12, 0)
+
+    def test_start_rereads_the_settle_window_of_the_oldest_watermark(self):
+        """Test that the range starts at the settle window of the oldest watermark."""
+        watermarks = {'i-a': datetime(2026, 1, 1, 11, 55), 'i-b': datetime(2026, 1, 1, 11, 50)}
+
+        start_time, _ = get_fetch_range(['i-a', 'i-b'], watermarks, now=NOW)
+
+        # The last CLOUDWATCH_SETTLE_PERIODS periods up to 11:50 are read again
+        assert start_time == datetime(2026, 1, 1, 11, 46)
+
+    def test_nothing_new_leaves_an_empty_range(self):
+        """Test that the settle window alone does not make a range when no period closed since the watermark."""
+        start_time, end_time = get_fetch_range(['i-a'], {'i-a': datetime(2026, 1, 1, 11, 59)}, now=NOW)
+
+        assert start_time >= end_time
+
+    def test_new_instance_uses_default_lookback(self):
+        """Test that an instance without a watermark gets the default lookback."""
+        start_time, end_time = get_fetch_range(['i-a'], {}, now=NOW)
+
+        assert end_time - start_time == timedelta(minutes=10)
+
+    def test_stale_watermark_is_capped(self):
+        """Test that an old watermark does not request unbounded history."""
+        start_time, end_time = get_fetch_range(['i-a'], {'i-a': NOW - timedelta(days=3)}, now=NOW)
+
+        assert end_time - start_time == timedelta(minutes=60)
+
+
+class TestGetMetricData:
+    """Test cases for demultiplexing GetMetricData results."""
+
+    def test_results_are_demultiplexed_per_instance(self):
+        """Test that each query result lands in the right instance samples."""
+        _, query_index = build_metric_queries(['i-a', 'i-b'])
+        cw = MagicMock()
+        cw.get_metric_data.return_value = metric_data_response(list(query_index))
+
+        results = get_metric_data(cw, ['i-a', 'i-b'], now=NOW)
+
+        assert cw.get_metric_data.call_count == 1
+        assert [s['cpu_utilization'] for s in results['i-a']] == [41.0, 42.0]
+        assert results['i-b'][-1]['network_out'] == 42.0
+
+    def test_every_datapoint_keeps_its_timestamp(self):
+        """Test that all datapoints are returned with naive UTC timestamps, oldest first."""
+        cw = MagicMock()
+        cw.get_metric_data.return_value = metric_data_response(['i0_cpu_utilization'])
+
+        results = get_metric_data(cw, ['i-a'], now=NOW)
+
+        assert [s['timestamp'] for s in results['i-a']] == [datetime(2026, 1, 1, 11, 58), datetime(2026, 1, 1, 11, 59)]
+
+    def test_datapoints_before_the_settle_window_are_dropped(self):
+        """Test that stored datapoints of the settle window come back and older ones are filtered out."""
+        cw = MagicMock()
+        cw.get_metric_data.return_value = metric_data_response(
+            ['i0_cpu_utilization'], timestamps=(datetime(2026, 1, 1, 11, 50, tzinfo=timezone.utc), T1, T2)
+        )
+
+        results = get_metric_data(cw, ['i-a'], {'i-a': datetime(2026, 1, 1, 11, 58)}, now=NOW)
+
+        assert [s['timestamp'] for s in results['i-a']] == [datetime(2026, 1, 1, 11, 58), datetime(2026, 1, 1, 11, 59)]
+        assert cw.get_metric_data.call_args.kwargs['StartTime'] == datetime(2026, 1, 1, 11, 54)
+
+    def test_up_to_date_watermark_skips_call(self):
+        """Test that no API call is made when there is no closed period to read."""
+        cw = MagicMock()
+
+        results = get_metric_data(cw, ['i-a'], {'i-a': datetime(2026, 1, 1, 11, 59)}, now=NOW)
+
+        assert results == {'i-a': []}
+        cw.get_metric_data.assert_not_called()
+
+    def test_missing_metric_is_none(self):
+        """Test that a metric without datapoints is reported as None."""
+        cw = MagicMock()
+        cw.get_metric_data.return_value = metric_data_response(['i0_cpu_utilization'])
+
+        results = get_metric_data(cw, ['i-a'], now=NOW)
+
+        assert results['i-a'][-1]['cpu_utilization'] == 42.0
+        assert results['i-a'][-1]['memory_usage'] is None
+
+    def test_follows_pagination(self):
+        """Test that NextToken pages are fetched and merged."""
+        cw = MagicMock()
+        cw.get_metric_data.side_effect = [
+            metric_data_response(['i0_cpu_utilization'], next_token='page-2'),
+            metric_data_response(['i0_memory_usage'], value=10.0)
+        ]
+
+        results = get_metric_data(cw, ['i-a'], now=NOW)
+
+        assert cw.get_metric_data.call_count == 2
+        assert cw.get_metric_data.call_args.kwargs['NextToken'] == 'page-2'
+        assert results['i-a'][-1]['cpu_utilization'] == 42.0
+        assert results['i-a'][-1]['memory_usage'] == 10.0
+
+
+class TestFetchInstanceMetricsBatch:
+    """Test cases for region-level batched fetching."""
+
+    @patch('service.aws_monitor.get_cloudwatch_client')
+    def test_large_fleet_is_chunked(self, mock_client):
+        """Test that one API call covers INSTANCES_PER_BATCH instances."""
+        cw = MagicMock()
+        cw.get_metric_data.side_effect = lambda **kwargs: metric_data_response(
+            [query['Id'] for query in kwargs['MetricDataQueries']]
+        )
+        mock_client.return_value = cw
+        instance_ids = [f'i-{n}' for n in range(INSTANCES_PER_BATCH * 2 + 1)]
+
+        results = fetch_instance_metrics_batch(instance_ids, 'us-east-1')
+
+        assert cw.get_metric_data.call_count == 3
+        assert all(len(results[instance_id]) == 2 for instance_id in instance_ids)
+
+    @patch('service.aws_monitor.get_cloudwatch_client')
+    def test_failed_batch_returns_none(self, mock_client):
+        """Test that instances in a failed call are reported as None."""
+        cw = MagicMock()
+        cw.get_metric_data.side_effect = RuntimeError("throttled")
+        mock_client.return_value = cw
+
+        results = fetch_instance_metrics_batch(['i-a', 'i-b'], 'us-east-1')
+
+        assert results == {'i-a': None, 'i-b': None}
@@ -0,0 +1,119 @@
+"""Unit tests for service/baseline_store.py"""
+import pytest
+from datetime import datetime, timedelta
+from unittest.mock import patch
+from service.baseline_store import BaselineStore, baseline_store, load_baselines, save_baselines
+from service.window_store import WindowSample
+from repo.models import MetricBaseline
+from repo.db import db
+
+NOW = datetime(2026, 1, 1, 12, 0)
+
+
+def samples_for(start, count, step_seconds=30, cpu=50.0, is_outlier=False):
+    return [
+        WindowSample(None, start + timedelta(seconds=step_seconds * i), cpu + i % 5, 40.0, 1000 + i, None, is_outlier)
+        for i in range(count)
+    ]
+
+
+class TestBaselineStore:
+    """Test cases for the in-memory long baselines."""
+
+    def test_unknown_instance_has_empty_baseline(self):
+        """Test that an instance never observed has no data points."""
+        baseline = BaselineStore(60).get_baseline('i-a')
+
+        assert baseline.count == 0
+        assert baseline.bounds['cpu_utilization'] is None
+
+    def test_bounds_from_observed_samples(self):
+        """Test that observed samples give IQR bounds per metric, None for a metric without values."""
+        store = BaselineStore(60)
+        store.observe('i-a', samples_for(NOW, 8))
+
+        baseline = store.get_baseline('i-a')
+
+        assert baseline.count == 8
+        lower, upper = baseline.bounds['cpu_utilization']
+        assert lower < 50.0 and upper > 54.0
+        assert baseline.bounds['network_out'] is None
+
+    def test_samples_are_observed_once(self):
+        """Test that overlapping windows do not count samples twice."""
+        store = BaselineStore(60)
+        samples = samples_for(NOW, 10)
+        store.observe('i-a', samples[:6])
+        store.observe('i-a', samples)
+
+        assert store.get_baseline('i-a').count == 10
+
+    def test_outliers_are_left_out(self):
+        """Test that flagged samples and the sample flagged by this decision are not added."""
+        store = BaselineStore(60)
+        samples = samples_for(NOW, 6) + samples_for(NOW + timedelta(minutes=3), 2, cpu=99.0, is_outlier=True)
+        store.observe('i-a', samples, flagged_timestamp=samples[5].timestamp)
+
+        assert store.get_baseline('i-a').count == 5
+
+    def test_baseline_covers_at_most_the_window(self):
+        """Test that samples older than the window stop counting."""
+        store = BaselineStore(60)
+        # Three hours at 30 seconds
+        store.observe('i-a', samples_for(NOW, 360))
+
+        count = store.get_baseline('i-a').count
+        # Between half a window (60 samples) and a whole window (120 samples)
+        assert 60 <= count <= 120
+
+    def test_dirty_instances_are_taken_once(self):
+        """Test that only changed instances are handed out for saving."""
+        store = BaselineStore(60)
+        store.observe('i-a', samples_for(NOW, 4))
+
+        assert list(store.take_dirty()) == ['i-a']
+        store.observe('i-a', samples_for(NOW, 4))
+        assert store.take_dirty() == {}
+
+
+class TestPersistence:
+    """Test cases for saving and restoring baselines."""
+
+    def test_restart_keeps_baseline(self, app, sample_instance, monkeypatch):
+        """Test that a saved baseline is restored after the in-memory state is lost."""
+        monkeypatch.setattr(baseline_store, 'window_minutes', 60)
+        instance_id = sample_instance['instance_id']
+        with app.app_context():
+            baseline_store.observe(instance_id, samples_for(NOW, 20))
+            before = baseline_store.get_baseline(instance_id)
+
+            assert save_baselines() == 1
+            baseline_store.clear()
+            load_baselines([instance_id])
+
+            assert baseline_store.get_baseline(instance_id) == before
+            assert MetricBaseline.query.count() == 1
+
+    def test_other_window_length_is_ignored(self, app, sample_instance, monkeypatch):
+        """Test that a baseline saved for another window length is not restored."""
+        instance_id = sample_instance['instance_id']
+        with app.app_context():
+            monkeypatch.setattr(baseline_store, 'window_minutes', 60)
+            baseline_store.observe(instance_id, samples_for(NOW, 20))
+            save_baselines()
+            baseline_store.clear()
+
+            monkeypatch.setattr(baseline_store, 'window_minutes', 1440)
+            load_baselines([instance_id])
+
+            assert baseline_store.get_baseline(instance_id).count == 0
+
+    def test_save_is_repeated_after_failure(self, app, sample_instance, monkeypatch):
+        """Test that baselines that failed to save are saved on the next attempt."""
+        monkeypatch.setattr(baseline_store, 'window_minutes', 60)
+        with app.app_context():
+            baseline_store.observe(sample_instance['instance_id'], samples_for(NOW, 4))
+
+            with patch.object(db.session, 'commit', side_effect=RuntimeError("db down")):
+                assert save_baselines() == 0
+            assert save_baselines() == 1
@@ -0,0 +1,113 @@
+"""Unit tests for service/decision_pool.py"""
+import pickle
+import random
+import numpy as np
+import pytest
+from service import decision_pool
+from service.decision_pool import pack_shard, latest_values, shard_bounds, evaluate_in_pool, shutdown_pool
+from service.fleet_evaluator import WINDOW_FIELDS
+from service.policy_engine import DEFAULT_PLAN, compile_policy
+from service.scaling_service import evaluate_scaling_decision
+from service.forecaster import ForecastStore
+from tests.test_fleet_evaluator import NOW, random_window, random_baseline
+
+
+@pytest.fixture
+def windows():
+    rnd = random.Random(14)
+    return [random_window(rnd, n) for n in range(60)]
+
+
+@pytest.fixture(scope='module', autouse=True)
+def stop_pool():
+    yield
+    shutdown_pool()
+
+
+class TestPackShard:
+    """Test cases for packing windows into worker payloads"""
+
+    def test_payload_is_flat_arrays(self, windows):
+        """Test that samples travel as flat NumPy columns, not one object per sample"""
+        payload = pack_shard(DEFAULT_PLAN, windows, NOW)
+
+        total = sum(len(samples) for _, samples, _, _ in windows)
+        flat = payload['packed']['flat']
+        assert all(isinstance(column, np.ndarray) for column in flat.values())
+        assert all(len(flat[field]) == total for field in WINDOW_FIELDS)
+        assert len(pickle.dumps(payload)) < len(pickle.dumps(windows))
+
+    def test_latest_values_keep_types(self, windows):
+        """Test that latest values rebuilt in a worker equal the originals, None and int network values included"""
+        payload = pickle.loads(pickle.dumps(pack_shard(DEFAULT_PLAN, windows, NOW)))
+
+        rebuilt = latest_values(payload['packed']['flat'])
+
+        expected = [tuple(getattr(latest, field) for field in WINDOW_FIELDS) for _, _, latest, _ in windows]
+        assert [tuple(values) for values in rebuilt] == expected
+        assert [type(values.network_out) for values in rebuilt] == [type(latest.network_out) for _, _, latest, _ in windows]
+
+    def test_empty_shard(self):
+        """Test that a shard without windows packs and evaluates"""
+        assert decision_pool.evaluate_shard(pack_shard(DEFAULT_PLAN, [], NOW)) == []
+
+
+class TestShardBounds:
+    """Test cases for splitting a fleet into shards"""
+
+    def test_even_contiguous_shards(self):
+        """Test that shards cover every instance once and differ in size by at most one"""
+        bounds = shard_bounds(10, 3)
+
+        assert bounds == [(0, 4), (4, 7), (7, 10)]
+
+    def test_more_workers_than_instances(self):
+        """Test that no empty shards are made"""
+        assert shard_bounds(2, 8) == [(0, 1), (1, 2)]
+
+
+class TestEvaluateInPool:
+    """Test cases for evaluating shards in worker processes"""
+
+    def test_matches_in_process(self, windows):
+        """Test that pool outcomes equal the scalar evaluator's, in the same order"""
+        expected = [evaluate_scaling_decision(*window, NOW) for window in windows]
+
+        assert evaluate_in_pool(DEFAULT_PLAN, windows, NOW, workers=2) == expected
+
+    def test_matches_in_process_with_baselines_trackers_and_forecasts(self, windows):
+        """Test that long baselines, sustained tracker results and forecasts reach the workers"""
+        rnd = random.Random(3)
+        baselines = [random_baseline(rnd) for _ in windows]
+        sustained = [[(rnd.random() < 0.3, rnd.uniform(0, 100)) for _ in range(3)] for _ in windows]
+        store = ForecastStore()
+        forecasts = [store.update(window[0], window[1]) for window in windows]
+        expected = DEFAULT_PLAN.evaluate(windows, NOW, baselines=baselines, sustained=sustained, forecasts=forecasts)
+
+        outcomes = evaluate_in_pool(
+            DEFAULT_PLAN, windows, NOW, baselines=baselines, sustained=sustained, forecasts=forecasts, workers=2
+        )
+
+        assert outcomes == expected
+
+    def test_policy_plans_run_in_workers(self, windows):
+        """Test that a custom policy reading only CPU gives the outcomes of evaluating it in-process"""
+        plan = compile_policy({'rules': [
+            {'type': 'average', 'decision': 'scale_up', 'minutes': 1,
+             'conditions': [{'metric': 'cpu_utilization', 'above': 60}]},
+            {'type': 'iqr', 'minutes': 10, 'min_history_minutes': 2, 'weights': {'cpu_utilization': 2}},
+        ]})
+
+        outcomes = evaluate_in_pool(plan, windows, NOW, workers=2)
+
+        assert plan.fields == ('cpu_utilization',)
+        assert outcomes == plan.evaluate(windows, NOW)
+        assert {decision for decision, _, _ in outcomes} >= {'scale_up', 'no_action'}
+
+    def test_pool_failure_falls_back_in_process(self, windows, monkeypatch):
+        """Test that a failing pool is dropped and the windows are evaluated in-process"""
+        def broken_pool(workers):
+            raise OSError("cannot start workers")
+        monkeypatch.setattr(decision_pool, 'get_pool', broken_pool)
+
+        assert evaluate_in_pool(DEFAULT_PLAN, windows, NOW, workers=2) == DEFAULT_PLAN.evaluate(windows, NOW)
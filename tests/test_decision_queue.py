@@ -0,0 +1,37 @@
+"""Unit tests for service/decision_queue.py"""
+import threading
+import pytest
+from service.decision_queue import DecisionQueue
+
+
+class TestDecisionQueue:
+    """Test cases for the queue between ingestion and the decision worker."""
+
+    def test_take_returns_pending_once(self):
+        """Test that every pending instance is handed out once, sorted."""
+        queue = DecisionQueue()
+        queue.enqueue(['i-b', 'i-a'])
+
+        assert queue.take(timeout=0) == ['i-a', 'i-b']
+        assert queue.take(timeout=0) == []
+
+    def test_repeated_instances_are_coalesced(self):
+        """Test that an instance queued twice before being taken is evaluated once."""
+        queue = DecisionQueue()
+        queue.enqueue(['i-a', 'i-a'])
+        queue.enqueue(['i-a', 'i-b'])
+
+        assert queue.take(timeout=0) == ['i-a', 'i-b']
+        assert queue.get_stats() == {'pending': 0, 'enqueued': 2, 'batches': 1}
+
+    def test_take_wakes_up_on_enqueue(self):
+        """Test that a waiting consumer gets instances enqueued by another thread."""
+        queue = DecisionQueue()
+        taken = []
+        consumer = threading.Thread(target=lambda: taken.append(queue.take(timeout=5)))
+        consumer.start()
+
+        queue.enqueue(['i-a'])
+        consumer.join(timeout=5)
+
+        assert taken == [['i-a']]
@@ -0,0 +1,175 @@
+"""Unit tests for service/decision_trace.py"""
+import pytest
+from datetime import datetime
+from sqlalchemy import event
+from repo.db import db
+from service.decision_trace import DecisionTrace, NULL_TIMER, decision_trace, histogram
+from service.scaling_service import make_scaling_decision, process_all_monitored_instances
+from tests.test_scaling_service import create_fleet
+
+
+@pytest.fixture
+def tracing():
+    """Turn the process-wide decision trace on for one test."""
+    decision_trace.enable()
+    try:
+        yield decision_trace
+    finally:
+        decision_trace.disable()
+
+
+class TestDecisionTrace:
+    """Test cases for recording decision cycles."""
+
+    def test_disabled_records_nothing(self):
+        """Test that a traced call runs untouched and hands out the no-op timer while tracing is off."""
+        trace = DecisionTrace(enabled=False)
+
+        @trace.traced('fleet')
+        def cycle():
+            assert trace.timer() is NULL_TIMER
+            return 'done'
+
+        assert cycle() == 'done'
+        assert trace.cycles() == []
+
+    def test_nested_calls_join_the_outer_cycle(self):
+        """Test that laps of a nested traced call land in the cycle of the outer call."""
+        trace = DecisionTrace(enabled=True)
+        try:
+            @trace.traced('instance')
+            def inner(instance_id):
+                trace.timer(instance_id).lap('evaluate', rows=3)
+
+            @trace.traced('fleet')
+            def outer():
+                inner('i-a')
+                inner('i-b')
+                trace.timer().lap('commit', instances=2)
+
+            outer()
+        finally:
+            trace.disable()
+
+        [cycle] = trace.cycles()
+        assert cycle.kind == 'fleet'
+        assert [(s.phase, s.instance_id, s.rows, s.instances) for s in cycle.spans] == [
+            ('evaluate', 'i-a', 3, 1), ('evaluate', 'i-b', 3, 1), ('commit', None, 0, 2)
+        ]
+        assert trace.summary({'i-b'})['phases']['evaluate']['count'] == 1
+
+    def test_fleet_phases_break_down_per_instance(self):
+        """Test that an instance gets an even share of a fleet phase's time and statements and its own rows."""
+        trace = DecisionTrace(enabled=True)
+        try:
+            @trace.traced('fleet')
+            def cycle():
+                trace.timer().lap('load_windows', rows=7, members={'i-a': 5, 'i-b': 2})
+                trace.timer().lap('commit', instances=2)
+
+            cycle()
+        finally:
+            trace.disable()
+
+        [span] = [span for span in trace.cycles()[0].spans if span.phase == 'load_windows']
+        phases = trace.summary({'i-b'})['phases']
+        assert span.instances == 2
+        assert phases.keys() == {'load_windows'}
+        assert phases['load_windows']['rows'] == 2
+        assert phases['load_windows']['instances'] == 1
+        assert phases['load_windows']['total_ms'] == pytest.approx(span.seconds * 1000 / 2)
+        assert trace.summary({'i-c'})['phases'] == {}
+
+    def test_keeps_the_latest_cycles(self):
+        """Test that only the most recent cycles are kept."""
+        trace = DecisionTrace(enabled=True, capacity=3)
+        try:
+            cycle = trace.traced('fleet')(lambda: None)
+            for _ in range(5):
+                cycle()
+        finally:
+            trace.disable()
+
+        assert trace.summary()['cycles'] == 3
+
+    def test_histogram_buckets(self):
+        """Test that durations land in the first bucket whose bound they do not exceed."""
+        result = histogram([0.0005, 0.001, 0.003, 2.0], buckets_ms=(1, 5, 1000))
+
+        assert [bucket['count'] for bucket in result['buckets']] == [2, 1, 0, 1]
+        assert result['buckets'][-1]['le_ms'] is None
+        assert result['max_ms'] == 2000.0
+
+
+class TestTracedDecisions:
+    """Test cases for the phases recorded by the scaling service."""
+
+    def test_make_scaling_decision_phases(self, app, tracing, sample_metrics, sample_instance):
+        """Test that an instance decision records its phases with their statements and rows."""
+        with app.app_context():
+            statements = []
+            def record(conn, cursor, statement, parameters, context, executemany):
+                statements.append(statement)
+            event.listen(db.engine, 'before_cursor_execute', record)
+            try:
+                success, _ = make_scaling_decision(sample_instance['instance_id'])
+            finally:
+                event.remove(db.engine, 'before_cursor_execute', record)
+
+        assert success is True
+        [cycle] = tracing.cycles()
+        phases = [span.phase for span in cycle.spans]
+        assert phases[0] == 'load' and phases[-1] == 'commit'
+        assert 'evaluate' in phases
+        assert all(span.instance_id == sample_instance['instance_id'] for span in cycle.spans)
+        # Metrics of the last DECISION_WINDOW_MINUTES, one a minute
+        assert cycle.spans[0].rows == 5
+        assert cycle.queries == len(statements)
+        assert sum(span.queries for span in cycle.spans) <= cycle.queries
+
+    def test_fleet_cycle_phases(self, app, tracing, sample_user):
+        """Test that a fleet pass records fleet-wide phases that account for its statements."""
+        with app.app_context():
+            create_fleet(sample_user['id'], [(95.0, 50.0), (5.0, 15.0), (50.0, 50.0)], datetime.utcnow())
+
+            process_all_monitored_instances()
+
+        [cycle] = tracing.cycles()
+        spans = {span.phase: span for span in cycle.spans}
+        assert list(spans)[:2] == ['load_instances', 'load_windows']
+        assert spans['load_windows'].rows == 15
+        assert spans['load_windows'].instances == 3
+        assert spans['commit'].queries >= 1
+        assert sum(span.queries for span in cycle.spans) == cycle.queries
+
+        summary = tracing.summary()
+        assert summary['cycle_kinds']['fleet']['count'] == 1
+        assert summary['phases']['evaluate']['us_per_instance'] is not None
+        instance = tracing.summary({'i-fleet0'})['phases']
+        assert instance.keys() == summary['phases'].keys()
+        assert instance['load_windows']['rows'] == 5
+        # Its scale up decision and its outlier flag
+        assert instance['commit']['rows'] == 2
+        assert all(phase['instances'] == 1 for phase in instance.values())
+
+
+class TestTraceRoute:
+    """Test cases for GET /api/metrics/trace."""
+
+    def test_returns_histograms(self, client, tracing, auth_headers, sample_metrics, sample_instance):
+        """Test that the endpoint returns the phase histograms, optionally for one instance."""
+        make_scaling_decision(sample_instance['instance_id'])
+
+        response = client.get('/api/metrics/trace', headers=auth_headers)
+        filtered = client.get(f"/api/metrics/trace?instance_id={sample_instance['instance_id']}", headers=auth_headers)
+
+        assert response.status_code == 200
+        assert response.json['enabled'] is True
+        assert response.json['phases']['load']['rows'] == 5
+        assert filtered.json['phases'].keys() == response.json['phases'].keys()
+
+    def test_unknown_instance(self, client, auth_headers):
+        """Test that filtering on an unknown instance is a 404."""
+        response = client.get('/api/metrics/trace?instance_id=i-missing', headers=auth_headers)
+
+        assert response.status_code == 404
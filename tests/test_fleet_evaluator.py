@@ -0,0 +1,94 @@
+"""Unit tests for service/fleet_evaluator.py"""
+import random
+import numpy as np
+from collections import namedtuple
+from datetime import datetime, timedelta
+from service.fleet_evaluator import WINDOW_FIELDS, flatten_samples, window_starts
+from service.baseline_store import Baseline, BASELINE_COLUMNS
+
+NOW = datetime(2026, 1, 1, 12, 0)
+
+Sample = namedtuple('Sample', 'id timestamp cpu_utilization memory_usage network_in network_out is_outlier')
+
+
+def random_window(rnd, n):
+    """Build a random instance window in the shape load_fleet_windows returns."""
+    profile = rnd.choice(['low', 'high', 'mid', 'mixed', 'spike'])
+    samples = []
+    for k in range(rnd.randint(0, 14)):
+        if profile == 'low':
+            cpu, memory = rnd.uniform(0, 14), rnd.uniform(5, 25)
+        elif profile == 'high':
+            cpu, memory = rnd.uniform(80, 100), rnd.uniform(40, 100)
+        elif profile == 'mid':
+            cpu, memory = rnd.gauss(50, 5), rnd.gauss(50, 5)
+        elif profile == 'spike':
+            cpu, memory = (rnd.uniform(70, 89) if k == 13 else rnd.gauss(40, 2)), rnd.gauss(50, 2)
+        else:
+            cpu, memory = rnd.uniform(0, 100), rnd.uniform(0, 100)
+        samples.append(Sample(
+            id=f'{n}-{k}',
+            timestamp=NOW - timedelta(seconds=(14 - k) * 25),
+            cpu_utilization=None if rnd.random() < 0.05 else cpu,
+            memory_usage=None if rnd.random() < 0.05 else memory,
+            network_in=None if rnd.random() < 0.05 else rnd.randint(0, 10 ** 7),
+            network_out=rnd.randint(0, 10 ** 7),
+            is_outlier=rnd.choice([False] * 8 + [True, None])
+        ))
+    latest = samples[-1] if samples else Sample(f'{n}-old', NOW - timedelta(hours=1), 50.0, 50.0, 1, 1, False)
+    oldest = rnd.choice([None, NOW - timedelta(minutes=2), NOW - timedelta(hours=2)])
+    return (f'i-{n}', samples, latest, oldest)
+
+
+def random_baseline(rnd):
+    """Build a random long baseline, some metrics without bounds."""
+    bounds = {}
+    for column in BASELINE_COLUMNS:
+        if rnd.random() < 0.2:
+            bounds[column] = None
+        elif column in ('network_in', 'network_out'):
+            bounds[column] = tuple(sorted(rnd.uniform(0, 10 ** 7) for _ in range(2)))
+        else:
+            bounds[column] = tuple(sorted(rnd.uniform(0, 100) for _ in range(2)))
+    return Baseline(rnd.choice([0, 3, 4, 500]), bounds)
+
+
+class TestFlattenSamples:
+    """Test cases for extracting window columns into flat arrays."""
+
+    def test_columns_follow_the_windows(self):
+        """Test that samples of all windows sit back to back with None as NaN and NULL flags as outliers."""
+        rnd = random.Random(7)
+        windows = [random_window(rnd, n) for n in range(50)]
+
+        flat = flatten_samples(windows)
+
+        rows = [sample for _, samples, _, _ in windows for sample in samples]
+        assert flat['counts'].tolist() == [len(samples) for _, samples, _, _ in windows]
+        for field in WINDOW_FIELDS:
+            assert [None if np.isnan(v) else v for v in flat[field].tolist()] == [getattr(row, field) for row in rows]
+            assert np.array_equal(flat[f'latest_{field}'], np.array([getattr(w[2], field) for w in windows], dtype=float), equal_nan=True)
+        assert flat['included'].tolist() == [row.is_outlier is False for row in rows]
+
+    def test_only_the_given_fields(self):
+        """Test that other columns and the outlier flags can be left out."""
+        flat = flatten_samples([random_window(random.Random(3), 0)], fields=('cpu_utilization',), outliers=False)
+
+        assert set(flat) == {'counts', 'cpu_utilization', 'latest_cpu_utilization'}
+
+
+class TestWindowStarts:
+    """Test cases for finding where each window's trailing part begins."""
+
+    def test_first_sample_at_or_after_cutoff(self):
+        """Test that each position is that of the first sample not older than the cutoff."""
+        rnd = random.Random(9)
+        windows = [random_window(rnd, n) for n in range(50)]
+        cutoff = NOW - timedelta(minutes=3)
+
+        starts = window_starts(windows, cutoff)
+
+        assert starts.tolist() == [
+            next((k for k, sample in enumerate(samples) if sample.timestamp >= cutoff), len(samples))
+            for _, samples, _, _ in windows
+        ]
@@ -0,0 +1,134 @@
+"""Unit tests for service/forecaster.py"""
+import pytest
+from collections import namedtuple
+from datetime import datetime, timedelta
+from service.forecaster import HoltTrend, ForecastStore, Forecast, Trend
+from service.scaling_service import predicted_decision, forecast_peak
+
+NOW = datetime(2026, 1, 1, 12, 0)
+
+Sample = namedtuple('Sample', 'timestamp cpu_utilization memory_usage')
+
+
+def series(cpu_values, memory_values=None, step=30, start=NOW):
+    memory_values = memory_values or [50.0] * len(cpu_values)
+    return [
+        Sample(start + timedelta(seconds=step * i), cpu, memory)
+        for i, (cpu, memory) in enumerate(zip(cpu_values, memory_values))
+    ]
+
+
+class TestHoltTrend:
+    """Test cases for the per-metric Holt model."""
+
+    def test_linear_series_is_followed_exactly(self):
+        """Test that a steady ramp gives its level and its slope per second."""
+        model = HoltTrend()
+        for i in range(20):
+            model.add(NOW + timedelta(seconds=30 * i), 20.0 + 1.5 * i)
+
+        assert model.trend().count == 20
+        assert model.level == pytest.approx(20.0 + 1.5 * 19)
+        assert model.slope == pytest.approx(1.5 / 30)
+
+    def test_flat_series_has_no_trend(self):
+        """Test that constant values give a zero slope."""
+        model = HoltTrend()
+        for i in range(10):
+            model.add(NOW + timedelta(seconds=5 * i), 42.0)
+
+        assert model.trend() == Trend(10, 42.0, 0.0)
+
+    def test_repeated_timestamp_is_ignored(self):
+        """Test that a second value at the same timestamp does not divide by zero or count."""
+        model = HoltTrend()
+        model.add(NOW, 10.0)
+        model.add(NOW, 90.0)
+
+        assert model.trend() == Trend(1, 10.0, 0.0)
+
+
+class TestForecastStore:
+    """Test cases for incremental per-instance forecasts."""
+
+    def test_only_new_samples_are_added(self):
+        """Test that feeding overlapping windows adds every sample once."""
+        store = ForecastStore()
+        samples = series([20.0 + i for i in range(12)])
+
+        store.update('i-a', samples[:8])
+        forecast = store.update('i-a', samples[4:])
+
+        assert forecast.cpu.count == 12
+        assert forecast.cpu.slope == pytest.approx(1 / 30)
+
+    def test_missing_values_skip_only_that_metric(self):
+        """Test that a None CPU value still updates the memory model."""
+        store = ForecastStore()
+
+        forecast = store.update('i-a', [Sample(NOW, None, 40.0), Sample(NOW + timedelta(seconds=30), 10.0, 41.0)])
+
+        assert forecast.cpu.count == 1
+        assert forecast.memory.count == 2
+
+    def test_long_gap_restarts_the_model(self):
+        """Test that samples after a gap longer than FORECAST_MAX_GAP_MINUTES start a new model."""
+        store = ForecastStore()
+        store.update('i-a', series([10.0 + 5 * i for i in range(6)]))
+
+        forecast = store.update('i-a', series([70.0, 70.0], start=NOW + timedelta(hours=1)))
+
+        assert forecast.cpu == Trend(2, 70.0, 0.0)
+        assert store.get_stats() == {'instances': 1, 'restarts': 1}
+
+    def test_values_filled_in_late_reach_the_model(self):
+        """Test that memory filled in by a settle window gives the forecast of the complete series."""
+        complete = series([50.0] * 12, [30.0 + 2 * i for i in range(12)])
+        late = [sample._replace(memory_usage=None) if i >= 9 else sample for i, sample in enumerate(complete)]
+        store = ForecastStore()
+
+        store.update('i-a', late)
+        forecast = store.update('i-a', complete[4:])
+
+        assert forecast.memory.count == 12
+        assert forecast == ForecastStore().update('i-a', complete)
+
+
+class TestPredictedDecision:
+    """Test cases for turning forecasts into decisions."""
+
+    def test_rising_cpu_predicts_scale_up(self):
+        """Test that CPU reaching the scale up threshold within the horizon scales up."""
+        forecast = Forecast(Trend(10, 70.0, 0.08), Trend(10, 50.0, 0.0))
+
+        decision, reason = predicted_decision(forecast)
+
+        assert forecast_peak(forecast.cpu) == pytest.approx(94.0)
+        assert decision == 'scale_up'
+        assert reason.startswith("Predicted scale up: CPU forecast to reach 94.00% (> 90%)")
+
+    def test_falling_usage_does_not_lower_the_peak(self):
+        """Test that a falling forecast is judged on its current level."""
+        forecast = Forecast(Trend(10, 95.0, -0.1), Trend(10, 50.0, 0.0))
+
+        assert forecast_peak(forecast.cpu) == 95.0
+        assert predicted_decision(forecast)[0] == 'scale_up'
+
+    def test_both_low_predicts_scale_down(self):
+        """Test that CPU and memory staying under the scale down thresholds scale down."""
+        forecast = Forecast(Trend(10, 5.0, -0.01), Trend(10, 12.0, 0.01))
+
+        decision, reason = predicted_decision(forecast)
+
+        assert decision == 'scale_down'
+        assert 'Memory at most 15.00%' in reason
+
+    def test_models_still_warming_up_are_ignored(self):
+        """Test that fewer than FORECAST_MIN_SAMPLES samples never trigger a decision."""
+        forecast = Forecast(Trend(3, 95.0, 1.0), Trend(3, 5.0, 0.0))
+
+        assert predicted_decision(forecast) is None
+
+    def test_steady_usage_predicts_nothing(self):
+        """Test that usage between the thresholds leaves the decision to the IQR analysis."""
+        assert predicted_decision(Forecast(Trend(10, 50.0, 0.0), Trend(10, 50.0, 0.0))) is None
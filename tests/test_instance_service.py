@@ -6,9 +6,12 @@ from service.instance_service import (
     start_monitoring,
     stop_monitoring,
     get_user_instances,
-    delete_instance
+    delete_instance,
+    get_scaling_policy,
+    set_scaling_policy,
+    clear_scaling_policy
 )
-from repo.models import Instance
+from repo.models import Instance, User
 from repo.db import db
 from datetime import datetime
 
@@ -307,3 +310,65 @@ class TestDeleteInstance:
             
             assert success is False
             assert "not found" in result.lower()
+
+
+class TestScalingPolicy:
+    """Test cases for setting scaling policies."""
+
+    POLICY = {'rules': [
+        {'type': 'sustained', 'decision': 'scale_up', 'conditions': [{'metric': 'cpu_utilization', 'above': 70}]}
+    ]}
+
+    def test_default_policy_until_one_is_set(self, app, sample_user, sample_instance):
+        """Test that the built-in policy applies, then the user's, then the instance's."""
+        with app.app_context():
+            user_id = sample_user['id_str']
+            instance_id = sample_instance['instance_id']
+
+            success, result = get_scaling_policy(user_id, instance_id)
+            assert success is True
+            assert result['source'] == 'default'
+            assert result['policy']['name'] == 'default'
+
+            set_scaling_policy(user_id, self.POLICY)
+            assert get_scaling_policy(user_id, instance_id)[1]['source'] == 'user'
+
+            success, stored = set_scaling_policy(user_id, {**self.POLICY, 'name': 'mine'}, instance_id)
+            assert success is True
+            assert stored['rules'][0]['minutes'] == 5
+            assert get_scaling_policy(user_id, instance_id)[1] == {'source': 'instance', 'policy': stored}
+
+            assert clear_scaling_policy(user_id, instance_id) == (True, "Scaling policy removed")
+            assert get_scaling_policy(user_id, instance_id)[1]['source'] == 'user'
+
+    def test_invalid_policy_is_rejected(self, app, sample_user, sample_instance):
+        """Test that a policy that does not validate is not stored."""
+        with app.app_context():
+            success, message = set_scaling_policy(sample_user['id_str'], {'rules': [{'type': 'iqr', 'votes': 0}]})
+
+            assert success is False
+            assert message == "Invalid scaling policy: rules[0].votes must be greater than 0"
+            assert User.query.one().scaling_policy is None
+
+    def test_setting_policy_reevaluates_instance(self, app, sample_user, sample_instance):
+        """Test that a new policy clears the instance's evaluated watermark."""
+        with app.app_context():
+            instance = Instance.query.filter_by(instance_id=sample_instance['instance_id']).one()
+            instance.last_evaluated_at = datetime(2026, 1, 1)
+            db.session.commit()
+
+            set_scaling_policy(sample_user['id_str'], self.POLICY, sample_instance['instance_id'])
+
+            assert Instance.query.one().last_evaluated_at is None
+
+    def test_policy_of_someone_elses_instance(self, app, sample_instance):
+        """Test that another user cannot read or set an instance's policy."""
+        with app.app_context():
+            other = User(email='other@example.com', password='x')
+            db.session.add(other)
+            db.session.commit()
+
+            assert get_scaling_policy(str(other.id), sample_instance['instance_id']) == \
+                (False, "Unauthorized: You don't own this instance")
+            assert set_scaling_policy(str(other.id), self.POLICY, sample_instance['instance_id'])[0] is False
+            assert clear_scaling_policy(str(other.id)) == (False, "No scaling policy set")
@@ -0,0 +1,144 @@
+"""Unit tests for repo/metric_writer.py"""
+import pytest
+from datetime import datetime, timedelta
+from repo.metric_writer import upsert_metrics, record_outliers, metric_row, widen_real
+from repo.models import Metric, MetricOutlier
+from repo.db import db
+from sqlalchemy import text
+
+
+class TestUpsertMetrics:
+    """Test cases for idempotent metric ingestion."""
+
+    def test_rows_are_inserted(self, app, sample_instance):
+        """Test that new rows are stored with their own timestamps."""
+        with app.app_context():
+            base_time = datetime(2026, 1, 1, 12, 0)
+            rows = [
+                (sample_instance['instance_id'], base_time + timedelta(minutes=i), 40.0 + i, 50.0, 1000, 500)
+                for i in range(3)
+            ]
+
+            upsert_metrics(rows)
+            db.session.commit()
+
+            metrics = Metric.query.order_by(Metric.timestamp.asc()).all()
+            assert [m.timestamp for m in metrics] == [row[1] for row in rows]
+            assert [m.cpu_utilization for m in metrics] == [40.0, 41.0, 42.0]
+            assert MetricOutlier.query.count() == 0
+
+    def test_reingesting_is_a_noop(self, app, sample_instance):
+        """Test that the same (instance_id, timestamp) is only stored once."""
+        with app.app_context():
+            timestamp = datetime(2026, 1, 1, 12, 0)
+            row = (sample_instance['instance_id'], timestamp, 40.0, 50.0, 1000, 500)
+
+            upsert_metrics([row])
+            db.session.commit()
+            upsert_metrics([row, (sample_instance['instance_id'], timestamp + timedelta(minutes=1), 41.0, 50.0, 1000, 500)])
+            db.session.commit()
+
+            assert Metric.query.count() == 2
+
+    def test_late_values_fill_in_stored_rows(self, app, sample_instance):
+        """Test that a datapoint fetched again fills in its missing values and never erases stored ones."""
+        with app.app_context():
+            timestamp = datetime(2026, 1, 1, 12, 0)
+
+            upsert_metrics([(sample_instance['instance_id'], timestamp, 40.0, None, 1000, 500)])
+            db.session.commit()
+            upsert_metrics([(sample_instance['instance_id'], timestamp, None, 63.5, None, 600)])
+            db.session.commit()
+
+            [metric] = Metric.query.all()
+            assert (metric.cpu_utilization, metric.memory_usage, metric.network_in, metric.network_out) == (40.0, 63.5, 1000, 600)
+
+    def test_duplicates_in_one_batch_are_merged(self, app, sample_instance):
+        """Test that the same datapoint twice in one batch is stored once with the values of both."""
+        with app.app_context():
+            timestamp = datetime(2026, 1, 1, 12, 0)
+
+            submitted = upsert_metrics([
+                (sample_instance['instance_id'], timestamp, 40.0, None, 1000, 500),
+                (sample_instance['instance_id'], timestamp, None, 63.5, None, None),
+            ])
+            db.session.commit()
+
+            [metric] = Metric.query.all()
+            assert submitted == 2
+            assert (metric.cpu_utilization, metric.memory_usage) == (40.0, 63.5)
+
+    def test_rows_are_stored_under_the_instance_key(self, app, sample_instance):
+        """Test that rows refer to their instance by instance_key and rows of unknown instances are skipped."""
+        with app.app_context():
+            timestamp = datetime(2026, 1, 1, 12, 0)
+
+            upsert_metrics([
+                (sample_instance['instance_id'], timestamp, 40.0, 50.0, 1000, 500),
+                ('i-unknown', timestamp, 40.0, 50.0, 1000, 500),
+            ])
+            db.session.commit()
+
+            [metric] = Metric.query.all()
+            assert metric.instance_key == sample_instance['instance_key']
+            assert metric.instance.instance_id == sample_instance['instance_id']
+            assert isinstance(metric.id, int)
+
+    def test_empty_rows(self, app):
+        """Test that an empty batch does nothing."""
+        with app.app_context():
+            assert upsert_metrics([]) == 0
+
+
+class TestMetricRow:
+    """Test cases for building metric rows."""
+
+    # What PostgreSQL returns for each value stored in a real column
+    @pytest.mark.parametrize('value, returned', [
+        (45.3, 45.3),
+        (12.3, 12.3),
+        (99.99, 99.99),
+        (1 / 3, 0.33333334),
+        (90.000001, 90.0),
+        (0.0, 0.0),
+    ])
+    def test_utilisation_is_what_postgres_returns(self, value, returned):
+        """Test that CPU and memory hold the shortest decimal of their float4, like a real read back."""
+        row = metric_row('i-a', datetime(2026, 1, 1), value, value, 1000.4, None)
+
+        assert float(widen_real(value)) == returned
+        assert row[2:] == (returned, returned, 1000, None)
+
+    def test_missing_values_stay_none(self):
+        """Test that absent metrics are not widened."""
+        assert metric_row('i-a', datetime(2026, 1, 1), None, None, None, None)[2:] == (None,) * 4
+
+
+class TestRecordOutliers:
+    """Test cases for the append-only outlier annotations."""
+
+    def test_flags_are_appended_once(self, app, sample_instance):
+        """Test that a metric keeps its first flag and metric rows are left untouched."""
+        with app.app_context():
+            timestamp = datetime(2026, 1, 1, 12, 0)
+            upsert_metrics([(sample_instance['instance_id'], timestamp, 95.0, 50.0, 1000, 500)])
+            db.session.commit()
+
+            record_outliers([(sample_instance['instance_id'], timestamp, 'scale_up')])
+            db.session.commit()
+            record_outliers([(sample_instance['instance_id'], timestamp, 'scale_down')])
+            db.session.commit()
+
+            [flag] = MetricOutlier.query.all()
+            assert (flag.instance_key, flag.timestamp, flag.outlier_type) == (
+                sample_instance['instance_key'], timestamp, 'scale_up'
+            )
+            assert flag.flagged_at is not None
+            # Stored as its smallint code
+            assert db.session.execute(text('SELECT outlier_type FROM metric_outliers')).scalar() == 1
+            assert Metric.query.one().cpu_utilization == 95.0
+
+    def test_empty_rows(self, app):
+        """Test that no flags do nothing."""
+        with app.app_context():
+            assert record_outliers([]) == 0
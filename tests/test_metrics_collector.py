@@ -0,0 +1,145 @@
+"""Unit tests for service/metrics_collector.py"""
+import threading
+import time
+import pytest
+from datetime import datetime
+from unittest.mock import patch
+from service.metrics_collector import collect_metrics, build_fetch_tasks, get_executor, shutdown_executor
+
+
+@pytest.fixture(autouse=True)
+def stop_executor():
+    yield
+    shutdown_executor(wait=False)
+
+
+def slow_fetch(delays):
+    """Build a fake fetch_instance_metrics_batch that sleeps per region."""
+    def fetch(instance_ids, region, watermarks):
+        time.sleep(delays.get(region, 0))
+        return {
+            instance_id: [{'timestamp': datetime(2026, 1, 1), 'cpu_utilization': 50.0, 'memory_usage': 40.0}]
+            for instance_id in instance_ids
+        }
+    return fetch
+
+
+class TestBuildFetchTasks:
+    """Test cases for grouping instances into batched fetches."""
+
+    def test_groups_by_region(self):
+        """Test that real instances are grouped per region and mocks are skipped."""
+        tasks = build_fetch_tasks([
+            ('i-1', 'us-east-1', False, None),
+            ('i-2', 'eu-west-1', False, None),
+            ('i-3', 'us-east-1', False, None),
+            ('i-mock', 'mock', True, None)
+        ])
+
+        assert sorted(tasks) == [('eu-west-1', ['i-2']), ('us-east-1', ['i-1', 'i-3'])]
+
+    def test_splits_large_regions(self):
+        """Test that a region is split into batches of at most batch_size instances."""
+        targets = [(f'i-{n}', 'us-east-1', False, None) for n in range(250)]
+
+        tasks = build_fetch_tasks(targets, batch_size=100)
+
+        assert [len(instance_ids) for _, instance_ids in tasks] == [100, 100, 50]
+
+
+class TestCollectMetrics:
+    """Test cases for concurrent metric collection."""
+
+    def test_mock_and_real_instances_collected(self):
+        """Test that mock and real instances are both collected."""
+        with patch('service.metrics_collector.fetch_instance_metrics_batch', side_effect=slow_fetch({})):
+            results = collect_metrics([
+                ('i-real', 'us-east-1', False, None),
+                ('i-mock', 'mock', True, None)
+            ])
+
+        assert results['i-real'][0]['cpu_utilization'] == 50.0
+        assert results['i-mock'][0]['cpu_utilization'] is not None
+        assert results['i-mock'][0]['timestamp'] is not None
+
+    def test_watermarks_are_passed_to_batches(self):
+        """Test that each batch receives the watermarks of its instances."""
+        watermark = datetime(2026, 1, 1, 11, 0)
+        fetch = slow_fetch({})
+        calls = []
+
+        def recording_fetch(instance_ids, region, watermarks):
+            calls.append(watermarks)
+            return fetch(instance_ids, region, watermarks)
+
+        with patch('service.metrics_collector.fetch_instance_metrics_batch', side_effect=recording_fetch):
+            collect_metrics([('i-a', 'us-east-1', False, watermark), ('i-b', 'us-east-1', False, None)])
+
+        assert calls == [{'i-a': watermark, 'i-b': None}]
+
+    def test_fetches_run_concurrently(self):
+        """Test that cycle time follows the slowest batch, not the sum."""
+        delays = {f'region-{n}': 0.3 for n in range(8)}
+        targets = [(f'i-{region}', region, False, None) for region in delays]
+
+        with patch('service.metrics_collector.fetch_instance_metrics_batch', side_effect=slow_fetch(delays)):
+            start = time.monotonic()
+            results = collect_metrics(targets, max_workers=8)
+            elapsed = time.monotonic() - start
+
+        assert all(v is not None for v in results.values())
+        assert elapsed < 1.5
+
+    def test_slow_batch_times_out(self):
+        """Test that a batch exceeding the timeout is dropped."""
+        delays = {'fast-region': 0, 'slow-region': 2}
+        targets = [('i-fast', 'fast-region', False, None), ('i-slow', 'slow-region', False, None)]
+
+        with patch('service.metrics_collector.fetch_instance_metrics_batch', side_effect=slow_fetch(delays)):
+            start = time.monotonic()
+            results = collect_metrics(targets, max_workers=2, instance_timeout=0.3)
+            elapsed = time.monotonic() - start
+
+        assert results['i-fast'] is not None
+        assert results['i-slow'] is None
+        assert elapsed < 1.5
+
+    def test_cycle_deadline_abandons_queued_batches(self):
+        """Test that instances not finished by the cycle deadline are reported as None."""
+        delays = {f'region-{n}': 0.4 for n in range(4)}
+        targets = [(f'i-{region}', region, False, None) for region in delays]
+
+        with patch('service.metrics_collector.fetch_instance_metrics_batch', side_effect=slow_fetch(delays)):
+            results = collect_metrics(targets, max_workers=1, cycle_deadline=0.6, instance_timeout=5)
+
+        collected = [v for v in results.values() if v is not None]
+        assert 0 < len(collected) < len(targets)
+
+    def test_fetch_error_is_reported_as_none(self):
+        """Test that an exception in a worker does not break the cycle."""
+        def failing_fetch(instance_ids, region, watermarks):
+            raise RuntimeError("boom")
+
+        with patch('service.metrics_collector.fetch_instance_metrics_batch', side_effect=failing_fetch):
+            results = collect_metrics([('i-broken', 'us-east-1', False, None)])
+
+        assert results == {'i-broken': None}
+
+    def test_pool_is_reused_across_cycles(self):
+        """Test that cycles share one bounded pool instead of starting threads every cycle."""
+        delays = {f'region-{n}': 0.01 for n in range(4)}
+        targets = [(f'i-{region}', region, False, None) for region in delays]
+        threads_before = threading.active_count()
+
+        with patch('service.metrics_collector.fetch_instance_metrics_batch', side_effect=slow_fetch(delays)):
+            collect_metrics(targets, max_workers=4)
+            executor = get_executor(4)
+            for _ in range(10):
+                collect_metrics(targets, max_workers=4)
+
+        assert get_executor(4) is executor
+        assert threading.active_count() - threads_before <= 4
+
+    def test_no_targets(self):
+        """Test that an empty target list returns an empty result."""
+        assert collect_metrics([]) == {}
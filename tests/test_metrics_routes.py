@@ -0,0 +1,65 @@
+"""Unit tests for api/metrics_routes.py"""
+import pytest
+from repo.models import Metric
+from service.decision_queue import decision_queue
+
+
+class TestSimulateMetrics:
+    """Test cases for the metrics simulation endpoint."""
+
+    def test_instant_simulation(self, client, auth_headers, sample_instance):
+        """Test that a single simulated metric is stored and returned."""
+        response = client.post('/api/metrics/simulate', headers=auth_headers, json={
+            'instance_id': sample_instance['instance_id'],
+            'cpu_utilization': 75.0,
+            'memory_usage': 60.0
+        })
+
+        assert response.status_code == 201
+        metric = response.get_json()['metric']
+        assert metric['cpu_utilization'] == 75.0
+        assert metric['is_outlier'] is False
+        assert Metric.query.count() == 1
+
+    def test_prolonged_simulation(self, client, auth_headers, sample_instance):
+        """Test that a prolonged simulation bulk inserts one row per interval."""
+        response = client.post('/api/metrics/simulate', headers=auth_headers, json={
+            'instance_id': sample_instance['instance_id'],
+            'cpu_utilization': 95.0,
+            'memory_usage': 50.0,
+            'duration_minutes': 10,
+            'interval_seconds': 30
+        })
+
+        assert response.status_code == 201
+        data = response.get_json()
+        assert data['metrics_created'] == 20
+        assert len(data['sample_metrics']) == 3
+        assert Metric.query.filter_by(instance_key=sample_instance['instance_key']).count() == 20
+
+    def test_simulated_instance_is_queued_for_decision(self, client, auth_headers, sample_instance):
+        """Test that a committed simulation queues the instance for the decision worker."""
+        response = client.post('/api/metrics/simulate', headers=auth_headers, json={
+            'instance_id': sample_instance['instance_id'],
+            'cpu_utilization': 95.0
+        })
+
+        assert response.status_code == 201
+        assert decision_queue.take(timeout=0) == [sample_instance['instance_id']]
+
+    def test_clear_existing(self, client, auth_headers, sample_instance, sample_metrics):
+        """Test that clear_existing replaces the instance's metrics."""
+        response = client.post('/api/metrics/simulate', headers=auth_headers, json={
+            'instance_id': sample_instance['instance_id'],
+            'cpu_utilization': 5.0,
+            'clear_existing': True
+        })
+
+        assert response.status_code == 201
+        assert Metric.query.count() == 1
+
+    def test_unknown_instance(self, client, auth_headers):
+        """Test that simulating for an unknown instance returns 404."""
+        response = client.post('/api/metrics/simulate', headers=auth_headers, json={'instance_id': 'i-missing'})
+
+        assert response.status_code == 404
@@ -0,0 +1,161 @@
+"""Unit tests for repo/migrations.py"""
+import pytest
+from datetime import datetime, timedelta
+from sqlalchemy import create_engine, inspect, text
+from repo.migrations import prepare_schema, upgrade_schema
+from repo.compaction import move_wide_metrics, WIDE_TABLE
+from repo.models import MetricOutlier
+
+
+@pytest.fixture
+def legacy_engine():
+    """An SQLite database with the tables as created by an older release."""
+    engine = create_engine('sqlite:///:memory:')
+    with engine.begin() as conn:
+        conn.execute(text('CREATE TABLE users (id CHAR(32) PRIMARY KEY, email VARCHAR UNIQUE)'))
+        conn.execute(text('CREATE TABLE instances (id CHAR(32) PRIMARY KEY, instance_id VARCHAR UNIQUE)'))
+        conn.execute(text(
+            'CREATE TABLE metrics (id CHAR(32) PRIMARY KEY, instance_id VARCHAR, timestamp DATETIME, '
+            'cpu_utilization FLOAT, memory_usage FLOAT, network_in BIGINT, network_out BIGINT)'
+        ))
+        conn.execute(text("INSERT INTO instances VALUES ('1', 'i-a'), ('2', 'i-b')"))
+    return engine
+
+
+def insert_wide_metrics(engine, rows):
+    """Insert (id, instance_id, timestamp, cpu_utilization) rows into a wide metrics table."""
+    with engine.begin() as conn:
+        conn.execute(
+            text('INSERT INTO metrics (id, instance_id, timestamp, cpu_utilization) VALUES (:id, :instance_id, :timestamp, :cpu)'),
+            [{'id': id_, 'instance_id': instance_id, 'timestamp': timestamp, 'cpu': cpu} for id_, instance_id, timestamp, cpu in rows]
+        )
+
+
+class TestUpgradeSchema:
+    """Test cases for in-place schema upgrades."""
+
+    def test_missing_column_and_index_are_added(self, legacy_engine):
+        """Test that an old schema is brought up to date."""
+        upgrade_schema(legacy_engine)
+
+        inspector = inspect(legacy_engine)
+        columns = {c['name'] for c in inspector.get_columns('instances')}
+        assert {'last_ingested_at', 'last_evaluated_at', 'scaling_policy', 'instance_key'} <= columns
+        assert 'scaling_policy' in {c['name'] for c in inspector.get_columns('users')}
+        # Indexed before it was set aside; the compaction job walks that index
+        assert 'uq_metrics_instance_timestamp' in {i['name'] for i in inspector.get_indexes(WIDE_TABLE)}
+
+    def test_upgrade_is_idempotent(self, legacy_engine):
+        """Test that running the upgrade twice is harmless."""
+        upgrade_schema(legacy_engine)
+        upgrade_schema(legacy_engine)
+
+        columns = [c['name'] for c in inspect(legacy_engine).get_columns('instances')]
+        assert columns.count('last_ingested_at') == 1
+        assert columns.count('instance_key') == 1
+
+    def test_instances_get_distinct_keys(self, legacy_engine):
+        """Test that existing instances are numbered before any table refers to their keys."""
+        prepare_schema(legacy_engine)
+
+        with legacy_engine.connect() as conn:
+            keys = conn.execute(text('SELECT instance_key FROM instances ORDER BY instance_id')).scalars().all()
+        assert keys == [1, 2]
+
+    def test_outlier_flags_move_to_their_own_table(self, legacy_engine):
+        """Test that flags kept on metric rows become annotations and the columns are dropped."""
+        with legacy_engine.begin() as conn:
+            conn.execute(text('ALTER TABLE metrics ADD COLUMN is_outlier BOOLEAN'))
+            conn.execute(text('ALTER TABLE metrics ADD COLUMN outlier_type VARCHAR'))
+            conn.execute(text(
+                "INSERT INTO metrics (id, instance_id, timestamp, is_outlier, outlier_type) VALUES "
+                "('a', 'i-a', '2026-01-01 12:00:00.000000', 1, 'scale_up'), "
+                "('b', 'i-a', '2026-01-01 12:01:00.000000', 0, NULL)"
+            ))
+        prepare_schema(legacy_engine)
+        # Created by db.create_all() before the upgrade runs
+        MetricOutlier.__table__.create(legacy_engine)
+
+        upgrade_schema(legacy_engine)
+        upgrade_schema(legacy_engine)
+
+        with legacy_engine.connect() as conn:
+            flags = conn.execute(text('SELECT instance_key, timestamp, outlier_type FROM metric_outliers')).all()
+        assert [tuple(flag) for flag in flags] == [(1, '2026-01-01 12:00:00.000000', 1)]
+        assert 'is_outlier' not in {c['name'] for c in inspect(legacy_engine).get_columns(WIDE_TABLE)}
+
+    def test_outlier_table_keyed_by_instance_id_is_rebuilt(self, legacy_engine):
+        """Test that a metric_outliers table of the wide layout is rebuilt keyed by instance_key."""
+        with legacy_engine.begin() as conn:
+            conn.execute(text(
+                'CREATE TABLE metric_outliers (instance_id VARCHAR, timestamp DATETIME, outlier_type VARCHAR, '
+                'flagged_at DATETIME, PRIMARY KEY (instance_id, timestamp))'
+            ))
+            conn.execute(text(
+                "INSERT INTO metric_outliers VALUES ('i-b', '2026-01-01 12:00:00.000000', 'scale_down', "
+                "'2026-01-01 12:00:30.000000')"
+            ))
+
+        upgrade_schema(legacy_engine)
+
+        with legacy_engine.connect() as conn:
+            flags = conn.execute(text('SELECT instance_key, outlier_type, flagged_at FROM metric_outliers')).all()
+        assert [tuple(flag) for flag in flags] == [(2, 2, '2026-01-01 12:00:30.000000')]
+        assert not inspect(legacy_engine).has_table('metric_outliers_wide')
+
+
+class TestCompactMetrics:
+    """Test cases for moving a wide metrics table to the compact layout online."""
+
+    def test_recent_metrics_are_copied_during_the_upgrade(self, legacy_engine):
+        """Test that the upgrade copies the recent metrics and leaves the rest in the wide table."""
+        now = datetime.utcnow()
+        insert_wide_metrics(legacy_engine, [
+            ('a', 'i-a', now - timedelta(minutes=5), 40.5),
+            ('b', 'i-a', now - timedelta(days=2), 41.0),
+        ])
+
+        upgrade_schema(legacy_engine)
+
+        with legacy_engine.connect() as conn:
+            rows = conn.execute(text('SELECT id, instance_key, cpu_utilization FROM metrics')).all()
+            waiting = conn.execute(text(f'SELECT COUNT(*) FROM {WIDE_TABLE}')).scalar()
+        assert [tuple(row) for row in rows] == [(1, 1, 40.5)]
+        assert waiting == 2
+        assert 'instance_id' not in {c['name'] for c in inspect(legacy_engine).get_columns('metrics')}
+
+    def test_batches_move_every_row_and_drop_the_wide_table(self, legacy_engine):
+        """Test that keyset batches move each row once, past conflicts, and drop the emptied table."""
+        now = datetime.utcnow()
+        insert_wide_metrics(legacy_engine, [
+            (f'{instance_id}{n}', instance_id, now - timedelta(hours=n, minutes=1), float(n))
+            for instance_id in ('i-a', 'i-b') for n in range(5)
+        ])
+        upgrade_schema(legacy_engine)
+
+        batches = []
+        while (copied := move_wide_metrics(legacy_engine, batch_rows=3, retention_days=0)) is not None:
+            batches.append(copied)
+
+        with legacy_engine.connect() as conn:
+            stored = conn.execute(text('SELECT instance_key, cpu_utilization FROM metrics ORDER BY instance_key, cpu_utilization')).all()
+        assert [tuple(row) for row in stored] == [(key, float(n)) for key in (1, 2) for n in range(5)]
+        # The upgrade copied the newest row of each instance; the batches skip those
+        assert sum(batches) == 8 and len(batches) == 4
+        assert not inspect(legacy_engine).has_table(WIDE_TABLE)
+        assert move_wide_metrics(legacy_engine) is None
+
+    def test_expired_rows_are_not_copied(self, legacy_engine):
+        """Test that rows past the retention period are dropped with the wide table."""
+        now = datetime.utcnow()
+        insert_wide_metrics(legacy_engine, [
+            ('a', 'i-a', now - timedelta(days=2), 1.0),
+            ('b', 'i-a', now - timedelta(days=40), 2.0),
+        ])
+        upgrade_schema(legacy_engine)
+
+        while move_wide_metrics(legacy_engine, retention_days=30) is not None:
+            pass
+
+        with legacy_engine.connect() as conn:
+            assert conn.execute(text('SELECT cpu_utilization FROM metrics')).scalars().all() == [1.0]
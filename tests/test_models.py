@@ -0,0 +1,53 @@
+"""Unit tests for repo/models.py"""
+import threading
+from sqlalchemy import create_engine, text
+from sqlalchemy.orm import Session
+from repo.db import db
+from repo.models import Instance, User
+
+
+def add_instance(engine, user_id, instance_id):
+    with Session(engine) as session:
+        session.add(Instance(instance_id=instance_id, user_id=user_id, region='mock', is_mock=True))
+        session.commit()
+
+
+class TestInstanceKey:
+    """Test cases for drawing instance keys on SQLite."""
+
+    def test_concurrent_sessions_draw_distinct_keys(self, tmp_path):
+        """Test that a session creating an instance while another one's is uncommitted gets its own key."""
+        engine = create_engine(f"sqlite:///{tmp_path / 'keys.db'}")
+        db.metadata.create_all(engine)
+        with Session(engine) as session:
+            user = User(email='keys@example.com', password='x')
+            session.add(user)
+            session.commit()
+            user_id = user.id
+
+        first = Session(engine)
+        first.add(Instance(instance_id='i-first', user_id=user_id, region='mock', is_mock=True))
+        first.flush()
+        # The second session waits for the first one's write to finish
+        second = threading.Thread(target=add_instance, args=(engine, user_id, 'i-second'))
+        second.start()
+        second.join(timeout=0.5)
+        first.commit()
+        first.close()
+        second.join()
+
+        with engine.connect() as conn:
+            keys = conn.execute(text('SELECT instance_id, instance_key FROM instances ORDER BY instance_id')).all()
+        assert [instance_id for instance_id, _ in keys] == ['i-first', 'i-second']
+        assert len({key for _, key in keys}) == 2
+        engine.dispose()
+
+    def test_keys_continue_after_existing_instances(self, app, sample_user):
+        """Test that keys drawn in one flush are distinct and follow the keys already stored."""
+        db.session.add(Instance(instance_id='i-old', instance_key=41, user_id=sample_user['id'], region='mock'))
+        db.session.commit()
+        db.session.add_all(Instance(instance_id=f'i-{n}', user_id=sample_user['id'], region='mock') for n in range(3))
+        db.session.commit()
+
+        keys = [instance.instance_key for instance in Instance.query.order_by(Instance.instance_key).all()]
+        assert keys == [41, 42, 43, 44]
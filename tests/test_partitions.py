@@ -0,0 +1,169 @@
+"""Unit tests for repo/partitions.py"""
+import os
+import uuid
+import pytest
+from datetime import datetime, timedelta
+from sqlalchemy import create_engine, text
+from sqlalchemy.orm import Session
+from repo.db import db
+from repo.models import Instance, Metric, User
+from repo.partitions import (
+    plan_partitions, expired_partitions, maintain_partitions, partition_metrics_table, create_partitions,
+    drop_expired, list_partitions, metrics_layout, LEGACY_PARTITION, DEFAULT_PARTITION
+)
+
+TODAY = datetime(2026, 10, 17, 15, 30)
+
+DATABASE_URL = os.getenv('DATABASE_URL', '').replace('postgres://', 'postgresql://', 1)
+requires_postgres = pytest.mark.skipif(
+    not DATABASE_URL.startswith('postgresql'), reason='needs DATABASE_URL of a PostgreSQL database'
+)
+
+
+def day(offset):
+    return datetime(2026, 10, 17) + timedelta(days=offset)
+
+
+class TestPlanPartitions:
+    """Test cases for choosing the daily partitions to create."""
+
+    def test_creates_today_through_days_ahead(self):
+        """Test that an unpartitioned range gets one partition per day, today included."""
+        planned = plan_partitions([], TODAY, days_ahead=2)
+
+        assert planned == [
+            ('metrics_p20261017', day(0), day(1)),
+            ('metrics_p20261018', day(1), day(2)),
+            ('metrics_p20261019', day(2), day(3)),
+        ]
+
+    def test_skips_days_already_covered(self):
+        """Test that existing partitions, including an unbounded legacy one, are not overlapped."""
+        existing = [('metrics_legacy', None, day(1)), ('metrics_p20261019', day(2), day(3))]
+
+        planned = plan_partitions(existing, TODAY, days_ahead=3)
+
+        assert [name for name, _, _ in planned] == ['metrics_p20261018', 'metrics_p20261020']
+
+
+class TestExpiredPartitions:
+    """Test cases for choosing the partitions retention drops."""
+
+    def test_only_partitions_entirely_before_the_cutoff(self):
+        """Test that a partition is dropped only once its newest possible row is older than the cutoff."""
+        existing = [
+            ('metrics_legacy', None, day(-30)),
+            ('metrics_p20260917', day(-30), day(-29)),
+            ('metrics_p20260918', day(-29), day(-28)),
+        ]
+
+        assert expired_partitions(existing, day(-29)) == ['metrics_legacy', 'metrics_p20260917']
+        assert expired_partitions(existing, day(-29) - timedelta(seconds=1)) == ['metrics_legacy']
+
+
+class TestMaintainPartitions:
+    """Test cases for the partition job outside PostgreSQL."""
+
+    def test_sqlite_is_left_alone(self, app, sample_metrics):
+        """Test that a plain SQLite table is neither partitioned nor trimmed."""
+        with app.app_context():
+            assert maintain_partitions(db.engine, TODAY + timedelta(days=365)) == ([], [])
+            assert Metric.query.count() == len(sample_metrics)
+
+
+@pytest.fixture
+def pg_engine():
+    """An engine on a throwaway schema of the DATABASE_URL database with the tables of an older release, metrics plain."""
+    schema = f'test_{uuid.uuid4().hex[:8]}'
+    with create_engine(DATABASE_URL).begin() as conn:
+        if conn.execute(text("SELECT EXISTS (SELECT 1 FROM pg_extension WHERE extname = 'timescaledb')")).scalar():
+            pytest.skip('TimescaleDB makes metrics a hypertable instead')
+        conn.execute(text(f'CREATE SCHEMA {schema}'))
+    engine = create_engine(DATABASE_URL, connect_args={'options': f'-csearch_path={schema}'})
+    db.metadata.create_all(engine)
+    with Session(engine) as session:
+        user = User(email='pg@example.com', password='x')
+        session.add(user)
+        session.flush()
+        session.add(Instance(instance_id='i-pg', user_id=user.id, region='mock', is_mock=True))
+        session.commit()
+    yield engine
+    engine.dispose()
+    with create_engine(DATABASE_URL).begin() as conn:
+        conn.execute(text(f'DROP SCHEMA {schema} CASCADE'))
+
+
+def insert_metrics(conn, timestamps):
+    conn.execute(
+        text("INSERT INTO metrics (instance_key, timestamp, cpu_utilization) "
+             "SELECT instance_key, :timestamp, 50 FROM instances WHERE instance_id = 'i-pg'"),
+        [{'timestamp': timestamp} for timestamp in timestamps]
+    )
+
+
+def partition_of(conn, timestamp):
+    return conn.execute(
+        text('SELECT tableoid::regclass::text FROM metrics WHERE timestamp = :timestamp'), {'timestamp': timestamp}
+    ).scalar()
+
+
+@requires_postgres
+class TestPostgresPartitions:
+    """Test cases for partitioning the metrics table on a real PostgreSQL database."""
+
+    def test_legacy_table_is_converted_partitions_created_and_expired(self, pg_engine):
+        """Test that a plain table becomes the legacy partition, daily partitions are added ahead and expired ones dropped."""
+        today = datetime.combine(datetime.utcnow().date(), datetime.min.time())
+        old, recent = today - timedelta(days=40), today - timedelta(hours=1)
+        with pg_engine.begin() as conn:
+            insert_metrics(conn, [old, recent])
+
+        with pg_engine.begin() as conn:
+            partition_metrics_table(conn)
+            assert metrics_layout(conn) == 'partitioned'
+            assert list_partitions(conn) == [(LEGACY_PARTITION, None, today + timedelta(days=1))]
+            assert partition_of(conn, old) == LEGACY_PARTITION
+
+        # A row past every partition waits in the default one until its day is created
+        later = today + timedelta(days=2, hours=3)
+        with pg_engine.begin() as conn:
+            insert_metrics(conn, [later])
+            assert partition_of(conn, later) == DEFAULT_PARTITION
+            created = create_partitions(conn, today, days_ahead=2)
+            assert created == [f'metrics_p{today + timedelta(days=d):%Y%m%d}' for d in (1, 2)]
+            assert partition_of(conn, later) == created[1]
+
+        with pg_engine.begin() as conn:
+            dropped = drop_expired(conn, today + timedelta(days=2))
+            assert dropped == [LEGACY_PARTITION, created[0]]
+            assert conn.execute(text('SELECT timestamp FROM metrics')).scalars().all() == [later]
+            # Converting again leaves the partitioned table alone
+            partition_metrics_table(conn)
+            assert [name for name, _, _ in list_partitions(conn)] == [created[1]]
+
+    def test_inserts_after_converting_a_populated_table_get_new_ids(self, pg_engine):
+        """Test that rows inserted through the partitioned table never reuse the ids of the legacy rows."""
+        today = datetime.combine(datetime.utcnow().date(), datetime.min.time())
+        with pg_engine.begin() as conn:
+            insert_metrics(conn, [today - timedelta(days=2), today - timedelta(days=1), today - timedelta(hours=2)])
+            legacy_ids = conn.execute(text('SELECT id FROM metrics')).scalars().all()
+
+        with pg_engine.begin() as conn:
+            partition_metrics_table(conn)
+            identity = conn.execute(text(
+                "SELECT attidentity FROM pg_attribute WHERE attrelid = to_regclass(:table) AND attname = 'id'"
+            ), {'table': LEGACY_PARTITION}).scalar()
+            assert identity == ''
+
+        # Into the legacy partition, the default one, and a daily one created afterwards
+        soon, later = today - timedelta(hours=1), today + timedelta(days=1, hours=3)
+        with pg_engine.begin() as conn:
+            insert_metrics(conn, [soon, later])
+            created = create_partitions(conn, today, days_ahead=1)
+            insert_metrics(conn, [later + timedelta(minutes=1)])
+            assert partition_of(conn, soon) == LEGACY_PARTITION
+            assert partition_of(conn, later) == created[0]
+            ids = conn.execute(text('SELECT id FROM metrics ORDER BY id')).scalars().all()
+
+        assert len(ids) == len(set(ids)) == 6
+        assert min(set(ids) - set(legacy_ids)) > max(legacy_ids)
@@ -0,0 +1,265 @@
+"""Unit tests for service/policy_engine.py"""
+import copy
+import random
+import re
+import pytest
+from datetime import timedelta
+from repo.db import db
+from repo.models import Instance, User
+from service.policy_engine import (
+    DEFAULT_PLAN, compile_policy, normalize_policy, resolve_policies, instance_plan
+)
+from service.forecaster import ForecastStore
+from service.scaling_service import SUSTAINED_CHECKS, evaluate_scaling_decision, sustained_usage, sustained_trackers
+from service.sustained_tracker import SustainedTrackerStore
+from constants.service_constants import SUSTAINED_DURATION_MINUTES
+from tests.test_fleet_evaluator import NOW, Sample, random_window, random_baseline
+
+CPU_AT_70 = {
+    'name': 'eager',
+    'rules': [{'type': 'sustained', 'decision': 'scale_up', 'conditions': [{'metric': 'cpu_utilization', 'above': 70}]}]
+}
+
+
+def steady_window(instance_id, cpu, memory=50.0, minutes=10):
+    """A window with one sample per minute at constant usage."""
+    samples = [
+        Sample(f'{instance_id}-{k}', NOW - timedelta(minutes=minutes - 1 - k), cpu, memory, 1000, 500, False)
+        for k in range(minutes)
+    ]
+    return (instance_id, samples, samples[-1], samples[0].timestamp)
+
+
+class TestCompilePolicy:
+    """Test cases for validating and compiling policy definitions."""
+
+    def test_omitted_settings_get_defaults(self):
+        """Test that a minimal rule is filled in from the service constants."""
+        [rule] = normalize_policy(CPU_AT_70)['rules']
+
+        assert rule['minutes'] == 5
+        assert rule['percentage'] == 80
+        assert rule['min_samples'] == 3
+        assert rule['match'] == 'all'
+        assert rule['flag_outlier'] is True
+
+    def test_equal_definitions_share_a_plan(self):
+        """Test that a definition is compiled once, whatever its key order."""
+        reordered = {'rules': CPU_AT_70['rules'], 'name': 'eager'}
+
+        assert compile_policy(copy.deepcopy(CPU_AT_70)) is compile_policy(reordered)
+
+    def test_plan_reads_only_what_its_rules_need(self):
+        """Test that the plan picks its columns and the longest window of its rules."""
+        plan = compile_policy({'rules': [
+            {'type': 'sustained', 'decision': 'scale_up', 'minutes': 15,
+             'conditions': [{'metric': 'memory_usage', 'above': 80}]},
+            {'type': 'iqr', 'minutes': 10, 'weights': {'cpu_utilization': 2}},
+        ]})
+
+        assert plan.fields == ('cpu_utilization', 'memory_usage')
+        assert plan.minutes == (10, 15)
+        assert plan.window_minutes == 15
+        assert DEFAULT_PLAN.window_minutes == 5
+
+    @pytest.mark.parametrize('definition, message', [
+        ([], 'policy must be an object'),
+        ({'rules': []}, 'policy.rules must be a non-empty list'),
+        ({'rules': [{'type': 'magic'}]}, 'rules[0].type must be one of'),
+        ({'rules': [{'type': 'iqr'}, {'type': 'forecast'}]}, 'rules[1] can never run'),
+        ({'rules': [{'type': 'sustained', 'decision': 'scale_up',
+                     'conditions': [{'metric': 'disk', 'above': 1}]}]}, 'rules[0].conditions[0].metric'),
+        ({'rules': [{'type': 'sustained', 'decision': 'scale_up', 'percentage': 150,
+                     'conditions': [{'metric': 'cpu_utilization', 'above': 1}]}]}, 'rules[0].percentage must be at most 100'),
+        ({'rules': [{'type': 'iqr', 'multipler': 3}]}, 'rules[0] has unknown key(s): multipler'),
+        ({'rules': [{'type': 'iqr', 'votes': True}]}, 'rules[0].votes must be a number'),
+        ({'rules': [{'type': 'average', 'decision': 'scale_up', 'percentage': 50,
+                     'conditions': [{'metric': 'cpu_utilization', 'above': 1}]}]}, 'rules[0] has unknown key(s): percentage'),
+    ])
+    def test_invalid_definitions_are_rejected(self, definition, message):
+        """Test that validation names the offending setting."""
+        with pytest.raises(ValueError, match=re.escape(message)):
+            compile_policy(definition)
+
+
+class TestDefaultPolicy:
+    """Test cases for the built-in policy against the built-in evaluator."""
+
+    def test_identical_to_built_in_logic(self):
+        """Test that the default plan returns the decisions, reasons and flags of evaluate_scaling_decision."""
+        rnd = random.Random(21)
+        windows = [random_window(rnd, n) for n in range(2000)]
+
+        results = DEFAULT_PLAN.evaluate(windows, NOW)
+
+        assert results == [evaluate_scaling_decision(*window, NOW) for window in windows]
+        # Every branch of the decision logic is covered
+        reasons = {reason.split(' ')[0] + ' ' + reason.split(' ')[1] for _, reason, _ in results}
+        assert {'Sustained scale', 'Insufficient historical', 'Insufficient data',
+                'Scale up', 'Scale down', 'All metrics'} <= reasons
+
+    def test_identical_to_built_in_logic_with_forecasts(self):
+        """Test that the default plan's forecast rule matches predictive scaling when forecasts are handed in."""
+        rnd = random.Random(23)
+        windows = [random_window(rnd, n) for n in range(1000)]
+        store = ForecastStore()
+        forecasts = [store.update(window[0], window[1]) for window in windows]
+
+        results = DEFAULT_PLAN.evaluate(windows, NOW, forecasts=forecasts)
+
+        assert results == [
+            evaluate_scaling_decision(*window, NOW, forecast=forecast) for window, forecast in zip(windows, forecasts)
+        ]
+        assert any(reason.startswith("Predicted scale up") for _, reason, _ in results)
+        assert any(reason.startswith("Predicted scale down") for _, reason, _ in results)
+
+    def test_tracker_counts_match_counting_the_windows(self):
+        """Test that sustained tracker results give the same outcomes as counting the sustained windows."""
+        rnd = random.Random(13)
+        windows = [random_window(rnd, n) for n in range(1000)]
+        trackers = SustainedTrackerStore(sustained_trackers._conditions)
+        cutoff = NOW - timedelta(minutes=SUSTAINED_DURATION_MINUTES)
+        sustained = [trackers.track(window[0], window[1], cutoff) for window in windows]
+
+        assert DEFAULT_PLAN.evaluate(windows, NOW, sustained=sustained) == DEFAULT_PLAN.evaluate(windows, NOW)
+
+    def test_identical_to_evaluate_scaling_decision_with_its_inputs(self):
+        """Test that the default plan decides like evaluate_scaling_decision with trackers, baselines and forecasts."""
+        rnd = random.Random(24)
+        windows = [random_window(rnd, n) for n in range(500)]
+        cutoff = NOW - timedelta(minutes=SUSTAINED_DURATION_MINUTES)
+        sustained = [
+            [sustained_usage([s for s in samples if s.timestamp >= cutoff], *check) for check in SUSTAINED_CHECKS]
+            for _, samples, _, _ in windows
+        ]
+        baselines = [random_baseline(rnd) for _ in windows]
+        store = ForecastStore()
+        forecasts = [store.update(window[0], window[1]) for window in windows]
+
+        for inputs in ({}, {'sustained': sustained}, {'baselines': baselines}, {'forecasts': forecasts},
+                       {'sustained': sustained, 'baselines': baselines, 'forecasts': forecasts}):
+            expected = [
+                evaluate_scaling_decision(
+                    *window, NOW,
+                    baseline=inputs['baselines'][i] if 'baselines' in inputs else None,
+                    sustained=inputs['sustained'][i] if 'sustained' in inputs else None,
+                    forecast=inputs['forecasts'][i] if 'forecasts' in inputs else None
+                )
+                for i, window in enumerate(windows)
+            ]
+            assert DEFAULT_PLAN.evaluate(windows, NOW, **inputs) == expected
+
+
+class TestEvaluatePlan:
+    """Test cases for evaluating custom policies."""
+
+    def test_lower_threshold_scales_up_earlier(self):
+        """Test that a custom threshold decides where the default logic does not."""
+        windows = [steady_window('i-a', 75.0), steady_window('i-b', 60.0)]
+
+        results = compile_policy(CPU_AT_70).evaluate(windows, NOW)
+
+        assert results[0] == (
+            'scale_up', 'Sustained scale up: CPU > 70% for 100.0% of last 5 minutes (Current: 75.00%)', 'scale_up'
+        )
+        assert results[1] == ('no_action', 'No policy rule matched. Current: CPU: 60.00%, Memory: 50.00%', None)
+        assert DEFAULT_PLAN.evaluate(windows[:1], NOW)[0][0] == 'no_action'
+
+    def test_rules_apply_in_order(self):
+        """Test that the first rule that fires decides and any match joins with OR."""
+        plan = compile_policy({'rules': [
+            {'type': 'sustained', 'decision': 'scale_down', 'flag_outlier': False,
+             'conditions': [{'metric': 'cpu_utilization', 'below': 30}]},
+            {'type': 'sustained', 'decision': 'scale_up', 'match': 'any', 'minutes': 8,
+             'conditions': [{'metric': 'cpu_utilization', 'above': 90}, {'metric': 'memory_usage', 'above': 60}]},
+        ]})
+
+        low, busy = plan.evaluate([steady_window('i-a', 20.0, 70.0), steady_window('i-b', 50.0, 70.0)], NOW)
+
+        assert low == ('scale_down', 'Sustained scale down: CPU < 30% for 100.0% of last 5 minutes (Current: 20.00%)', None)
+        assert busy[0] == 'scale_up'
+        assert busy[1].startswith('Sustained scale up: CPU > 90% OR Memory > 60% for 100.0% of last 8 minutes')
+
+    def test_iqr_weights_and_votes(self):
+        """Test that IQR voting uses the policy's weights and vote threshold."""
+        samples = [
+            Sample(str(k), NOW - timedelta(minutes=4 - k), 40.0 + k % 2, 50.0, 1000, 500, False) for k in range(5)
+        ]
+        spike = samples[-1]._replace(cpu_utilization=80.0)
+        window = ('i-a', samples[:-1] + [spike], spike, NOW - timedelta(hours=1))
+        one_vote = {'rules': [{'type': 'iqr', 'votes': 1, 'weights': {'cpu_utilization': 1}}]}
+        three_votes = {'rules': [{'type': 'iqr', 'votes': 3, 'weights': {'cpu_utilization': 2}}]}
+
+        assert compile_policy(one_vote).evaluate([window], NOW)[0][0] == 'scale_up'
+        assert compile_policy(three_votes).evaluate([window], NOW)[0][0] == 'no_action'
+
+    def test_short_average_next_to_long_sustained_rule(self):
+        """Test that rules over 1, 5 and 15 minute windows of one load each see their own window."""
+        plan = compile_policy({'rules': [
+            {'type': 'average', 'decision': 'scale_up', 'minutes': 1,
+             'conditions': [{'metric': 'cpu_utilization', 'above': 95}]},
+            {'type': 'sustained', 'decision': 'scale_up', 'minutes': 15, 'percentage': 60,
+             'conditions': [{'metric': 'cpu_utilization', 'above': 70}]},
+            {'type': 'average', 'decision': 'scale_down', 'minutes': 5, 'match': 'any',
+             'conditions': [{'metric': 'cpu_utilization', 'below': 10}, {'metric': 'memory_usage', 'below': 10}]},
+        ]})
+        _, spike, _, oldest = steady_window('i-spike', 40.0, minutes=15)
+        # The 1 minute window holds the last two samples
+        spike[-2:] = [spike[-2]._replace(cpu_utilization=97.0), spike[-1]._replace(cpu_utilization=99.0)]
+        _, busy, _, _ = steady_window('i-busy', 40.0, minutes=15)
+        busy[5:] = [s._replace(cpu_utilization=80.0) for s in busy[5:]]
+        spike, busy = ('i-spike', spike, spike[-1], oldest), ('i-busy', busy, busy[-1], oldest)
+        idle = steady_window('i-idle', 50.0, memory=5.0, minutes=15)
+
+        results = plan.evaluate([spike, busy, idle], NOW)
+
+        assert plan.minutes == (1, 5, 15)
+        assert results[0] == (
+            'scale_up', 'Average scale up: CPU > 95% over last 1 minutes (Average: 98.00%)', 'scale_up'
+        )
+        assert results[1][1] == 'Sustained scale up: CPU > 70% for 66.7% of last 15 minutes (Current: 80.00%)'
+        assert results[2] == (
+            'scale_down', 'Average scale down: CPU < 10% OR Memory < 10% over last 5 minutes '
+                          '(Average: CPU=50.00%, Memory=5.00%)', 'scale_down'
+        )
+
+    def test_forecast_rule_without_forecasts_is_skipped(self):
+        """Test that a forecast rule never fires when no forecasts are given."""
+        plan = compile_policy({'rules': [{'type': 'forecast', 'scale_up_above': 0}]})
+
+        assert plan.evaluate([steady_window('i-a', 50.0)], NOW)[0][0] == 'no_action'
+        assert plan.needs_forecast
+
+    def test_empty_fleet(self):
+        """Test that no windows give no results."""
+        assert compile_policy(CPU_AT_70).evaluate([], NOW) == []
+
+
+class TestResolvePolicies:
+    """Test cases for finding the policy of each instance."""
+
+    def test_instance_policy_overrides_user_policy(self, app, sample_user, sample_instance):
+        """Test that instance, then user, then the built-in default applies."""
+        with app.app_context():
+            db.session.add(Instance(instance_id='i-other', user_id=sample_user['id']))
+            db.session.commit()
+            assert resolve_policies(Instance.query.all()) == {}
+
+            User.query.first().scaling_policy = CPU_AT_70
+            instance = Instance.query.filter_by(instance_id=sample_instance['instance_id']).first()
+            instance.scaling_policy = {'rules': [{'type': 'iqr'}]}
+            db.session.commit()
+
+            plans = resolve_policies(Instance.query.all())
+            assert plans['i-other'] is compile_policy(CPU_AT_70)
+            assert plans[instance.instance_id] is compile_policy({'rules': [{'type': 'iqr'}]})
+            assert instance_plan('i-other') is plans['i-other']
+            assert instance_plan('i-unknown') is None
+
+    def test_invalid_stored_policy_falls_back_to_default(self, app, sample_instance):
+        """Test that a policy edited into an invalid state is ignored."""
+        with app.app_context():
+            Instance.query.first().scaling_policy = {'rules': 'none'}
+            db.session.commit()
+
+            assert resolve_policies(Instance.query.all()) == {}
@@ -0,0 +1,60 @@
+"""Unit tests for service/quantile_sketch.py"""
+import random
+import pytest
+from service.quantile_sketch import P2Quartiles
+
+
+def exact_quartiles(values):
+    values = sorted(values)
+    return values[len(values) // 4], values[(3 * len(values)) // 4]
+
+
+class TestP2Quartiles:
+    """Test cases for the streaming quartile estimator."""
+
+    def test_empty(self):
+        """Test that no values give no quartiles."""
+        assert P2Quartiles().quartiles() is None
+
+    def test_first_values_are_exact(self):
+        """Test that up to five values pick the same elements as iqr_bounds."""
+        sketch = P2Quartiles()
+        values = [7.0, 1.0, 9.0, 3.0, 5.0]
+        for n, value in enumerate(values, start=1):
+            sketch.add(value)
+            assert sketch.quartiles() == exact_quartiles(values[:n])
+
+    @pytest.mark.parametrize('draw', [
+        lambda rnd: rnd.gauss(50, 5),
+        lambda rnd: rnd.uniform(0, 100),
+        lambda rnd: rnd.expovariate(1 / 1e6),
+    ])
+    def test_estimates_close_to_exact(self, draw):
+        """Test that the estimates stay within a few percent of the spread of the data."""
+        rnd = random.Random(3)
+        sketch = P2Quartiles()
+        values = [draw(rnd) for _ in range(2880)]
+        for value in values:
+            sketch.add(value)
+
+        q1, q3 = sketch.quartiles()
+        exact_q1, exact_q3 = exact_quartiles(values)
+        tolerance = 0.05 * (exact_q3 - exact_q1)
+        assert abs(q1 - exact_q1) < tolerance
+        assert abs(q3 - exact_q3) < tolerance
+
+    def test_state_round_trip(self):
+        """Test that a restored sketch continues exactly where the original was."""
+        rnd = random.Random(5)
+        sketch = P2Quartiles()
+        for _ in range(100):
+            sketch.add(rnd.random())
+
+        restored = P2Quartiles.from_state(sketch.to_state())
+        for _ in range(100):
+            value = rnd.random()
+            sketch.add(value)
+            restored.add(value)
+
+        assert restored.quartiles() == sketch.quartiles()
+        assert restored.count == 200
@@ -0,0 +1,209 @@
+"""Unit tests for service/replay.py"""
+import random
+import pytest
+from collections import namedtuple
+from datetime import datetime, timedelta
+from repo.db import db
+from repo.models import Instance, Metric
+from service.replay import (
+    MetricSeries, ReplayDecision, replay, stored_plans, series_from_database, load_series, count_flaps, time_to_scale
+)
+from service.scaling_service import evaluate_scaling_decision, DECISION_WINDOW_MINUTES
+from service.forecaster import ForecastStore
+
+START = datetime(2026, 1, 1)
+
+Sample = namedtuple('Sample', 'id timestamp cpu_utilization memory_usage network_in network_out is_outlier')
+
+
+def random_rows(seed, instances=6, minutes=40):
+    """Metrics every 30 seconds or so with calm, busy, idle and ramping stretches."""
+    rnd = random.Random(seed)
+    rows = []
+    for n in range(instances):
+        timestamp = START + timedelta(seconds=rnd.randint(0, 29))
+        level = rnd.uniform(20, 60)
+        while timestamp < START + timedelta(minutes=minutes):
+            level = min(100.0, max(0.0, level + rnd.choice([-6, -2, 0, 2, 6]) + rnd.gauss(0, 2)))
+            memory = rnd.choice([level, 50.0, 15.0])
+            rows.append((
+                f'i-{n}', timestamp,
+                None if rnd.random() < 0.03 else round(level, 2),
+                round(memory, 2), rnd.randint(10 ** 6, 2 * 10 ** 6), rnd.randint(10 ** 5, 10 ** 6)
+            ))
+            timestamp += timedelta(seconds=rnd.randint(20, 40))
+    return rows
+
+
+def reference_replay(rows, interval_seconds, predictive=False):
+    """The same replay the slow way: evaluate_scaling_decision on sample objects, tick by tick."""
+    by_instance = {}
+    for instance_id, timestamp, cpu, memory, network_in, network_out in sorted(rows, key=lambda r: (r[0], r[1])):
+        by_instance.setdefault(instance_id, []).append(
+            Sample(None, timestamp, cpu, memory, network_in, network_out, False)
+        )
+    interval = timedelta(seconds=interval_seconds)
+    ticks = sorted({START + interval * -(-(r[1] - START) // interval) for r in rows})
+    forecasts = ForecastStore()
+    evaluated = {instance_id: 0 for instance_id in by_instance}
+    last = {}
+    decisions = []
+    for tick in ticks:
+        for instance_id in sorted(by_instance):
+            samples = by_instance[instance_id]
+            seen = [s for s in samples if s.timestamp <= tick]
+            if len(seen) <= evaluated[instance_id]:
+                continue
+            evaluated[instance_id] = len(seen)
+            window = [s for s in seen if s.timestamp >= tick - timedelta(minutes=DECISION_WINDOW_MINUTES)]
+            forecast = forecasts.update(instance_id, seen) if predictive else None
+            decision, reason, outlier_type = evaluate_scaling_decision(
+                instance_id, window, seen[-1], samples[0].timestamp, tick, forecast=forecast
+            )
+            if outlier_type is not None:
+                samples[len(seen) - 1] = seen[-1]._replace(is_outlier=True)
+            if decision != last.get(instance_id):
+                last[instance_id] = decision
+                decisions.append((tick, instance_id, decision, reason))
+    return decisions
+
+
+class TestReplay:
+    """Test cases for replaying metrics through the decision logic."""
+
+    @pytest.mark.parametrize('predictive', [False, True])
+    def test_matches_evaluating_each_tick(self, predictive):
+        """Test that the replay timeline equals evaluating every instance tick by tick."""
+        rows = random_rows(16)
+
+        result = replay(MetricSeries.from_rows(rows), interval_seconds=15, predictive=predictive)
+
+        timeline = sorted((d.timestamp, d.instance_id, d.decision, d.reason) for d in result.decisions)
+        assert timeline == sorted(reference_replay(rows, 15, predictive))
+        assert {d.decision for d in result.decisions} == {'scale_up', 'scale_down', 'no_action'}
+
+    def test_stats(self):
+        """Test that the summary counts what was replayed."""
+        rows = random_rows(16)
+
+        stats = replay(MetricSeries.from_rows(rows), interval_seconds=15).stats
+
+        assert stats['instances'] == 6
+        assert stats['samples'] == len(rows)
+        assert stats['evaluations'] <= len(rows)
+        assert stats['decisions_per_hour'] == pytest.approx(stats['decisions'] / stats['simulated_hours'])
+        assert stats['time_to_scale_up']['count'] + stats['time_to_scale_up']['missed'] > 0
+        assert stats['speedup'] > 1
+
+    def test_stored_policies_decide_their_instances(self, app, sample_instance):
+        """Test that an instance with a stored policy is replayed by it and the others by the built-in logic."""
+        policy_id = sample_instance['instance_id']
+        rows = [(policy_id if row[0] == 'i-2' else row[0], *row[1:]) for row in random_rows(16)]
+        series = MetricSeries.from_rows(rows)
+        with app.app_context():
+            Instance.query.one().scaling_policy = {'rules': [{
+                'type': 'average', 'decision': 'scale_up', 'minutes': 1,
+                'conditions': [{'metric': 'cpu_utilization', 'above': 50}],
+            }]}
+            db.session.commit()
+            plans = stored_plans(series.instance_ids)
+
+        result = replay(series, interval_seconds=15, plans=plans)
+
+        assert list(plans) == [policy_id]
+        reasons = {d.reason.split(':')[0] for d in result.decisions if d.instance_id == policy_id}
+        assert reasons == {'Average scale up', 'No policy rule matched. Current'}
+        others = [d for d in replay(series, interval_seconds=15).decisions if d.instance_id != policy_id]
+        assert [d for d in result.decisions if d.instance_id != policy_id] == others
+
+    def test_empty_series(self):
+        """Test that nothing to replay gives an empty timeline."""
+        result = replay(MetricSeries.from_rows([]))
+
+        assert result.decisions == []
+        assert result.stats['evaluations'] == 0
+
+
+class TestReplayStats:
+    """Test cases for flapping and time-to-scale."""
+
+    def timeline(self, *changes):
+        decisions = [ReplayDecision(START + timedelta(minutes=m), 'i-a', d, '', None, None) for m, d in changes]
+        times = [int((d.timestamp - datetime(1970, 1, 1)) / timedelta(microseconds=1)) for d in decisions]
+        return decisions, times
+
+    def test_reversal_within_window_is_a_flap(self):
+        """Test that only direction changes closer than the flap window count."""
+        decisions, times = self.timeline(
+            (0, 'scale_up'), (5, 'no_action'), (10, 'scale_down'), (60, 'scale_up'), (61, 'scale_up')
+        )
+
+        assert count_flaps(decisions, times, 15) == 1
+
+    def test_time_to_scale_up(self):
+        """Test that delays run from the first breaching sample to the scale up."""
+        rows = [('i-a', START + timedelta(minutes=m), cpu, 50.0, 1, 1) for m, cpu in
+                [(0, 50.0), (1, 95.0), (2, 95.0), (3, 50.0), (10, 95.0), (20, 50.0)]]
+        series = MetricSeries.from_rows(rows)
+        decisions, times = self.timeline((0, 'no_action'), (4, 'scale_up'), (9, 'no_action'))
+
+        stats = time_to_scale(series, decisions, times, series.cpu_utilization > 90, 'scale_up')
+
+        # The first breach took 3 minutes, the second was never answered
+        assert stats['count'] == 1
+        assert stats['mean_seconds'] == 180.0
+        assert stats['missed'] == 1
+
+
+class TestSeriesSources:
+    """Test cases for loading metrics to replay."""
+
+    def test_from_database(self, app, sample_instance):
+        """Test that stored Metric rows load in instance and timestamp order."""
+        with app.app_context():
+            for i in (2, 0, 1):
+                db.session.add(Metric(
+                    instance_key=sample_instance['instance_key'], cpu_utilization=10.0 * i, memory_usage=None,
+                    network_in=100, network_out=200, timestamp=START + timedelta(minutes=i)
+                ))
+            db.session.commit()
+
+            series = series_from_database()
+
+        assert series.instance_ids == [sample_instance['instance_id']]
+        assert series.cpu_utilization.tolist() == [0.0, 10.0, 20.0]
+        assert len(series) == 3
+
+    def test_from_csv(self, tmp_path):
+        """Test that a CSV file without network columns loads with missing values as NaN."""
+        path = tmp_path / 'metrics.csv'
+        path.write_text(
+            "instance_id,timestamp,cpu_utilization,memory_usage\n"
+            "i-b,2026-01-01T00:01:00,50,\n"
+            "i-a,2026-01-01T00:00:00,40,30\n"
+        )
+
+        series = load_series(str(path))
+
+        assert series.instance_ids == ['i-b', 'i-a']
+        assert series.instance.tolist() == [0, 1]
+        assert series.memory_usage[0] != series.memory_usage[0]
+        assert len(series) == 2
+
+    def test_from_parquet(self, tmp_path):
+        """Test that a Parquet file replays like the same rows loaded directly."""
+        pa = pytest.importorskip('pyarrow')
+        import pyarrow.parquet as pq
+        rows = random_rows(3, instances=3, minutes=20)
+        columns = list(zip(*rows))
+        table = pa.table({
+            'instance_id': columns[0], 'timestamp': columns[1], 'cpu_utilization': columns[2],
+            'memory_usage': columns[3], 'network_in': columns[4], 'network_out': columns[5]
+        })
+        path = tmp_path / 'metrics.parquet'
+        pq.write_table(table, path)
+
+        from_file = replay(load_series(str(path)))
+        direct = replay(MetricSeries.from_rows(rows))
+
+        assert from_file.decisions == direct.decisions
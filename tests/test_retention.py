@@ -0,0 +1,133 @@
+"""Unit tests for repo/retention.py"""
+from datetime import datetime, timedelta
+from sqlalchemy import event, text
+from repo.db import db
+from repo.models import Metric, MetricOutlier, MetricRollup, ScalingDecision
+from repo.metric_writer import upsert_metrics, metric_row
+from repo.retention import apply_retention, clear_instance_metrics, delete_in_batches
+
+NOW = datetime(2026, 10, 17, 12, 0)
+POLICIES = {
+    'metrics': {'days': 30, 'archive': False},
+    'metric_outliers': {'days': 30, 'archive': False},
+    'scaling_decisions': {'days': 90, 'archive': True},
+}
+
+
+def store_metrics(instance_id, ages):
+    """Store one metric per age (a timedelta before NOW), in the order given."""
+    upsert_metrics(metric_row(instance_id, NOW - age, 10.0, 20.0, 1, 2) for age in ages)
+    db.session.commit()
+
+
+def stored_ages(instance_key):
+    timestamps = db.session.query(Metric.timestamp).filter_by(instance_key=instance_key).order_by(Metric.timestamp).all()
+    return [NOW - timestamp for timestamp, in timestamps]
+
+
+class TestApplyRetention:
+    """Test cases for the batched retention of expired rows."""
+
+    def test_expired_metrics_are_deleted_in_batches(self, app, sample_instance):
+        """Test that metrics past the policy are deleted, a bounded batch at a time, and recent ones kept."""
+        store_metrics(sample_instance['instance_id'], [timedelta(days=40, minutes=n) for n in range(7)] + [timedelta(days=1)])
+
+        progress = apply_retention(now=NOW, policies=POLICIES, batch_rows=3, pause_seconds=0)
+
+        assert progress['metrics'] == (7, True)
+        assert stored_ages(sample_instance['instance_key']) == [timedelta(days=1)]
+
+    def test_run_stops_after_max_batches_and_the_next_carries_on(self, app, sample_instance):
+        """Test that a run ends after max_batches and a later run deletes the rest."""
+        store_metrics(sample_instance['instance_id'], [timedelta(days=40, minutes=n) for n in range(7)])
+
+        first = apply_retention(now=NOW, policies=POLICIES, batch_rows=3, pause_seconds=0, max_batches=1)
+        second = apply_retention(now=NOW, policies=POLICIES, batch_rows=3, pause_seconds=0)
+
+        assert first['metrics'] == (3, False)
+        assert second['metrics'] == (4, True)
+        assert Metric.query.count() == 0
+
+    def test_expired_metrics_are_found_whatever_their_id_order(self, app, sample_instance, sample_user):
+        """Test that expired metrics stored after live ones (late backfills) are all deleted, per instance."""
+        from repo.models import Instance
+        db.session.add(Instance(instance_id='i-other', user_id=sample_user['id'], region='mock', is_mock=True))
+        db.session.commit()
+        for instance_id in (sample_instance['instance_id'], 'i-other'):
+            store_metrics(instance_id, [timedelta(hours=n) for n in range(1, 6)])
+        for instance_id in (sample_instance['instance_id'], 'i-other'):
+            store_metrics(instance_id, [timedelta(days=40, minutes=n) for n in range(4)])
+
+        progress = apply_retention(now=NOW, policies={'metrics': POLICIES['metrics']}, batch_rows=3, pause_seconds=0)
+
+        assert progress['metrics'] == (8, True)
+        assert Metric.query.count() == 10
+        assert all(age < timedelta(days=1) for age in stored_ages(sample_instance['instance_key']))
+
+    def test_expired_decisions_are_archived(self, app, sample_instance):
+        """Test that decisions past the policy move to scaling_decisions_archive."""
+        for days in (100, 95, 10):
+            db.session.add(ScalingDecision(instance_id=sample_instance['instance_id'], timestamp=NOW - timedelta(days=days),
+                                           decision='scale_up', reason=f'{days} days ago'))
+        db.session.commit()
+
+        progress = apply_retention(now=NOW, policies=POLICIES, batch_rows=1, pause_seconds=0)
+
+        assert progress['scaling_decisions'] == (2, True)
+        assert [d.reason for d in ScalingDecision.query.all()] == ['10 days ago']
+        archived = db.session.execute(text('SELECT reason FROM scaling_decisions_archive ORDER BY timestamp')).scalars().all()
+        assert archived == ['100 days ago', '95 days ago']
+
+    def test_expired_outlier_flags_are_deleted(self, app, sample_instance):
+        """Test that outlier flags are expired with the metrics they annotate."""
+        for days in (40, 1):
+            db.session.add(MetricOutlier(instance_key=sample_instance['instance_key'], timestamp=NOW - timedelta(days=days),
+                                         outlier_type='scale_up'))
+        db.session.commit()
+
+        apply_retention(now=NOW, policies=POLICIES, pause_seconds=0)
+
+        assert [o.timestamp for o in MetricOutlier.query.all()] == [NOW - timedelta(days=1)]
+
+    def test_zero_days_keeps_everything(self, app, sample_instance):
+        """Test that a policy of 0 days leaves its table alone."""
+        store_metrics(sample_instance['instance_id'], [timedelta(days=400)])
+
+        progress = apply_retention(now=NOW, policies={'metrics': {'days': 0, 'archive': False}}, pause_seconds=0)
+
+        assert progress == {}
+        assert Metric.query.count() == 1
+
+
+class TestClearInstanceMetrics:
+    """Test cases for deleting the history of one instance."""
+
+    def test_only_that_instance_is_cleared(self, app, sample_instance, sample_user):
+        """Test that an instance's metrics, flags and rollups go in batches and other instances keep theirs."""
+        from repo.models import Instance
+        other = Instance(instance_id='i-other', user_id=sample_user['id'], region='mock', is_mock=True)
+        db.session.add(other)
+        db.session.commit()
+        store_metrics(sample_instance['instance_id'], [timedelta(minutes=n) for n in range(5)])
+        store_metrics('i-other', [timedelta(minutes=1)])
+        db.session.add(MetricOutlier(instance_key=sample_instance['instance_key'], timestamp=NOW, outlier_type='scale_up'))
+        db.session.add(MetricRollup(instance_id=sample_instance['instance_id'], resolution=60, bucket=NOW, samples=1))
+        db.session.commit()
+
+        deleted = clear_instance_metrics(sample_instance['instance_key'], sample_instance['instance_id'], batch_rows=2)
+
+        assert deleted == 5
+        assert [m.instance_key for m in Metric.query.all()] == [other.instance_key]
+        assert MetricOutlier.query.count() == 0 and MetricRollup.query.count() == 0
+
+    def test_delete_in_batches_commits_each_batch(self, app, sample_instance):
+        """Test that each batch is its own transaction."""
+        store_metrics(sample_instance['instance_id'], [timedelta(minutes=n) for n in range(5)])
+        commits = []
+        event.listen(db.session(), 'after_commit', lambda session: commits.append(session))
+
+        deleted, done = delete_in_batches('metrics', ('instance_key', 'timestamp'), 'instance_key = :instance_key',
+                                          {'instance_key': sample_instance['instance_key']}, batch_rows=2)
+
+        assert (deleted, done) == (5, True)
+        assert len(commits) == 3
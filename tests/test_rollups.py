@@ -0,0 +1,170 @@
+"""Unit tests for service/rollups.py"""
+import random
+import pytest
+import numpy as np
+from datetime import datetime, timedelta
+from repo.db import db
+from repo.models import MetricRollup
+from repo.metric_writer import upsert_metrics, metric_row
+from service.rollups import (
+    bucket_start, compute_rollups, choose_resolution, refresh_rollups, rollup_tracker, get_metric_series
+)
+
+NOW = datetime(2026, 10, 17, 12, 0)
+
+
+def random_rows(seed, instances=3, minutes=130):
+    """Rows sorted by instance and time, every 7 to 40 seconds, some values missing."""
+    rnd = random.Random(seed)
+    rows = []
+    for n in range(instances):
+        timestamp = NOW - timedelta(minutes=minutes) + timedelta(seconds=rnd.randint(0, 59))
+        while timestamp < NOW:
+            rows.append((
+                f'i-{n}', timestamp,
+                None if rnd.random() < 0.1 else rnd.uniform(0, 100), rnd.uniform(0, 100),
+                None if rnd.random() < 0.1 else rnd.randint(0, 10 ** 6), rnd.randint(0, 10 ** 6)
+            ))
+            timestamp += timedelta(seconds=rnd.randint(7, 40), microseconds=rnd.randint(0, 999999))
+    return rows
+
+
+def store(rows):
+    upsert_metrics(metric_row(*row) for row in rows)
+    db.session.commit()
+    rollup_tracker.note_rows(rows)
+
+
+class TestComputeRollups:
+    """Test cases for summarizing metric rows per bucket."""
+
+    def test_matches_each_bucket_computed_alone(self):
+        """Test that every bucket holds the count, min, max, mean, percentile and sums of its own rows."""
+        rows = random_rows(22)
+
+        rollups = compute_rollups(rows, resolutions=(60, 300, 3600))
+
+        expected = {}
+        for row in rows:
+            for resolution in (60, 300, 3600):
+                expected.setdefault((row[0], resolution, bucket_start(row[1], resolution)), []).append(row)
+        assert len(rollups) == len(expected)
+        for instance_id, resolution, bucket, samples, *values in rollups:
+            bucket_rows = expected[(instance_id, resolution, bucket)]
+            cpu = [row[2] for row in bucket_rows if row[2] is not None]
+            network_in = [row[4] for row in bucket_rows if row[4] is not None]
+            assert samples == len(bucket_rows)
+            if cpu:
+                assert values[:4] == pytest.approx([min(cpu), max(cpu), np.mean(cpu), np.percentile(cpu, 95)])
+            else:
+                assert values[:4] == [None] * 4
+            assert values[8] == (sum(network_in) if network_in else None)
+
+    def test_bucket_start(self):
+        """Test that buckets are aligned to the epoch whatever the timestamp's precision."""
+        timestamp = datetime(2026, 10, 17, 12, 34, 56, 789)
+
+        assert bucket_start(timestamp, 60) == datetime(2026, 10, 17, 12, 34)
+        assert bucket_start(timestamp, 300) == datetime(2026, 10, 17, 12, 30)
+        assert bucket_start(timestamp, 3600) == datetime(2026, 10, 17, 12, 0)
+
+
+class TestRefreshRollups:
+    """Test cases for keeping the rollup table up to date."""
+
+    def test_new_metrics_recompute_their_buckets(self, app, sample_instance):
+        """Test that late metrics of a rolled up hour update its buckets."""
+        instance_id = sample_instance['instance_id']
+        with app.app_context():
+            store([(instance_id, NOW - timedelta(minutes=30) + timedelta(minutes=k), 40.0, 50.0, 100, 10) for k in range(10)])
+            refresh_rollups(NOW)
+            hour = MetricRollup.query.filter_by(resolution=3600).one()
+            assert (hour.samples, hour.cpu_max, hour.network_in) == (10, 40.0, 1000)
+
+            store([(instance_id, NOW - timedelta(minutes=45), 90.0, 50.0, 100, 10)])
+            written = refresh_rollups(NOW)
+
+            db.session.expire_all()
+            hour = MetricRollup.query.filter_by(resolution=3600).one()
+            assert (hour.samples, hour.cpu_max, hour.network_in) == (11, 90.0, 1100)
+            assert MetricRollup.query.filter_by(resolution=60).count() == 11
+            # The 1 minute and 5 minute buckets from 11:15 on, and the hour
+            assert written == 11 + 3 + 1
+            assert refresh_rollups(NOW) == 0
+
+    def test_first_refresh_catches_up_from_the_database(self, app, sample_instance):
+        """Test that metrics stored before a restart are rolled up without being noted."""
+        instance_id = sample_instance['instance_id']
+        with app.app_context():
+            store([(instance_id, NOW - timedelta(days=2, minutes=k), 40.0, 50.0, 100, 10) for k in range(5)])
+            rollup_tracker.clear()
+
+            refresh_rollups(NOW)
+
+            assert MetricRollup.query.filter_by(resolution=60).count() == 5
+
+
+class TestMetricSeries:
+    """Test cases for routing a range query to raw metrics or a rollup."""
+
+    @pytest.mark.parametrize('hours, raw_count, max_points, resolution', [
+        (1, 120, 500, 0),
+        (24, 2880, 500, 300),
+        (24 * 7, 20160, 500, 3600),
+        (24 * 7, 20160, 5000, 300),
+        (24 * 365, 10 ** 6, 100, 3600),
+    ])
+    def test_choose_resolution(self, hours, raw_count, max_points, resolution):
+        """Test that the finest source whose points fit the budget is used."""
+        start = NOW - timedelta(hours=hours)
+
+        assert choose_resolution(start, NOW, raw_count, max_points, now=NOW) == resolution
+
+    def test_old_ranges_skip_expired_resolutions(self):
+        """Test that a range older than the 1 minute rollups are kept is read from coarser ones."""
+        start = NOW - timedelta(days=20)
+
+        assert choose_resolution(start, start + timedelta(hours=2), 240, 200, now=NOW) == 300
+
+    def test_get_metric_series(self, app, sample_instance):
+        """Test that a series that fits its budget is raw and a larger one comes from the finest rollup that fits."""
+        instance_id = sample_instance['instance_id']
+        now = datetime.utcnow()
+        start = now - timedelta(hours=2)
+        with app.app_context():
+            store([(instance_id, now - timedelta(minutes=k), 40.0 + k % 10, 50.0, 100, 10) for k in range(1, 121)])
+            refresh_rollups()
+
+            raw_ok, raw = get_metric_series(instance_id, start, now, 500)
+            rolled_ok, rolled = get_metric_series(instance_id, start, now, 30)
+
+        assert raw_ok is True and rolled_ok is True
+        assert raw['resolution_seconds'] == 0
+        assert len(raw['points']) == 120
+        assert raw['points'][0].keys() == {'timestamp', 'cpu_utilization', 'memory_usage', 'network_in', 'network_out'}
+        assert raw['points'][-1]['cpu_utilization'] == 41.0
+        # 2 hours in 1 minute buckets would not fit 30 points, in 5 minute ones they do
+        assert rolled['resolution_seconds'] == 300
+        assert len(rolled['points']) <= 30
+        assert sum(point['samples'] for point in rolled['points']) == 120
+        assert rolled['points'][0]['cpu_utilization'].keys() == {'min', 'max', 'avg', 'p95'}
+
+    def test_series_route(self, app, client, auth_headers, sample_instance):
+        """Test that a long range comes from rollups and a short one from raw metrics."""
+        instance_id = sample_instance['instance_id']
+        now = datetime.utcnow()
+        with app.app_context():
+            store([(instance_id, now - timedelta(minutes=k), 40.0 + k % 10, 50.0, 100, 10) for k in range(1, 121)])
+            refresh_rollups()
+
+        raw = client.get(f'/api/metrics/{instance_id}/series?max_points=500', headers=auth_headers)
+        rolled = client.get(f'/api/metrics/{instance_id}/series?max_points=24', headers=auth_headers)
+        invalid = client.get(f'/api/metrics/{instance_id}/series?start=yesterday', headers=auth_headers)
+
+        assert raw.status_code == 200
+        assert raw.json['resolution_seconds'] == 0
+        assert len(raw.json['points']) == 120
+        assert rolled.json['resolution_seconds'] == 3600
+        assert sum(point['samples'] for point in rolled.json['points']) == 120
+        assert rolled.json['points'][0]['cpu_utilization'].keys() == {'min', 'max', 'avg', 'p95'}
+        assert invalid.status_code == 400
@@ -1,13 +1,69 @@
 """Unit tests for service/scaling_service.py"""
 import pytest
+import numpy as np
 from datetime import datetime, timedelta
+from sqlalchemy import event
+from unittest.mock import patch
 from service.scaling_service import (
     check_sustained_usage,
     calculate_metrics_mean,
-    make_scaling_decision
+    make_scaling_decision,
+    load_metric_window,
+    evaluate_scaling_decision,
+    evaluate_fleet,
+    process_all_monitored_instances,
+    sustained_trackers,
+    DECISION_WINDOW_MINUTES
 )
-from repo.models import Metric, Instance
+from repo.models import Metric, MetricOutlier, Instance, ScalingDecision, User
+from repo.metric_writer import upsert_metrics, metric_row
 from repo.db import db
+from service.window_store import window_store
+from service.baseline_store import baseline_store
+from constants.service_constants import SCALE_UP_THRESHOLD
+
+def count_metric_reads(statements):
+    return len([s for s in statements if s.lstrip().upper().startswith('SELECT') and 'FROM metrics' in s])
+
+
+def record_statements():
+    statements = []
+    def record(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+    return statements, record
+
+
+def feed(instance_ids, timestamp, cpu=50.0, memory=50.0):
+    """Ingest one metric per instance the way the collector does."""
+    rows = [(instance_id, timestamp, cpu, memory, 1000000, 500000) for instance_id in instance_ids]
+    upsert_metrics(rows)
+    db.session.commit()
+    window_store.append_rows(rows)
+
+
+def create_fleet(user_id, profiles, base_time):
+    """Create one monitored instance per (cpu, memory) profile with ten minutes of metrics."""
+    for n, (cpu, memory) in enumerate(profiles):
+        instance = Instance(
+            instance_id=f'i-fleet{n}',
+            instance_type='t2.micro',
+            region='us-east-1',
+            user_id=user_id,
+            is_monitoring=True,
+            is_mock=True
+        )
+        db.session.add(instance)
+        for i in range(10):
+            db.session.add(Metric(
+                instance=instance,
+                cpu_utilization=cpu,
+                memory_usage=memory,
+                network_in=1000000,
+                network_out=500000,
+                timestamp=base_time - timedelta(minutes=9-i)
+            ))
+    db.session.commit()
+
 
 class TestSustainedUsageCheck:
     """Test cases for sustained usage checking."""
@@ -19,7 +75,7 @@ class TestSustainedUsageCheck:
             base_time = datetime.utcnow()
             for i in range(10):
                 metric = Metric(
-                    instance_id=sample_instance['instance_id'],
+                    instance_key=sample_instance['instance_key'],
                     cpu_utilization=95.0,
                     memory_usage=50.0,
                     timestamp=base_time - timedelta(minutes=9-i)
@@ -44,7 +100,7 @@ class TestSustainedUsageCheck:
             base_time = datetime.utcnow()
             for i in range(10):
                 metric = Metric(
-                    instance_id=sample_instance['instance_id'],
+                    instance_key=sample_instance['instance_key'],
                     cpu_utilization=5.0,
                     memory_usage=15.0,
                     timestamp=base_time - timedelta(minutes=9-i)
@@ -70,7 +126,7 @@ class TestSustainedUsageCheck:
             base_time = datetime.utcnow()
             for i in range(2):
                 metric = Metric(
-                    instance_id=sample_instance['instance_id'],
+                    instance_key=sample_instance['instance_key'],
                     cpu_utilization=95.0,
                     memory_usage=50.0,
                     timestamp=base_time - timedelta(minutes=i)
@@ -95,7 +151,7 @@ class TestSustainedUsageCheck:
             for i in range(10):
                 cpu = 95.0 if i % 2 == 0 else 30.0
                 metric = Metric(
-                    instance_id=sample_instance['instance_id'],
+                    instance_key=sample_instance['instance_key'],
                     cpu_utilization=cpu,
                     memory_usage=50.0,
                     timestamp=base_time - timedelta(minutes=9-i)
@@ -126,13 +182,12 @@ class TestMetricsMeanCalculation:
             
             for i, cpu in enumerate(cpu_values):
                 metric = Metric(
-                    instance_id=sample_instance['instance_id'],
+                    instance_key=sample_instance['instance_key'],
                     cpu_utilization=cpu,
                     memory_usage=50.0 + i * 2,
                     network_in=1000000,
                     network_out=500000,
-                    timestamp=base_time - timedelta(minutes=4-i),
-                    is_outlier=False
+                    timestamp=base_time - timedelta(minutes=4-i)
                 )
                 db.session.add(metric)
             db.session.commit()
@@ -155,23 +210,24 @@ class TestMetricsMeanCalculation:
             # Create normal metrics
             for i in range(5):
                 metric = Metric(
-                    instance_id=sample_instance['instance_id'],
+                    instance_key=sample_instance['instance_key'],
                     cpu_utilization=50.0,
                     memory_usage=50.0,
-                    timestamp=base_time - timedelta(minutes=4-i),
-                    is_outlier=False
+                    timestamp=base_time - timedelta(minutes=4-i)
                 )
                 db.session.add(metric)
             
             # Create outlier metric
             outlier = Metric(
-                instance_id=sample_instance['instance_id'],
+                instance_key=sample_instance['instance_key'],
                 cpu_utilization=99.0,
                 memory_usage=99.0,
-                timestamp=base_time,
-                is_outlier=True
+                timestamp=base_time - timedelta(seconds=30)  # (instance_id, timestamp) is unique
             )
             db.session.add(outlier)
+            db.session.add(MetricOutlier(
+                instance_key=sample_instance['instance_key'], timestamp=outlier.timestamp, outlier_type='scale_up'
+            ))
             db.session.commit()
             
             result = calculate_metrics_mean(sample_instance['instance_id'])
@@ -203,13 +259,12 @@ class TestScalingDecisions:
             base_time = datetime.utcnow()
             for i in range(10):
                 metric = Metric(
-                    instance_id=sample_instance['instance_id'],
+                    instance_key=sample_instance['instance_key'],
                     cpu_utilization=95.0,
                     memory_usage=50.0,
                     network_in=1000000,
                     network_out=500000,
-                    timestamp=base_time - timedelta(minutes=9-i),
-                    is_outlier=False
+                    timestamp=base_time - timedelta(minutes=9-i)
                 )
                 db.session.add(metric)
             db.session.commit()
@@ -227,13 +282,12 @@ class TestScalingDecisions:
             base_time = datetime.utcnow()
             for i in range(10):
                 metric = Metric(
-                    instance_id=sample_instance['instance_id'],
+                    instance_key=sample_instance['instance_key'],
                     cpu_utilization=5.0,
                     memory_usage=15.0,
                     network_in=1000000,
                     network_out=500000,
-                    timestamp=base_time - timedelta(minutes=9-i),
-                    is_outlier=False
+                    timestamp=base_time - timedelta(minutes=9-i)
                 )
                 db.session.add(metric)
             db.session.commit()
@@ -251,13 +305,12 @@ class TestScalingDecisions:
             base_time = datetime.utcnow()
             for i in range(10):
                 metric = Metric(
-                    instance_id=sample_instance['instance_id'],
+                    instance_key=sample_instance['instance_key'],
                     cpu_utilization=50.0,
                     memory_usage=50.0,
                     network_in=1000000,
                     network_out=500000,
-                    timestamp=base_time - timedelta(minutes=9-i),
-                    is_outlier=False
+                    timestamp=base_time - timedelta(minutes=9-i)
                 )
                 db.session.add(metric)
             db.session.commit()
@@ -283,13 +336,12 @@ class TestScalingDecisions:
             base_time = datetime.utcnow()
             for i in range(10):
                 metric = Metric(
-                    instance_id=sample_instance['instance_id'],
+                    instance_key=sample_instance['instance_key'],
                     cpu_utilization=95.0,
                     memory_usage=95.0,
                     network_in=1000000,
                     network_out=500000,
-                    timestamp=base_time - timedelta(minutes=9-i),
-                    is_outlier=False
+                    timestamp=base_time - timedelta(minutes=9-i)
                 )
                 db.session.add(metric)
             db.session.commit()
@@ -307,13 +359,12 @@ class TestScalingDecisions:
             base_time = datetime.utcnow()
             for i in range(10):
                 metric = Metric(
-                    instance_id=sample_instance['instance_id'],
+                    instance_key=sample_instance['instance_key'],
                     cpu_utilization=5.0,
                     memory_usage=10.0,
                     network_in=1000000,
                     network_out=500000,
-                    timestamp=base_time - timedelta(minutes=9-i),
-                    is_outlier=False
+                    timestamp=base_time - timedelta(minutes=9-i)
                 )
                 db.session.add(metric)
             db.session.commit()
@@ -323,3 +374,575 @@ class TestScalingDecisions:
             assert success is True
             if hasattr(result, 'decision'):
                 assert result.decision == "scale_down"
+
+
+class TestMetricWindow:
+    """Test cases for the single-query metric window."""
+    
+    def test_window_is_loaded_with_one_query(self, app, sample_instance):
+        """Test that a decision reads the instance's metrics with a single query."""
+        with app.app_context():
+            base_time = datetime.utcnow()
+            for i in range(10):
+                db.session.add(Metric(
+                    instance_key=sample_instance['instance_key'],
+                    cpu_utilization=50.0,
+                    memory_usage=50.0,
+                    timestamp=base_time - timedelta(minutes=9-i)
+                ))
+            db.session.commit()
+            
+            statements = []
+            def record(conn, cursor, statement, parameters, context, executemany):
+                statements.append(statement)
+            event.listen(db.engine, 'before_cursor_execute', record)
+            try:
+                success, _ = make_scaling_decision(sample_instance['instance_id'])
+            finally:
+                event.remove(db.engine, 'before_cursor_execute', record)
+            
+            assert success is True
+            assert count_metric_reads(statements) == 1
+    
+    def test_window_returns_latest_and_oldest(self, app, sample_instance):
+        """Test that the window carries the newest metric and the oldest timestamp."""
+        with app.app_context():
+            base_time = datetime.utcnow()
+            for i in range(10):
+                db.session.add(Metric(
+                    instance_key=sample_instance['instance_key'],
+                    cpu_utilization=float(i),
+                    memory_usage=50.0,
+                    timestamp=base_time - timedelta(minutes=9-i)
+                ))
+            db.session.commit()
+            
+            samples, latest, oldest_timestamp = load_metric_window(sample_instance['instance_id'], now=base_time)
+            
+            assert len(samples) == 6
+            assert latest.cpu_utilization == 9.0
+            assert oldest_timestamp == base_time - timedelta(minutes=9)
+    
+    def test_empty_window_falls_back_to_latest(self, app, sample_instance):
+        """Test that an old latest metric is still returned when the window is empty."""
+        with app.app_context():
+            base_time = datetime.utcnow()
+            db.session.add(Metric(
+                instance_key=sample_instance['instance_key'],
+                cpu_utilization=42.0,
+                memory_usage=50.0,
+                timestamp=base_time - timedelta(hours=1)
+            ))
+            db.session.commit()
+            
+            samples, latest, _ = load_metric_window(sample_instance['instance_id'], now=base_time)
+            
+            assert samples == []
+            assert latest.cpu_utilization == 42.0
+            
+            decision, reason, _ = evaluate_scaling_decision(
+                sample_instance['instance_id'], samples, latest, base_time - timedelta(hours=1), base_time
+            )
+            assert decision == "no_action"
+            assert reason.startswith("Insufficient data for IQR analysis")
+
+
+class TestFleetEvaluation:
+    """Test cases for fleet-wide batched evaluation."""
+    
+    PROFILES = [(95.0, 50.0), (5.0, 15.0), (50.0, 50.0), (50.0, 95.0)]
+    
+    def test_fleet_matches_per_instance_decisions(self, app, sample_user):
+        """Test that the fleet pass makes the same decisions as make_scaling_decision."""
+        with app.app_context():
+            create_fleet(sample_user['id'], self.PROFILES, datetime.utcnow())
+            
+            fleet_results = evaluate_fleet()
+            fleet_decisions = {d.instance_id: (d.decision, d.reason) for d in ScalingDecision.query.all()}
+            
+            ScalingDecision.query.delete()
+            Instance.query.update({'last_decision': None})
+            MetricOutlier.query.delete()
+            db.session.commit()
+            window_store.clear()
+            
+            for result in fleet_results:
+                success, decision = make_scaling_decision(result['instance_id'])
+                assert result['success'] is success
+                assert result['result'] == decision.decision
+                assert fleet_decisions[result['instance_id']] == (decision.decision, decision.reason)
+            
+            assert [r['result'] for r in fleet_results] == ['scale_up', 'scale_down', 'no_action', 'scale_up']
+    
+    def test_query_count_does_not_grow_with_fleet(self, app, sample_user):
+        """Test that metric reads stay constant as the fleet grows."""
+        with app.app_context():
+            create_fleet(sample_user['id'], self.PROFILES * 5, datetime.utcnow())
+            
+            statements = []
+            def record(conn, cursor, statement, parameters, context, executemany):
+                statements.append(statement)
+            event.listen(db.engine, 'before_cursor_execute', record)
+            try:
+                results = evaluate_fleet()
+            finally:
+                event.remove(db.engine, 'before_cursor_execute', record)
+            
+            # Instances with min/max timestamps, then every window; writes are batched
+            selects = [s for s in statements if s.lstrip().upper().startswith('SELECT')]
+            assert len(results) == 20
+            assert len(selects) == 2
+            assert len(statements) <= 5
+    
+    def test_outliers_flagged_and_state_kept(self, app, sample_user):
+        """Test that outlier flags are written and a second pass reports no state change."""
+        with app.app_context():
+            create_fleet(sample_user['id'], [(95.0, 50.0), (50.0, 50.0)], datetime.utcnow())
+            
+            evaluate_fleet()
+            with patch('service.scaling_service.SKIP_UNCHANGED_INSTANCES', False):
+                results = evaluate_fleet()
+            
+            assert [r['result'] for r in results] == ['No state change (still scale_up)', 'No state change (still no_action)']
+            assert ScalingDecision.query.count() == 2
+            flagged = MetricOutlier.query.all()
+            fleet0 = Instance.query.filter_by(instance_id='i-fleet0').one()
+            assert [(m.instance_key, m.outlier_type) for m in flagged] == [(fleet0.instance_key, 'scale_up')]
+    
+    def test_subset_of_instances(self, app, sample_user):
+        """Test that only the requested monitored instances are evaluated."""
+        with app.app_context():
+            create_fleet(sample_user['id'], self.PROFILES, datetime.utcnow())
+            
+            results = evaluate_fleet(instance_ids=['i-fleet1', 'i-fleet3', 'i-unknown'])
+            
+            assert [(r['instance_id'], r['result']) for r in results] == [('i-fleet1', 'scale_down'), ('i-fleet3', 'scale_up')]
+            assert {d.instance_id for d in ScalingDecision.query.all()} == {'i-fleet1', 'i-fleet3'}
+    
+    def test_quiet_instance_uses_latest_metric(self, app, sample_user):
+        """Test that an instance without recent metrics is evaluated on its newest one."""
+        with app.app_context():
+            create_fleet(sample_user['id'], [(50.0, 50.0)], datetime.utcnow() - timedelta(hours=1))
+            db.session.add(Instance(
+                instance_id='i-empty', instance_type='t2.micro', region='us-east-1',
+                user_id=sample_user['id'], is_monitoring=True, is_mock=True
+            ))
+            db.session.commit()
+            
+            results = {r['instance_id']: r for r in evaluate_fleet()}
+            
+            assert results['i-fleet0']['result'] == 'no_action'
+            assert results['i-empty']['success'] is False
+            decision = ScalingDecision.query.filter_by(instance_id='i-fleet0').first()
+            assert decision.reason.startswith("Insufficient data for IQR analysis")
+    
+    def test_failed_commit_reports_failure(self, app, sample_user):
+        """Test that a failed batched commit is rolled back and reported per instance."""
+        with app.app_context():
+            create_fleet(sample_user['id'], [(95.0, 50.0)], datetime.utcnow())
+            
+            with patch.object(db.session, 'commit', side_effect=RuntimeError("db down")):
+                results = evaluate_fleet()
+            
+            assert results == [{'instance_id': 'i-fleet0', 'success': False, 'result': 'db down', 'skipped': False}]
+            assert ScalingDecision.query.count() == 0
+
+    def test_decision_pool_commits_worker_decisions(self, app, sample_user):
+        """Test that decisions made in worker processes are committed like in-process ones."""
+        from service.decision_pool import shutdown_pool
+        with app.app_context():
+            create_fleet(sample_user['id'], self.PROFILES, datetime.utcnow())
+
+            try:
+                with patch('service.scaling_service.DECISION_POOL_WORKERS', 2), \
+                        patch('service.scaling_service.DECISION_POOL_MIN_INSTANCES', 1):
+                    results = evaluate_fleet()
+            finally:
+                shutdown_pool()
+
+            assert [r['result'] for r in results] == ['scale_up', 'scale_down', 'no_action', 'scale_up']
+            assert ScalingDecision.query.count() == 4
+            flagged = {m.instance_key for m in MetricOutlier.query.all()}
+            assert flagged == {i.instance_key for i in Instance.query.filter(Instance.instance_id != 'i-fleet2')}
+
+
+class TestSkipUnchanged:
+    """Test cases for skipping instances without new metrics."""
+    
+    def test_unchanged_instances_are_skipped_without_metric_reads(self, app, sample_user):
+        """Test that a second pass with no new metrics evaluates nothing and reads no windows."""
+        with app.app_context():
+            create_fleet(sample_user['id'], [(95.0, 50.0), (50.0, 50.0)], datetime.utcnow())
+            evaluate_fleet()
+            window_store.clear()
+            
+            statements, record = record_statements()
+            event.listen(db.engine, 'before_cursor_execute', record)
+            try:
+                results = evaluate_fleet()
+            finally:
+                event.remove(db.engine, 'before_cursor_execute', record)
+            
+            assert [(r['result'], r['skipped']) for r in results] == [
+                ('No new metrics (still scale_up)', True), ('No new metrics (still no_action)', True)
+            ]
+            # Only the instance list with its newest timestamps
+            assert len(statements) == 1
+            assert ScalingDecision.query.count() == 2
+    
+    def test_new_metric_triggers_evaluation(self, app, sample_user):
+        """Test that only instances with a newer metric are evaluated again."""
+        with app.app_context():
+            base_time = datetime.utcnow() - timedelta(minutes=1)
+            create_fleet(sample_user['id'], [(95.0, 50.0), (50.0, 50.0)], base_time)
+            evaluate_fleet()
+            
+            feed(['i-fleet1'], datetime.utcnow(), 50.0, 50.0)
+            results = {r['instance_id']: r for r in evaluate_fleet()}
+            
+            assert results['i-fleet0']['skipped'] is True
+            assert results['i-fleet1']['skipped'] is False
+            assert results['i-fleet1']['result'] == 'No state change (still no_action)'
+            instance = Instance.query.filter_by(instance_id='i-fleet1').first()
+            assert instance.last_evaluated_at == Metric.query.filter_by(instance_key=instance.instance_key)\
+                .order_by(Metric.timestamp.desc()).first().timestamp
+    
+    def test_reset_decision_is_evaluated_again(self, app, sample_user):
+        """Test that an instance without a current decision is never skipped."""
+        with app.app_context():
+            create_fleet(sample_user['id'], [(95.0, 50.0)], datetime.utcnow())
+            evaluate_fleet()
+            Instance.query.update({'last_decision': None})
+            db.session.commit()
+            
+            results = evaluate_fleet()
+            
+            assert [(r['result'], r['skipped']) for r in results] == [('scale_up', False)]
+    
+    def test_per_instance_mode_skips_too(self, app, sample_user):
+        """Test that the per-instance fallback skips unchanged instances as well."""
+        with app.app_context():
+            create_fleet(sample_user['id'], [(95.0, 50.0)], datetime.utcnow())
+            
+            with patch('service.scaling_service.SCALING_FLEET_EVALUATION', False):
+                first = process_all_monitored_instances()
+                second = process_all_monitored_instances()
+            
+            assert [(r['result'], r['skipped']) for r in first] == [('scale_up', False)]
+            assert [(r['result'], r['skipped']) for r in second] == [('No new metrics (still scale_up)', True)]
+
+
+class TestSustainedTracking:
+    """Test cases for the incremental sustained usage counts."""
+    
+    def test_trackers_follow_new_metrics(self, app, sample_user):
+        """Test that later cycles only add new metrics and decide as a full recount would."""
+        with app.app_context():
+            create_fleet(sample_user['id'], [(50.0, 50.0), (5.0, 15.0)], datetime.utcnow() - timedelta(minutes=1))
+            evaluate_fleet()
+            for i in range(4):
+                feed(['i-fleet0', 'i-fleet1'], datetime.utcnow() - timedelta(seconds=40 - 10 * i), 95.0, 50.0)
+            
+            def reset_decisions():
+                ScalingDecision.query.delete()
+                Instance.query.update({'last_decision': None})
+                db.session.commit()
+            
+            reset_decisions()
+            tracked = evaluate_fleet()
+            tracked_reasons = sorted(d.reason for d in ScalingDecision.query.all())
+            reset_decisions()
+            with patch('service.scaling_service.SUSTAINED_TRACKER_ENABLED', False):
+                recounted = evaluate_fleet()
+            
+            assert [r['result'] for r in tracked] == ['no_action', 'no_action']
+            assert tracked == recounted
+            assert tracked_reasons == sorted(d.reason for d in ScalingDecision.query.all())
+            assert sustained_trackers.get_stats() == {'instances': 2, 'rebuilds': 0}
+
+
+
+class TestPredictiveScaling:
+    """Test cases for forecast-based decisions."""
+    
+    def create_ramp(self, user_id):
+        """One monitored instance whose CPU climbs 2% every 30 seconds, from 40% to 78%."""
+        instance = Instance(
+            instance_id='i-ramp', instance_type='t2.micro', region='us-east-1',
+            user_id=user_id, is_monitoring=True, is_mock=True
+        )
+        db.session.add(instance)
+        now = datetime.utcnow()
+        for i in range(20):
+            db.session.add(Metric(
+                instance=instance, cpu_utilization=40.0 + 2 * i, memory_usage=50.0,
+                network_in=1000000, network_out=500000, timestamp=now - timedelta(seconds=30 * (19 - i))
+            ))
+        db.session.commit()
+    
+    def test_rising_cpu_scales_up_before_the_threshold(self, app, sample_user):
+        """Test that a CPU ramp forecast to pass the threshold scales up while still under it."""
+        with app.app_context():
+            self.create_ramp(sample_user['id'])
+            
+            with patch('service.scaling_service.PREDICTIVE_SCALING_ENABLED', True):
+                results = evaluate_fleet()
+            
+            decision = ScalingDecision.query.one()
+            assert results[0]['result'] == 'scale_up'
+            assert decision.cpu_utilization == 78.0
+            assert decision.reason.startswith("Predicted scale up: CPU forecast to reach")
+            assert MetricOutlier.query.count() == 0
+    
+    def test_disabled_by_default(self, app, sample_user):
+        """Test that without predictive scaling the same ramp waits for the thresholds."""
+        with app.app_context():
+            self.create_ramp(sample_user['id'])
+            
+            results = evaluate_fleet()
+            
+            assert results[0]['result'] == 'no_action'
+    
+    def test_per_instance_path_matches_fleet(self, app, sample_user):
+        """Test that make_scaling_decision makes the same predictive decision."""
+        with app.app_context():
+            self.create_ramp(sample_user['id'])
+            
+            with patch('service.scaling_service.PREDICTIVE_SCALING_ENABLED', True):
+                success, decision = make_scaling_decision('i-ramp')
+            
+            assert success is True
+            assert decision.decision == 'scale_up'
+            assert decision.reason.startswith("Predicted scale up: CPU forecast to reach")
+
+class TestScalingPolicies:
+    """Test cases for instances decided by a scaling policy."""
+    
+    EAGER = {'rules': [
+        {'type': 'sustained', 'decision': 'scale_up', 'conditions': [{'metric': 'cpu_utilization', 'above': 70}]},
+        {'type': 'iqr'}
+    ]}
+    
+    def test_fleet_uses_instance_and_user_policies(self, app, sample_user):
+        """Test that each instance is decided by its own policy, its user's or the built-in one."""
+        with app.app_context():
+            create_fleet(sample_user['id'], [(75.0, 50.0)] * 3, datetime.utcnow())
+            Instance.query.filter_by(instance_id='i-fleet0').one().scaling_policy = self.EAGER
+            db.session.commit()
+            
+            first = evaluate_fleet()
+            User.query.one().scaling_policy = self.EAGER
+            db.session.commit()
+            with patch('service.scaling_service.SKIP_UNCHANGED_INSTANCES', False):
+                second = evaluate_fleet()
+            
+            assert [r['result'] for r in first] == ['scale_up', 'no_action', 'no_action']
+            assert [r['result'] for r in second] == ['No state change (still scale_up)', 'scale_up', 'scale_up']
+            assert ScalingDecision.query.filter_by(instance_id='i-fleet0').one().reason.startswith(
+                'Sustained scale up: CPU > 70% for 100.0% of last 5 minutes'
+            )
+            assert MetricOutlier.query.count() == 3
+    
+    def test_policy_window_is_loaded(self, app, sample_user):
+        """Test that a policy reading 10 minutes gets a 10 minute window, not the default one."""
+        with app.app_context():
+            create_fleet(sample_user['id'], [(75.0, 50.0)], datetime.utcnow())
+            User.query.one().scaling_policy = {'rules': [{
+                'type': 'sustained', 'decision': 'scale_up', 'minutes': 10, 'min_samples': 10,
+                'conditions': [{'metric': 'cpu_utilization', 'above': 70}]
+            }]}
+            db.session.commit()
+            
+            results = evaluate_fleet()
+            
+            assert results[0]['result'] == 'scale_up'
+            assert 'of last 10 minutes' in ScalingDecision.query.one().reason
+    
+    def test_per_instance_path_uses_policy(self, app, sample_user):
+        """Test that make_scaling_decision decides by the policy too."""
+        with app.app_context():
+            create_fleet(sample_user['id'], [(75.0, 50.0)], datetime.utcnow())
+            User.query.one().scaling_policy = self.EAGER
+            db.session.commit()
+            
+            success, decision = make_scaling_decision('i-fleet0')
+            
+            assert success is True
+            assert decision.decision == 'scale_up'
+
+    def test_default_instances_go_through_the_default_plan(self, app, sample_user):
+        """Test that instances without a policy are decided by DEFAULT_PLAN in both paths, with the trackers' results."""
+        from service.policy_engine import DEFAULT_PLAN
+        with app.app_context():
+            create_fleet(sample_user['id'], [(95.0, 50.0), (5.0, 15.0)], datetime.utcnow())
+            
+            with patch.object(DEFAULT_PLAN, 'evaluate', wraps=DEFAULT_PLAN.evaluate) as evaluate:
+                results = evaluate_fleet()
+                make_scaling_decision('i-fleet0')
+            
+            assert [r['result'] for r in results] == ['scale_up', 'scale_down']
+            assert evaluate.call_count == 2
+            assert all(call.kwargs['sustained'] is not None for call in evaluate.call_args_list)
+
+class TestLongBaseline:
+    """Test cases for IQR analysis against a streaming long baseline."""
+    
+    @pytest.fixture(autouse=True)
+    def hour_baseline(self, monkeypatch):
+        monkeypatch.setattr(baseline_store, 'window_minutes', 60)
+    
+    def test_fleet_judges_new_metrics_against_baseline(self, app, sample_user):
+        """Test that the baseline builds up from evaluated windows and judges the next metric."""
+        with app.app_context():
+            create_fleet(sample_user['id'], [(50.0, 50.0)], datetime.utcnow() - timedelta(seconds=30))
+            
+            [first] = evaluate_fleet()
+            feed(['i-fleet0'], datetime.utcnow(), 70.0, 70.0)
+            [second] = evaluate_fleet()
+            
+            assert first['result'] == 'no_action'
+            assert ScalingDecision.query.filter_by(decision='no_action').first().reason.startswith('Insufficient data for IQR')
+            assert second['result'] == 'scale_up'
+            # The five samples of the first decision window plus the new one
+            assert baseline_store.get_baseline('i-fleet0').count == 6
+    
+    def test_flagged_metric_stays_out_of_baseline(self, app, sample_user):
+        """Test that a metric flagged by a sustained decision is not added to the baseline."""
+        with app.app_context():
+            create_fleet(sample_user['id'], [(95.0, 50.0)], datetime.utcnow())
+            
+            [result] = evaluate_fleet()
+            
+            assert result['result'] == 'scale_up'
+            # Five samples in the decision window, the newest one flagged
+            assert baseline_store.get_baseline('i-fleet0').count == 4
+    
+    def test_per_instance_path_uses_baseline(self, app, sample_user):
+        """Test that make_scaling_decision reads and feeds the same baseline."""
+        with app.app_context():
+            create_fleet(sample_user['id'], [(50.0, 50.0)], datetime.utcnow() - timedelta(seconds=30))
+            
+            make_scaling_decision('i-fleet0')
+            feed(['i-fleet0'], datetime.utcnow(), 70.0, 70.0)
+            success, decision = make_scaling_decision('i-fleet0')
+            
+            assert success is True
+            assert decision.decision == 'scale_up'
+            assert 'CPU (70.00%) > upper bound (50.00%)' in decision.reason
+
+
+class TestWindowStore:
+    """Test cases for serving decision windows from the window store."""
+    
+    def test_decision_reads_store_after_seed(self, app, sample_instance):
+        """Test that the first decision seeds the store and the next one needs no metric query."""
+        with app.app_context():
+            base_time = datetime.utcnow()
+            for i in range(10):
+                db.session.add(Metric(
+                    instance_key=sample_instance['instance_key'],
+                    cpu_utilization=50.0,
+                    memory_usage=50.0,
+                    network_in=1000000,
+                    network_out=500000,
+                    timestamp=base_time - timedelta(minutes=9-i)
+                ))
+            db.session.commit()
+            make_scaling_decision(sample_instance['instance_id'])
+            feed([sample_instance['instance_id']], datetime.utcnow(), cpu=99.0)
+            
+            statements, record = record_statements()
+            event.listen(db.engine, 'before_cursor_execute', record)
+            try:
+                success, result = make_scaling_decision(sample_instance['instance_id'])
+            finally:
+                event.remove(db.engine, 'before_cursor_execute', record)
+            
+            assert success is True
+            assert result.cpu_utilization == 99.0
+            assert count_metric_reads(statements) == 0
+            assert window_store.get_stats()['hits'] == 1
+    
+    def test_fleet_reads_store_after_seed(self, app, sample_user):
+        """Test that a warm fleet pass only reads the instance list."""
+        with app.app_context():
+            create_fleet(sample_user['id'], [(50.0, 50.0)] * 4, datetime.utcnow())
+            evaluate_fleet()
+            feed([f'i-fleet{n}' for n in range(4)], datetime.utcnow())
+            
+            statements, record = record_statements()
+            event.listen(db.engine, 'before_cursor_execute', record)
+            try:
+                evaluate_fleet()
+            finally:
+                event.remove(db.engine, 'before_cursor_execute', record)
+            
+            selects = [s for s in statements if s.lstrip().upper().startswith('SELECT')]
+            assert len(selects) == 1
+    
+    def test_fleet_store_matches_database(self, app, sample_user):
+        """Test that decisions served from the store equal decisions read from the database."""
+        with app.app_context():
+            profiles = [(95.0, 50.0), (5.0, 15.0), (50.0, 50.0), (50.0, 95.0), (40.0, 45.0)]
+            create_fleet(sample_user['id'], profiles, datetime.utcnow() - timedelta(seconds=30))
+            evaluate_fleet()
+            # A spike on one instance, steady values elsewhere
+            feed(['i-fleet2'], datetime.utcnow(), cpu=80.0)
+            feed(['i-fleet0', 'i-fleet1', 'i-fleet3', 'i-fleet4'], datetime.utcnow(), cpu=45.0, memory=45.0)
+            now = datetime.utcnow()
+            
+            def reset_decisions():
+                ScalingDecision.query.delete()
+                Instance.query.update({'last_decision': None})
+                db.session.commit()
+            
+            reset_decisions()
+            from_store = evaluate_fleet(now)
+            store_decisions = sorted((d.instance_id, d.decision, d.reason) for d in ScalingDecision.query.all())
+            
+            reset_decisions()
+            with patch('service.scaling_service.WINDOW_STORE_ENABLED', False):
+                from_database = evaluate_fleet(now)
+            database_decisions = sorted((d.instance_id, d.decision, d.reason) for d in ScalingDecision.query.all())
+            
+            assert window_store.get_stats()['hits'] >= len(profiles)
+            assert from_store == from_database
+            assert store_decisions == database_decisions
+    
+    def test_reloaded_window_matches_store_on_a_threshold(self, app, sample_instance):
+        """Test that a window just above a threshold evaluates the same from the store and reloaded from the database."""
+        with app.app_context():
+            instance_id = sample_instance['instance_id']
+            cpu = SCALE_UP_THRESHOLD + 1e-6
+            now = datetime.utcnow()
+            rows = [
+                metric_row(instance_id, now - timedelta(seconds=30 * (20 - i)), cpu, 50.0, 1000000, 500000)
+                for i in range(21)
+            ]
+            upsert_metrics(rows)
+            db.session.commit()
+            window_store.append_rows(rows)
+
+            from_store = window_store.get_window(instance_id, DECISION_WINDOW_MINUTES, now)
+            window_store.discard(instance_id)
+            from_database = load_metric_window(instance_id, now=now)
+
+            # Both hold the float4 value the REAL column stores, as PostgreSQL returns it
+            assert from_store[1].cpu_utilization == float(str(np.float32(cpu)))
+            assert from_database[1].cpu_utilization == from_store[1].cpu_utilization
+            assert evaluate_scaling_decision(instance_id, *from_store, now)[:2] == \
+                evaluate_scaling_decision(instance_id, *from_database, now)[:2]
+
+    def test_metrics_written_elsewhere_are_not_missed(self, app, sample_user):
+        """Test that a fleet pass rereads an instance whose newest metric the store never saw."""
+        with app.app_context():
+            create_fleet(sample_user['id'], [(50.0, 50.0)], datetime.utcnow())
+            evaluate_fleet()
+            # Written without going through the store, as another process would
+            upsert_metrics([('i-fleet0', datetime.utcnow(), 99.0, 99.0, 1, 1)])
+            db.session.commit()
+            
+            evaluate_fleet()
+            
+            decision = ScalingDecision.query.order_by(ScalingDecision.timestamp.desc()).first()
+            assert decision.cpu_utilization == 99.0
@@ -0,0 +1,97 @@
+"""Unit tests for service/sustained_tracker.py"""
+import random
+import pytest
+from collections import namedtuple
+from datetime import datetime, timedelta
+from service.scaling_service import SUSTAINED_CHECKS, sustained_usage, sustained_trackers
+from service.sustained_tracker import SustainedTrackerStore
+
+NOW = datetime(2026, 1, 1, 12, 0)
+
+Sample = namedtuple('Sample', 'timestamp cpu_utilization memory_usage')
+
+
+def recount(samples, cutoff):
+    window = [s for s in samples if s.timestamp >= cutoff]
+    return [sustained_usage(window, *check) for check in SUSTAINED_CHECKS]
+
+
+def random_sample(rnd, timestamp):
+    profile = rnd.choice(['low', 'high', 'mixed'])
+    if profile == 'low':
+        cpu, memory = rnd.uniform(0, 12), rnd.uniform(10, 25)
+    elif profile == 'high':
+        cpu, memory = rnd.uniform(85, 100), rnd.uniform(85, 100)
+    else:
+        cpu, memory = rnd.uniform(0, 100), rnd.uniform(0, 100)
+    return Sample(
+        timestamp,
+        None if rnd.random() < 0.1 else cpu,
+        None if rnd.random() < 0.1 else memory
+    )
+
+
+class TestSustainedTrackerStore:
+    """Test cases for incremental sustained usage counts."""
+
+    def test_matches_recount_as_window_slides(self):
+        """Test that every cycle gives the same results as counting the window again."""
+        rnd = random.Random(4)
+        store = SustainedTrackerStore(sustained_trackers._conditions)
+        samples = []
+        timestamp = now = NOW
+        for cycle in range(500):
+            for _ in range(rnd.randint(0, 3)):
+                timestamp += timedelta(seconds=rnd.randint(5, 60))
+                samples.append(random_sample(rnd, timestamp))
+            now = max(now, timestamp + timedelta(seconds=rnd.randint(0, 30)))
+            cutoff = now - timedelta(minutes=5)
+            # The decision window, as loaded by the scaling engine
+            window = [s for s in samples if s.timestamp >= now - timedelta(minutes=6)]
+
+            assert store.track('i-a', window, cutoff) == recount(samples, cutoff)
+
+        assert store.get_stats()['rebuilds'] == 0
+
+    def test_too_few_samples_are_never_sustained(self):
+        """Test that fewer than three samples give (False, 0.0) for every check."""
+        store = SustainedTrackerStore(sustained_trackers._conditions)
+        samples = [Sample(NOW, 95.0, 95.0), Sample(NOW + timedelta(seconds=30), 95.0, 95.0)]
+
+        assert store.track('i-a', samples, NOW) == [(False, 0.0)] * 3
+
+    def test_backfill_rebuilds_the_tracker(self):
+        """Test that samples inserted before the newest tracked one are picked up."""
+        store = SustainedTrackerStore(sustained_trackers._conditions)
+        samples = [Sample(NOW + timedelta(minutes=i), 95.0, 50.0) for i in range(0, 5, 2)]
+        store.track('i-a', samples, NOW)
+
+        backfilled = sorted(samples + [Sample(NOW + timedelta(minutes=1), 5.0, 5.0)])
+        results = store.track('i-a', backfilled, NOW)
+
+        assert results == recount(backfilled, NOW)
+        assert store.get_stats()['rebuilds'] == 1
+
+    def test_values_filled_in_late_are_counted(self):
+        """Test that memory filled in on tracked samples by a settle window changes the result like a recount."""
+        store = SustainedTrackerStore(sustained_trackers._conditions)
+        samples = [Sample(NOW + timedelta(minutes=i), 5.0, None) for i in range(5)]
+        assert store.track('i-a', samples, NOW)[0] == (True, 100.0)
+
+        filled = [sample._replace(memory_usage=50.0) for sample in samples]
+        results = store.track('i-a', filled, NOW)
+
+        assert results == recount(filled, NOW)
+        assert results[0] == (False, 0.0)
+        assert store.get_stats()['rebuilds'] == 0
+
+    def test_replaced_metrics_rebuild_the_tracker(self):
+        """Test that a window with different samples (metrics deleted and re-simulated) is not mixed with the old one."""
+        store = SustainedTrackerStore(sustained_trackers._conditions)
+        store.track('i-a', [Sample(NOW + timedelta(minutes=i), 95.0, 50.0) for i in range(5)], NOW)
+
+        replaced = [Sample(NOW + timedelta(minutes=i, seconds=30), 5.0, 5.0) for i in range(4)]
+        results = store.track('i-a', replaced, NOW)
+
+        assert results == recount(replaced, NOW)
+        assert results[0][0] is True
@@ -0,0 +1,293 @@
+"""Unit tests for jobs/tasks.py"""
+import threading
+import time
+import pytest
+from datetime import datetime, timedelta
+from unittest.mock import patch
+from jobs.tasks import fetch_metrics_job, scaling_decision_job, decision_worker, persist_baselines_job
+from service.window_store import window_store, WindowSample
+from service.decision_queue import decision_queue
+from service.baseline_store import baseline_store
+from repo.models import Metric, Instance, ScalingDecision, MetricBaseline
+from repo.db import db
+
+
+def monitor(instance_id, is_mock=False):
+    instance = Instance.query.filter_by(instance_id=instance_id).first()
+    instance.is_monitoring = True
+    instance.is_mock = is_mock
+    db.session.commit()
+
+
+class TestFetchMetricsJob:
+    """Test cases for the metrics collection job."""
+
+    def test_every_datapoint_is_stored_and_watermark_advances(self, app, sample_instance):
+        """Test that all new datapoints are stored and the watermark moves to the newest one."""
+        base_time = datetime(2026, 1, 1, 12, 0)
+        samples = [
+            {'timestamp': base_time + timedelta(minutes=i), 'cpu_utilization': 40.0 + i,
+             'memory_usage': 50.0, 'network_in': 1000, 'network_out': 500}
+            for i in range(3)
+        ]
+        with app.app_context():
+            monitor(sample_instance['instance_id'])
+
+            with patch('jobs.tasks.collect_metrics', return_value={sample_instance['instance_id']: samples}):
+                fetch_metrics_job(app)
+                # A retry of the same range must not duplicate rows
+                fetch_metrics_job(app)
+
+            instance = Instance.query.filter_by(instance_id=sample_instance['instance_id']).first()
+            assert Metric.query.count() == 3
+            assert instance.last_ingested_at == samples[-1]['timestamp']
+
+    def test_late_datapoints_fill_in_stored_rows(self, app, sample_instance):
+        """Test that a settle window fetched again fills in late memory values and keeps the watermark."""
+        base_time = datetime(2026, 1, 1, 12, 0)
+        first = [
+            {'timestamp': base_time + timedelta(minutes=i), 'cpu_utilization': 40.0 + i,
+             'memory_usage': None, 'network_in': 1000, 'network_out': 500}
+            for i in range(3)
+        ]
+        # The agent's memory datapoints arrived after the first fetch
+        settled = [{'timestamp': sample['timestamp'], 'memory_usage': 55.0} for sample in first[:2]]
+        with app.app_context():
+            monitor(sample_instance['instance_id'])
+
+            with patch('jobs.tasks.collect_metrics', return_value={sample_instance['instance_id']: first}):
+                fetch_metrics_job(app)
+            with patch('jobs.tasks.collect_metrics', return_value={sample_instance['instance_id']: settled}):
+                fetch_metrics_job(app)
+
+            instance = Instance.query.filter_by(instance_id=sample_instance['instance_id']).first()
+            metrics = Metric.query.order_by(Metric.timestamp).all()
+            assert [(m.cpu_utilization, m.memory_usage) for m in metrics] == [(40.0, 55.0), (41.0, 55.0), (42.0, None)]
+            assert instance.last_ingested_at == first[-1]['timestamp']
+
+    def test_samples_without_stored_metrics_are_dropped(self, app, sample_instance):
+        """Test that a sample with only unstored metrics (disk I/O) writes no row, moves no watermark and queues nothing."""
+        samples = [{'timestamp': datetime(2026, 1, 1, 12, 0), 'cpu_utilization': None, 'memory_usage': None,
+                    'network_in': None, 'network_out': None, 'disk_read': 4096}]
+        with app.app_context():
+            monitor(sample_instance['instance_id'])
+
+            with patch('jobs.tasks.collect_metrics', return_value={sample_instance['instance_id']: samples}):
+                fetch_metrics_job(app)
+
+            instance = Instance.query.filter_by(instance_id=sample_instance['instance_id']).first()
+            assert Metric.query.count() == 0
+            assert instance.last_ingested_at is None
+            assert decision_queue.take(timeout=0) == []
+
+    def test_watermark_is_passed_to_collector(self, app, sample_instance):
+        """Test that the stored watermark is handed to the collector."""
+        watermark = datetime(2026, 1, 1, 12, 0)
+        with app.app_context():
+            monitor(sample_instance['instance_id'])
+            instance = Instance.query.filter_by(instance_id=sample_instance['instance_id']).first()
+            instance.last_ingested_at = watermark
+            db.session.commit()
+
+            with patch('jobs.tasks.collect_metrics', return_value={}) as mock_collect:
+                fetch_metrics_job(app)
+
+            targets = mock_collect.call_args.args[0]
+            assert targets == [(sample_instance['instance_id'], 'us-east-1', False, watermark)]
+
+    def test_mock_instance_metrics_saved(self, app, sample_instance):
+        """Test that a monitored mock instance gets a metric row per run."""
+        with app.app_context():
+            monitor(sample_instance['instance_id'], is_mock=True)
+
+            fetch_metrics_job(app)
+
+            assert Metric.query.filter_by(instance_key=sample_instance['instance_key']).count() == 1
+
+    def test_committed_rows_feed_window_store(self, app, sample_instance):
+        """Test that stored datapoints are appended to the window store, network rounded like the database."""
+        base_time = datetime.utcnow() - timedelta(minutes=6)
+        samples = [
+            {'timestamp': base_time + timedelta(minutes=i), 'cpu_utilization': 40.0 + i,
+             'memory_usage': 50.0, 'network_in': 1000.6, 'network_out': 500}
+            for i in range(7)
+        ]
+        with app.app_context():
+            monitor(sample_instance['instance_id'])
+
+            with patch('jobs.tasks.collect_metrics', return_value={sample_instance['instance_id']: samples}):
+                fetch_metrics_job(app)
+
+            window, latest, _ = window_store.get_window(sample_instance['instance_id'], 5, datetime.utcnow())
+            stored = Metric.query.order_by(Metric.timestamp.desc()).first()
+            assert latest.timestamp == samples[-1]['timestamp']
+            assert latest.network_in == stored.network_in == 1001
+
+    def test_failed_commit_does_not_feed_window_store(self, app, sample_instance):
+        """Test that rows are only cached once they are committed."""
+        samples = [{'timestamp': datetime.utcnow(), 'cpu_utilization': 40.0, 'memory_usage': 50.0}]
+        with app.app_context():
+            monitor(sample_instance['instance_id'])
+
+            with patch('jobs.tasks.collect_metrics', return_value={sample_instance['instance_id']: samples}), \
+                    patch('jobs.tasks.upsert_metrics', side_effect=RuntimeError("db down")):
+                fetch_metrics_job(app)
+
+            assert window_store.get_stats()['instances'] == 0
+            assert decision_queue.take(timeout=0) == []
+
+    def test_committed_instances_are_queued_for_decision(self, app, sample_instance):
+        """Test that instances with newly stored metrics are handed to the decision worker."""
+        samples = [{'timestamp': datetime.utcnow(), 'cpu_utilization': 40.0, 'memory_usage': 50.0}]
+        with app.app_context():
+            monitor(sample_instance['instance_id'])
+
+            with patch('jobs.tasks.collect_metrics', return_value={sample_instance['instance_id']: samples}):
+                fetch_metrics_job(app)
+
+            assert decision_queue.take(timeout=0) == [sample_instance['instance_id']]
+
+    def test_nothing_queued_when_event_driven_decisions_are_off(self, app, sample_instance):
+        """Test that only the periodic job makes decisions when the queue is disabled."""
+        samples = [{'timestamp': datetime.utcnow(), 'cpu_utilization': 40.0, 'memory_usage': 50.0}]
+        with app.app_context():
+            monitor(sample_instance['instance_id'])
+
+            with patch('jobs.tasks.collect_metrics', return_value={sample_instance['instance_id']: samples}), \
+                    patch('jobs.tasks.EVENT_DRIVEN_DECISIONS', False):
+                fetch_metrics_job(app)
+
+            assert decision_queue.take(timeout=0) == []
+
+
+class TestScalingDecisionJob:
+    """Test cases for the periodic scaling decision job."""
+
+    def test_cycle_reports_evaluated_and_skipped(self, app, sample_instance, caplog):
+        """Test that a cycle without new metrics skips the instance and says so."""
+        now = datetime.utcnow()
+        with app.app_context():
+            monitor(sample_instance['instance_id'], is_mock=True)
+            db.session.add_all(
+                Metric(instance_key=sample_instance['instance_key'], timestamp=now - timedelta(minutes=i),
+                       cpu_utilization=50.0, memory_usage=50.0, network_in=1000, network_out=500)
+                for i in range(6)
+            )
+            db.session.commit()
+
+        with caplog.at_level('INFO', logger='autoscaler'):
+            scaling_decision_job(app)
+            scaling_decision_job(app)
+
+        cycles = [r.getMessage() for r in caplog.records if r.getMessage().startswith('Scaling cycle')]
+        assert cycles == [
+            'Scaling cycle: 1 instance(s) evaluated, 0 skipped with no new metrics',
+            'Scaling cycle: 0 instance(s) evaluated, 1 skipped with no new metrics'
+        ]
+
+
+    def test_late_value_in_evaluated_metric_is_evaluated_again(self, app, sample_instance, caplog):
+        """Test that a late value filled into the newest evaluated metric brings the instance back into the next cycle."""
+        now = datetime.utcnow().replace(second=0, microsecond=0)
+        first = [
+            {'timestamp': now - timedelta(minutes=5 - i), 'cpu_utilization': 50.0,
+             'memory_usage': 50.0 if i < 5 else None, 'network_in': 1000, 'network_out': 500}
+            for i in range(6)
+        ]
+        # The newest memory datapoint arrived after the decision was made
+        settled = [{'timestamp': first[-1]['timestamp'], 'memory_usage': 95.0}]
+        with app.app_context():
+            monitor(sample_instance['instance_id'], is_mock=True)
+            with patch('jobs.tasks.collect_metrics', return_value={sample_instance['instance_id']: first}):
+                fetch_metrics_job(app)
+
+        with caplog.at_level('INFO', logger='autoscaler'):
+            scaling_decision_job(app)
+            with patch('jobs.tasks.collect_metrics', return_value={sample_instance['instance_id']: settled}):
+                fetch_metrics_job(app)
+            scaling_decision_job(app)
+            scaling_decision_job(app)
+
+        cycles = [r.getMessage() for r in caplog.records if r.getMessage().startswith('Scaling cycle')]
+        assert cycles == [
+            'Scaling cycle: 1 instance(s) evaluated, 0 skipped with no new metrics',
+            'Scaling cycle: 1 instance(s) evaluated, 0 skipped with no new metrics',
+            'Scaling cycle: 0 instance(s) evaluated, 1 skipped with no new metrics'
+        ]
+        with app.app_context():
+            instance = Instance.query.filter_by(instance_id=sample_instance['instance_id']).first()
+            assert instance.last_evaluated_at == first[-1]['timestamp']
+
+    def test_refetched_value_that_changes_nothing_keeps_the_skip(self, app, sample_instance, caplog):
+        """Test that a settle window fetched again with the values already stored does not re-evaluate."""
+        now = datetime.utcnow().replace(second=0, microsecond=0)
+        samples = [
+            {'timestamp': now - timedelta(minutes=5 - i), 'cpu_utilization': 45.3,
+             'memory_usage': 50.0, 'network_in': 1000, 'network_out': 500}
+            for i in range(6)
+        ]
+        with app.app_context():
+            monitor(sample_instance['instance_id'], is_mock=True)
+
+        with caplog.at_level('INFO', logger='autoscaler'):
+            with patch('jobs.tasks.collect_metrics', return_value={sample_instance['instance_id']: samples}):
+                fetch_metrics_job(app)
+                scaling_decision_job(app)
+                fetch_metrics_job(app)
+            scaling_decision_job(app)
+
+        cycles = [r.getMessage() for r in caplog.records if r.getMessage().startswith('Scaling cycle')]
+        assert cycles[-1] == 'Scaling cycle: 0 instance(s) evaluated, 1 skipped with no new metrics'
+
+
+class TestDecisionWorker:
+    """Test cases for the event-driven decision worker."""
+
+    def test_queued_instance_is_evaluated(self, app, sample_instance):
+        """Test that the worker makes a decision for a queued instance and stops on request."""
+        now = datetime.utcnow()
+        with app.app_context():
+            monitor(sample_instance['instance_id'], is_mock=True)
+            db.session.add_all(
+                Metric(instance_key=sample_instance['instance_key'], timestamp=now - timedelta(minutes=i),
+                       cpu_utilization=95.0, memory_usage=50.0, network_in=1000, network_out=500)
+                for i in range(6)
+            )
+            db.session.commit()
+
+        stop = threading.Event()
+        worker = threading.Thread(target=decision_worker, args=[app, stop])
+        worker.start()
+        try:
+            decision_queue.enqueue([sample_instance['instance_id']])
+            deadline = time.monotonic() + 5
+            while decision_queue.get_stats()['batches'] == 0 and time.monotonic() < deadline:
+                time.sleep(0.01)
+        finally:
+            stop.set()
+            worker.join(timeout=5)
+
+        assert not worker.is_alive()
+        with app.app_context():
+            decision = ScalingDecision.query.filter_by(instance_id=sample_instance['instance_id']).first()
+            assert decision.decision == 'scale_up'
+
+
+class TestPersistBaselinesJob:
+    """Test cases for persisting the long IQR baselines."""
+
+    def test_changed_baselines_are_saved(self, app, sample_instance, monkeypatch):
+        """Test that observed baselines are written once."""
+        monkeypatch.setattr(baseline_store, 'window_minutes', 60)
+        now = datetime(2026, 1, 1, 12, 0)
+        baseline_store.observe(sample_instance['instance_id'], [
+            WindowSample(None, now + timedelta(minutes=i), 50.0, 50.0, 1000, 500, False) for i in range(5)
+        ])
+
+        persist_baselines_job(app)
+        persist_baselines_job(app)
+
+        with app.app_context():
+            [row] = MetricBaseline.query.all()
+            assert row.instance_id == sample_instance['instance_id']
+            assert row.window_minutes == 60
@@ -0,0 +1,101 @@
+"""Unit tests for service/window_stats.py"""
+import random
+import pytest
+import numpy as np
+from datetime import timedelta
+from service.window_stats import WindowStats
+from tests.test_fleet_evaluator import NOW, Sample
+
+
+def random_windows(seed, instances=50):
+    """Windows of up to 15 minutes of samples, some values missing."""
+    rnd = random.Random(seed)
+    windows = []
+    for n in range(instances):
+        samples = []
+        seconds = rnd.randint(0, 20)  # always leaves at least one sample
+        while seconds < 15 * 60:
+            samples.append(Sample(
+                f'{n}-{len(samples)}', NOW - timedelta(seconds=15 * 60 - seconds),
+                None if rnd.random() < 0.1 else rnd.uniform(0, 100), rnd.uniform(0, 100),
+                rnd.randint(0, 10 ** 7), rnd.randint(0, 10 ** 7), False
+            ))
+            seconds += rnd.randint(5, 90)
+        windows.append((f'i-{n}', samples, samples[-1], None))
+    return windows
+
+
+def recount(samples, minutes):
+    return [s for s in samples if s.timestamp >= NOW - timedelta(minutes=minutes)]
+
+
+class TestWindowStats:
+    """Test cases for statistics over several windows at once."""
+
+    def test_matches_each_window_computed_alone(self):
+        """Test that counts and means of every window equal filtering the samples per window."""
+        windows = random_windows(18)
+
+        stats = WindowStats(windows, NOW, (1, 5, 15))
+
+        for minutes in (1, 5, 15):
+            counts = stats.count(minutes)
+            means = stats.mean('cpu_utilization', minutes)
+            for i, (_, samples, _, _) in enumerate(windows):
+                window = recount(samples, minutes)
+                cpu = [s.cpu_utilization for s in window if s.cpu_utilization is not None]
+                assert counts[i] == len(window)
+                if cpu:
+                    assert means[i] == pytest.approx(sum(cpu) / len(cpu))
+                else:
+                    assert np.isnan(means[i])
+
+    def test_count_where(self):
+        """Test that a per-sample condition is counted within each window."""
+        windows = random_windows(19)
+        stats = WindowStats(windows, NOW, (1, 15))
+        busy = stats.flat['memory_usage'] > 50
+
+        for minutes in (1, 15):
+            expected = [sum(s.memory_usage > 50 for s in recount(samples, minutes)) for _, samples, _, _ in windows]
+            assert stats.count_where(busy, minutes).tolist() == expected
+
+    def test_quartiles_of_every_window_from_shared_rows(self):
+        """Test that each window's quartiles equal sorting that window's included values alone."""
+        windows = random_windows(20)
+        stats = WindowStats(windows, NOW, (1, 5, 15))
+        stats.flat['included'] = np.array([s.memory_usage < 90 for _, samples, _, _ in windows for s in samples])
+
+        for minutes in (1, 5, 15):
+            q1, q3, known = stats.quartiles('cpu_utilization', minutes, outliers=False)
+            for i, (_, samples, _, _) in enumerate(windows):
+                values = sorted(s.cpu_utilization for s in recount(samples, minutes)
+                                if s.cpu_utilization is not None and s.memory_usage < 90)
+                assert known[i] == len(values)
+                if values:
+                    assert (q1[i], q3[i]) == (values[len(values) // 4], values[(3 * len(values)) // 4])
+                else:
+                    assert np.isnan(q1[i]) and np.isnan(q3[i])
+        assert list(stats._padded) == [('cpu_utilization', False)]
+
+    def test_quartiles_of_some_rows(self):
+        """Test that quartiles of a subset of instances match those of the whole fleet at the same rows."""
+        stats = WindowStats(random_windows(20), NOW, (5,))
+        rows = np.array([3, 0, 17])
+
+        subset = stats.quartiles('memory_usage', 5, rows=rows)
+        fleet = stats.quartiles('memory_usage', 5)
+
+        for part, whole in zip(subset, fleet):
+            np.testing.assert_array_equal(part, whole[rows])
+
+    def test_empty_windows(self):
+        """Test that instances without samples get zero counts and no mean."""
+        latest = Sample('old', NOW - timedelta(hours=1), 50.0, 50.0, 1, 1, False)
+
+        stats = WindowStats([('i-a', [], latest, None)], NOW, (5,))
+
+        assert stats.count(5).tolist() == [0]
+        assert stats.known('network_in', 5).tolist() == [0]
+        assert np.isnan(stats.mean('network_in', 5)[0])
+        assert stats.quartiles('cpu_utilization', 5)[2].tolist() == [0]
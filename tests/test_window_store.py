@@ -0,0 +1,161 @@
+"""Unit tests for service/window_store.py"""
+import pytest
+from datetime import datetime, timedelta
+from service.window_store import MetricWindowStore, WindowSample
+
+NOW = datetime(2026, 1, 1, 12, 0)
+
+
+def rows_for(instance_id, start, count, step_seconds=30, cpu=50.0):
+    return [
+        (instance_id, start + timedelta(seconds=step_seconds * i), cpu + i, 40.0, 1000 + i, 500)
+        for i in range(count)
+    ]
+
+
+class TestAppendAndRead:
+    """Test cases for feeding and reading the ring buffers."""
+
+    def test_covered_window_is_served(self):
+        """Test that a window fully covered by appended rows is returned oldest first."""
+        store = MetricWindowStore()
+        store.append_rows(rows_for('i-a', NOW - timedelta(minutes=10), 21))
+
+        samples, latest, oldest = store.get_window('i-a', 5, NOW)
+
+        assert [s.timestamp for s in samples] == [NOW - timedelta(seconds=30 * i) for i in range(10, -1, -1)]
+        assert latest == samples[-1]
+        assert latest.cpu_utilization == 70.0
+        assert latest.network_in == 1020 and isinstance(latest.network_in, int)
+        assert oldest == NOW - timedelta(minutes=10)
+
+    def test_partial_window_is_a_miss(self):
+        """Test that a buffer fed for less than the window does not answer."""
+        store = MetricWindowStore()
+        store.append_rows(rows_for('i-a', NOW - timedelta(minutes=2), 5))
+
+        assert store.get_window('i-a', 5, NOW) is None
+        assert store.get_window('i-unknown', 5, NOW) is None
+        assert store.get_stats()['misses'] == 2
+
+    def test_missing_values_round_trip(self):
+        """Test that None metrics come back as None."""
+        store = MetricWindowStore()
+        store.append_rows([('i-a', NOW - timedelta(minutes=6), None, 40.0, None, 5)])
+
+        _, latest, _ = store.get_window('i-a', 5, NOW)
+
+        assert latest.cpu_utilization is None
+        assert latest.network_in is None
+        assert latest.is_outlier is False
+
+    def test_duplicates_are_skipped(self):
+        """Test that re-ingested rows are not stored twice."""
+        store = MetricWindowStore()
+        rows = rows_for('i-a', NOW - timedelta(minutes=6), 12)
+        store.append_rows(rows)
+        store.append_rows(rows[-3:])
+
+        samples, _, _ = store.get_window('i-a', 6, NOW)
+
+        assert len(samples) == 12
+
+    def test_refetched_rows_fill_in_late_values(self):
+        """Test that a row fetched again fills in the values its buffered sample lacks and keeps the others."""
+        store = MetricWindowStore()
+        rows = rows_for('i-a', NOW - timedelta(minutes=6), 12)
+        instance_id, timestamp, cpu, _, network_in, network_out = rows[-2]
+        store.append_rows(rows[:-2] + [(instance_id, timestamp, cpu, None, network_in, network_out)] + rows[-1:])
+        store.append_rows([(instance_id, timestamp, None, 75.0, None, None)])
+
+        samples, _, _ = store.get_window('i-a', 6, NOW)
+
+        assert len(samples) == 12
+        assert (samples[-2].cpu_utilization, samples[-2].memory_usage, samples[-2].network_in) == (cpu, 75.0, network_in)
+
+    def test_backfill_drops_the_instance(self):
+        """Test that a row older than the buffered ones invalidates the instance."""
+        store = MetricWindowStore()
+        store.append_rows(rows_for('i-a', NOW - timedelta(minutes=6), 12))
+        store.append_rows([('i-a', NOW - timedelta(minutes=8), 1.0, 1.0, 1, 1)])
+
+        assert store.get_window('i-a', 5, NOW) is None
+
+    def test_overwritten_samples_end_coverage(self):
+        """Test that the ring only answers for the span it still holds."""
+        store = MetricWindowStore(capacity=8)
+        store.append_rows(rows_for('i-a', NOW - timedelta(minutes=10), 20))
+
+        assert store.get_window('i-a', 5, NOW) is None
+        samples, _, _ = store.get_window('i-a', 3, NOW)
+        assert len(samples) == 6
+
+    def test_newest_timestamp_mismatch_is_a_miss(self):
+        """Test that a buffer behind the database does not answer."""
+        store = MetricWindowStore()
+        rows = rows_for('i-a', NOW - timedelta(minutes=6), 12)
+        store.append_rows(rows)
+
+        assert store.get_window('i-a', 5, NOW, newest_timestamp=rows[-1][1]) is not None
+        assert store.get_window('i-a', 5, NOW, newest_timestamp=NOW) is None
+
+    def test_memory_per_instance_is_small(self):
+        """Test that a full buffer stays within a few KB."""
+        store = MetricWindowStore()
+        store.append_rows(rows_for('i-a', NOW - timedelta(hours=1), 200))
+
+        assert store.get_stats()['bytes'] < 4096
+
+
+class TestSeed:
+    """Test cases for seeding from the database."""
+
+    def sample(self, timestamp, cpu=50.0, is_outlier=False):
+        return WindowSample('id', timestamp, cpu, 40.0, 1000, 500, is_outlier)
+
+    def test_seeded_window_is_served(self):
+        """Test that a seeded window answers immediately."""
+        store = MetricWindowStore()
+        samples = [self.sample(NOW - timedelta(minutes=4 - i), is_outlier=(i == 1)) for i in range(5)]
+
+        store.seed('i-a', (samples, samples[-1], NOW - timedelta(hours=1)), NOW - timedelta(minutes=5))
+        served, latest, oldest = store.get_window('i-a', 5, NOW)
+
+        assert [s.timestamp for s in served] == [s.timestamp for s in samples]
+        assert [s.is_outlier for s in served] == [False, True, False, False, False]
+        assert oldest == NOW - timedelta(hours=1)
+
+    def test_seed_keeps_newer_appended_rows(self):
+        """Test that rows appended while the database was read survive the seed."""
+        store = MetricWindowStore()
+        store.append_rows([('i-a', NOW, 99.0, 40.0, 1, 1)])
+        samples = [self.sample(NOW - timedelta(minutes=4 - i)) for i in range(4)]
+
+        store.seed('i-a', (samples, samples[-1], samples[0].timestamp), NOW - timedelta(minutes=5))
+        _, latest, _ = store.get_window('i-a', 5, NOW)
+
+        assert latest.timestamp == NOW
+        assert latest.cpu_utilization == 99.0
+
+    def test_quiet_instance_keeps_latest(self):
+        """Test that an instance without recent samples is answered with its newest metric."""
+        store = MetricWindowStore()
+        latest = self.sample(NOW - timedelta(hours=1))
+
+        store.seed('i-a', ([], latest, latest.timestamp), NOW - timedelta(minutes=5))
+        samples, served_latest, _ = store.get_window('i-a', 5, NOW)
+
+        assert samples == []
+        assert served_latest.timestamp == latest.timestamp
+
+    def test_mark_outlier(self):
+        """Test that flagging a sample is reflected in later reads."""
+        store = MetricWindowStore()
+        rows = rows_for('i-a', NOW - timedelta(minutes=6), 12)
+        store.append_rows(rows)
+
+        store.mark_outlier('i-a', rows[-1][1])
+        samples, latest, _ = store.get_window('i-a', 5, NOW)
+
+        assert latest.is_outlier is True
+        assert not any(s.is_outlier for s in samples[:-1])